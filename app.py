@@ -23,12 +23,9 @@ except Exception:
 
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 from datetime import datetime, date, time, timedelta
 import calendar
-from io import BytesIO
-from streamlit_sortables import sort_items
+# plotly, openpyxl và streamlit_sortables được import tại nơi dùng để giảm thời gian khởi động
 
 
 
@@ -36,6 +33,11 @@ from streamlit_sortables import sort_items
 import db_wrapper as db  # Tự động chọn Supabase hoặc SQLite
 import database  # Direct access for low-level operations
 import calculations as calc
+import payroll
+import report_data
+import snapshots
+import sync_worker
+import tenant_context
 
 # ==================== CẤU HÌNH TRANG ====================
 
@@ -174,6 +176,14 @@ st.markdown(CSS_STYLES, unsafe_allow_html=True)
 
 
 # ==================== KHỞI TẠO DATABASE ====================
+# Tenant của session (user đăng nhập qua user_auth nếu có) cho tầng dữ liệu;
+# contextvar nên phải đặt lại trên thread của mỗi lượt chạy
+_user_info = st.session_state.get("user_info") or {}
+tenant_context.set_tenant(user_id=_user_info.get('id'), db_path=st.session_state.get("user_db_path"))
+
+# Bật memo đọc cho lượt chạy này: các lần đọc giống nhau chỉ truy vấn một lần
+db.begin_request()
+
 # Khởi tạo database trực tiếp, không cần đăng nhập
 try:
     db.init_database()
@@ -192,33 +202,16 @@ st.markdown('<h1 class="main-header">✨ Quản Lý Giờ Làm 🚀</h1>', unsaf
 # Giảm TTL xuống 60s để cập nhật nhanh hơn sau khi thay đổi
 @st.cache_data(ttl=60, show_spinner=False)
 def get_dashboard_data(month, year, today_str):
-    """Lấy dữ liệu dashboard với caching."""
+    """Lấy dữ liệu dashboard với caching (lương theo mức có hiệu lực tại ngày của từng ca)."""
     month_start = date(year, month, 1)
     today = date.fromisoformat(today_str)
     
-    # Lấy tất cả ca làm việc trong tháng
-    all_shifts_month = db.get_shifts_by_range(month_start, today)
-    all_jobs = db.get_all_jobs()
-    job_map = {j['id']: j for j in all_jobs}
-    
-    # Tính tổng
-    total_hours = 0
-    total_salary = 0
-    work_days = set()
-    
-    for shift in all_shifts_month:
-        hours = shift.get('total_hours', 0)
-        job_id = shift.get('job_id', 0)
-        hourly_rate = job_map.get(job_id, {}).get('hourly_rate', 0)
-        
-        total_hours += hours
-        total_salary += hours * hourly_rate
-        work_days.add(shift.get('work_date'))
+    salary = db.calculate_salary_by_range(month_start, today)
     
     return {
-        'total_hours': total_hours,
-        'total_salary': total_salary,
-        'total_days': len(work_days)
+        'total_hours': salary['total_hours'],
+        'total_salary': salary['total_salary'],
+        'total_days': salary['total_days']
     }
 
 # Lấy dữ liệu tháng hiện tại
@@ -367,6 +360,8 @@ with tab1:
     is_hol, hol_desc = db.is_holiday(work_date)
     if is_hol:
         st.warning(f"⚠️ Ngày này là ngày nghỉ: **{hol_desc}**")
+    if db.is_date_closed(work_date):
+        st.warning("🔒 Ngày này thuộc tháng đã chốt lương. Mở lại tháng trong tab 🗓️ Lịch Làm để thêm/sửa ca.")
     
     # Lấy các ca làm việc hiện có
     existing_shifts = db.get_shifts_by_date(work_date)
@@ -740,6 +735,33 @@ with tab2:
     # Tạo dict để tra cứu nhanh
     log_dict = {log['work_date']: log for log in work_logs}
     
+    # Chốt lương tháng: tháng đã chốt đọc từ bản chốt và không cho sửa ca
+    month_closed = db.is_month_closed(selected_year, selected_month)
+    _, selected_month_end = payroll.month_range(selected_year, selected_month)
+    col_close_info, col_close_btn = st.columns([3, 1])
+    with col_close_info:
+        if month_closed:
+            st.info(f"🔒 Tháng {selected_month}/{selected_year} đã chốt lương - số liệu lấy từ bản chốt.")
+        elif selected_month_end < date.today():
+            st.caption("💡 Tháng đã qua có thể chốt lương để báo cáo tải nhanh và tránh sửa nhầm.")
+    with col_close_btn:
+        if month_closed:
+            if st.button("🔓 Mở Lại Tháng", key="reopen_month", use_container_width=True):
+                if db.reopen_month(selected_year, selected_month):
+                    st.toast(f"🔓 Đã mở lại tháng {selected_month}/{selected_year}", icon="✅")
+                    st.cache_data.clear()
+                    st.rerun()
+                else:
+                    st.error("Lỗi khi mở lại tháng!")
+        elif selected_month_end < date.today():
+            if st.button("🔒 Chốt Tháng", key="close_month", use_container_width=True):
+                if db.close_month(selected_year, selected_month):
+                    st.toast(f"🔒 Đã chốt lương tháng {selected_month}/{selected_year}", icon="✅")
+                    st.cache_data.clear()
+                    st.rerun()
+                else:
+                    st.error("Lỗi khi chốt tháng!")
+    
     if view_type == "Lịch tháng":
         # Tạo calendar view
         st.subheader(f"📅 Lịch Tháng {selected_month}/{selected_year}")
@@ -882,7 +904,19 @@ with tab2:
                         </div>
                     </div>
                     """, unsafe_allow_html=True)
-            
+
+            # Phụ cấp: làm thêm (OT), ca đêm, ngày lễ
+            bonus_items = [
+                ("⏰ Làm thêm (OT)", salary_data.get('total_ot_hours', 0), salary_data.get('ot_bonus', 0)),
+                ("🌙 Ca đêm", salary_data.get('total_night_hours', 0), salary_data.get('night_bonus', 0)),
+                ("🎌 Ngày lễ", salary_data.get('total_holiday_hours', 0), salary_data.get('holiday_bonus', 0)),
+            ]
+            bonus_items = [item for item in bonus_items if item[2] > 0]
+            if bonus_items:
+                st.markdown("#### ➕ Phụ Cấp")
+                for label, bonus_hours, bonus_amount in bonus_items:
+                    st.markdown(f"- **{label}**: {bonus_hours:.1f} giờ → **{bonus_amount:,.0f} ¥**")
+
             # Tổng lương cuối cùng
             st.markdown("")
             st.markdown(f"""
@@ -968,6 +1002,8 @@ with tab2:
             st.success(f"🌟 Ngày {edit_date.strftime('%d/%m/%Y')}: {len(edit_shifts)} ca, {total_h:.1f} giờ")
         else:
             st.info(f"🌸 Ngày {edit_date.strftime('%d/%m/%Y')}: Chưa có ca làm việc")
+        if db.is_date_closed(edit_date):
+            st.warning("🔒 Ngày này thuộc tháng đã chốt lương. Hãy mở lại tháng trước khi sửa.")
     
     # Hiển thị và cho phép chỉnh sửa các ca
     if edit_shifts:
@@ -1202,13 +1238,14 @@ with tab3:
     if report_start > report_end:
         st.error("❌ Ngày bắt đầu phải trước ngày kết thúc!")
     else:
-        # Lấy dữ liệu
-        report_logs = db.get_work_logs_by_range(report_start, report_end)
+        # Lấy dữ liệu dạng cột (không tạo danh sách ca lồng nhau)
+        report_shifts = report_data.load_shift_frame(report_start, report_end)
         standard_hours = db.get_standard_hours()
+        report_daily = report_data.daily_frame(report_shifts, standard_hours)
         
-        if report_logs:
+        if not report_daily.empty:
             # Tạo báo cáo
-            report = calc.generate_report(report_logs, standard_hours)
+            report = calc.generate_report(report_daily, standard_hours)
             
             # Hiển thị thống kê (không có OT)
             st.subheader("✨ Thống Kê Tổng Quan")
@@ -1238,39 +1275,25 @@ with tab3:
             # ==================== TÍNH LƯƠNG DỰ TÍNH ====================
             st.subheader("💰 Lương Dự Tính")
             
-            # Lấy tất cả ca làm việc trong khoảng thời gian
-            all_shifts = db.get_shifts_by_range(report_start, report_end)
-            all_jobs = db.get_all_jobs()
-            job_map = {j['id']: j for j in all_jobs}
-            
-            # Tính lương theo từng công việc
+            # Tính lương theo mức lương có hiệu lực tại ngày của từng ca
+            salary_range = db.calculate_salary_by_range(report_start, report_end)
+            total_salary = salary_range['total_salary']
             job_salary_data = {}
-            total_salary = 0
-            
-            for shift in all_shifts:
-                job_id = shift.get('job_id', 0)
-                hours = shift.get('total_hours', 0)
-                
-                if job_id in job_map:
-                    job_info = job_map[job_id]
-                    job_name = job_info['job_name']
-                    hourly_rate = job_info['hourly_rate']
-                else:
-                    job_name = "Chưa phân loại"
-                    hourly_rate = 0
-                
-                if job_name not in job_salary_data:
-                    job_salary_data[job_name] = {
-                        'hours': 0,
-                        'salary': 0,
-                        'hourly_rate': hourly_rate,
-                        'shift_count': 0
-                    }
-                
-                job_salary_data[job_name]['hours'] += hours
-                job_salary_data[job_name]['salary'] += hours * hourly_rate
-                job_salary_data[job_name]['shift_count'] += 1
-                total_salary += hours * hourly_rate
+            for job in salary_range['jobs']:
+                # Tổng của từng công việc gồm cả phụ cấp để cộng lại khớp với tổng lương
+                premiums = [
+                    ("OT", job['ot_bonus']),
+                    ("Ca đêm", job['night_bonus']),
+                    ("Ngày lễ", job['holiday_bonus']),
+                ]
+                job_salary_data[job['job_name']] = {
+                    'hours': job['total_hours'],
+                    'base_salary': job['base_salary'],
+                    'salary': job['total_salary'],
+                    'hourly_rate': job['base_salary'] / job['total_hours'] if job['total_hours'] > 0 else 0,
+                    'premiums': [(label, amount) for label, amount in premiums if amount > 0],
+                    'shift_count': job['shift_count']
+                }
             
             # Hiển thị tổng lương
             col_salary1, col_salary2 = st.columns([1, 2])
@@ -1289,24 +1312,28 @@ with tab3:
                     st.markdown("**📋 Chi tiết theo công việc:**")
                     for job_name, data in job_salary_data.items():
                         if data['salary'] > 0:
+                            # Có phụ cấp: lương giờ + từng khoản phụ cấp = tổng của công việc
+                            breakdown = ""
+                            if data['premiums']:
+                                breakdown = f"{data['base_salary']:,.0f} Yen" + "".join(
+                                    f" + {label} {amount:,.0f} Yen" for label, amount in data['premiums']) + " = "
                             st.markdown(f"""
-                            - **{job_name}**: {data['hours']:.1f}h × {data['hourly_rate']:,.0f} Yen = **{data['salary']:,.0f} Yen** ({data['shift_count']} ca)
+                            - **{job_name}**: {data['hours']:.1f}h × {data['hourly_rate']:,.0f} Yen = {breakdown}**{data['salary']:,.0f} Yen** ({data['shift_count']} ca)
                             """)
             
             st.markdown("---")
             
             # Biểu đồ giờ làm
-            st.subheader("📈 Biểu Đồ Giờ Làm")
+            import plotly.graph_objects as go
             
-            df = pd.DataFrame(report_logs)
-            df['work_date'] = pd.to_datetime(df['work_date'])
+            st.subheader("📈 Biểu Đồ Giờ Làm")
             
             # Biểu đồ cột đơn giản (chỉ tổng giờ, không phân chia OT)
             fig = go.Figure()
             
             fig.add_trace(go.Bar(
-                x=df['work_date'],
-                y=df['total_hours'],
+                x=report_daily['work_date'],
+                y=report_daily['total_hours'],
                 name='Giờ làm',
                 marker_color='#22C55E'
             ))
@@ -1325,122 +1352,40 @@ with tab3:
             # Xuất Excel
             st.subheader("📤 Xuất Báo Cáo")
             
-            # Lấy tất cả shifts để tính lương
-            export_shifts = db.get_shifts_by_range(report_start, report_end)
-            all_jobs_export = db.get_all_jobs()
-            job_map_export = {j['id']: j for j in all_jobs_export}
+            # File chỉ được tạo khi bấm tải (openpyxl chỉ tải khi cần); hàm tạo file chạy ở
+            # thread khác nên được gắn tenant hiện tại. File đã tạo được dùng lại giữa các
+            # process cho đến khi dữ liệu đổi (report_data.build_export)
+            export_name = f"bao_cao_{report_start.strftime('%d%m%Y')}_{report_end.strftime('%d%m%Y')}"
+            col_export1, col_export2 = st.columns(2)
             
-            # Chuẩn bị dữ liệu xuất với cột lương
-            export_data = []
-            total_salary_export = 0
-            
-            for shift in export_shifts:
-                job_id = shift.get('job_id', 1)
-                job_info = job_map_export.get(job_id, {'job_name': 'N/A', 'hourly_rate': 0})
-                salary = shift['total_hours'] * job_info['hourly_rate']
-                total_salary_export += salary
-                
-                export_data.append({
-                    'Ngày': shift['work_date'],
-                    'Ca làm': shift['shift_name'],
-                    'Nơi làm': job_info['job_name'],
-                    'Giờ BĐ': shift['start_time'],
-                    'Giờ KT': shift['end_time'],
-                    'Nghỉ (h)': shift['break_hours'],
-                    'Tổng giờ': shift['total_hours'],
-                    'Lương/h': job_info['hourly_rate'],
-                    'Lương ca': salary,
-                    'Ghi chú': shift.get('notes', '')
-                })
+            with col_export1:
+                st.download_button(
+                    label="💾 Tải Excel",
+                    data=tenant_context.bind(lambda: report_data.export_file(report_start, report_end, 'xlsx')),
+                    file_name=f"{export_name}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    use_container_width=True
+                )
             
-            if export_data:
-                df_export = pd.DataFrame(export_data)
-                
-                # Thêm dòng tổng kết
-                summary_row = {
-                    'Ngày': 'TỔNG CỘNG',
-                    'Ca làm': '',
-                    'Nơi làm': '',
-                    'Giờ BĐ': '',
-                    'Giờ KT': '',
-                    'Nghỉ (h)': '',
-                    'Tổng giờ': sum(s['total_hours'] for s in export_shifts),
-                    'Lương/h': '',
-                    'Lương ca': total_salary_export,
-                    'Ghi chú': ''
-                }
-                df_export = pd.concat([df_export, pd.DataFrame([summary_row])], ignore_index=True)
-                
-                # Tạo file Excel
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    df_export.to_excel(writer, sheet_name='Bao Cao Gio Lam', index=False)
-                
-                excel_data = output.getvalue()
-                
-                col_export1, col_export2 = st.columns(2)
-                
-                with col_export1:
-                    st.download_button(
-                        label="💾 Tải Excel",
-                        data=excel_data,
-                        file_name=f"bao_cao_{report_start.strftime('%d%m%Y')}_{report_end.strftime('%d%m%Y')}.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        use_container_width=True
-                    )
-                
-                with col_export2:
-                    # Export CSV
-                    csv_data = df_export.to_csv(index=False).encode('utf-8-sig')
-                    st.download_button(
-                        label="📄 Tải CSV",
-                        data=csv_data,
-                        file_name=f"bao_cao_{report_start.strftime('%d%m%Y')}_{report_end.strftime('%d%m%Y')}.csv",
-                        mime="text/csv",
-                        use_container_width=True
-                    )
-                
-                st.success(f"📊 Tổng lương trong kỳ: **{total_salary_export:,.0f} Yen**")
+            with col_export2:
+                # Export CSV
+                st.download_button(
+                    label="📄 Tải CSV",
+                    data=tenant_context.bind(lambda: report_data.export_file(report_start, report_end, 'csv')),
+                    file_name=f"{export_name}.csv",
+                    mime="text/csv",
+                    use_container_width=True
+                )
             
             # ==================== TÍNH LƯƠNG ====================
             st.markdown("---")
             st.subheader("💝 Tính Lương Theo Giờ")
             
-            # Lấy tất cả shifts trong khoảng thời gian báo cáo
-            shifts_data = db.get_shifts_by_range(report_start, report_end)
-            
-            if shifts_data:
-                # Lấy danh sách công việc
-                all_jobs = db.get_all_jobs()
-                job_map = {j['id']: j for j in all_jobs}
-                
-                # Tính lương theo từng công việc
-                job_salary = {}
-                total_hours_all = 0
-                total_salary_all = 0
-                
-                for shift in shifts_data:
-                    job_id = shift.get('job_id') or 1
-                    job_info = job_map.get(job_id, {'job_name': 'Chua phan loai', 'hourly_rate': 0})
-                    job_name = job_info.get('job_name', 'Chua phan loai')
-                    hourly_rate = job_info.get('hourly_rate', 0)
-                    hours = shift['total_hours']
-                    
-                    if job_id not in job_salary:
-                        job_salary[job_id] = {
-                            'job_id': job_id,
-                            'job_name': job_name,
-                            'hourly_rate': hourly_rate,
-                            'total_hours': 0,
-                            'shift_count': 0,
-                            'base_salary': 0
-                        }
-                    
-                    job_salary[job_id]['total_hours'] += hours
-                    job_salary[job_id]['shift_count'] += 1
-                    job_salary[job_id]['base_salary'] += hours * hourly_rate
-                    total_hours_all += hours
-                    total_salary_all += hours * hourly_rate
+            if not report_shifts.empty:
+                # Lương theo từng công việc (dùng lại kết quả tính ở trên)
+                job_salary = {job['job_id']: job for job in salary_range['jobs']}
+                total_hours_all = salary_range['total_hours']
+                total_salary_all = salary_range['base_salary']
                 
                 # Hiển thị tổng quan lương
                 col_sal1, col_sal2, col_sal3 = st.columns(3)
@@ -1483,6 +1428,8 @@ with tab3:
                     
                     # Biểu đồ phân bổ lương theo công việc
                     if len(job_salary) > 1:
+                        import plotly.express as px
+                        
                         fig_salary = px.pie(
                             values=[j['base_salary'] for j in job_salary.values()],
                             names=[j['job_name'] for j in job_salary.values()],
@@ -1509,6 +1456,78 @@ with tab3:
                 
         else:
             st.info("ℹ️ Không có dữ liệu trong khoảng thời gian này.")
+    
+    # ==================== SO SÁNH THEO THÁNG / NĂM ====================
+    st.markdown("---")
+    st.subheader("📊 So Sánh Theo Tháng / Năm")
+    
+    import plotly.graph_objects as go
+    
+    col_cmp_mode, col_cmp_range = st.columns([1, 2])
+    with col_cmp_mode:
+        compare_mode = st.radio(
+            "Kiểu so sánh:",
+            options=["Theo tháng", "Cùng kỳ năm trước"],
+            horizontal=True,
+            key="compare_mode"
+        )
+
+    today_cmp = date.today()
+    if compare_mode == "Theo tháng":
+        with col_cmp_range:
+            compare_months = st.slider("Số tháng:", min_value=3, max_value=36, value=12, key="compare_months")
+        series = db.get_monthly_series(today_cmp.year, today_cmp.month, compare_months)
+    
+        # Lương cơ bản + phụ cấp (cột chồng) và tổng giờ (đường, trục phải)
+        fig_cmp = go.Figure()
+        fig_cmp.add_trace(go.Bar(x=series['labels'], y=series['base_salary'], name='Lương cơ bản', marker_color='#667eea'))
+        fig_cmp.add_trace(go.Bar(x=series['labels'], y=series['ot_bonus'], name='OT', marker_color='#F59E0B'))
+        fig_cmp.add_trace(go.Bar(x=series['labels'], y=series['night_bonus'], name='Ca đêm', marker_color='#8B5CF6'))
+        fig_cmp.add_trace(go.Bar(x=series['labels'], y=series['holiday_bonus'], name='Ngày lễ', marker_color='#EF4444'))
+        fig_cmp.add_trace(go.Scatter(x=series['labels'], y=series['total_hours'], name='Tổng giờ',
+                                     yaxis='y2', mode='lines+markers', line=dict(color='#22C55E')))
+        fig_cmp.update_layout(
+            title=f'Lương & Giờ Làm {compare_months} Tháng Gần Nhất',
+            barmode='stack',
+            yaxis=dict(title='Lương (¥)'),
+            yaxis2=dict(title='Số Giờ', overlaying='y', side='right'),
+            height=420
+        )
+        st.plotly_chart(fig_cmp, use_container_width=True)
+    
+        # Phân chia theo công việc
+        if len(series['jobs']) > 1:
+            fig_jobs = go.Figure()
+            for job in series['jobs']:
+                fig_jobs.add_trace(go.Bar(x=series['labels'], y=job['salary'], name=job['job_name'], marker_color=job['color']))
+            fig_jobs.update_layout(title='Lương Theo Công Việc', barmode='stack', yaxis_title='Lương (¥)', height=380)
+            st.plotly_chart(fig_jobs, use_container_width=True)
+    else:
+        with col_cmp_range:
+            compare_years = st.multiselect(
+                "Chọn năm:",
+                options=list(range(today_cmp.year - 5, today_cmp.year + 1)),
+                default=[today_cmp.year - 1, today_cmp.year],
+                key="compare_years"
+            )
+        if compare_years:
+            yoy = db.get_year_over_year(sorted(compare_years))
+            month_labels = [f"T{m}" for m in range(1, 13)]
+        
+            fig_yoy = go.Figure()
+            for year, year_series in yoy.items():
+                fig_yoy.add_trace(go.Bar(x=month_labels, y=year_series['total_salary'], name=str(year)))
+            fig_yoy.update_layout(title='Tổng Lương Theo Tháng - So Sánh Cùng Kỳ', barmode='group',
+                                  yaxis_title='Lương (¥)', height=400)
+            st.plotly_chart(fig_yoy, use_container_width=True)
+        
+            yoy_cols = st.columns(len(yoy))
+            for col, (year, year_series) in zip(yoy_cols, yoy.items()):
+                with col:
+                    st.metric(f"💰 Năm {year}", f"{sum(year_series['total_salary']):,.0f} ¥",
+                              f"{sum(year_series['total_hours']):.1f} giờ", delta_color="off")
+        else:
+            st.info("🌸 Hãy chọn ít nhất một năm để so sánh.")
 
 # ==================== TAB 4: TÙY CHỈNH ====================
 
@@ -1553,7 +1572,53 @@ with tab4:
                 st.toast(f"💫 Đã cập nhật giờ nghỉ: {new_break}h", icon="✅")
             else:
                 st.toast("😿 Lỗi khi lưu!", icon="❌")
-    
+
+    # Hệ số lương (OT, ca đêm 22:00-05:00, ngày lễ)
+    st.markdown("**💴 Hệ Số Lương**")
+    col_rate1, col_rate2, col_rate3 = st.columns(3)
+
+    with col_rate1:
+        new_ot_rate = st.number_input(
+            "Hệ số làm thêm (OT):",
+            min_value=1.0,
+            max_value=3.0,
+            value=db.get_ot_rate(),
+            step=0.05,
+            help="Áp dụng cho giờ vượt giờ làm chuẩn trong ngày."
+        )
+
+    with col_rate2:
+        new_night_rate = st.number_input(
+            "Hệ số ca đêm:",
+            min_value=1.0,
+            max_value=3.0,
+            value=float(db.get_setting("night_rate") or payroll.DEFAULT_NIGHT_RATE),
+            step=0.05,
+            help="Áp dụng cho giờ làm trong khung 22:00 - 05:00. Để 1.0 nếu không có phụ cấp."
+        )
+
+    with col_rate3:
+        new_holiday_rate = st.number_input(
+            "Hệ số ngày lễ:",
+            min_value=1.0,
+            max_value=3.0,
+            value=float(db.get_setting("holiday_rate") or payroll.DEFAULT_HOLIDAY_RATE),
+            step=0.05,
+            help="Áp dụng cho giờ làm vào ngày nghỉ lễ. Để 1.0 nếu không có phụ cấp."
+        )
+
+    if st.button("💖 LƯU HỆ SỐ LƯƠNG", key="save_pay_rates"):
+        saved = all([
+            db.update_setting("ot_rate", str(new_ot_rate)),
+            db.update_setting("night_rate", str(new_night_rate)),
+            db.update_setting("holiday_rate", str(new_holiday_rate)),
+        ])
+        if saved:
+            st.toast("💫 Đã cập nhật hệ số lương!", icon="✅")
+            st.cache_data.clear()
+        else:
+            st.toast("😿 Lỗi khi lưu!", icon="❌")
+
     st.markdown("---")
     
     # ==================== KHUNG GIỜ MẪU ====================
@@ -1638,6 +1703,7 @@ with tab4:
             ]
             
             # Drag-and-drop sorting
+            from streamlit_sortables import sort_items
             sorted_labels = sort_items(preset_labels, direction="vertical")
             
             # Kiểm tra thứ tự có thay đổi không
@@ -1731,6 +1797,7 @@ with tab4:
         st.markdown("**📋 Danh Sách Công Việc**")
         
         jobs = db.get_all_jobs()
+        job_rates = db.get_job_rates()
         
         if jobs:
             for job in jobs:
@@ -1755,6 +1822,15 @@ with tab4:
                             key=f"rate_{job['id']}"
                         )
                         
+                        # Ngày hiệu lực của lương mới (các ca trước ngày này giữ lương cũ)
+                        updated_rate_from = st.date_input(
+                            "Áp dụng lương mới từ ngày:",
+                            value=date.today(),
+                            format="DD/MM/YYYY",
+                            key=f"rate_from_{job['id']}",
+                            help="Chỉ áp dụng khi thay đổi lương giờ. Lương các tháng trước ngày này không bị tính lại."
+                        )
+                        
                         # Chỉnh sửa mô tả
                         updated_desc = st.text_input(
                             "Mô tả:",
@@ -1763,7 +1839,8 @@ with tab4:
                         )
                         
                         if st.button("💖 Cập Nhật Công Việc", key=f"update_job_{job['id']}", type="primary"):
-                            if db.update_job(job['id'], updated_name, updated_rate, updated_desc):
+                            if db.update_job(job['id'], updated_name, updated_rate, updated_desc,
+                                             effective_from=updated_rate_from):
                                 st.success("🎉 Đã cập nhật công việc!")
                                 st.cache_data.clear()  # Clear cache để cập nhật dashboard
                                 st.rerun()
@@ -1775,22 +1852,27 @@ with tab4:
                         if job.get('description'):
                             st.write(f"**Mô tả:** {job['description']}")
                         
+                        # Lịch sử lương giờ
+                        rate_history = [r for r in job_rates if r['job_id'] == job['id']]
+                        if len(rate_history) > 1:
+                            st.markdown("**📜 Lịch sử lương:**")
+                            for rate in rate_history:
+                                rate_from = str(rate['effective_from'])
+                                rate_label = "Ban đầu" if rate_from == database.RATE_EPOCH else f"Từ {rate_from}"
+                                st.caption(f"{rate_label}: {rate['hourly_rate']:,.0f} Yen/h")
+                        
                         st.markdown("---")
                         st.markdown("**🗑️ Xóa Công Việc**")
                         
                         # Kiểm tra xem công việc có đang được sử dụng không
-                        # Lấy số ca đang dùng công việc này (với xử lý lỗi)
+                        # (một truy vấn GROUP BY cho mọi công việc, dùng chung trong lượt chạy)
                         count = 0
                         try:
-                            conn = database.get_connection()
-                            cursor = conn.cursor()
-                            cursor.execute("SELECT COUNT(*) FROM work_shifts WHERE job_id = ?", (job['id'],))
-                            count = cursor.fetchone()[0]
-                            conn.close()
+                            count = db.get_shift_counts_by_job().get(job['id'], 0)
                         except Exception:
                             # Bảng work_shifts có thể chưa tồn tại - init lại database
                             try:
-                                database.init_database()
+                                db.init_database()
                             except:
                                 pass
                             count = 0
@@ -1899,6 +1981,56 @@ with tab4:
                 st.rerun()
             else:
                 st.toast("ℹ️ Đã có sẵn các ngày lễ", icon="ℹ️")
+    
+    st.markdown("---")
+    
+    # ==================== SAO LƯU DỮ LIỆU ====================
+    st.subheader("💾 Sao Lưu & Khôi Phục")
+    
+    if db.is_cloud_mode():
+        st.caption("☁️ Dữ liệu được lưu trên **Supabase** — sao lưu do Supabase quản lý")
+    elif db.is_multi_tenant():
+        # Khôi phục file chung sẽ ghi đè dữ liệu của mọi user -> chỉ quản trị viên thực hiện
+        st.caption("🗄️ Dữ liệu của mọi user nằm chung một file — sao lưu bằng `python maintenance.py --include-tenants --backup`")
+    else:
+        current_db_path = database.get_db_path()
+        col_backup, col_restore = st.columns([1, 2])
+        
+        with col_backup:
+            st.markdown("**📦 Tạo bản sao lưu**")
+            st.caption(f"Giữ {snapshots.KEEP_SNAPSHOTS} bản mới nhất trong `{snapshots.BACKUP_DIR}` "
+                       f"(và {snapshots.KEEP_PRE_RESTORE} bản tự động trước khi khôi phục)")
+            if st.button("💾 SAO LƯU NGAY", type="primary", key="create_backup", use_container_width=True):
+                backup_path = snapshots.create_snapshot(current_db_path)
+                if backup_path:
+                    st.toast(f"✅ Đã sao lưu: {os.path.basename(backup_path)}", icon="💾")
+                else:
+                    st.toast("😿 Lỗi khi sao lưu!", icon="❌")
+        
+        with col_restore:
+            st.markdown("**♻️ Khôi phục**")
+            backup_list = snapshots.list_snapshots(current_db_path)
+            if backup_list:
+                backup_labels = {
+                    f"{b['created_at'].strftime('%d/%m/%Y %H:%M:%S')} ({b['size'] / 1024:,.0f} KB)"
+                    f"{' — trước khi khôi phục' if b['tag'] == snapshots.PRE_RESTORE_TAG else ''}": b['path']
+                    for b in backup_list
+                }
+                selected_backup = st.selectbox("Chọn bản sao lưu:", list(backup_labels.keys()), key="restore_backup_choice")
+                confirm_restore = st.checkbox(
+                    "Tôi hiểu dữ liệu hiện tại sẽ được thay thế (bản hiện tại được sao lưu trước)",
+                    key="confirm_restore"
+                )
+                if confirm_restore and st.button("♻️ Khôi Phục", key="restore_backup"):
+                    if snapshots.restore_snapshot(backup_labels[selected_backup], current_db_path):
+                        db.clear_cache()
+                        db.init_database()
+                        st.toast("✅ Đã khôi phục dữ liệu!", icon="♻️")
+                        st.rerun()
+                    else:
+                        st.error("😿 Bản sao lưu bị lỗi, không thể khôi phục!")
+            else:
+                st.info("ℹ️ Chưa có bản sao lưu nào.")
 
 # ==================== SIDEBAR ====================
 
@@ -1920,6 +2052,69 @@ with st.sidebar:
     
     st.markdown("---")
     
+    # Trạng thái đồng bộ GitHub (worker nền, chỉ ở chế độ SQLite)
+    if not db.is_cloud_mode() and sync_worker.is_enabled():
+        sync_status = sync_worker.get_status()
+        sync_labels = {
+            'idle': "✅ Đã đồng bộ",
+            'pending': f"⏳ Chờ đồng bộ ({sync_status['pending']})",
+            'syncing': "🔄 Đang đồng bộ...",
+            'retrying': "🔁 Đang thử lại...",
+            'error': "⚠️ Lỗi đồng bộ",
+        }
+        st.caption(f"☁️ GitHub: {sync_labels.get(sync_status['state'], sync_status['state'])}")
+        if sync_status['last_success_at']:
+            last_sync = datetime.fromtimestamp(sync_status['last_success_at']).strftime('%H:%M:%S')
+            st.caption(f"Lần cuối: {last_sync}")
+        if sync_status['state'] == 'error' and sync_status['last_error']:
+            st.caption(f"⚠️ {sync_status['last_error']}")
+        st.markdown("---")
+
+    # Các lần ghi chưa gửi lên Supabase (outbox của bản sao local, chỉ hiện khi có)
+    outbox_status = db.get_outbox_status() if db.is_cloud_mode() else None
+    if outbox_status and (outbox_status.get('pending') or outbox_status.get('failed')):
+        if outbox_status.get('pending'):
+            if outbox_status['state'] == 'retrying':
+                st.caption(f"🔁 Mất kết nối Supabase: {outbox_status['pending']} thay đổi đã lưu trên máy, đang thử gửi lại")
+            else:
+                st.caption(f"⏳ Đang gửi {outbox_status['pending']} thay đổi lên Supabase...")
+        if outbox_status.get('failed'):
+            st.caption(f"⚠️ {outbox_status['failed']} thay đổi bị Supabase từ chối")
+            if outbox_status['last_error']:
+                st.caption(f"⚠️ {outbox_status['last_error']}")
+        st.markdown("---")
+
+    # Debug: cache dữ liệu tham chiếu dùng chung giữa các session (ref_cache)
+    with st.expander("🧰 Debug: cache dữ liệu", expanded=False):
+        cache_stats = db.get_reference_cache_stats()
+        st.caption(
+            f"Trúng {cache_stats['hits']:,} / trượt {cache_stats['misses']:,} "
+            f"({cache_stats['hit_ratio']:.0%}) · {cache_stats['entries']}/{cache_stats['max_entries']} mục, "
+            f"{cache_stats['scopes']} user"
+        )
+        st.caption(
+            f"Hủy {cache_stats['invalidations']:,} · hết hạn {cache_stats['expired']:,} · "
+            f"đẩy ra (LRU) {cache_stats['evictions']:,} · TTL {cache_stats['ttl_seconds']:.0f}s"
+        )
+        for table, counts in cache_stats['tables'].items():
+            st.caption(f"• {table}: {counts['hits']:,} trúng / {counts['misses']:,} trượt")
+        # Cache kết quả tổng hợp trên đĩa, dùng chung giữa các process (result_cache)
+        result_stats = db.get_result_cache_stats()
+        if result_stats and result_stats['entries'] is not None:
+            st.caption(
+                f"Kết quả tổng hợp (đĩa): trúng {result_stats['hits']:,} / trượt {result_stats['misses']:,} "
+                f"({result_stats['hit_ratio']:.0%}) · {result_stats['entries']:,} mục, "
+                f"{result_stats['bytes'] / 1024 / 1024:.1f}/{result_stats['max_bytes'] / 1024 / 1024:.0f} MB · "
+                f"đẩy ra {result_stats['evictions']:,}"
+            )
+        # Ghi SQLite: các session lần lượt lấy khóa ghi của file (sqlite_writer)
+        write_stats = db.get_write_stats()
+        st.caption(
+            f"Ghi SQLite: {write_stats['transactions']:,} transaction · chờ khóa {write_stats['contended']:,} lần "
+            f"(TB {write_stats['avg_wait_ms']:.1f} ms, tối đa {write_stats['max_wait_ms']:.0f} ms) · "
+            f"lỗi khóa {write_stats['lock_errors']:,}"
+        )
+
     st.markdown("### 💌 Thông Tin")
     st.markdown("""
     **Quản Lý Giờ Làm** v1.0
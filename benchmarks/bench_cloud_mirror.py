@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Đo bản sao đọc SQLite cục bộ (cloud_mirror) trong chế độ cloud, với PostgREST
+giả lập (benchmarks/postgrest_stub.py, đã cài RPC tổng hợp và mirror_changes).
+
+Một "lượt vẽ trang" gọi các hàm đọc mà app.py dùng mỗi rerun (jobs, khung giờ,
+cài đặt, tháng đã chốt, tổng hợp ngày / lương tháng này, chuỗi 12 tháng, ngày
+lễ, ca hôm nay). In số request, số byte và thời gian của:
+  - direct: đọc thẳng Supabase (CLOUD_MIRROR tắt)
+  - mirror: đọc từ bản sao đã nạp (kèm chi phí nạp lần đầu và một lần làm mới)
+rồi kiểm tra bản sao cho cùng kết quả với đọc thẳng sau khi:
+  - ghi qua db_wrapper (ghi vào bản sao + outbox: thêm/sửa/xóa ca, ngày lễ, cài đặt, đổi lương,
+    chốt tháng), so sánh sau khi outbox gửi xong
+  - dữ liệu bị đổi ngoài app (sửa thẳng database của stub, kể cả xóa) rồi làm mới ở nền
+  - project chưa có RPC mirror_changes (tải toàn bộ từng bảng)
+
+Chạy: python benchmarks/bench_cloud_mirror.py   (exit code 1 nếu bản sao lệch)
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+os.environ['CLOUD_MIRROR_DIR'] = tempfile.mkdtemp()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from postgrest_stub import PostgrestStub  # noqa: E402
+
+import cloud_mirror  # noqa: E402
+import cloud_outbox  # noqa: E402
+import database  # noqa: E402
+import db_wrapper as db  # noqa: E402
+import payroll  # noqa: E402
+import supabase_db as sdb  # noqa: E402
+import tenant_context  # noqa: E402
+
+TODAY = date.today()
+FIRST_DAY = TODAY - timedelta(days=600)   # một phần ca nằm ngoài cửa sổ của bản sao
+RENDERS = 20
+
+
+def populate(seed: int = 7) -> None:
+    """Dữ liệu mẫu ghi qua db_wrapper (đường ghi của app)."""
+    rng = random.Random(seed)
+    db.init_database()
+    db.update_setting('standard_hours', '7.5')
+    jobs = db.get_all_jobs()
+    day = FIRST_DAY
+    while day <= TODAY:
+        for _ in range(rng.choice((0, 1, 1, 2))):
+            start, end, brk, total = rng.choice((('08:00', '17:00', 1.0, 8.0), ('22:00', '06:00', 1.0, 7.0),
+                                                 ('13:00', '18:30', 0.5, 5.0)))
+            db.add_shift(day, rng.choice(jobs)['id'], start, end, brk, total, 0.0, rng.choice(('', 'trực')))
+        day += timedelta(days=1)
+    for i in range(8):
+        db.add_holiday(FIRST_DAY + timedelta(days=40 + i * 70), f'Ngày lễ {i}')
+    year, month = payroll.months_back(TODAY.year, TODAY.month, 3)[0]
+    db.close_month(year, month)
+
+
+def render() -> dict:
+    """Các lần đọc của một lượt vẽ trang (một rerun)."""
+    db.begin_request()
+    standard_hours = db.get_standard_hours()
+    return {
+        'jobs': db.get_all_jobs(),
+        'presets': db.get_all_presets(),
+        'settings': db.get_all_settings(),
+        'closed': db.get_closed_months(),
+        'today': db.get_shifts_by_date(TODAY),
+        'days': db.get_daily_summaries_by_month(TODAY.year, TODAY.month, standard_hours),
+        'salary': db.calculate_salary_by_month(TODAY.year, TODAY.month),
+        'series': db.get_monthly_series(TODAY.year, TODAY.month, 12),
+        'holidays': db.get_holidays_by_year(TODAY.year),
+        'rates': db.get_job_rates(),
+    }
+
+
+def report() -> dict:
+    """Báo cáo dài hạn (một phần ngoài cửa sổ: đọc thẳng Supabase)."""
+    db.begin_request()
+    return {
+        'range': db.calculate_salary_by_range(FIRST_DAY, TODAY),
+        'old_shifts': db.get_shifts_by_range(FIRST_DAY, FIRST_DAY + timedelta(days=60)),
+        'counts': db.get_shift_counts_by_job(),
+    }
+
+
+def normalize(value):
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, dict):
+        return {k: normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    return value
+
+
+def read_both(reader) -> tuple:
+    """(kết quả đọc thẳng, kết quả từ bản sao)."""
+    cloud_mirror._enabled = False
+    direct = normalize(reader())
+    cloud_mirror._enabled = True
+    return direct, normalize(reader())
+
+
+def measure(stub: PostgrestStub, reader, runs: int = RENDERS) -> tuple:
+    """(request, byte nhận, ms) trung bình mỗi lượt."""
+    stub.reset_counters()
+    started = time.perf_counter()
+    for _ in range(runs):
+        reader()
+    elapsed = (time.perf_counter() - started) * 1000 / runs
+    return stub.requests / runs, stub.bytes_out / runs, elapsed
+
+
+def check(name: str, reader, failures: list) -> None:
+    direct, mirrored = read_both(reader)
+    ok = direct == mirrored
+    if not ok:
+        for key in direct:
+            if direct[key] != mirrored.get(key):
+                failures.append(f"{name}: lệch ở '{key}'")
+                break
+    print(f"  {name:<44} {'OK' if ok else 'LỆCH'}")
+
+
+def writes_through_app() -> None:
+    """Ghi qua db_wrapper (bản sao + outbox, gửi lên server ở nền)."""
+    db.begin_request()
+    jobs = db.get_all_jobs()
+    shift_id = db.add_shift(TODAY, jobs[0]['id'], '09:00', '12:00', 0.0, 3.0, 0.0, 'mới')
+    db.update_shift(shift_id, start_time='09:30', end_time='12:30', break_hours=0.0, total_hours=3.0, notes='sửa')
+    victim = db.get_shifts_by_range(TODAY - timedelta(days=20), TODAY)[0]
+    db.delete_shift(victim['id'])
+    db.add_holiday(TODAY, 'Nghỉ hôm nay')
+    db.update_setting('ot_rate', '1.5')
+    db.update_job(jobs[1]['id'], jobs[1]['job_name'], 1500, '', jobs[1]['color'],
+                  effective_from=TODAY - timedelta(days=10))
+    db.add_preset('Ca ngắn', '10:00', '12:00', 0.0, 2.0)
+    year, month = payroll.months_back(TODAY.year, TODAY.month, 2)[0]
+    db.close_month(year, month)
+
+
+def changes_outside_app(stub: PostgrestStub, user_id: int) -> None:
+    """Thiết bị / người khác sửa dữ liệu: ghi thẳng vào database của stub."""
+    with stub.lock:
+        conn = stub.conn
+        conn.execute("UPDATE work_shifts SET notes = 'sửa ngoài app', total_hours = total_hours + 1 "
+                     "WHERE id = (SELECT MAX(id) FROM work_shifts WHERE user_id = ? AND work_date < ?)",
+                     (user_id, TODAY.isoformat()))
+        conn.execute("DELETE FROM work_shifts WHERE id = (SELECT MIN(id) FROM work_shifts "
+                     "WHERE user_id = ? AND work_date >= ?)", (user_id, (TODAY - timedelta(days=90)).isoformat()))
+        conn.execute("INSERT INTO work_shifts (user_id, work_date, shift_name, job_id, start_time, end_time, "
+                     "break_hours, total_hours, notes) SELECT ?, ?, 'Ca làm', MIN(id), '18:00', '22:00', 0, 4, 'điện thoại' "
+                     "FROM jobs WHERE user_id = ?", (user_id, TODAY.isoformat(), user_id))
+        conn.execute("DELETE FROM holidays WHERE user_id = ? AND holiday_date = ?", (user_id, TODAY.isoformat()))
+        conn.execute("UPDATE settings SET value = '8.0' WHERE user_id = ? AND key = 'standard_hours'", (user_id,))
+        conn.execute("DELETE FROM payroll_snapshots WHERE user_id = ?", (user_id,))
+        conn.commit()
+
+
+def main() -> int:
+    database.ENABLE_SYNC = False
+    cloud_mirror.REFRESH_SECONDS = 3600
+    # Stub ghi tuần tự (không có transaction commit muộn): không cần lùi mốc,
+    # làm mới chỉ tải đúng phần thay đổi dù dữ liệu vừa được tạo
+    cloud_mirror.WATERMARK_OVERLAP = timedelta(0)
+    failures = []
+
+    stub = PostgrestStub().install_aggregate_rpcs().install_mirror_rpcs().install_client_refs().start()
+    stub.connect_supabase_db()
+    try:
+        user_id = sdb.create_user('mirror_user', 'hash', 'Mirror')['id']
+        db.clear_cache()
+        db._check_supabase()
+        with tenant_context.use_tenant(user_id=user_id):
+            cloud_mirror._enabled = True
+            populate()
+            cloud_outbox.wait_idle(60)
+
+            # Nạp lần đầu (như sau đăng nhập: process mới, file bản sao chưa có)
+            os.remove(cloud_mirror.mirror_path(user_id))
+            db.clear_cache()
+            stub.reset_counters()
+            started = time.perf_counter()
+            db.init_database()
+            hydrate = (stub.requests, stub.bytes_out, (time.perf_counter() - started) * 1000)
+
+            cloud_mirror._enabled = False
+            direct = measure(stub, render)
+            cloud_mirror._enabled = True
+            mirrored = measure(stub, render)
+            stub.reset_counters()
+            started = time.perf_counter()
+            cloud_mirror.refresh(user_id)
+            delta = (stub.requests, stub.bytes_out, (time.perf_counter() - started) * 1000)
+
+            print(f"{'':<28} {'request':>8} {'byte nhận':>10} {'ms':>8}")
+            print(f"{'lượt vẽ trang: direct':<28} {direct[0]:>8.1f} {direct[1]:>10,.0f} {direct[2]:>8.1f}")
+            print(f"{'lượt vẽ trang: mirror':<28} {mirrored[0]:>8.1f} {mirrored[1]:>10,.0f} {mirrored[2]:>8.1f}")
+            print(f"{'nạp bản sao (đăng nhập)':<28} {hydrate[0]:>8} {hydrate[1]:>10,} {hydrate[2]:>8.1f}")
+            print(f"{'làm mới (không đổi gì)':<28} {delta[0]:>8} {delta[1]:>10,} {delta[2]:>8.1f}")
+            if mirrored[0] != 0:
+                failures.append(f"lượt vẽ trang từ bản sao vẫn gửi {mirrored[0]} request")
+
+            print("\nBản sao so với đọc thẳng Supabase:")
+            check("sau khi nạp", render, failures)
+            check("báo cáo dài hạn (ngoài cửa sổ)", report, failures)
+            writes_through_app()
+            cloud_outbox.wait_idle(60)
+            check("sau khi ghi qua app (outbox đã gửi)", render, failures)
+
+            changes_outside_app(stub, user_id)
+            cloud_mirror.REFRESH_SECONDS = 0
+            db.begin_request()
+            # Bản sao quá hạn: làm mới ở nền, lượt này vẫn đọc bản cũ (đọc ca làm việc:
+            # dữ liệu tham chiếu do ref_cache trả lời, không chạm bản sao)
+            db.get_shifts_by_date(TODAY)
+            deadline = time.monotonic() + 5
+            mirror = cloud_mirror.get_mirror(user_id)
+            while mirror._refresh_lock.locked() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            cloud_mirror.REFRESH_SECONDS = 3600
+            check("sau khi sửa ngoài app + làm mới nền", render, failures)
+
+            stub.rpc.pop('mirror_changes')
+            changes_outside_app(stub, user_id)
+            stub.reset_counters()
+            cloud_mirror.refresh(user_id)
+            print(f"  (không có RPC: làm mới = {stub.requests} request, {stub.bytes_out:,} byte)")
+            check("không có RPC mirror_changes", render, failures)
+    finally:
+        cloud_outbox.shutdown()
+        stub.stop()
+
+    for failure in failures:
+        print(f"LỖI: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Đo outbox ghi của chế độ cloud (cloud_outbox) với PostgREST giả lập chập chờn
+(benchmarks/postgrest_stub.py: set_faults).
+
+  1. Độ trễ một lần ghi qua db_wrapper khi mỗi request tới Supabase mất LATENCY
+     giây: ghi thẳng (CLOUD_MIRROR tắt) so với ghi vào outbox (worker gửi ở nền)
+  2. Supabase sập: mọi lần ghi vẫn được nhận và đọc thấy ngay; "khởi động lại"
+     app (dừng worker, quên bản sao đã mở) khi outbox còn nguyên; server sống
+     lại thì outbox tự gửi hết
+  3. Mạng chập chờn (503 và mất response sau khi server đã ghi): không mất lần
+     ghi nào, không tạo dòng trùng, dữ liệu server khớp bản sao
+
+Chạy: python benchmarks/bench_cloud_outbox.py   (exit code 1 nếu mất / trùng / lệch dữ liệu)
+"""
+
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+os.environ['CLOUD_MIRROR_DIR'] = tempfile.mkdtemp()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from postgrest_stub import PostgrestStub  # noqa: E402
+
+import cloud_mirror  # noqa: E402
+import cloud_outbox  # noqa: E402
+import database  # noqa: E402
+import db_wrapper as db  # noqa: E402
+import supabase_db as sdb  # noqa: E402
+import tenant_context  # noqa: E402
+
+TODAY = date.today()
+LATENCY = 0.08
+WRITES = 20
+OUTAGE_OPS = 60
+FLAKY_OPS = 200
+
+
+def render() -> dict:
+    """Dữ liệu mà các lần ghi của workload chạm tới."""
+    db.begin_request()
+    return {
+        'jobs': db.get_all_jobs(),
+        'rates': db.get_job_rates(),
+        'presets': db.get_all_presets(),
+        'settings': db.get_all_settings(),
+        'shifts': db.get_shifts_by_range(TODAY - timedelta(days=60), TODAY),
+        # id ngày lễ chỉ có trên server (bản sao nhận diện theo ngày, như MIRROR_KEYS)
+        'holidays': [(row['holiday_date'], row['description'])
+                     for row in db.get_holidays_by_range(TODAY - timedelta(days=60), TODAY)],
+    }
+
+
+def read_both() -> tuple:
+    """(đọc thẳng Supabase, đọc từ bản sao) - bản sao chưa làm mới: đúng ý định của các lần ghi."""
+    cloud_mirror._enabled = False
+    direct = render()
+    cloud_mirror._enabled = True
+    return direct, render()
+
+
+def workload(rng: random.Random, ops: int, tag: str) -> int:
+    """Ghi hỗn hợp qua db_wrapper, kể cả sửa / xóa dòng còn mang id tạm. Trả về số lần ghi bị từ chối."""
+    refused = 0
+    db.begin_request()
+    job_id = db.add_job(f'Việc {tag}', 1300, 'outbox')
+    refused += not job_id
+    db.update_job(job_id, f'Việc {tag}', 1400, 'outbox', '#ff9900', effective_from=TODAY - timedelta(days=20))
+    preset_id = db.add_preset(f'Ca {tag}', '07:00', '11:00', 0.0, 4.0, job_id)
+    refused += not preset_id
+    job_ids = [job['id'] for job in db.get_all_jobs()]
+    created = []
+    for i in range(ops):
+        db.begin_request()
+        roll = rng.random()
+        day = TODAY - timedelta(days=rng.randrange(45))
+        if roll < 0.45 or not created:
+            shift_id = db.add_shift(day, rng.choice(job_ids), '09:00', '17:00', 1.0, 7.0, 0.0, f'{tag} {i}')
+            refused += not shift_id
+            if shift_id:
+                created.append(shift_id)
+        elif roll < 0.6:
+            refused += not db.update_shift(rng.choice(created), start_time='10:00', end_time='17:00',
+                                           break_hours=1.0, total_hours=6.0, notes=f'{tag} sửa {i}')
+        elif roll < 0.7:
+            refused += not db.delete_shift(created.pop(rng.randrange(len(created))))
+        elif roll < 0.8:
+            refused += not db.add_holiday(day, f'Nghỉ {tag} {i}')
+        elif roll < 0.85:
+            refused += not db.remove_holiday(day)
+        elif roll < 0.95:
+            refused += not db.update_setting('ot_rate', str(1.25 + rng.randrange(4) * 0.05))
+        else:
+            refused += not db.update_preset(preset_id, emoji=rng.choice('🌅🌙⏰'))
+    return refused
+
+
+def outbox_counts(user_id: int) -> dict:
+    with sqlite3.connect(cloud_mirror.mirror_path(user_id)) as conn:
+        return cloud_outbox.counts(conn)
+
+
+def server_duplicates(stub: PostgrestStub, user_id: int) -> int:
+    """Số ca trùng trên server (cùng ngày, giờ và ghi chú - workload không bao giờ tạo hai ca như vậy)."""
+    with stub.lock:
+        return stub.conn.execute("""
+            SELECT COALESCE(SUM(n - 1), 0) FROM (
+                SELECT COUNT(*) AS n FROM work_shifts WHERE user_id = ?
+                GROUP BY work_date, start_time, notes
+            )
+        """, (user_id,)).fetchone()[0]
+
+
+def check(name: str, failures: list) -> None:
+    direct, mirrored = read_both()
+    ok = direct == mirrored
+    if not ok:
+        for key in direct:
+            if direct[key] != mirrored.get(key):
+                failures.append(f"{name}: lệch ở '{key}' (server {len(direct[key])}, bản sao {len(mirrored[key])})")
+                break
+    print(f"  {name:<44} {'OK' if ok else 'LỆCH'}")
+
+
+def main() -> int:
+    database.ENABLE_SYNC = False
+    cloud_mirror.REFRESH_SECONDS = 3600
+    cloud_mirror.WATERMARK_OVERLAP = timedelta(0)
+    cloud_outbox.BACKOFF_BASE_SECONDS = 0.05
+    cloud_outbox.BACKOFF_MAX_SECONDS = 0.5
+    failures = []
+
+    stub = PostgrestStub().install_aggregate_rpcs().install_mirror_rpcs().install_client_refs().start()
+    stub.connect_supabase_db()
+    try:
+        user_id = sdb.create_user('outbox_user', 'hash', 'Outbox')['id']
+        db.clear_cache()
+        db._check_supabase()
+        with tenant_context.use_tenant(user_id=user_id):
+            cloud_mirror._enabled = True
+            db.init_database()
+            job_id = db.get_all_jobs()[0]['id']
+
+            # 1. Độ trễ ghi
+            stub.set_faults(latency=LATENCY)
+            timings = {}
+            for mode in ('direct', 'outbox'):
+                cloud_mirror._enabled = mode == 'outbox'
+                samples = []
+                stub.reset_counters()
+                for i in range(WRITES):
+                    db.begin_request()
+                    started = time.perf_counter()
+                    db.add_shift(TODAY - timedelta(days=i), job_id, '08:00', '12:00', 0.0, 4.0, 0.0, f'{mode} {i}')
+                    samples.append((time.perf_counter() - started) * 1000)
+                requests_in_call = stub.requests
+                started = time.perf_counter()
+                cloud_outbox.wait_idle(60)
+                drained = (time.perf_counter() - started) * 1000
+                timings[mode] = (statistics.median(samples), max(samples), requests_in_call / WRITES,
+                                 stub.requests, drained)
+            cloud_mirror._enabled = True
+            stub.set_faults()
+            cloud_mirror.refresh(user_id)   # ca ghi thẳng (CLOUD_MIRROR tắt) chưa có trong bản sao
+
+            print(f"Ghi {WRITES} ca, mỗi request tới Supabase trễ {LATENCY * 1000:.0f} ms:")
+            print(f"{'':<10} {'ms/ghi p50':>11} {'max':>8} {'req/ghi':>8} {'req tổng':>9} {'gửi nền ms':>11}")
+            for mode, (p50, worst, per_write, total, drained) in timings.items():
+                background = f"{drained:>11.0f}" if mode == 'outbox' else f"{'-':>11}"
+                print(f"{mode:<10} {p50:>11.1f} {worst:>8.1f} {per_write:>8.1f} {total:>9} {background}")
+            print()
+
+            # 2. Supabase sập, app khởi động lại, server sống lại
+            stub.set_faults(error_rate=1.0)
+            stub.reset_counters()
+            refused = workload(random.Random(1), OUTAGE_OPS, 'sập')
+            time.sleep(0.3)   # worker thử gửi vài lần (đều lỗi)
+            pending = outbox_counts(user_id)['pending']
+            status = cloud_outbox.get_status()
+            print(f"Supabase sập: {OUTAGE_OPS + 3} lần ghi, {refused} bị từ chối, "
+                  f"{pending} chờ trong outbox, {stub.requests} request lỗi, trạng thái '{status['state']}'")
+            if refused or not pending:
+                failures.append("Supabase sập: lần ghi bị từ chối hoặc outbox trống")
+
+            cloud_outbox.shutdown()
+            db.clear_cache()
+            print(f"  khởi động lại: outbox trong file còn {outbox_counts(user_id)['pending']} thao tác")
+            stub.set_faults()
+            stub.reset_counters()
+            started = time.perf_counter()
+            db.init_database()       # mở lại bản sao -> worker gửi tiếp outbox
+            drained = cloud_outbox.wait_idle(30)
+            counts = outbox_counts(user_id)
+            print(f"  server sống lại: gửi {pending} thao tác bằng {stub.requests} request "
+                  f"trong {(time.perf_counter() - started) * 1000:.0f} ms, còn {counts['pending']} chờ, "
+                  f"{counts['failed']} bị từ chối")
+            if not drained or counts['pending'] or counts['failed']:
+                failures.append("Supabase sống lại: outbox chưa gửi hết")
+            check("sau khi gửi outbox tồn đọng", failures)
+            print()
+
+            # 3. Mạng chập chờn
+            stub.set_faults(error_rate=0.25, drop_rate=0.15, seed=3)
+            stub.reset_counters()
+            sent_before = cloud_outbox.get_status()['sent']
+            started = time.perf_counter()
+            refused = workload(random.Random(2), FLAKY_OPS, 'chập chờn')
+            drained = cloud_outbox.wait_idle(120)
+            elapsed = (time.perf_counter() - started) * 1000
+            status = cloud_outbox.get_status()
+            failed_requests = sum(1 for entry in stub.log if entry[2] in (0, 503))
+            counts = outbox_counts(user_id)
+            stub.set_faults()
+            duplicates = server_duplicates(stub, user_id)
+            print(f"Mạng chập chờn (25% lỗi 503, 15% mất response): {FLAKY_OPS + 3} lần ghi, {refused} bị từ chối")
+            print(f"  gửi {status['sent'] - sent_before} thao tác, {stub.requests} request "
+                  f"({failed_requests} lỗi / mất response), {elapsed:.0f} ms; "
+                  f"còn {counts['pending']} chờ, {counts['failed']} bị từ chối, {duplicates} ca trùng trên server")
+            if refused or not drained or counts['pending'] or counts['failed'] or duplicates:
+                failures.append("Mạng chập chờn: mất, trùng hoặc bị từ chối")
+            check("sau khi gửi qua mạng chập chờn", failures)
+            cloud_mirror.refresh(user_id)
+            check("sau khi làm mới bản sao", failures)
+    finally:
+        cloud_outbox.shutdown()
+        stub.stop()
+
+    for failure in failures:
+        print(f"LỖI: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
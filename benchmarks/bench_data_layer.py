@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Bộ benchmark của tầng dữ liệu trên dữ liệu giả (benchmarks/workload.py, một
+user với --years năm dữ liệu, database SQLite riêng như DB_LAYOUT per_user):
+
+  shifts_month / shifts_year / shifts_all   database.get_shifts_by_range
+  daily_year                                database.get_daily_summaries_by_range (12 tháng)
+  salary_month                              database.calculate_salary_by_month
+  dispatch_shifts_month                     db_wrapper.get_shifts_by_range (mỗi lần một lượt chạy mới)
+  dispatch_memo_hit                         db_wrapper.get_shifts_by_range (trong cùng lượt chạy)
+  dispatch_salary_12m                       db_wrapper.calculate_salary_by_months (12 tháng)
+  calculate_full_1000                       calculations.calculate_full, 1000 ca của dữ liệu giả
+  export_year                               report_data: file Excel + CSV của 12 tháng
+
+Mỗi benchmark chạy một lần làm nóng rồi --repeat lần; so trung vị với ngân sách
+BUDGETS_MS (đặt cho DEFAULT_YEARS năm dữ liệu, benchmark đọc toàn bộ lịch sử
+thì ngân sách tỉ lệ theo số năm) và, nếu có --baseline, với kết quả lần chạy
+trước (chậm hơn quá --max-regression lần là hồi quy). Cache kết quả trên đĩa
+(result_cache) tắt; cache trong process của database.py được xóa trước mỗi lần đo.
+
+Chạy: python benchmarks/bench_data_layer.py [--years 5] [--json results.json] [--baseline old.json]
+(exit code 1 nếu vượt ngân sách hoặc hồi quy)
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ['RESULT_CACHE'] = '0'
+
+import calculations as calc  # noqa: E402
+import database  # noqa: E402
+import db_wrapper as db  # noqa: E402
+import payroll  # noqa: E402
+import report_data  # noqa: E402
+import tenant_context  # noqa: E402
+import workload  # noqa: E402
+
+DEFAULT_YEARS = 5
+
+# Ngân sách trung vị (ms) với DEFAULT_YEARS năm dữ liệu, rộng gấp vài lần số đo
+# trên máy dev để chỉ bắt các thay đổi làm chậm hẳn (truy vấn N+1, mất index...)
+BUDGETS_MS = {
+    'shifts_month': 5,
+    'shifts_year': 25,
+    'shifts_all': 100,
+    'daily_year': 40,
+    'salary_month': 25,
+    'dispatch_shifts_month': 10,
+    'dispatch_memo_hit': 0.5,
+    'dispatch_salary_12m': 150,
+    'calculate_full_1000': 100,
+    'export_year': 1500,
+}
+
+# Benchmark đọc toàn bộ lịch sử: ngân sách tỉ lệ theo số năm dữ liệu
+SCALES_WITH_YEARS = ('shifts_all',)
+
+# Chênh lệch dưới ngưỡng này (ms) so với baseline không tính là hồi quy (nhiễu đo)
+REGRESSION_FLOOR_MS = 1.0
+
+
+def build_cases(summary: dict) -> dict:
+    """Các benchmark: tên -> hàm không tham số (chạy trong tenant của database giả)."""
+    end = date.fromisoformat(summary['end'])
+    start = date.fromisoformat(summary['start'])
+    year, month = payroll.months_back(end.year, end.month, 2)[0]   # tháng đầy đủ gần nhất
+    month_start, month_end = payroll.month_range(year, month)
+    year_start = payroll.month_range(*payroll.months_back(year, month, 12)[0])[0]
+    month_keys = payroll.months_back(year, month, 12)
+    standard_hours = db.get_standard_hours()
+
+    samples = [(s['start_time'], s['end_time'], s['break_hours'])
+               for s in database.get_shifts_by_range(year_start, month_end)][:1000]
+    samples = (samples * (1000 // max(len(samples), 1) + 1))[:1000]
+
+    def dispatch_memo_hit():
+        db.get_shifts_by_range(month_start, month_end)
+
+    def dispatch_shifts_month():
+        db.begin_request()
+        db.get_shifts_by_range(month_start, month_end)
+
+    def dispatch_salary_12m():
+        db.begin_request()
+        db.calculate_salary_by_months(month_keys)
+
+    def calculate_full_1000():
+        for shift_start, shift_end, break_hours in samples:
+            calc.calculate_full(shift_start, shift_end, break_hours, standard_hours)
+
+    def export_year():
+        if not report_data._build_export(year_start, month_end):
+            raise RuntimeError("không có ca nào để xuất")
+
+    return {
+        'shifts_month': lambda: database.get_shifts_by_range(month_start, month_end),
+        'shifts_year': lambda: database.get_shifts_by_range(year_start, month_end),
+        'shifts_all': lambda: database.get_shifts_by_range(start, end),
+        'daily_year': lambda: database.get_daily_summaries_by_range(year_start, month_end, standard_hours),
+        'salary_month': lambda: database.calculate_salary_by_month(year, month),
+        'dispatch_shifts_month': dispatch_shifts_month,
+        'dispatch_memo_hit': dispatch_memo_hit,
+        'dispatch_salary_12m': dispatch_salary_12m,
+        'calculate_full_1000': calculate_full_1000,
+        'export_year': export_year,
+    }
+
+
+def measure(func, repeat: int, fresh_cache: bool = True) -> list:
+    """Một lần làm nóng rồi repeat lần đo (ms)."""
+    func()
+    samples = []
+    for _ in range(repeat):
+        if fresh_cache:
+            database.clear_cache()
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def budget_for(name: str, years: int) -> float:
+    budget = BUDGETS_MS[name]
+    return budget * years / DEFAULT_YEARS if name in SCALES_WITH_YEARS else budget
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', type=int, default=DEFAULT_YEARS, choices=range(1, 11), metavar='1-10')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=15)
+    parser.add_argument('--only', nargs='+', choices=sorted(BUDGETS_MS), help='chỉ chạy các benchmark này')
+    parser.add_argument('--json', help="ghi kết quả ra file JSON ('-': stdout)")
+    parser.add_argument('--baseline', help='file JSON của lần chạy trước để so hồi quy')
+    parser.add_argument('--max-regression', type=float, default=1.3,
+                        help='trung vị chậm hơn baseline quá số lần này là hồi quy (mặc định 1.3)')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            previous_run = json.load(f)
+        previous_workload = previous_run['meta']['workload']
+        if (previous_workload['years'], previous_run['meta'].get('seed')) != (args.years, args.seed):
+            parser.error(f"baseline đo trên {previous_workload['years']} năm dữ liệu "
+                         f"(seed {previous_run['meta'].get('seed')}), chạy lại với cùng --years / --seed")
+        baseline = previous_run['results']
+
+    database.ENABLE_SYNC = False
+    workdir = tempfile.mkdtemp(prefix='bench_data_layer_')
+    results = {}
+    failures = []
+    log = sys.stderr if args.json == '-' else sys.stdout
+    try:
+        db_path = os.path.join(workdir, 'user_bench.db')
+        summary = workload.generate_user(db_path, args.years, seed=args.seed)
+        print(f"Dữ liệu giả: {summary['years']} năm, {summary['shifts']:,} ca "
+              f"({summary['overnight_shifts']:,} qua đêm), {summary['jobs']} công việc, "
+              f"{summary['rate_changes']} lần đổi lương, {summary['holidays']} ngày lễ", file=log)
+        print(f"{'benchmark':<24} {'trung vị':>9} {'min':>8} {'p95':>8} {'ngân sách':>10} {'baseline':>9}", file=log)
+
+        with tenant_context.use_tenant(db_path=db_path):
+            cases = build_cases(summary)
+            for name, func in cases.items():
+                if args.only and name not in args.only:
+                    continue
+                samples = sorted(measure(func, args.repeat, fresh_cache=name != 'dispatch_memo_hit'))
+                median = statistics.median(samples)
+                budget = budget_for(name, args.years)
+                result = {
+                    'median_ms': round(median, 3),
+                    'min_ms': round(samples[0], 3),
+                    'p95_ms': round(samples[max(0, int(len(samples) * 0.95) - 1)], 3),
+                    'runs': len(samples),
+                    'budget_ms': budget,
+                    'within_budget': median <= budget,
+                }
+                previous = (baseline or {}).get(name)
+                if previous:
+                    limit = max(previous['median_ms'] * args.max_regression,
+                                previous['median_ms'] + REGRESSION_FLOOR_MS)
+                    result['baseline_median_ms'] = previous['median_ms']
+                    result['regressed'] = median > limit
+                results[name] = result
+
+                compared = f"{median / previous['median_ms']:>8.2f}x" if previous and previous['median_ms'] else f"{'-':>9}"
+                print(f"{name:<24} {median:>9.2f} {samples[0]:>8.2f} {result['p95_ms']:>8.2f} "
+                      f"{budget:>10.1f} {compared}", file=log)
+                if not result['within_budget']:
+                    failures.append(f"{name}: trung vị {median:.2f} ms vượt ngân sách {budget:.1f} ms")
+                if result.get('regressed'):
+                    failures.append(f"{name}: {median:.2f} ms, chậm hơn baseline "
+                                    f"{previous['median_ms']:.2f} ms quá {args.max_regression}x")
+    finally:
+        db.begin_request()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'max_regression': args.max_regression if baseline else None,
+            'workload': summary,
+        },
+        'results': results,
+        'failures': failures,
+    }
+    if args.json == '-':
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for failure in failures:
+        print(f"LỖI: {failure}", file=log)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
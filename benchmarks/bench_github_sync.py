@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Kiểm tra và đo delta sync của github_sync với một stub Contents API chạy trên
+git repo local (blob lưu bằng `git hash-object`, sha giống hệt GitHub).
+
+Đếm số lần gọi API và số byte upload/download cho các kịch bản: đẩy lần đầu,
+đẩy lại khi không đổi, ghi liên tiếp (debounce), xung đột sha, kéo về, file .db cũ,
+database WAL (ghi nằm trong file -wal, header không đổi) vẫn được đẩy.
+
+Chạy: python benchmarks/bench_github_sync.py   (exit code 1 nếu sai kết quả)
+"""
+
+import base64
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from github import GithubException  # noqa: E402
+
+import github_sync  # noqa: E402
+
+
+class GitBackedContentsStub:
+    """Giả lập các hàm Repository của PyGithub mà github_sync dùng, lưu blob trong git repo local."""
+
+    def __init__(self, git_dir: str):
+        self.git_dir = git_dir
+        subprocess.run(['git', 'init', '-q', '--bare', git_dir], check=True)
+        self.files = {}  # path -> sha
+        self.calls = Counter()
+        self.bytes_up = 0
+        self.bytes_down = 0
+
+    def _git(self, *args, data: bytes = None) -> bytes:
+        return subprocess.run(['git', '--git-dir', self.git_dir, *args], input=data,
+                              capture_output=True, check=True).stdout
+
+    def _store(self, path: str, content: bytes) -> dict:
+        sha = self._git('hash-object', '-w', '--stdin', data=content).decode().strip()
+        self.files[path] = sha
+        self.bytes_up += len(content)
+        return {'content': SimpleNamespace(path=path, sha=sha), 'commit': None}
+
+    def get_contents(self, path: str):
+        self.calls['get_contents'] += 1
+        if path in self.files:
+            content = self._git('cat-file', 'blob', self.files[path])
+            self.bytes_down += len(content)
+            return SimpleNamespace(path=path, sha=self.files[path], content=base64.b64encode(content).decode())
+        listing = [SimpleNamespace(path=p, sha=s) for p, s in self.files.items()
+                   if os.path.dirname(p) == path]
+        if listing:
+            return listing
+        raise GithubException(404, {'message': 'Not Found'})
+
+    def create_file(self, path: str, message: str, content: bytes):
+        self.calls['create_file'] += 1
+        if path in self.files:
+            raise GithubException(422, {'message': '"sha" wasn\'t supplied.'})
+        return self._store(path, content)
+
+    def update_file(self, path: str, message: str, content: bytes, sha: str):
+        self.calls['update_file'] += 1
+        if path not in self.files:
+            raise GithubException(404, {'message': 'Not Found'})
+        if self.files[path] != sha:
+            raise GithubException(409, {'message': f'{path} does not match {sha}'})
+        return self._store(path, content)
+
+    def get_git_blob(self, sha: str):
+        self.calls['get_git_blob'] += 1
+        content = self._git('cat-file', 'blob', sha)
+        self.bytes_down += len(content)
+        return SimpleNamespace(sha=sha, content=base64.b64encode(content).decode())
+
+
+def _make_db(path: str, rows: int) -> None:
+    """Tạo database mẫu với nhiều ca làm việc."""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE work_shifts (id INTEGER PRIMARY KEY, work_date TEXT, total_hours REAL, notes TEXT)")
+    conn.executemany("INSERT INTO work_shifts (work_date, total_hours, notes) VALUES (?, ?, ?)",
+                     [(f"2026-01-{i % 28 + 1:02d}", 8.0, "ca làm việc") for i in range(rows)])
+    conn.commit()
+    conn.close()
+
+
+def _write(path: str, sql: str) -> None:
+    conn = sqlite3.connect(path)
+    conn.execute(sql)
+    conn.commit()
+    conn.close()
+
+
+def main() -> int:
+    workdir = tempfile.mkdtemp()
+    stub = GitBackedContentsStub(os.path.join(workdir, 'remote.git'))
+    github_sync.get_repo = lambda: stub
+    github_sync.SYNC_STATE_FILE = os.path.join(workdir, 'state_a.json')
+
+    db_path = os.path.join(workdir, 'user_a.db')
+    repo_path = 'user_data/user_a.db.gz'
+    _make_db(db_path, 5000)
+    failures = []
+    rows = []
+
+    def step(name, func, expect_calls, expect_result=True):
+        before = Counter(stub.calls)
+        up, down = stub.bytes_up, stub.bytes_down
+        result = func()
+        calls = sum((stub.calls - before).values())
+        rows.append((name, calls, stub.bytes_up - up, stub.bytes_down - down))
+        if calls != expect_calls or result != expect_result:
+            failures.append(f"{name}: {calls} lần gọi (mong đợi {expect_calls}), kết quả {result}")
+
+    raw_size = os.path.getsize(db_path)
+    step("Đẩy lần đầu", lambda: github_sync.push_db(db_path, repo_path, "init"), 1)
+    step("Đẩy lại, không đổi", lambda: github_sync.push_db(db_path, repo_path, "noop"), 0)
+
+    _write(db_path, "UPDATE work_shifts SET notes = notes WHERE id = 1")
+    step("Transaction không đổi nội dung", lambda: github_sync.push_db(db_path, repo_path, "same"), 0)
+
+    # Ghi liên tiếp: lần đầu đẩy ngay, các lần sau trong cửa sổ debounce chỉ ghi nhận
+    github_sync._last_push_at.clear()
+    _write(db_path, "INSERT INTO work_shifts (work_date, total_hours) VALUES ('2026-02-01', 4)")
+    step("Ghi #1 (đẩy ngay)", lambda: github_sync.request_push(db_path, repo_path, "w1"), 1)
+    for i in range(2, 6):
+        _write(db_path, f"INSERT INTO work_shifts (work_date, total_hours) VALUES ('2026-02-0{i}', 4)")
+        step(f"Ghi #{i} (debounce)", lambda: github_sync.request_push(db_path, repo_path, "burst"), 0, False)
+    step("Flush debounce", github_sync.flush_pending_pushes, 1, 1)
+
+    # Máy khác đẩy bản khác -> sha đã lưu bị lệch -> 409 -> get_contents + update
+    stub._store(repo_path, b"other machine")
+    _write(db_path, "DELETE FROM work_shifts WHERE id = 2")
+    step("Xung đột sha", lambda: github_sync.push_db(db_path, repo_path, "conflict"), 3)
+
+    # Kéo về máy mới (state riêng), rồi kéo lại khi repo không đổi
+    github_sync.SYNC_STATE_FILE = os.path.join(workdir, 'state_b.json')
+    pulled_path = os.path.join(workdir, 'pulled', 'user_a.db')
+    step("Kéo về máy mới", lambda: github_sync.pull_db('user_data/user_a.db', pulled_path), 2)
+    step("Kéo lại, repo không đổi", lambda: github_sync.pull_db('user_data/user_a.db', pulled_path), 1)
+    conn = sqlite3.connect(pulled_path)
+    pulled_rows = conn.execute("SELECT COUNT(*) FROM work_shifts").fetchone()[0]
+    conn.close()
+    if pulled_rows != 5000 + 5 - 1:
+        failures.append(f"Dữ liệu kéo về sai: {pulled_rows} dòng")
+
+    # File .db cũ (không nén) vẫn kéo được
+    with open(db_path, 'rb') as f:
+        stub._store('user_data/legacy.db', f.read())
+    legacy_path = os.path.join(workdir, 'pulled', 'legacy.db')
+    step("Kéo file .db cũ", lambda: github_sync.pull_db('user_data/legacy.db', legacy_path), 2)
+
+    # Database WAL (như users.db, tenants.db): transaction ghi vào file -wal, bộ đếm
+    # thay đổi và kích thước file chính không đổi -> vẫn phải đẩy, không đổi thì không đẩy
+    github_sync.SYNC_STATE_FILE = os.path.join(workdir, 'state_wal.json')
+    wal_path = os.path.join(workdir, 'users.db')
+    _make_db(wal_path, 100)
+    wal_conn = sqlite3.connect(wal_path)
+    wal_conn.execute("PRAGMA journal_mode=WAL")
+    step("WAL: đẩy lần đầu", lambda: github_sync.push_db(wal_path, 'user_data/users.db.gz', "init"), 1)
+    wal_conn.execute("UPDATE work_shifts SET notes = 'đã sửa' WHERE id = 1")
+    wal_conn.commit()
+    step("WAL: ghi trong file -wal", lambda: github_sync.push_db(wal_path, 'user_data/users.db.gz', "wal"), 1)
+    step("WAL: đẩy lại, không đổi", lambda: github_sync.push_db(wal_path, 'user_data/users.db.gz', "noop"), 0)
+    wal_conn.close()
+
+    if github_sync.git_blob_sha(b"abc") != stub._git('hash-object', '--stdin', data=b"abc").decode().strip():
+        failures.append("git_blob_sha khác sha của git")
+
+    print(f"DB gốc: {raw_size:,} bytes\n")
+    print(f"{'Kịch bản':<32} {'API':>4} {'Upload':>10} {'Download':>10}")
+    for name, calls, up, down in rows:
+        print(f"{name:<32} {calls:>4} {up:>10,} {down:>10,}")
+
+    if failures:
+        print("\n❌ Sai kết quả:\n- " + "\n- ".join(failures))
+        return 1
+    print("\n✅ Delta sync hoạt động đúng")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
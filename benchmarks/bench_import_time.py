@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark thời gian import khi khởi động (cold start) dựa trên `python -X importtime`.
+
+- Đo thời gian import (cumulative) của từng module nội bộ, sau khi streamlit đã
+  được import (app luôn cần streamlit), và so với ngân sách IMPORT_BUDGETS_MS.
+- Kiểm tra các thư viện nặng (plotly.express, openpyxl, PyGithub, supabase) không bị
+  import khi chỉ import các module lõi hoặc khi chạy app lần đầu với database trống.
+
+Chạy: python benchmarks/bench_import_time.py   (exit code 1 nếu vượt ngân sách)
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Ngân sách thời gian import (ms) của từng module, không tính streamlit
+IMPORT_BUDGETS_MS = {
+    'payroll': 30,
+    'database': 50,
+    'calculations': 30,
+    'supabase_db': 60,
+    'db_wrapper': 100,
+    'github_sync': 60,
+    'report_data': 1000,  # pandas + numpy: chỉ dùng cho báo cáo
+}
+
+# Thư viện chỉ được tải khi vào đúng đường dùng (biểu đồ, xuất file, sync, cloud).
+# Lưu ý: streamlit (>= 1.3x) tự import plotly.graph_objs để đăng ký theme, nên chỉ
+# kiểm tra plotly.express (kéo theo phần còn lại của plotly).
+LAZY_MODULES = ('plotly.express', 'openpyxl', 'github', 'supabase')
+
+# Ngân sách cho lần chạy app đầu tiên (database trống, không bật biểu đồ/xuất file)
+APP_COLD_START_BUDGET_MS = 6000
+
+_APP_PROBE = r'''
+import os, sys, time
+sys.path.insert(0, {root!r})
+import database
+database.DEFAULT_DB_PATH = os.path.join({workdir!r}, "cold_start.db")
+from streamlit.testing.v1 import AppTest
+began = time.perf_counter()
+at = AppTest.from_file(os.path.join({root!r}, "app.py"), default_timeout=120)
+at.run()
+elapsed = (time.perf_counter() - began) * 1000
+errors = [e.value for e in at.exception]
+loaded = [m for m in {lazy!r} if m in sys.modules]
+print("RESULT", round(elapsed), ",".join(loaded) or "-", len(errors))
+'''
+
+
+def import_time_ms(module: str) -> float:
+    """Thời gian import cumulative (ms) của module, sau khi đã import streamlit."""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import streamlit; import {module}'],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    for line in reversed(proc.stderr.splitlines()):
+        # "import time: self [us] | cumulative | imported package"
+        parts = [p.strip() for p in line.split('|')]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1000
+    return 0.0
+
+
+def loaded_lazy_modules(modules) -> list:
+    """Các thư viện nặng bị import khi chỉ import những module đã cho."""
+    code = (f"import sys; import {', '.join(modules)}; "
+            f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))")
+    proc = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    output = proc.stdout.strip().splitlines()
+    return [m for m in (output[-1] if output else '').split(',') if m]
+
+
+def app_cold_start() -> tuple:
+    """Chạy app.py một lần (AppTest) với database trống: (ms, thư viện nặng đã tải, số lỗi)."""
+    workdir = tempfile.mkdtemp()
+    code = _APP_PROBE.format(root=ROOT, workdir=workdir, lazy=LAZY_MODULES)
+    proc = subprocess.run([sys.executable, '-c', code], cwd=workdir, capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith('RESULT '):
+            _, elapsed, loaded, errors = line.split()
+            return int(elapsed), [] if loaded == '-' else loaded.split(','), int(errors)
+    raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr else 'app probe failed')
+
+
+def main() -> int:
+    failures = []
+
+    print(f"{'Module':<14} {'Import (ms)':>12} {'Ngân sách':>10}")
+    for module, budget in IMPORT_BUDGETS_MS.items():
+        elapsed = import_time_ms(module)
+        flag = '' if elapsed <= budget else '  <-- vượt'
+        print(f"{module:<14} {elapsed:>12.1f} {budget:>10}{flag}")
+        if elapsed > budget:
+            failures.append(f"{module}: {elapsed:.1f}ms > {budget}ms")
+
+    core = [m for m in IMPORT_BUDGETS_MS if m != 'report_data']
+    leaked = loaded_lazy_modules(core)
+    print(f"\nThư viện nặng bị tải bởi module lõi: {', '.join(leaked) or 'không có'}")
+    if leaked:
+        failures.append(f"module lõi tải {', '.join(leaked)}")
+
+    elapsed, loaded, errors = app_cold_start()
+    print(f"App cold start: {elapsed}ms (ngân sách {APP_COLD_START_BUDGET_MS}ms), "
+          f"thư viện nặng: {', '.join(loaded) or 'không có'}, lỗi: {errors}")
+    if elapsed > APP_COLD_START_BUDGET_MS:
+        failures.append(f"app cold start {elapsed}ms > {APP_COLD_START_BUDGET_MS}ms")
+    if loaded:
+        failures.append(f"app cold start tải {', '.join(loaded)}")
+    if errors:
+        failures.append(f"app cold start có {errors} lỗi")
+
+    if failures:
+        print("\n❌ Vượt ngân sách:\n- " + "\n- ".join(failures))
+        return 1
+    print("\n✅ Trong ngân sách")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
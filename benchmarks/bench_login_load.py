@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Tải thử đăng nhập đồng thời với user_auth (SQLite local).
+
+Đăng ký N user rồi cho nhiều thread cùng đăng nhập:
+  - legacy_lookup: tra user kiểu cũ (CREATE TABLE IF NOT EXISTS + kết nối mới mỗi lần)
+  - store_lookup:  tra user qua UsersStore (pool kết nối WAL + LRU)
+  - login:         login_user() đầy đủ (KDF + cập nhật last_login)
+  - token_cold:    auto-login bằng token, LRU token trống (một lần tra khóa chính)
+  - token_warm:    auto-login bằng token, trúng LRU
+In thông lượng và độ trễ p50/p95/p99 của từng kịch bản.
+
+Chạy: python benchmarks/bench_login_load.py [--users 300] [--threads 64] [--kdf-n 16384]
+(exit code 1 nếu có lần đăng nhập thất bại)
+"""
+
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import user_auth  # noqa: E402
+
+
+def legacy_lookup(username: str):
+    """Đường tra user trước khi có UsersStore: init schema + kết nối mới mỗi lần."""
+    conn = sqlite3.connect(user_auth.get_users_db_path())
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            password_hash TEXT NOT NULL,
+            display_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_login TIMESTAMP
+        )
+    """)
+    conn.commit()
+    conn.close()
+    conn = sqlite3.connect(user_auth.get_users_db_path())
+    conn.row_factory = sqlite3.Row
+    row = conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def run_scenario(name: str, func, items, threads: int) -> dict:
+    latencies = []
+
+    def timed(item):
+        started = time.perf_counter()
+        ok = func(item)
+        latencies.append(time.perf_counter() - started)
+        return ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(timed, items))
+    elapsed = time.perf_counter() - started
+
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        'name': name,
+        'ops': len(items),
+        'failed': sum(1 for ok in results if not ok),
+        'ops_per_s': len(items) / elapsed,
+        'p50_ms': quantiles[49] * 1000,
+        'p95_ms': quantiles[94] * 1000,
+        'p99_ms': quantiles[98] * 1000,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Tải thử đăng nhập đồng thời (user_auth, SQLite)")
+    parser.add_argument('--users', type=int, default=300, help="Số user đăng ký")
+    parser.add_argument('--threads', type=int, default=64, help="Số thread đăng nhập đồng thời")
+    parser.add_argument('--rounds', type=int, default=3, help="Số lượt tra cứu/auto-login mỗi user")
+    parser.add_argument('--kdf-n', type=int, default=user_auth.SCRYPT_N, help="Tham số N của scrypt")
+    args = parser.parse_args(argv)
+
+    user_auth.DATA_DIR = tempfile.mkdtemp()
+    user_auth._check_supabase = lambda: False
+    user_auth.SCRYPT_N = args.kdf_n
+
+    usernames = [f"user{i:04d}" for i in range(args.users)]
+    password = "mat_khau_1"
+    for username in usernames:
+        ok, message = user_auth.register_user(username, password)
+        if not ok:
+            print(f"Đăng ký {username} lỗi: {message}")
+            return 1
+
+    lookups = usernames * args.rounds
+    reports = [
+        run_scenario('legacy_lookup', lambda u: legacy_lookup(u) is not None, lookups, args.threads),
+        run_scenario('store_lookup', lambda u: user_auth.get_users_store().get_user_by_username(u) is not None,
+                     lookups, args.threads),
+        run_scenario('login', lambda u: user_auth.login_user(u, password)[0], usernames, args.threads),
+    ]
+
+    tokens = []
+    for username in usernames:
+        user = user_auth.get_users_store().get_user_by_username(username)
+        tokens.append(user_auth.create_session_token(user))
+
+    def token_cold(token):
+        with user_auth._token_lock:
+            user_auth._token_cache.clear()
+        return user_auth.validate_session_token(token) is not None
+
+    reports.append(run_scenario('token_cold', token_cold, tokens * args.rounds, args.threads))
+    reports.append(run_scenario('token_warm', lambda t: user_auth.validate_session_token(t) is not None,
+                                tokens * args.rounds, args.threads))
+
+    print(f"{args.users} user, {args.threads} thread, scrypt N={args.kdf_n}")
+    print(f"{'kịch bản':<14} {'ops':>6} {'lỗi':>4} {'ops/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for r in reports:
+        print(f"{r['name']:<14} {r['ops']:>6} {r['failed']:>4} {r['ops_per_s']:>10,.0f} "
+              f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+    return 1 if any(r['failed'] for r in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Đếm round trip khởi tạo dữ liệu mặc định ở chế độ cloud (Supabase) với
+PostgREST giả lập (benchmarks/postgrest_stub.py).
+
+Kịch bản:
+  - legacy_rerun:      cách cũ, init_user_default_data kiểm tra jobs/settings/presets mỗi rerun
+  - register:          đăng ký user mới (provision theo lô)
+  - first_rerun:       lượt chạy đầu của user trong process (kiểm tra cờ provisioned)
+  - next_reruns:       10 lượt chạy tiếp theo (không request nào)
+  - existing_user:     user cũ đã có dữ liệu nhưng chưa có cờ
+  - existing_rerun:    lượt chạy sau khi user cũ đã được đánh dấu
+
+Chạy: python benchmarks/bench_provisioning.py   (exit code 1 nếu số request khác mong đợi)
+"""
+
+import os
+import sys
+
+# Đo request của supabase_db trực tiếp (bản sao đọc local: bench_cloud_mirror.py)
+os.environ['CLOUD_MIRROR'] = '0'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from postgrest_stub import PostgrestStub  # noqa: E402
+
+import db_wrapper as db  # noqa: E402
+import supabase_db  # noqa: E402
+import tenant_context  # noqa: E402
+import user_auth  # noqa: E402
+
+EXPECTED = {
+    'legacy_rerun': 5,
+    'register': 6,
+    'first_rerun': 1,
+    'next_reruns': 0,
+    'existing_user': 4,
+    'existing_rerun': 0,
+}
+
+
+def legacy_init(user_id: int) -> None:
+    """Các lệnh đọc của init_user_default_data trước khi có cờ provisioned (user đã đủ dữ liệu)."""
+    supabase_db.get_all_jobs(user_id)
+    for key in ('standard_hours', 'break_hours', 'ot_rate'):
+        supabase_db.get_setting(user_id, key)
+    supabase_db.get_all_presets(user_id)
+
+
+def rerun(user_id: int, times: int = 1) -> None:
+    """Giả lập đầu app.py mỗi lượt chạy: begin_request + init_database."""
+    with tenant_context.use_tenant(user_id=user_id):
+        for _ in range(times):
+            db.begin_request()
+            db.init_database()
+
+
+def main() -> int:
+    stub = PostgrestStub().start()
+    stub.connect_supabase_db()
+    user_auth.hash_password = lambda password: "stub"  # không đo KDF
+    results = {}
+
+    def measure(name, func):
+        # Kiểm tra Supabase một lần trước khi đo (db_wrapper cache kết quả)
+        db._check_supabase()
+        stub.reset_counters()
+        func()
+        results[name] = (stub.requests, stub.bytes_in + stub.bytes_out, dict(stub.calls))
+
+    try:
+        ok, message = user_auth.register_user("legacy_user", "abcd")
+        legacy = supabase_db.get_user_by_username("legacy_user")
+        measure('legacy_rerun', lambda: legacy_init(legacy['id']))
+
+        measure('register', lambda: user_auth.register_user("new_user", "abcd"))
+        new_user = supabase_db.get_user_by_username("new_user")
+        measure('first_rerun', lambda: rerun(new_user['id']))
+        measure('next_reruns', lambda: rerun(new_user['id'], 10))
+
+        # User cũ: có jobs/presets, chưa có cờ provisioned
+        supabase_db.get_supabase_client().table('settings').delete() \
+            .eq('user_id', legacy['id']).eq('key', supabase_db.PROVISIONED_KEY).execute()
+        db.clear_cache()
+        jobs_before = len(supabase_db.get_all_jobs(legacy['id']))
+        measure('existing_user', lambda: rerun(legacy['id']))
+        measure('existing_rerun', lambda: rerun(legacy['id']))
+        jobs_after = len(supabase_db.get_all_jobs(legacy['id']))
+    finally:
+        stub.stop()
+
+    failed = jobs_before != jobs_after
+    print(f"{'kịch bản':<16} {'request':>8} {'mong đợi':>9} {'bytes':>8}  chi tiết")
+    for name, (requests, size, calls) in results.items():
+        mark = '' if requests == EXPECTED[name] else '  ✗'
+        failed |= bool(mark)
+        detail = ', '.join(f"{m} {t}×{n}" for (m, t), n in sorted(calls.items()))
+        print(f"{name:<16} {requests:>8} {EXPECTED[name]:>9} {size:>8}  {detail}{mark}")
+    if jobs_before != jobs_after:
+        print(f"✗ user cũ bị thêm jobs mặc định: {jobs_before} -> {jobs_after}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
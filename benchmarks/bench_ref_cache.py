@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Đo cache dữ liệu tham chiếu dùng chung (ref_cache) ở chế độ cloud đọc thẳng
+Supabase (CLOUD_MIRROR tắt), PostgREST giả lập trễ LATENCY giây mỗi request.
+
+USERS user, mỗi user TABS session (thread riêng, như nhiều tab / user quay lại)
+chạy ROUNDS lượt vẽ trang chỉ gồm dữ liệu tham chiếu (công việc, lương, khung giờ
+mẫu, cài đặt, ngày nghỉ). So sánh cache tắt (max_entries = 0) với cache bật:
+số request tới Supabase, thời gian mỗi lượt, tỉ lệ trúng. Sau đó kiểm tra:
+  - một session ghi (cài đặt, ngày nghỉ, đổi lương, khung giờ) thì session khác
+    của cùng user thấy ngay ở lượt sau; user khác không bị hủy cache
+  - số mục không vượt giới hạn LRU
+
+Chạy: python benchmarks/bench_ref_cache.py   (exit code 1 nếu đọc thấy dữ liệu cũ)
+"""
+
+import os
+import statistics
+import sys
+import threading
+import time
+from datetime import date
+
+os.environ['CLOUD_MIRROR'] = '0'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from postgrest_stub import PostgrestStub  # noqa: E402
+
+import database  # noqa: E402
+import db_wrapper as db  # noqa: E402
+import ref_cache  # noqa: E402
+import supabase_db as sdb  # noqa: E402
+import tenant_context  # noqa: E402
+
+USERS = 12
+TABS = 3
+ROUNDS = 10
+LATENCY = 0.005
+LRU_LIMIT = 40
+
+
+def render() -> dict:
+    """Phần dữ liệu tham chiếu của một lượt vẽ trang."""
+    db.begin_request()
+    return {
+        'jobs': db.get_all_jobs(),
+        'rates': db.get_job_rates(),
+        'presets': db.get_all_presets(),
+        'settings': db.get_all_settings(),
+        'holidays': db.get_holidays_by_year(date.today().year),
+        'rules': db.get_payroll_rules(date.today().replace(day=1), date.today()),
+    }
+
+
+def uncached(user_id: int) -> dict:
+    """Đọc thẳng Supabase, bỏ qua mọi cache (đáp án đúng)."""
+    year = date.today().year
+    return {
+        'jobs': sdb.get_all_jobs(user_id),
+        'rates': sdb.get_job_rates(user_id),
+        'presets': sdb.get_all_presets(user_id),
+        'settings': sdb.get_all_settings(user_id),
+        'holidays': sdb.get_holidays_by_range(user_id, date(year, 1, 1), date(year, 12, 31)),
+    }
+
+
+def session(user_id: int, samples: list) -> None:
+    with tenant_context.use_tenant(user_id=user_id):
+        for _ in range(ROUNDS):
+            started = time.perf_counter()
+            render()
+            samples.append((time.perf_counter() - started) * 1000)
+
+
+def run(stub: PostgrestStub, user_ids: list, max_entries: int) -> tuple:
+    db.clear_cache()
+    ref_cache.configure(max_entries=max_entries)
+    ref_cache.reset_stats()
+    stub.reset_counters()
+    samples = []
+    threads = [threading.Thread(target=session, args=(user_id, samples))
+               for user_id in user_ids for _ in range(TABS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, stub.requests, ref_cache.get_stats()
+
+
+def check_writes(user_ids: list, failures: list) -> None:
+    """Session A ghi, session B (cùng user) đọc lại ngay; user khác giữ cache."""
+    writer, other = user_ids[0], user_ids[1]
+    with tenant_context.use_tenant(user_id=other):
+        render()
+    with tenant_context.use_tenant(user_id=writer):
+        render()
+        db.begin_request()
+        job = db.get_all_jobs()[0]
+        db.update_setting('ot_rate', '1.4')
+        db.add_holiday(date(date.today().year, 12, 30), 'Nghỉ cuối năm')
+        db.update_job(job['id'], job['job_name'], (job['hourly_rate'] or 0) + 100, job.get('description') or '',
+                      job.get('color') or '#667eea', effective_from=date.today())
+        db.add_preset('Ca thử cache', '06:00', '10:00', 0.0, 4.0, job['id'], '🧪')
+
+    seen = {}
+
+    def other_tab():
+        with tenant_context.use_tenant(user_id=writer):
+            seen.update(render())
+    thread = threading.Thread(target=other_tab)
+    thread.start()
+    thread.join()
+    expected = uncached(writer)
+    for key, value in expected.items():
+        ok = seen[key] == value
+        print(f"  tab khác của user đã ghi: {key:<10} {'OK' if ok else 'CŨ'}")
+        if not ok:
+            failures.append(f"tab khác đọc '{key}' cũ sau khi ghi")
+
+    before = ref_cache.get_stats()['hits']
+    with tenant_context.use_tenant(user_id=other):
+        render()
+    if ref_cache.get_stats()['hits'] == before:
+        failures.append("ghi của một user làm mất cache của user khác")
+    print(f"  user khác vẫn trúng cache: {'OK' if ref_cache.get_stats()['hits'] > before else 'KHÔNG'}")
+
+
+def main() -> int:
+    database.ENABLE_SYNC = False
+    failures = []
+
+    stub = PostgrestStub().install_aggregate_rpcs().start()
+    stub.connect_supabase_db()
+    try:
+        db.clear_cache()
+        db._check_supabase()
+        user_ids = []
+        for i in range(USERS):
+            user_id = sdb.create_user(f'cache_user_{i}', 'hash', f'Cache {i}')['id']
+            with tenant_context.use_tenant(user_id=user_id):
+                db.init_database()
+                db.add_holiday(date(date.today().year, 1 + i % 12, 10), f'Ngày lễ {i}')
+            user_ids.append(user_id)
+        stub.set_faults(latency=LATENCY)
+
+        print(f"{USERS} user x {TABS} tab x {ROUNDS} lượt, mỗi request Supabase trễ {LATENCY * 1000:.0f} ms")
+        print(f"{'cache':<6} {'request':>8} {'req/lượt':>9} {'p50 ms':>8} {'p95 ms':>8} {'trúng':>7} {'mục':>5}")
+        for label, max_entries in (('tắt', 0), ('bật', ref_cache.MAX_ENTRIES)):
+            samples, requests, stats = run(stub, user_ids, max_entries)
+            samples.sort()
+            print(f"{label:<6} {requests:>8} {requests / len(samples):>9.2f} {statistics.median(samples):>8.1f} "
+                  f"{samples[int(len(samples) * 0.95) - 1]:>8.1f} {stats['hit_ratio']:>7.0%} {stats['entries']:>5}")
+
+        print("\nGhi từ một session:")
+        check_writes(user_ids, failures)
+
+        samples, _, stats = run(stub, user_ids, LRU_LIMIT)
+        print(f"\nGiới hạn LRU {LRU_LIMIT} mục: còn {stats['entries']} mục, đẩy ra {stats['evictions']}, "
+              f"trúng {stats['hit_ratio']:.0%}")
+        if stats['entries'] > LRU_LIMIT:
+            failures.append(f"cache giữ {stats['entries']} mục, vượt giới hạn {LRU_LIMIT}")
+    finally:
+        stub.stop()
+
+    for failure in failures:
+        print(f"LỖI: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
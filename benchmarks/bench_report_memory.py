@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark bộ nhớ cho đường dữ liệu báo cáo (Tab 3): so sánh cách cũ
+(danh sách dict theo ngày có danh sách ca lồng nhau -> pd.DataFrame) với lớp
+dữ liệu dạng cột report_data trên khoảng 1 / 12 / 60 tháng.
+
+Chạy: python benchmarks/bench_report_memory.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+
+import calculations as calc  # noqa: E402
+import database  # noqa: E402
+import db_wrapper as db  # noqa: E402
+import payroll  # noqa: E402
+import report_data  # noqa: E402
+
+MONTH_RANGES = (1, 12, 60)
+SHIFTS_PER_DAY = 2
+
+
+def _populate(months: int) -> date:
+    """Tạo dữ liệu giả: SHIFTS_PER_DAY ca mỗi ngày trong months tháng gần nhất."""
+    end = date.today()
+    start = end - timedelta(days=months * 31)
+    rows = []
+    day = start
+    while day <= end:
+        rows.append((day.isoformat(), 1, '08:00', '17:00', 1.0, 8.0, 'sáng'))
+        if SHIFTS_PER_DAY > 1:
+            rows.append((day.isoformat(), 2, '18:00', '23:00', 0.0, 5.0, 'tối'))
+        day += timedelta(days=1)
+    conn = database.get_connection()
+    conn.executemany("""
+        INSERT INTO work_shifts (work_date, job_id, start_time, end_time, break_hours, total_hours, notes)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+    conn.commit()
+    conn.close()
+    return start
+
+
+def legacy_path(start: date, end: date, standard_hours: float) -> int:
+    """Cách cũ: logs lồng nhau, generate_report, DataFrame biểu đồ và danh sách xuất."""
+    logs = db.get_work_logs_by_range(start, end)
+    calc.generate_report(logs, standard_hours)
+    df = pd.DataFrame(logs)
+    df['work_date'] = pd.to_datetime(df['work_date'])
+    rules = db.get_payroll_rules(start, end)
+    export = []
+    for shift in db.get_shifts_by_range(start, end):
+        rate = payroll.resolve_rate(rules, shift['job_id'], str(shift['work_date']))
+        export.append({**shift, 'rate': rate, 'salary': shift['total_hours'] * rate})
+    return len(pd.DataFrame(export))
+
+
+def columnar_path(start: date, end: date, standard_hours: float) -> int:
+    """Cách mới: một DataFrame ca dạng cột dùng chung cho thống kê, biểu đồ và xuất."""
+    shifts = report_data.load_shift_frame(start, end)
+    daily = report_data.daily_frame(shifts, standard_hours)
+    calc.generate_report(daily, standard_hours)
+    return len(report_data.export_frame(shifts, db.get_payroll_rules(start, end)))
+
+
+def measure(func, *args):
+    """Đo peak bộ nhớ (tracemalloc) và thời gian của một lần chạy."""
+    tracemalloc.start()
+    began = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - began
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, elapsed
+
+
+def main():
+    workdir = tempfile.mkdtemp()
+    print(f"{'Tháng':>6} {'Số ca':>7} {'Cũ (KiB)':>10} {'Cột (KiB)':>10} {'Cũ (ms)':>9} {'Cột (ms)':>9}")
+    for months in MONTH_RANGES:
+        database.DEFAULT_DB_PATH = os.path.join(workdir, f"bench_{months}.db")
+        db.init_database()
+        start = _populate(months)
+        end = date.today()
+        standard_hours = db.get_standard_hours()
+
+        # Chạy làm nóng một lần để không đo chi phí import/khởi tạo lần đầu
+        legacy_path(start, end, standard_hours)
+        columnar_path(start, end, standard_hours)
+
+        legacy_peak, legacy_time = measure(legacy_path, start, end, standard_hours)
+        columnar_peak, columnar_time = measure(columnar_path, start, end, standard_hours)
+        shift_count = len(db.get_shifts_by_range(start, end))
+        print(f"{months:>6} {shift_count:>7} {legacy_peak / 1024:>10.0f} {columnar_peak / 1024:>10.0f} "
+              f"{legacy_time * 1000:>9.1f} {columnar_time * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+Đo cache kết quả trên đĩa (result_cache) với nhiều process worker chạy đồng
+thời như nhiều process Streamlit sau load balancer, trên SQLite multi-tenant
+(một file chung) trong thư mục tạm.
+
+USERS user, mỗi user MONTHS tháng ca làm việc. WORKERS process, mỗi process
+ROUNDS lượt vẽ trang (user và tháng ngẫu nhiên): lương tháng, tổng hợp theo
+ngày, chuỗi 12 tháng, file xuất báo cáo của tháng. Các lần chạy:
+  1. cache tắt
+  2. cache bật, file cache rỗng (các worker điền cho nhau)
+  3. cache bật, process mới trên file cache đã có (như sau khi khởi động lại)
+Sau đó kiểm tra:
+  - một process ghi (thêm ca, đổi cài đặt) thì process khác đọc được kết quả
+    mới ngay (so với tính trực tiếp, không qua cache)
+  - process khác đổi lương giờ trong khi một process đang chạy đã cache lịch sử
+    lương (ref_cache, chỉ mục lương của database.py): process đang chạy và
+    process mới đọc file cache đều thấy lương mới (cả per_user và multi_tenant)
+  - giới hạn kích thước nhỏ: tổng kích thước mục không vượt giới hạn
+
+Chạy: python benchmarks/bench_result_cache.py   (exit code 1 nếu đọc thấy kết quả cũ)
+"""
+
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+USERS = 6
+MONTHS = 24
+WORKERS = 4
+ROUNDS = 40
+SMALL_LIMIT_MB = 0.25
+
+
+def _environment(workdir: str, enabled: bool, max_mb: float = 64, layout: str = 'multi_tenant') -> None:
+    """Cấu hình qua biến môi trường, trước khi import module của ứng dụng."""
+    os.environ['DB_LAYOUT'] = layout
+    os.environ['TENANT_DB_PATH'] = os.path.join(workdir, 'tenants.db')
+    os.environ['RESULT_CACHE'] = '1' if enabled else '0'
+    os.environ['RESULT_CACHE_PATH'] = os.path.join(workdir, 'result_cache.db')
+    os.environ['RESULT_CACHE_MAX_MB'] = str(max_mb)
+    import database
+    database.ENABLE_SYNC = False
+
+
+def _month_keys() -> list:
+    import payroll
+    today = date.today()
+    return payroll.months_back(today.year, today.month, MONTHS)
+
+
+def render(year: int, month: int) -> dict:
+    """Phần tổng hợp của một lượt vẽ trang."""
+    import db_wrapper as db
+    import payroll
+    import report_data
+
+    db.begin_request()
+    start, end = payroll.month_range(year, month)
+    export = report_data.build_export(start, end)
+    return {
+        'salary': db.calculate_salary_by_month(year, month),
+        'daily': db.get_daily_summaries_by_month(year, month, db.get_standard_hours()),
+        'series': db.get_monthly_series(year, month, 12),
+        'export': export and export['csv'],
+    }
+
+
+def seed(workdir: str) -> list:
+    """Tạo USERS user, mỗi user 1-2 ca mỗi ngày trong MONTHS tháng."""
+    _environment(workdir, enabled=False)
+    import db_wrapper as db
+    import tenant_context
+    import tenant_db
+
+    user_ids = []
+    first = date(*_month_keys()[0], 1)
+    for i in range(USERS):
+        user_id = tenant_db.create_user(f'worker_user_{i}', 'hash', f'User {i}')['id']
+        with tenant_context.use_tenant(user_id=user_id):
+            db.init_database()
+            job_ids = [job['id'] for job in db.get_all_jobs()]
+        rows = []
+        day = first
+        while day <= date.today():
+            rows.append((user_id, day.isoformat(), job_ids[day.day % len(job_ids)], '08:00', '17:00', 1.0, 8.0))
+            if day.weekday() in (1, 4):
+                rows.append((user_id, day.isoformat(), job_ids[0], '18:00', '23:00', 0.0, 5.0))
+            day += timedelta(days=1)
+        conn = tenant_db.get_connection()
+        conn.executemany("""
+            INSERT INTO work_shifts (user_id, work_date, job_id, start_time, end_time, break_hours, total_hours)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        conn.commit()
+        conn.close()
+        user_ids.append(user_id)
+    return user_ids
+
+
+def worker(workdir: str, enabled: bool, max_mb: float, user_ids: list, worker_seed: int, barrier, results) -> None:
+    _environment(workdir, enabled, max_mb)
+    import result_cache
+    import tenant_context
+
+    rng = random.Random(worker_seed)
+    month_keys = _month_keys()[-6:]
+    samples = []
+    barrier.wait()
+    for _ in range(ROUNDS):
+        user_id = rng.choice(user_ids)
+        year, month = rng.choice(month_keys)
+        with tenant_context.use_tenant(user_id=user_id):
+            started = time.perf_counter()
+            render(year, month)
+            samples.append((time.perf_counter() - started) * 1000)
+    results.put({'samples': samples, 'stats': result_cache.get_stats()})
+
+
+def run_workers(ctx, workdir: str, enabled: bool, user_ids: list, max_mb: float = 64) -> dict:
+    barrier = ctx.Barrier(WORKERS)
+    results = ctx.Queue()
+    processes = [ctx.Process(target=worker, args=(workdir, enabled, max_mb, user_ids, 100 + i, barrier, results))
+                 for i in range(WORKERS)]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+    samples = sorted(sample for outcome in outcomes for sample in outcome['samples'])
+    hits = sum(outcome['stats']['hits'] for outcome in outcomes)
+    misses = sum(outcome['stats']['misses'] for outcome in outcomes)
+    return {
+        'p50': statistics.median(samples),
+        'p95': samples[int(len(samples) * 0.95) - 1],
+        'elapsed': elapsed,
+        'hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+        'errors': sum(outcome['stats']['errors'] for outcome in outcomes),
+        'evictions': sum(outcome['stats']['evictions'] for outcome in outcomes),
+        'entries': outcomes[-1]['stats']['entries'],
+        'bytes': outcomes[-1]['stats']['bytes'],
+    }
+
+
+def write_then_read(workdir: str, user_id: int, year: int, month: int, action: str, queue) -> None:
+    """Một process: 'write' thêm ca + đổi cài đặt; 'read' trả về kết quả qua cache và tính trực tiếp."""
+    _environment(workdir, enabled=True)
+    import db_wrapper as db
+    import result_cache
+    import tenant_context
+
+    with tenant_context.use_tenant(user_id=user_id):
+        if action == 'write':
+            render(year, month)
+            db.add_shift(date(year, month, 3), db.get_all_jobs()[0]['id'], '19:00', '23:00', 0.0, 4.0, 'ca thêm')
+            db.update_setting('ot_rate', '1.4')
+            queue.put(None)
+            return
+        cached = render(year, month)
+        result_cache.configure(enabled=False)
+        queue.put((cached, render(year, month)))
+
+
+def check_cross_process_writes(ctx, workdir: str, user_id: int, failures: list) -> None:
+    year, month = _month_keys()[-2]
+    queue = ctx.Queue()
+    for action in ('read', 'write', 'read'):
+        process = ctx.Process(target=write_then_read, args=(workdir, user_id, year, month, action, queue))
+        process.start()
+        outcome = queue.get()
+        process.join()
+    cached, direct = outcome
+    for key in direct:
+        ok = cached[key] == direct[key]
+        print(f"  process khác sau khi ghi: {key:<7} {'OK' if ok else 'CŨ'}")
+        if not ok:
+            failures.append(f"process khác đọc '{key}' cũ sau khi ghi")
+
+
+def _rate_tenant(workdir: str, layout: str, user_id: int) -> dict:
+    """Tenant của kiểm tra đổi lương: user multi-tenant, hoặc file database riêng (per_user)."""
+    if layout == 'per_user':
+        return {'db_path': os.path.join(workdir, 'rate_user.db')}
+    return {'user_id': user_id}
+
+
+def rate_process(workdir: str, layout: str, user_id: int, year: int, month: int, commands, results) -> None:
+    """
+    Một process chạy lâu, làm theo lệnh: 'seed' (file database per_user: một
+    ca mỗi ngày trong tháng), 'render' (lương tháng qua cache), 'direct' (tính
+    trực tiếp, không qua cache), 'raise' (nhân đôi lương giờ từ đầu tháng),
+    'stop'. Lỗi được trả về qua results để process chính không chờ mãi.
+    """
+    _environment(workdir, enabled=True, layout=layout)
+    import db_wrapper as db
+    import result_cache
+    import tenant_context
+
+    with tenant_context.use_tenant(**_rate_tenant(workdir, layout, user_id)):
+        while True:
+            command = commands.get()
+            if command == 'stop':
+                return
+            db.begin_request()
+            try:
+                if command == 'seed':
+                    db.init_database()
+                    job_id = db.get_all_jobs()[0]['id']
+                    for day in range(1, 29):
+                        db.add_shift(date(year, month, day), job_id, '08:00', '17:00', 1.0, 8.0)
+                    results.put(None)
+                elif command == 'render':
+                    results.put(db.calculate_salary_by_month(year, month)['total_salary'])
+                elif command == 'direct':
+                    result_cache.configure(enabled=False)
+                    results.put(db.calculate_salary_by_month(year, month)['total_salary'])
+                    result_cache.configure(enabled=True)
+                elif command == 'raise':
+                    job_id = db.get_shifts_by_range(date(year, month, 1), date(year, month, 28))[0]['job_id']
+                    job = next(job for job in db.get_all_jobs() if job['id'] == job_id)
+                    db.update_job(job['id'], job['job_name'], job['hourly_rate'] * 2, job.get('description') or '',
+                                  job.get('color') or '#667eea', effective_from=date(year, month, 1))
+                    results.put(None)
+            except Exception as e:
+                results.put(RuntimeError(f"{layout} '{command}': {e!r}"))
+
+
+def check_cross_process_rate_change(ctx, workdir: str, layout: str, user_id: int, failures: list) -> None:
+    year, month = _month_keys()[-3]
+
+    def start():
+        commands, results = ctx.Queue(), ctx.Queue()
+        process = ctx.Process(target=rate_process, args=(workdir, layout, user_id, year, month, commands, results))
+        process.start()
+        return process, commands, results
+
+    def ask(worker, command):
+        worker[1].put(command)
+        if command == 'stop':
+            return worker[0].join()
+        answer = worker[2].get(timeout=120)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    running = start()
+    if layout == 'per_user':
+        ask(running, 'seed')
+    before = ask(running, 'render')       # process đang chạy đã cache lịch sử lương
+    writer = start()
+    ask(writer, 'raise')
+    ask(writer, 'stop')
+    outcomes = {'process đang chạy': ask(running, 'render')}
+    ask(running, 'stop')
+    fresh = start()
+    outcomes['process mới'] = ask(fresh, 'render')
+    direct = ask(fresh, 'direct')
+    ask(fresh, 'stop')
+
+    for label, total in outcomes.items():
+        ok = total == direct and direct != before
+        print(f"  {layout:<12} {label:<18} {total:>12,.0f} (đúng {direct:,.0f}, trước {before:,.0f}) "
+              f"{'OK' if ok else 'CŨ'}")
+        if not ok:
+            failures.append(f"{layout}: {label} đọc lương {total} sau khi process khác đổi lương giờ (đúng {direct})")
+
+
+def main() -> int:
+    ctx = multiprocessing.get_context('spawn')
+    failures = []
+    workdir = tempfile.mkdtemp(prefix='bench_result_cache_')
+    try:
+        user_ids = seed(workdir)
+        print(f"{USERS} user x {MONTHS} tháng ca, {WORKERS} process x {ROUNDS} lượt "
+              f"(lương tháng, tổng hợp ngày, chuỗi 12 tháng, file xuất)")
+        print(f"{'lần chạy':<28} {'p50 ms':>8} {'p95 ms':>8} {'tổng s':>7} {'trúng':>6} {'mục':>5} {'KB':>7}")
+        for label, enabled in (('cache tắt', False), ('cache bật, file rỗng', True),
+                               ('cache bật, process mới', True)):
+            result = run_workers(ctx, workdir, enabled, user_ids)
+            entries = '-' if not enabled else result['entries']
+            size = '-' if not enabled else f"{result['bytes'] / 1024:.0f}"
+            print(f"{label:<28} {result['p50']:>8.1f} {result['p95']:>8.1f} {result['elapsed']:>7.2f} "
+                  f"{result['hit_ratio']:>6.0%} {entries:>5} {size:>7}")
+            if result['errors']:
+                failures.append(f"{label}: {result['errors']} lỗi SQLite của cache")
+
+        print("\nGhi từ một process, đọc từ process khác:")
+        check_cross_process_writes(ctx, workdir, user_ids[0], failures)
+
+        print("\nĐổi lương giờ từ process khác:")
+        for layout in ('multi_tenant', 'per_user'):
+            check_cross_process_rate_change(ctx, workdir, layout, user_ids[1], failures)
+
+        os.remove(os.path.join(workdir, 'result_cache.db'))
+        result = run_workers(ctx, workdir, True, user_ids, max_mb=SMALL_LIMIT_MB)
+        limit = SMALL_LIMIT_MB * 1024 * 1024
+        print(f"\nGiới hạn {SMALL_LIMIT_MB} MB: còn {result['entries']} mục, {result['bytes'] / 1024:.0f} KB, "
+              f"đẩy ra {result['evictions']}, trúng {result['hit_ratio']:.0%}")
+        if result['bytes'] > limit:
+            failures.append(f"cache giữ {result['bytes']} byte, vượt giới hạn {limit:.0f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for failure in failures:
+        print(f"LỖI: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+Ghi SQLite đồng thời qua sqlite_writer (khóa ghi theo file + BEGIN IMMEDIATE +
+busy_timeout), trên database tạm:
+  - per_user:     THREADS thread cùng ghi một database của user (database.py,
+                  như nhiều tab của một user), kèm READERS thread đọc liên tục
+  - multi_tenant: THREADS thread ghi tenants.db cho USERS user (tenant_db)
+  - processes:    PROCESSES process x THREADS thread cùng ghi tenants.db (khóa
+                  trong process không che được process khác: chỉ còn BEGIN
+                  IMMEDIATE + busy_timeout)
+  - legacy:       cách ghi cũ để so sánh: transaction DEFERRED đọc rồi mới ghi,
+                  timeout ngắn (chỉ in số lỗi, không tính là lỗi của benchmark)
+Mỗi lần ghi là thêm một ca và đổi một cài đặt riêng của thread. Kiểm tra: mọi
+lần ghi báo thành công, số ca trong database bằng số lần ghi, giá trị cuối của
+từng cài đặt là giá trị thread ghi sau cùng (không mất lần ghi nào).
+
+Chạy: python benchmarks/bench_sqlite_writes.py [--threads 16] [--writes 150]
+(exit code 1 nếu có lần ghi thất bại hoặc bị mất)
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+READERS = 4
+USERS = 4
+PROCESSES = 4
+LEGACY_TIMEOUT_SECONDS = 0.05
+
+FIRST_DAY = date(2024, 1, 1)
+
+
+def _environment(workdir: str) -> None:
+    """Cấu hình qua biến môi trường, trước khi import module của ứng dụng."""
+    os.environ['TENANT_DB_PATH'] = os.path.join(workdir, 'tenants.db')
+    import database
+    database.ENABLE_SYNC = False
+
+
+def run_threads(threads: int, target, *args) -> float:
+    """Chạy threads thread target(index, *args) cùng lúc; trả về thời gian (giây)."""
+    barrier = threading.Barrier(threads)
+
+    def run(index):
+        barrier.wait()
+        target(index, *args)
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started
+
+
+# ==================== PER-USER DATABASE ====================
+
+def per_user(workdir: str, threads: int, writes: int) -> dict:
+    import database
+    import sqlite_writer
+    import tenant_context
+
+    db_path = os.path.join(workdir, 'user_bench.db')
+    with tenant_context.use_tenant(db_path=db_path):
+        database.init_database()
+        job_id = database.get_all_jobs()[0]['id']
+    failures = []
+    stop = threading.Event()
+
+    def writer(index):
+        with tenant_context.use_tenant(db_path=db_path):
+            for i in range(writes):
+                day = FIRST_DAY + timedelta(days=i)
+                if database.add_shift(day, job_id, '08:00', '12:00', 0.0, 4.0, notes=f't{index}') is None:
+                    failures.append(('add_shift', index, i))
+                if not database.update_setting(f'bench_{index}', str(i)):
+                    failures.append(('update_setting', index, i))
+
+    def reader():
+        with tenant_context.use_tenant(db_path=db_path):
+            while not stop.is_set():
+                database.get_shifts_by_range(FIRST_DAY, FIRST_DAY + timedelta(days=writes))
+
+    readers = [threading.Thread(target=reader) for _ in range(READERS)]
+    for thread in readers:
+        thread.start()
+    sqlite_writer.reset_stats()
+    elapsed = run_threads(threads, writer)
+    stop.set()
+    for thread in readers:
+        thread.join()
+
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT COUNT(*) FROM work_shifts").fetchone()[0]
+    settings = dict(conn.execute("SELECT key, value FROM settings WHERE key LIKE 'bench_%'").fetchall())
+    conn.close()
+    return _outcome(threads, writes, elapsed, failures, rows, settings)
+
+
+# ==================== MULTI-TENANT ====================
+
+def _tenant_users(count: int) -> list:
+    import tenant_db
+
+    users = []
+    for i in range(count):
+        user = tenant_db.get_user_by_username(f'writer_{i}') or tenant_db.create_user(f'writer_{i}', 'hash')
+        tenant_db.init_user_default_data(user['id'])
+        users.append((user['id'], tenant_db.get_all_jobs(user['id'])[0]['id']))
+    return users
+
+
+def tenant_writer(index: int, users: list, writes: int, tag: str, failures: list) -> None:
+    import tenant_db
+
+    user_id, job_id = users[index % len(users)]
+    for i in range(writes):
+        day = FIRST_DAY + timedelta(days=i)
+        if tenant_db.add_work_shift(user_id, day, 'Ca 1', '08:00', '12:00', 0.0, 4.0, f'{tag}{index}', job_id) is None:
+            failures.append(('add_work_shift', tag, index, i))
+        if not tenant_db.update_setting(user_id, f'bench_{tag}{index}', str(i)):
+            failures.append(('update_setting', tag, index, i))
+
+
+def _tenant_counts(db_path: str) -> tuple:
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT COUNT(*) FROM work_shifts").fetchone()[0]
+    settings = dict(conn.execute("SELECT key, value FROM settings WHERE key LIKE 'bench_%'").fetchall())
+    conn.execute("DELETE FROM work_shifts")
+    conn.execute("DELETE FROM settings WHERE key LIKE 'bench_%'")
+    conn.commit()
+    conn.close()
+    return rows, settings
+
+
+def multi_tenant(workdir: str, threads: int, writes: int) -> dict:
+    import sqlite_writer
+    import tenant_db
+
+    users = _tenant_users(USERS)
+    failures = []
+    sqlite_writer.reset_stats()
+    elapsed = run_threads(threads, tenant_writer, users, writes, 't', failures)
+    rows, settings = _tenant_counts(tenant_db.TENANT_DB_PATH)
+    return _outcome(threads, writes, elapsed, failures, rows, settings)
+
+
+def process_worker(workdir: str, process_index: int, threads: int, writes: int, barrier, results) -> None:
+    _environment(workdir)
+    import sqlite_writer
+
+    users = _tenant_users(USERS)
+    failures = []
+    barrier.wait()
+    run_threads(threads, tenant_writer, users, writes, f'p{process_index}_', failures)
+    results.put({'failures': failures, 'stats': sqlite_writer.get_stats()})
+
+
+def processes(workdir: str, threads: int, writes: int) -> dict:
+    import tenant_db
+
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(PROCESSES)
+    results = ctx.Queue()
+    workers = [ctx.Process(target=process_worker, args=(workdir, i, threads, writes, barrier, results))
+               for i in range(PROCESSES)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    outcomes = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    rows, settings = _tenant_counts(tenant_db.TENANT_DB_PATH)
+    failures = [failure for outcome in outcomes for failure in outcome['failures']]
+    stats = {key: sum(outcome['stats'][key] for outcome in outcomes)
+             for key in ('transactions', 'contended', 'lock_errors', 'rollbacks', 'wait_ms')}
+    stats['max_wait_ms'] = max(outcome['stats']['max_wait_ms'] for outcome in outcomes)
+    attempts = stats['transactions'] + stats['lock_errors']
+    stats['avg_wait_ms'] = stats['wait_ms'] / attempts if attempts else 0.0
+    return _outcome(PROCESSES * threads, writes, elapsed, failures, rows, settings, stats)
+
+
+# ==================== LEGACY ====================
+
+def legacy(workdir: str, threads: int, writes: int) -> dict:
+    """Transaction DEFERRED (SELECT rồi INSERT, như add_job / provision_user cũ), không có khóa ghi."""
+    db_path = os.path.join(workdir, 'legacy.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE shifts (id INTEGER PRIMARY KEY, work_date TEXT, notes TEXT)")
+    conn.commit()
+    conn.close()
+    failures = []
+
+    def writer(index):
+        for i in range(writes):
+            conn = sqlite3.connect(db_path, timeout=LEGACY_TIMEOUT_SECONDS)
+            try:
+                conn.execute("SELECT COUNT(*) FROM shifts WHERE notes = ?", (f't{index}',)).fetchone()
+                conn.execute("BEGIN")
+                conn.execute("SELECT COUNT(*) FROM shifts WHERE notes = ?", (f't{index}',)).fetchone()
+                conn.execute("INSERT INTO shifts (work_date, notes) VALUES (?, ?)",
+                             ((FIRST_DAY + timedelta(days=i)).isoformat(), f't{index}'))
+                conn.commit()
+            except sqlite3.OperationalError:
+                failures.append(('legacy', index, i))
+            finally:
+                conn.close()
+
+    elapsed = run_threads(threads, writer)
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT COUNT(*) FROM shifts").fetchone()[0]
+    conn.close()
+    return {'writes': threads * writes, 'failed': len(failures), 'rows': rows, 'lost': 0,
+            'elapsed': elapsed, 'stats': None}
+
+
+# ==================== KẾT QUẢ ====================
+
+def _outcome(threads: int, writes: int, elapsed: float, failures: list, rows: int,
+             settings: dict, stats: dict = None) -> dict:
+    import sqlite_writer
+
+    expected_setting = str(writes - 1)
+    return {
+        'writes': threads * writes,
+        'failed': len(failures),
+        'rows': rows,
+        # Ca báo thành công nhưng không có trong database, cài đặt không phải giá trị ghi sau cùng
+        'lost': (threads * writes - sum(1 for f in failures if f[0].startswith('add'))) - rows
+                + sum(1 for value in settings.values() if value != expected_setting)
+                + (threads - len(settings)),
+        'elapsed': elapsed,
+        'stats': stats or sqlite_writer.get_stats(),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--writes', type=int, default=150, help='số lần ghi của mỗi thread')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_sqlite_writes_')
+    _environment(workdir)
+    import sqlite_writer
+
+    failures = []
+    try:
+        print(f"{args.threads} thread x {args.writes} lần ghi (thêm ca + đổi cài đặt), "
+              f"busy_timeout {sqlite_writer.BUSY_TIMEOUT_SECONDS:.0f}s")
+        print(f"{'kịch bản':<14} {'ghi':>6} {'lỗi':>5} {'mất':>5} {'ghi/s':>8} {'chờ khóa':>9} "
+              f"{'TB ms':>7} {'max ms':>8} {'lỗi khóa':>9}")
+        for name, scenario in (('per_user', per_user), ('multi_tenant', multi_tenant),
+                               ('processes', processes), ('legacy', legacy)):
+            result = scenario(workdir, args.threads, args.writes)
+            stats = result['stats']
+            waits = (f"{stats['contended']:>9,} {stats['avg_wait_ms']:>7.2f} {stats['max_wait_ms']:>8.1f} "
+                     f"{stats['lock_errors']:>9,}") if stats else f"{'-':>9} {'-':>7} {'-':>8} {'-':>9}"
+            print(f"{name:<14} {result['writes']:>6,} {result['failed']:>5,} {result['lost']:>5,} "
+                  f"{result['writes'] / result['elapsed']:>8,.0f} {waits}")
+            if name == 'legacy':
+                continue
+            if result['failed']:
+                failures.append(f"{name}: {result['failed']} lần ghi thất bại")
+            if result['lost']:
+                failures.append(f"{name}: {result['lost']} lần ghi bị mất")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for failure in failures:
+        print(f"LỖI: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
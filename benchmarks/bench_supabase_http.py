@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+So sánh Supabase client mặc định (create_client không tùy chọn: timeout 120 giây,
+postgrest-py tự thử lại GET khi 503 với chờ 1, 2, 4 giây) với tầng HTTP
+supabase_http (pool keep-alive, ngân sách thời gian, thử lại có jitter) trên
+PostgREST giả lập có độ trễ và lỗi mạng (benchmarks/postgrest_stub.py).
+
+Mỗi "lượt" là ba lần đọc như một rerun: danh sách công việc, ca làm trong tháng,
+RPC tổng hợp theo ngày. Các kịch bản:
+  1. chỉ độ trễ: thời gian mỗi lượt, số kết nối TCP mở, tỉ lệ dùng lại kết nối
+  2. 10% kết nối bị reset trước khi xử lý
+  3. 10% request trả 503
+  4. 3% request treo HANG_SECONDS giây (ngân sách đọc rút xuống READ_BUDGET)
+
+Chạy: python benchmarks/bench_supabase_http.py
+(exit code 1 nếu client tinh chỉnh có lượt lỗi ở kịch bản 1-3 hoặc lượt chậm
+nhất ở kịch bản 4 vượt ngân sách)
+"""
+
+import os
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from postgrest_stub import PostgrestStub  # noqa: E402
+
+import supabase_db as sdb  # noqa: E402
+import supabase_http  # noqa: E402
+
+from postgrest import base_request_builder  # noqa: E402
+from supabase import create_client  # noqa: E402
+
+ROUNDS = 150
+LATENCY = 0.01
+HANG_SECONDS = 6.0
+READ_BUDGET = 1.5
+LIBRARY_RETRIES = base_request_builder.MAX_RETRIES
+
+SCENARIOS = [
+    ('độ trễ 10 ms', dict(latency=LATENCY)),
+    ('10% reset kết nối', dict(latency=LATENCY, reset_rate=0.1, seed=1)),
+    ('10% lỗi 503', dict(latency=LATENCY, error_rate=0.1, seed=2)),
+    (f'3% treo {HANG_SECONDS:.0f} giây', dict(latency=LATENCY, hang_rate=0.03, hang_seconds=HANG_SECONDS, seed=3)),
+]
+
+
+def seed(user_id: int) -> int:
+    sdb.provision_user(user_id, new_user=True)
+    job_id = sdb.get_all_jobs(user_id)[0]['id']
+    start = date.today().replace(day=1)
+    sdb.get_supabase_client().table('work_shifts').insert([
+        {'user_id': user_id, 'work_date': (start + timedelta(days=i % 28)).isoformat(),
+         'shift_name': 'Ca làm', 'job_id': job_id, 'start_time': '08:00', 'end_time': '17:00',
+         'break_hours': 1.0, 'total_hours': 8.0, 'notes': ''}
+        for i in range(40)
+    ]).execute()
+    return job_id
+
+
+def make_client(stub: PostgrestStub, mode: str):
+    """Client mới (pool riêng) cho một lần chạy."""
+    if mode == 'mặc định':
+        client = create_client(stub.url, 'stub-key')
+        base_request_builder.MAX_RETRIES = LIBRARY_RETRIES
+    else:
+        client = create_client(stub.url, 'stub-key', options=supabase_http.client_options())
+    return client
+
+
+def rerun(client, user_id: int) -> None:
+    start = date.today().replace(day=1)
+    end = start + timedelta(days=27)
+    client.table('jobs').select(sdb.JOB_COLUMNS).eq('user_id', user_id).execute()
+    client.table('work_shifts').select(sdb.SHIFT_COLUMNS).eq('user_id', user_id) \
+        .gte('work_date', start.isoformat()).lte('work_date', end.isoformat()).execute()
+    client.rpc('daily_summaries', {'p_user_id': user_id, 'p_start': start.isoformat(),
+                                   'p_end': end.isoformat()}).execute()
+
+
+def run(stub: PostgrestStub, mode: str, user_id: int, faults: dict) -> dict:
+    client = make_client(stub, mode)
+    rerun(client, user_id)          # mở kết nối trước khi đo
+    stub.set_faults(**faults)
+    stub.reset_counters()
+    supabase_http.reset_stats()
+    samples, failed = [], 0
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        try:
+            rerun(client, user_id)
+        except Exception:
+            failed += 1
+        samples.append((time.perf_counter() - started) * 1000)
+    stub.set_faults()
+    samples.sort()
+    stats = supabase_http.get_stats()
+    return {
+        'p50': statistics.median(samples),
+        'p95': samples[int(len(samples) * 0.95) - 1],
+        'max': samples[-1],
+        'failed': failed,
+        'connections': stub.connections,
+        'requests': stub.requests,
+        'retries': stats['retries'] if mode != 'mặc định' else None,
+        'reuse': stats['reuse_ratio'] if mode != 'mặc định' else None,
+    }
+
+
+def main() -> int:
+    supabase_http.BUDGETS['read'] = supabase_http.BUDGETS['rpc'] = READ_BUDGET
+    failures = []
+
+    stub = PostgrestStub().install_aggregate_rpcs().start()
+    stub.connect_supabase_db()
+    try:
+        user_id = sdb.create_user('http_user', 'hash', 'HTTP')['id']
+        seed(user_id)
+
+        print(f"{ROUNDS} lượt x 3 lần đọc, ngân sách đọc của supabase_http {READ_BUDGET} giây")
+        print(f"{'kịch bản':<22} {'client':<11} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} "
+              f"{'lỗi':>5} {'kết nối':>8} {'request':>8} {'thử lại':>8} {'dùng lại':>9}")
+        for name, faults in SCENARIOS:
+            for mode in ('mặc định', 'tinh chỉnh'):
+                result = run(stub, mode, user_id, faults)
+                retries = '-' if result['retries'] is None else result['retries']
+                reuse = '-' if result['reuse'] is None else f"{result['reuse']:.0%}"
+                print(f"{name:<22} {mode:<11} {result['p50']:>8.1f} {result['p95']:>8.1f} {result['max']:>8.0f} "
+                      f"{result['failed']:>5} {result['connections']:>8} {result['requests']:>8} "
+                      f"{retries:>8} {reuse:>9}")
+                if mode == 'mặc định':
+                    continue
+                if 'hang_rate' in faults:
+                    # Một lượt: tối đa ba lần gọi, mỗi lần không quá ngân sách
+                    if result['max'] > 3 * READ_BUDGET * 1000 + 500:
+                        failures.append(f"{name}: lượt chậm nhất {result['max']:.0f} ms vượt ngân sách")
+                elif result['failed']:
+                    failures.append(f"{name}: {result['failed']} lượt lỗi")
+    finally:
+        stub.stop()
+
+    for failure in failures:
+        print(f"LỖI: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
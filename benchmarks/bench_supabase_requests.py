@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Ghim số request và số byte của từng thao tác supabase_db / db_wrapper (chế độ
+cloud) với PostgREST giả lập (benchmarks/postgrest_stub.py) chứa dữ liệu mẫu:
+400 ca trong hai năm, 30 ngày nghỉ trong ba năm, 12 tháng đã chốt. Stub đã cài
+các RPC tổng hợp của supabase/migrations (như project đã áp dụng migration).
+
+Mỗi thao tác phải đúng số request trong EXPECTED và không vượt ngân sách byte
+(request + response). Thao tác mới chậm hơn hoặc tải nhiều dữ liệu hơn sẽ làm
+script thất bại.
+
+Chạy: python benchmarks/bench_supabase_requests.py [--update]
+(--update in bảng EXPECTED mới thay vì kiểm tra; exit code 1 nếu sai lệch)
+"""
+
+import os
+import sys
+from datetime import date, timedelta
+
+# Đo request của supabase_db trực tiếp (bản sao đọc local: bench_cloud_mirror.py)
+os.environ['CLOUD_MIRROR'] = '0'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from postgrest_stub import PostgrestStub  # noqa: E402
+
+import db_wrapper as db  # noqa: E402
+import supabase_db as sdb  # noqa: E402
+import tenant_context  # noqa: E402
+
+# thao tác -> (số request, ngân sách byte)
+EXPECTED = {
+    'get_user_by_username': (1, 100),
+    'update_user_last_login': (1, 50),
+    'get_all_jobs': (1, 300),
+    'add_job_new': (1, 150),
+    'add_job_existing': (1, 150),
+    'update_job': (1, 150),
+    'record_rate_change': (2, 200),
+    'get_job_rates': (1, 200),
+    'get_shift_counts_by_job': (1, 150),    # RPC shift_counts_by_job, đếm phía server
+    'add_work_shift': (1, 200),
+    'update_work_shift': (1, 150),
+    'get_shifts_by_date': (1, 200),
+    'get_shifts_by_range': (1, 3300),
+    'get_shift_by_id': (1, 200),
+    'delete_work_shift': (1, 50),
+    'get_closed_months': (1, 400),
+    'get_payroll_snapshot': (1, 300),
+    'get_payroll_snapshots': (1, 450),
+    'save_payroll_snapshot': (1, 150),
+    'delete_payroll_snapshot': (1, 50),
+    'add_holiday': (1, 100),
+    'get_all_holidays': (1, 2600),
+    'is_holiday': (1, 50),
+    'db.get_holidays_by_year': (1, 850),
+    'db.get_payroll_rules': (4, 850),
+    'db.calculate_salary_by_month': (2, 800),
+    'db.get_daily_summaries_by_month': (2, 2650),
+    'db.get_monthly_series': (2, 7900),
+    'db.get_year_over_year': (4, 8000),     # 2024 và 2026: không đọc năm 2025 ở giữa
+    'get_setting': (1, 50),
+    'get_all_settings': (1, 250),
+    'update_setting': (1, 100),
+    'get_all_presets': (1, 800),
+    'add_preset': (1, 200),
+    'update_preset': (1, 50),
+    'delete_preset': (1, 50),
+}
+
+
+def seed(user_id: int) -> dict:
+    """Dữ liệu mẫu cho một user (ghi thẳng vào database của stub)."""
+    ids = {}
+    sdb.provision_user(user_id, new_user=True)
+    jobs = sdb.get_all_jobs(user_id)
+    ids['job'] = jobs[0]['id']
+    day = date(2025, 1, 1)
+    client = sdb.get_supabase_client()
+    client.table('work_shifts').insert([
+        {'user_id': user_id, 'work_date': (day + timedelta(days=i * 730 // 400)).isoformat(),
+         'shift_name': 'Ca làm', 'job_id': jobs[i % len(jobs)]['id'], 'start_time': '08:00',
+         'end_time': '17:00', 'break_hours': 1.0, 'total_hours': 8.0, 'notes': ''}
+        for i in range(400)
+    ]).execute()
+    client.table('holidays').insert([
+        {'user_id': user_id, 'holiday_date': date(2024 + i // 10, 1 + i % 10, 10).isoformat(),
+         'description': f'Ngày nghỉ {i}'}
+        for i in range(30)
+    ]).execute()
+    for month in range(1, 13):
+        sdb.save_payroll_snapshot(user_id, 2025, month, {'year': 2025, 'month': month, 'total_salary': 1000.0 * month,
+                                                          'jobs': [{'job_id': ids['job'], 'hours': 160}]},
+                                  [{'date': f'2025-{month:02d}-01', 'hours': 8}])
+    return ids
+
+
+def operations(user_id: int, ids: dict) -> list:
+    """Danh sách (tên, hàm) theo thứ tự chạy (các thao tác ghi phụ thuộc thao tác trước)."""
+    state = {}
+
+    def with_tenant(func):
+        def run():
+            with tenant_context.use_tenant(user_id=user_id):
+                db.begin_request()
+                return func()
+        return run
+
+    def add_shift():
+        state['shift'] = sdb.add_work_shift(user_id, date(2026, 3, 3), 'Ca làm', '08:00', '12:00', 0.0, 4.0, '', ids['job'])
+
+    def add_preset():
+        state['preset'] = sdb.add_preset(user_id, 'Ca thử', '09:00', '12:00', 0.0, 3.0, emoji='🧪', sort_order=9)
+
+    return [
+        ('get_user_by_username', lambda: sdb.get_user_by_username('bench_user')),
+        ('update_user_last_login', lambda: sdb.update_user_last_login(user_id)),
+        ('get_all_jobs', lambda: sdb.get_all_jobs(user_id)),
+        ('add_job_new', lambda: sdb.add_job(user_id, 'Việc mới', 1300, 'Thử', '#000000')),
+        ('add_job_existing', lambda: sdb.add_job(user_id, 'Việc mới', 1350, 'Thử', '#000000')),
+        ('update_job', lambda: sdb.update_job(user_id, ids['job'], 'Bệnh viện', 1250, 'Công việc chính', '#10B981')),
+        ('record_rate_change', lambda: sdb.record_rate_change(user_id, ids['job'], 1200, 1250, date(2026, 1, 1), '0001-01-01')),
+        ('get_job_rates', lambda: sdb.get_job_rates(user_id)),
+        ('get_shift_counts_by_job', lambda: sdb.get_shift_counts_by_job(user_id)),
+        ('add_work_shift', add_shift),
+        ('update_work_shift', lambda: sdb.update_work_shift(user_id, state['shift'], 'Ca làm', '08:00', '13:00', 0.0, 5.0, 'sửa')),
+        ('get_shifts_by_date', lambda: sdb.get_shifts_by_date(user_id, date(2026, 3, 3))),
+        ('get_shifts_by_range', lambda: sdb.get_shifts_by_range(user_id, date(2025, 6, 1), date(2025, 6, 30))),
+        ('get_shift_by_id', lambda: sdb.get_shift_by_id(user_id, state['shift'])),
+        ('delete_work_shift', lambda: sdb.delete_work_shift(user_id, state['shift'])),
+        ('get_closed_months', lambda: sdb.get_closed_months(user_id)),
+        ('get_payroll_snapshot', lambda: sdb.get_payroll_snapshot(user_id, 2025, 5)),
+        ('get_payroll_snapshots', lambda: sdb.get_payroll_snapshots(user_id, (2025, 3), (2025, 5))),
+        ('save_payroll_snapshot', lambda: sdb.save_payroll_snapshot(user_id, 2024, 12, {'total_salary': 1.0}, [])),
+        ('delete_payroll_snapshot', lambda: sdb.delete_payroll_snapshot(user_id, 2024, 12)),
+        ('add_holiday', lambda: sdb.add_holiday(user_id, date(2026, 12, 31), 'Cuối năm')),
+        ('get_all_holidays', lambda: sdb.get_all_holidays(user_id)),
+        ('is_holiday', lambda: sdb.is_holiday(user_id, date(2025, 1, 10))),
+        ('db.get_holidays_by_year', with_tenant(lambda: db.get_holidays_by_year(2025))),
+        ('db.get_payroll_rules', with_tenant(lambda: db.get_payroll_rules(date(2025, 6, 1), date(2025, 6, 30)))),
+        ('db.calculate_salary_by_month', with_tenant(lambda: db.calculate_salary_by_month(2026, 2))),
+        ('db.get_daily_summaries_by_month', with_tenant(lambda: db.get_daily_summaries_by_month(2026, 2))),
+        ('db.get_monthly_series', with_tenant(lambda: db.get_monthly_series(2026, 12, 12))),
+        ('db.get_year_over_year', with_tenant(lambda: db.get_year_over_year([2024, 2026]))),
+        ('get_setting', lambda: sdb.get_setting(user_id, 'ot_rate')),
+        ('get_all_settings', lambda: sdb.get_all_settings(user_id)),
+        ('update_setting', lambda: sdb.update_setting(user_id, 'standard_hours', '7.5')),
+        ('get_all_presets', lambda: sdb.get_all_presets(user_id)),
+        ('add_preset', add_preset),
+        ('update_preset', lambda: sdb.update_preset(user_id, state['preset'], total_hours=2.5)),
+        ('delete_preset', lambda: sdb.delete_preset(user_id, state['preset'])),
+    ]
+
+
+def main(argv=None) -> int:
+    update = '--update' in (argv if argv is not None else sys.argv[1:])
+    stub = PostgrestStub().install_aggregate_rpcs().start()
+    stub.connect_supabase_db()
+    results = {}
+    try:
+        user = sdb.create_user('bench_user', 'hash', 'Bench')
+        ids = seed(user['id'])
+        db._check_supabase()
+        for name, func in operations(user['id'], ids):
+            stub.reset_counters()
+            func()
+            results[name] = (stub.requests, stub.bytes_in + stub.bytes_out,
+                             [status for *_, status, _, _ in stub.log if status >= 400])
+    finally:
+        stub.stop()
+
+    if update:
+        for name, (requests, size, _) in results.items():
+            print(f"    '{name}': ({requests}, {int(size * 1.1) // 50 * 50 + 50}),")
+        return 0
+
+    failed = False
+    print(f"{'thao tác':<32} {'request':>8} {'bytes':>8} {'ngân sách':>10}")
+    for name, (requests, size, errors) in results.items():
+        expected_requests, budget = EXPECTED.get(name, (None, None))
+        problems = []
+        if requests != expected_requests:
+            problems.append(f"mong đợi {expected_requests} request")
+        if budget is not None and size > budget:
+            problems.append("vượt ngân sách byte")
+        if errors:
+            problems.append(f"HTTP lỗi {errors}")
+        failed |= bool(problems)
+        print(f"{name:<32} {requests:>8} {size:>8} {budget or '-':>10}  {'; '.join(problems)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
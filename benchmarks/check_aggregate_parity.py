@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Kiểm tra tổng hợp phía server (RPC daily_summaries / payroll_aggregates) cho cùng
+kết quả với bộ tính lương SQLite (database.py, mỗi user một file).
+
+Cùng một bộ dữ liệu (ca qua đêm, nhiều ca/ngày, OT, ngày lễ, đổi lương giờ giữa
+kỳ, tháng đã chốt) được ghi qua db_wrapper vào từng backend:
+  - sqlite:         database.py (chuẩn để so sánh)
+  - tenant:         tenant_db (SQL tổng hợp trong SQLite)
+  - cloud_rpc:      supabase_db + PostgREST giả lập đã cài RPC của migration
+  - cloud_fallback: supabase_db + PostgREST giả lập chưa có RPC (tính phía client)
+  - cloud_mirror:   cloud_mirror (bản sao SQLite local, SQL của tenant_db; khoảng
+                    ngoài cửa sổ của bản sao gọi RPC)
+rồi so sánh lương theo tháng / khoảng / nhiều tháng và tổng hợp theo ngày.
+Với các chế độ cloud còn in số request và số byte của báo cáo 14 tháng.
+
+Chạy: python benchmarks/check_aggregate_parity.py   (exit code 1 nếu lệch)
+"""
+
+import os
+import random
+import sys
+import tempfile
+from datetime import date, timedelta
+
+_TMP = tempfile.mkdtemp()
+os.environ['TENANT_DB_PATH'] = os.path.join(_TMP, 'tenants.db')
+os.environ['CLOUD_MIRROR_DIR'] = os.path.join(_TMP, 'mirror')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from postgrest_stub import PostgrestStub  # noqa: E402
+
+import cloud_mirror  # noqa: E402
+import cloud_outbox  # noqa: E402
+import database  # noqa: E402
+import db_wrapper as db  # noqa: E402
+import payroll  # noqa: E402
+import supabase_db as sdb  # noqa: E402
+import tenant_context  # noqa: E402
+
+FIRST_DAY = date(2025, 1, 1)
+LAST_DAY = date(2026, 2, 28)
+MONTHS = [(2025, m) for m in range(1, 13)] + [(2026, 1), (2026, 2)]
+SHIFT_TEMPLATES = [
+    ('08:00', '17:00', 1.0, 8.0),
+    ('13:00', '18:30', 0.5, 5.0),
+    ('18:00', '23:30', 0.0, 5.5),
+    ('22:00', '06:00', 1.0, 7.0),
+    ('09:00', '09:00', 0.0, 0.0),
+]
+
+
+def populate(seed: int = 42) -> None:
+    """Ghi bộ dữ liệu mẫu qua db_wrapper (backend đang chọn)."""
+    rng = random.Random(seed)
+    db.init_database()
+    for key, value in (('standard_hours', '7.5'), ('ot_rate', '1.25'),
+                       ('night_rate', '1.25'), ('holiday_rate', '1.35')):
+        db.update_setting(key, value)
+    db.add_job('Ca đêm', 1300, 'Phụ', '#111111')
+    jobs = {job['job_name']: job for job in db.get_all_jobs()}
+    main, night = jobs['Bệnh viện'], jobs['Ca đêm']
+    db.update_job(main['id'], main['job_name'], 1250, '', '#10B981', effective_from=date(2025, 4, 1))
+    db.update_job(main['id'], main['job_name'], 1300, '', '#10B981', effective_from=date(2025, 9, 15))
+    db.update_job(night['id'], night['job_name'], 1400, '', '#111111', effective_from=date(2025, 6, 1))
+    # Công việc mặc định khác nhau giữa các backend: chỉ dùng các công việc có ở mọi nơi
+    job_ids = [jobs[name]['id'] for name in ('Bệnh viện', 'Ca đêm', 'Kombini')]
+
+    day = FIRST_DAY
+    while day <= LAST_DAY:
+        for _ in range(rng.choice((0, 0, 1, 1, 1, 2, 3))):
+            start, end, brk, total = rng.choice(SHIFT_TEMPLATES)
+            notes = rng.choice(('', '', 'trực', 'thay ca'))
+            db.add_shift(day, rng.choice(job_ids), start, end, brk, total, 0.0, notes)
+        day += timedelta(days=1)
+    for i in range(12):
+        db.add_holiday(date(2025, 1 + i, 1 + (i * 7) % 27), f'Ngày lễ {i}')
+    db.close_month(2025, 3)
+
+
+def collect() -> dict:
+    """Các kết quả cần so sánh (mỗi mục một lượt chạy mới)."""
+    def run(func):
+        db.begin_request()
+        return func()
+
+    days = run(lambda: db.get_daily_summaries_by_range(FIRST_DAY, LAST_DAY, 7.5))
+    return {
+        'months': {key: run(lambda key=key: db.calculate_salary_by_month(*key)) for key in MONTHS},
+        'range': run(lambda: db.calculate_salary_by_range(date(2025, 2, 10), date(2025, 11, 20))),
+        'range_open': run(lambda: db.calculate_salary_by_range(date(2025, 6, 3), date(2025, 6, 3))),
+        'batch': run(lambda: db.calculate_salary_by_months(MONTHS)),
+        # Danh sách ca gốc chỉ có ở đường tính phía client (snapshot / RPC không giữ)
+        'days': [{k: v for k, v in day.items() if k != 'shifts'} for day in days],
+    }
+
+
+def normalize(value):
+    """Làm tròn số thực; id công việc khác nhau giữa các backend nên bỏ job_id."""
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, dict):
+        return {k: normalize(v) for k, v in value.items() if k != 'job_id'}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    return value
+
+
+def first_difference(expected, actual, path='') -> str:
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        for key in sorted(set(expected) | set(actual), key=str):
+            if key not in expected or key not in actual:
+                return f"{path}/{key}: chỉ có ở một bên"
+            diff = first_difference(expected[key], actual[key], f"{path}/{key}")
+            if diff:
+                return diff
+        return ''
+    if isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            return f"{path}: {len(expected)} != {len(actual)} phần tử"
+        for i, (a, b) in enumerate(zip(expected, actual)):
+            diff = first_difference(a, b, f"{path}[{i}]")
+            if diff:
+                return diff
+        return ''
+    if isinstance(expected, float) or isinstance(actual, float):
+        if abs((expected or 0) - (actual or 0)) <= 1e-6 * max(1.0, abs(expected or 0)):
+            return ''
+    return '' if expected == actual else f"{path}: {expected!r} != {actual!r}"
+
+
+def use_sqlite() -> None:
+    database.DEFAULT_DB_PATH = os.path.join(_TMP, 'user_parity.db')
+    database.clear_cache()
+    db._supabase_available = False
+    db._db_layout = 'per_user'
+    db.clear_cache()
+
+
+def use_tenant() -> int:
+    db._supabase_available = False
+    db._db_layout = 'multi_tenant'
+    db.clear_cache()
+    return 1
+
+
+def use_cloud(stub: PostgrestStub, mirror: bool) -> int:
+    stub.connect_supabase_db()
+    sdb._missing_rpcs.clear()
+    cloud_mirror._enabled = mirror
+    db._db_layout = 'per_user'
+    db.clear_cache()
+    db._check_supabase()
+    return sdb.create_user('parity', 'hash', 'Parity')['id']
+
+
+def main() -> int:
+    database.ENABLE_SYNC = False
+    results, traffic = {}, {}
+
+    use_sqlite()
+    populate()
+    results['sqlite'] = normalize(collect())
+
+    with tenant_context.use_tenant(user_id=use_tenant()):
+        populate()
+        results['tenant'] = normalize(collect())
+
+    for name, with_rpc, mirror in (('cloud_rpc', True, False), ('cloud_fallback', False, False),
+                                   ('cloud_mirror', True, True)):
+        stub = PostgrestStub()
+        if with_rpc:
+            stub.install_aggregate_rpcs()
+        if mirror:
+            stub.install_mirror_rpcs().install_client_refs()
+        stub.start()
+        try:
+            with tenant_context.use_tenant(user_id=use_cloud(stub, mirror)):
+                populate()
+                results[name] = normalize(collect())
+                cloud_outbox.wait_idle(60)   # bản sao: các lần ghi gửi ở nền
+                stub.reset_counters()
+                db.begin_request()
+                db.calculate_salary_by_months(MONTHS)
+                db.get_daily_summaries_by_range(FIRST_DAY, LAST_DAY, 7.5)
+                traffic[name] = (stub.requests, stub.bytes_out)
+        finally:
+            stub.stop()
+
+    expected = results['sqlite']
+    failed = False
+    for name in ('tenant', 'cloud_rpc', 'cloud_fallback', 'cloud_mirror'):
+        diff = first_difference(expected, results[name])
+        failed |= bool(diff)
+        print(f"{name:<16} {'OK' if not diff else 'LỆCH ' + diff}")
+
+    total = expected['batch'][MONTHS[-1]]['total_salary'] if MONTHS[-1] in expected['batch'] else None
+    print(f"\nlương tháng {MONTHS[-1][1]}/{MONTHS[-1][0]}: {total}, "
+          f"tổng 14 tháng: {sum(r['total_salary'] for r in expected['batch'].values()):,.0f}")
+    print("báo cáo 14 tháng + tổng hợp ngày (cloud):")
+    for name, (requests, size) in traffic.items():
+        print(f"  {name:<16} {requests:>3} request {size:>9,} byte nhận")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Kiểm tra công cụ bảo trì maintenance.py trên một thư mục user_data tạm.
+
+- find_user_dbs chỉ liệt kê database riêng của user: bỏ qua users.db, tenants.db
+  và file cache kết quả (result_cache.CACHE_PATH)
+- Chạy bảo trì (integrity + migrate + analyze) không đụng vào file cache: không
+  thêm bảng của database.init_database vào result_cache.db
+- rollups mặc định chỉ báo cáo tháng đã chốt bị lệch (đổi hệ số OT sau khi chốt),
+  snapshot giữ nguyên; --rewrite-rollups mới ghi đè và báo tổng cũ / mới
+- analyze / vacuum chờ khóa ghi của process khác (app đang ghi) theo
+  sqlite_writer.BUSY_TIMEOUT_SECONDS, không lỗi "database is locked" sau 5 giây
+  (timeout mặc định của sqlite3.connect)
+
+Chạy: python benchmarks/check_maintenance.py   (exit code 1 nếu sai kết quả)
+"""
+
+import os
+import sqlite3
+import sys
+import subprocess
+import tempfile
+import time
+from datetime import date
+
+_TMP = tempfile.mkdtemp()
+_DATA_DIR = os.path.join(_TMP, 'user_data')
+os.makedirs(_DATA_DIR)
+os.environ['TENANT_DB_PATH'] = os.path.join(_DATA_DIR, 'tenants.db')
+os.environ['RESULT_CACHE_PATH'] = os.path.join(_DATA_DIR, 'result_cache.db')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+import db_wrapper as db  # noqa: E402
+import maintenance  # noqa: E402
+import result_cache  # noqa: E402
+import sqlite_writer  # noqa: E402
+import tenant_context  # noqa: E402
+
+# Giữ khóa ghi lâu hơn timeout mặc định của sqlite3.connect (5 giây)
+HOLD_LOCK_SECONDS = 7.0
+
+failures = []
+
+
+def check(name: str, ok: bool, detail: str = '') -> None:
+    print(f"  [{'OK ' if ok else 'SAI'}] {name}" + (f": {detail}" if detail else ''))
+    if not ok:
+        failures.append(name)
+
+
+def table_names(db_path: str) -> list:
+    conn = sqlite3.connect(db_path)
+    try:
+        return sorted(row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+    finally:
+        conn.close()
+
+
+def setup() -> str:
+    """
+    Tạo một database user (một tháng đã chốt có ca làm thêm, hệ số OT đổi sau khi
+    chốt), users.db, tenants.db và file cache kết quả trong thư mục tạm.
+    """
+    database.ENABLE_SYNC = False
+    db._supabase_available = False
+    db._db_layout = 'per_user'
+    user_db = os.path.join(_DATA_DIR, 'user_a.db')
+    with tenant_context.use_tenant(db_path=user_db):
+        db.init_database()
+        job_id = db.add_job('Cửa hàng', 1000)
+        db.add_work_shift(work_date=date(2026, 1, 5), shift_name='Ca dài', start_time='08:00',
+                          end_time='20:00', break_hours=1.0, total_hours=11.0, notes='', job_id=job_id)
+        db.close_month(2026, 1)
+        db.update_setting('ot_rate', '2.0')
+    for name in ('users.db', 'tenants.db'):
+        sqlite3.connect(os.path.join(_DATA_DIR, name)).close()
+    result_cache.configure(enabled=True)
+    result_cache.get_or_compute('scope', 'gen-1', 'salary', (2026, 1), lambda: {'total_salary': 1.0})
+    result_cache._drop_connection()
+    return user_db
+
+
+def snapshot_total(db_path: str):
+    with tenant_context.use_tenant(db_path=db_path):
+        return database.get_payroll_snapshot(2026, 1)['salary']['total_salary']
+
+
+def rollups(db_path: str, rewrite: bool) -> dict:
+    report = maintenance.run_maintenance([db_path], ('rollups',), workers=1, rewrite_rollups=rewrite)[0]
+    return report['tasks']['rollups']
+
+
+# Process khác (như app đang ghi) giữ khóa ghi; không dùng thread của process này vì
+# process con của ProcessPoolExecutor (fork) thừa hưởng trạng thái khóa SQLite của nó
+_HOLD_LOCK_SCRIPT = """
+import sqlite3, sys, time
+conn = sqlite3.connect(sys.argv[1], isolation_level=None)
+conn.execute("BEGIN IMMEDIATE")
+print("locked", flush=True)
+time.sleep(float(sys.argv[2]))
+conn.execute("COMMIT")
+"""
+
+
+def hold_write_lock(db_path: str) -> subprocess.Popen:
+    """Chạy process giữ khóa ghi HOLD_LOCK_SECONDS giây, trả về khi đã lấy được khóa."""
+    holder = subprocess.Popen([sys.executable, '-c', _HOLD_LOCK_SCRIPT, db_path, str(HOLD_LOCK_SECONDS)],
+                              stdout=subprocess.PIPE, text=True)
+    holder.stdout.readline()
+    return holder
+
+
+def main() -> int:
+    user_db = setup()
+    cache_tables = table_names(result_cache.CACHE_PATH)
+
+    print("find_user_dbs:")
+    found = maintenance.find_user_dbs(_DATA_DIR)
+    check("chỉ có database của user", found == [user_db], ', '.join(os.path.basename(p) for p in found))
+
+    print("run_maintenance (mặc định):")
+    reports = maintenance.run_maintenance(found, workers=1)
+    check("bảo trì thành công", all(report['ok'] for report in reports))
+    check("file cache không bị migrate", table_names(result_cache.CACHE_PATH) == cache_tables,
+          ', '.join(table_names(result_cache.CACHE_PATH)))
+
+    print("rollups (chỉ đối chiếu):")
+    closed_total = snapshot_total(user_db)
+    result = rollups(user_db, rewrite=False)
+    drift = result.get('drift') or []
+    check("báo cáo tháng lệch", [(d['year'], d['month']) for d in drift] == [(2026, 1)], result['detail'])
+    check("snapshot giữ nguyên", snapshot_total(user_db) == closed_total)
+
+    print("rollups --rewrite-rollups:")
+    result = rollups(user_db, rewrite=True)
+    drift = result.get('drift') or []
+    check("báo tổng cũ / mới", len(drift) == 1 and drift[0]['old_total'] == closed_total
+          and drift[0]['new_total'] != closed_total, result['detail'])
+    check("snapshot được ghi đè", bool(drift) and snapshot_total(user_db) == drift[0]['new_total'])
+    check("đối chiếu lại không còn lệch", not rollups(user_db, rewrite=False).get('drift'))
+
+    print(f"analyze + vacuum khi database đang bị khóa ghi {HOLD_LOCK_SECONDS:.0f}s "
+          f"(busy timeout {sqlite_writer.BUSY_TIMEOUT_SECONDS:.0f}s):")
+    holder = hold_write_lock(user_db)
+    started = time.perf_counter()
+    report = maintenance.run_maintenance([user_db], ('analyze', 'vacuum'), workers=1)[0]
+    holder.wait()
+    detail = '; '.join(f"{name}: {result['detail']}" for name, result in report['tasks'].items())
+    check("chờ được khóa và chạy xong", report['ok'] and set(report['tasks']) == {'analyze', 'vacuum'},
+          f"{detail} ({time.perf_counter() - started:.1f}s)")
+
+    print(f"\n{'Tất cả kiểm tra đều đúng' if not failures else f'{len(failures)} kiểm tra sai'}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
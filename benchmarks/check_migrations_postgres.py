@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""
+Chạy SQL của supabase/migrations trên PostgreSQL thật (server giả lập và
+check_aggregate_parity.py chỉ chạy bản SQLite cùng logic).
+
+- Tạo các bảng gốc của project (BASE_SCHEMA: bảng tạo trên dashboard Supabase,
+  không có trong migrations), áp dụng mọi migration theo thứ tự tên file, rồi áp
+  dụng lại lần nữa (dán lại vào SQL Editor không lỗi)
+- Trigger chốt tháng: thêm / sửa / xóa ca của tháng đã chốt bị từ chối
+  (check_violation 23514), xóa user vẫn xóa được ca của tháng đã chốt
+- RPC daily_summaries / payroll_aggregates / shift_counts_by_job: PostgREST giả lập
+  chuyển lời gọi RPC sang Postgres (bảng của stub được chép sang trước mỗi lần gọi),
+  supabase_db chạy như với project thật; kết quả so với SQLite (database.py) bằng
+  bộ dữ liệu của check_aggregate_parity.py
+
+Postgres: biến môi trường POSTGRES_URL (user được tạo database; script tạo và xóa
+một database tạm), hoặc gói pgserver (pip install pgserver) chạy server tạm.
+Cần psycopg2 (pip install psycopg2-binary). Thiếu cả hai thì bỏ qua (exit code 0).
+
+Chạy: python benchmarks/check_migrations_postgres.py   (exit code 1 nếu sai kết quả)
+"""
+
+import glob
+import os
+import sys
+import tempfile
+from datetime import date, datetime
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import check_aggregate_parity as parity  # noqa: E402
+from postgrest_stub import PostgrestStub, StubError  # noqa: E402
+
+import database  # noqa: E402
+import supabase_db as sdb  # noqa: E402
+import tenant_context  # noqa: E402
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              'supabase', 'migrations')
+
+# Bảng gốc của project Supabase, kiểu cột như supabase_db gửi / đọc (ngày là date,
+# giờ là chuỗi 'HH:MM'). job_rates, payroll_snapshots, auth_tokens do migration tạo.
+BASE_SCHEMA = """
+do $$
+declare
+    r text;
+begin
+    foreach r in array array['anon', 'authenticated', 'service_role'] loop
+        if not exists (select 1 from pg_roles where rolname = r) then
+            execute format('create role %I nologin', r);
+        end if;
+    end loop;
+end;
+$$;
+
+create table users (
+    id bigint generated by default as identity primary key,
+    username text not null unique,
+    password_hash text not null,
+    display_name text,
+    created_at timestamptz default now(),
+    last_login timestamptz
+);
+
+create table jobs (
+    id bigint generated by default as identity primary key,
+    user_id bigint not null references users(id) on delete cascade,
+    job_name text not null,
+    hourly_rate double precision not null default 0,
+    description text,
+    color text default '#667eea',
+    created_at timestamptz default now()
+);
+
+create table work_shifts (
+    id bigint generated by default as identity primary key,
+    user_id bigint not null references users(id) on delete cascade,
+    work_date date not null,
+    shift_name text default 'Ca 1',
+    job_id bigint references jobs(id) on delete cascade,
+    start_time text not null,
+    end_time text not null,
+    break_hours double precision default 1.0,
+    total_hours double precision not null,
+    overtime_hours double precision default 0,
+    notes text,
+    created_at timestamptz default now()
+);
+
+create table shift_presets (
+    id bigint generated by default as identity primary key,
+    user_id bigint not null references users(id) on delete cascade,
+    preset_name text not null,
+    start_time text not null,
+    end_time text not null,
+    break_hours double precision default 0,
+    total_hours double precision not null,
+    job_id bigint references jobs(id) on delete set null,
+    emoji text default '⏰',
+    sort_order integer default 0,
+    created_at timestamptz default now()
+);
+
+create table holidays (
+    id bigint generated by default as identity primary key,
+    user_id bigint not null references users(id) on delete cascade,
+    holiday_date date not null,
+    description text not null,
+    created_at timestamptz default now(),
+    unique (user_id, holiday_date)
+);
+
+create table settings (
+    user_id bigint not null references users(id) on delete cascade,
+    key text not null,
+    value text not null,
+    primary key (user_id, key)
+);
+"""
+
+# Bảng chép từ stub sang Postgres trước mỗi lần gọi RPC (thứ tự khóa ngoại; ca làm
+# việc trước snapshot để trigger chốt tháng không từ chối)
+SYNC_TABLES = ('users', 'jobs', 'job_rates', 'work_shifts', 'shift_presets', 'holidays',
+               'settings', 'payroll_snapshots')
+
+BRIDGED_RPCS = ('daily_summaries', 'payroll_aggregates', 'shift_counts_by_job')
+
+failures = []
+
+
+def check(name: str, ok: bool, detail: str = '') -> None:
+    print(f"  [{'OK ' if ok else 'SAI'}] {name}" + (f": {detail}" if detail else ''))
+    if not ok:
+        failures.append(name)
+
+
+# ==================== POSTGRES ====================
+
+def start_postgres():
+    """URL của server Postgres (POSTGRES_URL hoặc pgserver tạm) và hàm dọn dẹp; None nếu không có."""
+    url = os.environ.get('POSTGRES_URL')
+    if url:
+        return url, lambda: None
+    try:
+        import pgserver
+    except ImportError:
+        return None
+    server = pgserver.get_server(tempfile.mkdtemp(), cleanup_mode='stop')
+    return server.get_uri(), server.cleanup
+
+
+def create_database(psycopg2, url: str, name: str) -> str:
+    """Tạo database trống tên name, trả về DSN của nó."""
+    admin = psycopg2.connect(url)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute(f'drop database if exists "{name}"')
+            cur.execute(f'create database "{name}"')
+    finally:
+        admin.close()
+    return psycopg2.extensions.make_dsn(url, dbname=name)
+
+
+def drop_database(psycopg2, url: str, name: str) -> None:
+    admin = psycopg2.connect(url)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute(f'drop database if exists "{name}"')
+    finally:
+        admin.close()
+
+
+def apply_migrations(conn) -> list:
+    """Áp dụng mọi migration theo thứ tự tên file; trả về danh sách (file, lỗi hoặc None)."""
+    results = []
+    for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, '*.sql'))):
+        with open(path, encoding='utf-8') as f:
+            sql = f.read()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql)
+            conn.commit()
+            results.append((os.path.basename(path), None))
+        except Exception as e:
+            conn.rollback()
+            results.append((os.path.basename(path), str(e).strip().splitlines()[0]))
+    return results
+
+
+def _json_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+class PostgresRpcBridge:
+    """RPC của stub chạy bằng hàm của migration trên Postgres (dữ liệu chép từ stub)."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.calls = {name: 0 for name in BRIDGED_RPCS}
+        self.errors = []
+
+    def install(self, stub: PostgrestStub) -> None:
+        for name in BRIDGED_RPCS:
+            stub.rpc[name] = lambda conn, name=name, **args: self.call(conn, name, args)
+
+    def _pg_columns(self, table: str) -> list:
+        with self.conn.cursor() as cur:
+            cur.execute("select column_name from information_schema.columns "
+                        "where table_schema = 'public' and table_name = %s", (table,))
+            return [row[0] for row in cur.fetchall()]
+
+    def sync(self, stub_conn) -> None:
+        """Chép toàn bộ bảng của stub (SQLite) sang Postgres."""
+        with self.conn.cursor() as cur:
+            cur.execute(f"truncate {', '.join(SYNC_TABLES)} cascade")
+            for table in SYNC_TABLES:
+                stub_columns = [row[1] for row in stub_conn.execute(f"PRAGMA table_info({table})")]
+                columns = [c for c in stub_columns if c in self._pg_columns(table) and c != 'updated_at']
+                rows = stub_conn.execute(f"SELECT {', '.join(columns)} FROM {table}").fetchall()
+                if rows:
+                    placeholders = ', '.join(['%s'] * len(columns))
+                    cur.executemany(f"insert into {table} ({', '.join(columns)}) values ({placeholders})",
+                                    [tuple(row) for row in rows])
+        self.conn.commit()
+
+    def call(self, stub_conn, name: str, args: dict):
+        self.calls[name] += 1
+        try:
+            self.sync(stub_conn)
+            with self.conn.cursor() as cur:
+                params = ', '.join(f"{key} => %({key})s" for key in args)
+                cur.execute(f"select * from public.{name}({params})", args)
+                columns = [column.name for column in cur.description]
+                rows = [{c: _json_value(v) for c, v in zip(columns, row)} for row in cur.fetchall()]
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            self.errors.append(f"{name}: {str(e).strip().splitlines()[0]}")
+            raise StubError(400, 'P0001', str(e))
+        # Hàm trả về một giá trị (jsonb): PostgREST trả thẳng giá trị đó
+        if len(columns) == 1 and columns[0] == name:
+            return rows[0][name] if rows else None
+        return rows
+
+
+# ==================== KIỂM TRA ====================
+
+def check_migrations(conn) -> None:
+    print("Migration:")
+    for run in ('lần đầu', 'áp dụng lại'):
+        results = apply_migrations(conn)
+        errors = [f"{name}: {error}" for name, error in results if error]
+        check(f"{len(results)} file, {run}", not errors, '; '.join(errors))
+
+
+def check_closed_period_guard(psycopg2, conn) -> None:
+    print("Trigger chốt tháng:")
+    with conn.cursor() as cur:
+        cur.execute("insert into users (username, password_hash) values ('guard', 'x') returning id")
+        user_id = cur.fetchone()[0]
+        cur.execute("insert into jobs (user_id, job_name, hourly_rate) values (%s, 'Việc', 1000) returning id",
+                    (user_id,))
+        job_id = cur.fetchone()[0]
+        cur.execute("insert into work_shifts (user_id, work_date, job_id, start_time, end_time, total_hours) "
+                    "values (%s, '2026-01-05', %s, '08:00', '12:00', 4) returning id", (user_id, job_id))
+        shift_id = cur.fetchone()[0]
+        cur.execute("insert into payroll_snapshots (user_id, year, month, salary_json, daily_json) "
+                    "values (%s, 2026, 1, '{}', '[]')", (user_id,))
+    conn.commit()
+
+    statements = {
+        'thêm ca': ("insert into work_shifts (user_id, work_date, job_id, start_time, end_time, total_hours) "
+                    "values (%s, '2026-01-06', %s, '08:00', '12:00', 4)", (user_id, job_id)),
+        'sửa ca': ("update work_shifts set total_hours = 5 where id = %s", (shift_id,)),
+        'chuyển ca sang tháng đã chốt': (
+            "insert into work_shifts (user_id, work_date, job_id, start_time, end_time, total_hours) "
+            "values (%s, '2026-02-02', %s, '08:00', '12:00', 4)", (user_id, job_id)),
+        'xóa ca': ("delete from work_shifts where id = %s", (shift_id,)),
+    }
+    for label, (sql, params) in statements.items():
+        code = None
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                if label == 'chuyển ca sang tháng đã chốt':
+                    cur.execute("update work_shifts set work_date = '2026-01-07' "
+                                "where user_id = %s and work_date = '2026-02-02'", (user_id,))
+            conn.commit()
+        except psycopg2.Error as e:
+            conn.rollback()
+            code = e.pgcode
+        check(f"{label} bị từ chối", code == '23514', code or 'không lỗi')
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute("delete from users where id = %s", (user_id,))
+            cur.execute("select count(*) from work_shifts where user_id = %s", (user_id,))
+            remaining = cur.fetchone()[0]
+        conn.commit()
+        check("xóa user xóa được ca đã chốt", remaining == 0)
+    except psycopg2.Error as e:
+        conn.rollback()
+        check("xóa user xóa được ca đã chốt", False, e.pgcode or str(e))
+
+
+def check_rpc_parity(conn) -> None:
+    print("RPC tổng hợp (so với SQLite):")
+    database.ENABLE_SYNC = False
+    parity.use_sqlite()
+    parity.populate()
+    expected = parity.normalize(parity.collect())
+
+    bridge = PostgresRpcBridge(conn)
+    stub = PostgrestStub().install_aggregate_rpcs()
+    bridge.install(stub)
+    stub.start()
+    try:
+        user_id = parity.use_cloud(stub, mirror=False)
+        with tenant_context.use_tenant(user_id=user_id):
+            parity.populate()
+            actual = parity.normalize(parity.collect())
+            counts = sdb.get_shift_counts_by_job(user_id)
+            with stub.lock:
+                expected_counts = {job_id: count for job_id, count in stub.conn.execute(
+                    "SELECT job_id, COUNT(*) FROM work_shifts WHERE user_id = ? GROUP BY job_id", (user_id,))}
+    finally:
+        stub.stop()
+
+    check("không lỗi SQL", not bridge.errors, '; '.join(bridge.errors[:3]))
+    check("RPC được gọi", all(bridge.calls.values()), ', '.join(f"{k}: {v}" for k, v in bridge.calls.items()))
+    diff = parity.first_difference(expected, actual)
+    check("lương / tổng hợp ngày khớp SQLite", not diff, diff)
+    check("số ca theo công việc", counts == expected_counts, f"{counts} / {expected_counts}")
+
+
+def main() -> int:
+    try:
+        import psycopg2
+    except ImportError:
+        print("Bỏ qua: cần psycopg2 (pip install psycopg2-binary)")
+        return 0
+    server = start_postgres()
+    if server is None:
+        print("Bỏ qua: cần POSTGRES_URL hoặc gói pgserver (pip install pgserver)")
+        return 0
+    url, cleanup = server
+    name = f"check_migrations_{os.getpid()}"
+    try:
+        conn = psycopg2.connect(create_database(psycopg2, url, name))
+        try:
+            with conn.cursor() as cur:
+                cur.execute("select version()")
+                print(cur.fetchone()[0].split(',')[0])
+                cur.execute(BASE_SCHEMA)
+            conn.commit()
+            check_migrations(conn)
+            check_closed_period_guard(psycopg2, conn)
+            check_rpc_parity(conn)
+        finally:
+            conn.close()
+        drop_database(psycopg2, url, name)
+    finally:
+        cleanup()
+
+    print(f"\n{'Tất cả kiểm tra đều đúng' if not failures else f'{len(failures)} kiểm tra sai'}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Kiểm tra sao lưu / khôi phục của snapshots.py trên database tạm.
+
+- Khôi phục sao lưu database hiện tại trước (tag PRE_RESTORE_TAG) rồi mới chép đè
+- Không sao lưu được database hiện tại (thư mục sao lưu không ghi được) thì hủy
+  khôi phục, dữ liệu hiện tại giữ nguyên
+- Bản trước khi khôi phục xoay vòng riêng (KEEP_PRE_RESTORE), không làm mất bản
+  sao lưu thường và không bị xoay vòng của bản sao lưu thường xóa
+
+Chạy: python benchmarks/check_snapshots.py   (exit code 1 nếu sai kết quả)
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snapshots  # noqa: E402
+
+failures = []
+
+
+def check(name: str, ok: bool, detail: str = '') -> None:
+    print(f"  [{'OK ' if ok else 'SAI'}] {name}" + (f": {detail}" if detail else ''))
+    if not ok:
+        failures.append(name)
+
+
+def write_value(db_path: str, value: str) -> None:
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('v', ?)", (value,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def read_value(db_path: str) -> str:
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT value FROM settings WHERE key = 'v'").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def count_tags(db_path: str, backup_dir: str) -> dict:
+    counts = {}
+    for snapshot in snapshots.list_snapshots(db_path, backup_dir):
+        counts[snapshot['tag']] = counts.get(snapshot['tag'], 0) + 1
+    return counts
+
+
+def main() -> int:
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, 'user_a.db')
+    backup_dir = os.path.join(tmp, 'backups')
+
+    print("Khôi phục:")
+    write_value(db_path, 'cũ')
+    old_snapshot = snapshots.create_snapshot(db_path, backup_dir)
+    write_value(db_path, 'mới')
+    ok = snapshots.restore_snapshot(old_snapshot, db_path, backup_dir)
+    check("khôi phục thành công", ok and read_value(db_path) == 'cũ', read_value(db_path))
+    pre_restore = [s for s in snapshots.list_snapshots(db_path, backup_dir) if s['tag'] == snapshots.PRE_RESTORE_TAG]
+    check("có bản trước khi khôi phục", len(pre_restore) == 1)
+
+    print("Không sao lưu được bản hiện tại:")
+    blocked_dir = os.path.join(tmp, 'not_a_dir')
+    with open(blocked_dir, 'w') as f:
+        f.write('x')
+    write_value(db_path, 'mới')
+    ok = snapshots.restore_snapshot(old_snapshot, db_path, blocked_dir)
+    check("hủy khôi phục", ok is False)
+    check("dữ liệu hiện tại giữ nguyên", read_value(db_path) == 'mới', read_value(db_path))
+
+    print("Xoay vòng:")
+    for _ in range(snapshots.KEEP_PRE_RESTORE + 2):
+        snapshots.restore_snapshot(old_snapshot, db_path, backup_dir)
+    for _ in range(snapshots.KEEP_SNAPSHOTS + 2):
+        snapshots.create_snapshot(db_path, backup_dir)
+    counts = count_tags(db_path, backup_dir)
+    check("bản trước khi khôi phục giữ KEEP_PRE_RESTORE",
+          counts.get(snapshots.PRE_RESTORE_TAG) == snapshots.KEEP_PRE_RESTORE, str(counts))
+    check("bản sao lưu thường giữ KEEP_SNAPSHOTS", counts.get('') == snapshots.KEEP_SNAPSHOTS, str(counts))
+
+    print(f"\n{'Tất cả kiểm tra đều đúng' if not failures else f'{len(failures)} kiểm tra sai'}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
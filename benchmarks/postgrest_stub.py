@@ -0,0 +1,542 @@
+# -*- coding: utf-8 -*-
+"""
+PostgREST giả lập chạy local (HTTP thật, dữ liệu trong SQLite in-memory) để đo
+supabase_db bằng client supabase-py thật: đếm số request và số byte mỗi thao tác.
+
+Hỗ trợ phần PostgREST mà supabase_db dùng: select (cột, alias, embed theo khóa
+ngoại <bảng số ít>_id), lọc eq/neq/gt/gte/lt/lte/in/like/ilike/is (kể cả not.),
+order, limit, offset, Prefer count=exact, insert/upsert (on_conflict,
+merge-duplicates / ignore-duplicates), update, delete, return=representation
+và RPC đăng ký bằng Python (install_aggregate_rpcs: các hàm tổng hợp của migration,
+install_mirror_rpcs: updated_at + mirror_changes cho cloud_mirror, install_client_refs:
+cột client_ref cho cloud_outbox).
+
+Mô phỏng mạng chập chờn (set_faults): thêm độ trễ, trả 503 trước khi xử lý,
+xử lý xong rồi cắt kết nối không trả response (client không biết đã ghi hay chưa),
+reset kết nối trước khi xử lý, hoặc treo request. stub.connections đếm số kết nối
+TCP client đã mở (đo keep-alive).
+
+Dùng trong benchmark:
+    stub = PostgrestStub().start()
+    stub.connect_supabase_db()       # trỏ supabase_db tới stub
+    ... gọi supabase_db ...
+    print(stub.calls, stub.bytes_out)
+    stub.stop()
+"""
+
+import json
+import os
+import random
+import re
+import socket
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tenant_db  # noqa: E402
+
+# Cột jsonb trên Supabase: lưu dạng text JSON, trả về dạng object
+JSON_COLUMNS = {'salary_json', 'daily_json'}
+
+EXTRA_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS auth_tokens (
+        token_hash TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        expires_at TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+_FILTER_OPS = {'eq': '=', 'neq': '!=', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<=',
+               'like': 'LIKE', 'ilike': 'LIKE'}
+_RESERVED_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+
+
+class StubError(Exception):
+    def __init__(self, status: int, code: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+
+
+def _split_top(text: str) -> List[str]:
+    """Tách theo dấu phẩy ở mức ngoài cùng (bỏ qua dấu phẩy trong ngoặc)."""
+    parts, depth, current = [], 0, ''
+    for ch in text:
+        if ch == ',' and depth == 0:
+            parts.append(current)
+            current = ''
+            continue
+        depth += ch == '('
+        depth -= ch == ')'
+        current += ch
+    if current:
+        parts.append(current)
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _parse_select(select: str) -> List[Dict]:
+    """'id,name:job_name,user:users(*)' -> [{alias, column} | {alias, embed, select}]"""
+    fields = []
+    for part in _split_top(select or '*'):
+        alias = None
+        match = re.match(r'^(\w+):(?!:)(.*)$', part)
+        if match:
+            alias, part = match.group(1), match.group(2)
+        embed = re.match(r'^(\w+)(?:!\w+)?\((.*)\)$', part)
+        if embed:
+            fields.append({'alias': alias or embed.group(1), 'embed': embed.group(1),
+                           'select': _parse_select(embed.group(2))})
+        else:
+            column = part.split('::')[0]
+            fields.append({'alias': alias or column, 'column': column})
+    return fields
+
+
+def _coerce(value: str):
+    if value == 'true':
+        return 1
+    if value == 'false':
+        return 0
+    return value
+
+
+class PostgrestStub:
+    """Server PostgREST giả lập, một database SQLite in-memory cho mỗi instance."""
+
+    def __init__(self):
+        self.conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        for statement in tenant_db.SCHEMA + EXTRA_SCHEMA:
+            self.conn.execute(statement)
+        self.lock = threading.Lock()
+        self.rpc: Dict[str, Callable] = {}
+        self.server = None
+        self.url = None
+        self.set_faults()
+        self.reset_counters()
+
+    # ---------- vòng đời ----------
+
+    def start(self) -> "PostgrestStub":
+        stub = self
+
+        class Handler(_Handler):
+            pass
+        Handler.stub = stub
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def connect_supabase_db(self) -> None:
+        """Trỏ supabase_db (và db_wrapper) tới stub qua biến môi trường."""
+        import supabase_db
+        os.environ['SUPABASE_URL'] = self.url
+        os.environ['SUPABASE_KEY'] = 'stub-key'
+        supabase_db._cached_client = None
+        supabase_db._client_initialized = False
+        try:
+            import db_wrapper
+            db_wrapper._supabase_available = None
+        except ImportError:
+            pass
+
+    def install_aggregate_rpcs(self) -> "PostgrestStub":
+        """
+        Đăng ký RPC của supabase/migrations/*_aggregate_rpcs.sql, *_shift_counts_rpc.sql
+        (bản SQLite trong tenant_db).
+        """
+        self.rpc['daily_summaries'] = lambda conn, p_user_id, p_start, p_end: \
+            tenant_db.query_daily_aggregates(conn, p_user_id, p_start, p_end)
+        self.rpc['payroll_aggregates'] = lambda conn, p_user_id, p_start, p_end: \
+            tenant_db.query_payroll_aggregates(conn, p_user_id, p_start, p_end)
+        self.rpc['shift_counts_by_job'] = lambda conn, p_user_id: [
+            {'job_id': job_id, 'shift_count': count} for job_id, count in conn.execute(
+                "SELECT job_id, COUNT(*) FROM work_shifts WHERE user_id = ? GROUP BY job_id", (p_user_id,))
+        ]
+        return self
+
+    def install_mirror_rpcs(self) -> "PostgrestStub":
+        """Như supabase/migrations/*_mirror_changes.sql: cột updated_at (trigger) và RPC mirror_changes."""
+        import cloud_mirror
+        stamp = "strftime('%Y-%m-%dT%H:%M:%f', 'now')"
+        with self.lock:
+            for table in cloud_mirror.MIRROR_KEYS:
+                if 'updated_at' not in self._columns(table):
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN updated_at TEXT")
+                for event in ('INSERT', 'UPDATE'):
+                    self.conn.execute(f"""
+                        CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_stamp AFTER {event} ON {table}
+                        BEGIN UPDATE {table} SET updated_at = {stamp} WHERE rowid = NEW.rowid; END
+                    """)
+            self.conn.commit()
+        self.rpc['mirror_changes'] = self._mirror_changes
+        return self
+
+    def install_client_refs(self) -> "PostgrestStub":
+        """Như supabase/migrations/*_outbox_client_ref.sql: cột client_ref (unique) cho insert của outbox."""
+        with self.lock:
+            for table in ('work_shifts', 'shift_presets'):
+                if 'client_ref' not in self._columns(table):
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN client_ref TEXT")
+                self.conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{table}_client_ref ON {table} (client_ref)")
+            self.conn.commit()
+        return self
+
+    def _mirror_changes(self, conn, p_user_id, p_since, p_shifts_from) -> Dict:
+        import cloud_mirror
+        tables, keys = {}, {}
+        everything = [{'alias': None, 'column': '*'}]
+        for table, key_columns in cloud_mirror.MIRROR_KEYS.items():
+            where, params = " WHERE user_id = ?", [p_user_id]
+            if table == 'work_shifts':
+                where += " AND work_date >= ?"
+                params.append(p_shifts_from)
+            changed = (" AND updated_at > ?", [p_since]) if p_since else ("", [])
+            rows = conn.execute(f"SELECT * FROM {table}{where}{changed[0]}", params + changed[1]).fetchall()
+            hidden = {'user_id', 'id'} if table == 'job_rates' else {'user_id'}
+            tables[table] = [{k: v for k, v in self._shape(table, row, everything).items() if k not in hidden}
+                             for row in rows]
+            found = conn.execute(f"SELECT {', '.join(key_columns)} FROM {table}{where}", params).fetchall()
+            keys[table] = [row[0] if len(key_columns) == 1 else list(row) for row in found]
+        return {
+            'server_time': conn.execute("SELECT strftime('%Y-%m-%dT%H:%M:%f', 'now')").fetchone()[0],
+            'oldest_shift': conn.execute("SELECT MIN(work_date) FROM work_shifts WHERE user_id = ?",
+                                         (p_user_id,)).fetchone()[0],
+            'tables': tables,
+            'keys': keys,
+        }
+
+    # ---------- mạng chập chờn ----------
+
+    def set_faults(self, latency: float = 0.0, error_rate: float = 0.0, drop_rate: float = 0.0,
+                   reset_rate: float = 0.0, hang_rate: float = 0.0, hang_seconds: float = 30.0,
+                   seed: int = 0) -> "PostgrestStub":
+        """
+        Lỗi giả lập cho mỗi request:
+            latency: giây chờ trước khi xử lý
+            error_rate: tỉ lệ trả 503 (PGRST001) mà không xử lý
+            drop_rate: tỉ lệ xử lý xong rồi cắt kết nối không trả response
+            reset_rate: tỉ lệ reset kết nối (RST) mà không xử lý
+            hang_rate: tỉ lệ treo hang_seconds giây rồi cắt kết nối, không xử lý
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.reset_rate = reset_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self._faults = random.Random(seed)
+        return self
+
+    def _draw_fault(self) -> Optional[str]:
+        with self.lock:
+            roll = self._faults.random()
+        for fault, rate in (('error', self.error_rate), ('drop', self.drop_rate),
+                            ('reset', self.reset_rate), ('hang', self.hang_rate)):
+            if roll < rate:
+                return fault
+            roll -= rate
+        return None
+
+    # ---------- bộ đếm ----------
+
+    def reset_counters(self) -> None:
+        self.connections = 0        # kết nối TCP đã nhận
+        self.calls = Counter()      # (method, bảng) -> số request
+        self.log = []               # (method, bảng, status, bytes_in, bytes_out)
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def requests(self) -> int:
+        return sum(self.calls.values())
+
+    def _record(self, method: str, target: str, status: int, bytes_in: int, bytes_out: int) -> None:
+        with self.lock:
+            self.calls[(method, target)] += 1
+            self.log.append((method, target, status, bytes_in, bytes_out))
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    # ---------- SQL ----------
+
+    def _columns(self, table: str) -> List[str]:
+        columns = [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+        if not columns:
+            raise StubError(404, '42P01', f'relation "{table}" does not exist')
+        return columns
+
+    def _pk(self, table: str) -> List[str]:
+        rows = sorted((row[5], row[1]) for row in self.conn.execute(f"PRAGMA table_info({table})") if row[5])
+        return [name for _, name in rows]
+
+    def _where(self, table: str, params: List[tuple]) -> tuple:
+        columns = set(self._columns(table))
+        clauses, values = [], []
+        for key, raw in params:
+            if key in _RESERVED_PARAMS:
+                continue
+            if key not in columns:
+                raise StubError(400, '42703', f'column {table}.{key} does not exist')
+            negate = raw.startswith('not.')
+            if negate:
+                raw = raw[4:]
+            op, _, value = raw.partition('.')
+            if op == 'in':
+                items = [v.strip().strip('"') for v in value.strip('()').split(',') if v.strip()]
+                clause = f"{key} IN ({', '.join('?' * len(items))})" if items else "0"
+                values.extend(_coerce(v) for v in items)
+            elif op == 'is':
+                clause = f"{key} IS {'NULL' if value == 'null' else value.upper()}"
+            elif op in _FILTER_OPS:
+                if op in ('like', 'ilike'):
+                    value = value.replace('*', '%')
+                clause = f"{key} {_FILTER_OPS[op]} ?"
+                values.append(_coerce(value))
+            else:
+                raise StubError(400, 'PGRST100', f'unsupported operator {op}')
+            clauses.append(f"NOT ({clause})" if negate else clause)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", values
+
+    def _order(self, table: str, order: Optional[str]) -> str:
+        if not order:
+            return ""
+        columns = set(self._columns(table))
+        terms = []
+        for term in order.split(','):
+            parts = term.split('.')
+            if parts[0] not in columns:
+                raise StubError(400, '42703', f'column {table}.{parts[0]} does not exist')
+            direction = 'DESC' if 'desc' in parts[1:] else 'ASC'
+            nulls = ' NULLS FIRST' if 'nullsfirst' in parts[1:] else (' NULLS LAST' if 'nullslast' in parts[1:] else '')
+            terms.append(f"{parts[0]} {direction}{nulls}")
+        return " ORDER BY " + ", ".join(terms)
+
+    def _shape(self, table: str, row: sqlite3.Row, fields: List[Dict]) -> Dict:
+        data = dict(row)
+        for column in JSON_COLUMNS & data.keys():
+            if isinstance(data[column], str):
+                data[column] = json.loads(data[column])
+        out = {}
+        for field in fields:
+            if 'embed' in field:
+                target = field['embed']
+                fk = target[:-1] + '_id' if target.endswith('s') else target + '_id'
+                child = self.conn.execute(f"SELECT * FROM {target} WHERE id = ?", (data.get(fk),)).fetchone()
+                out[field['alias']] = self._shape(target, child, field['select']) if child else None
+            elif field['column'] == '*':
+                out.update(data)
+            else:
+                if field['column'] not in data:
+                    raise StubError(400, '42703', f"column {table}.{field['column']} does not exist")
+                out[field['alias']] = data[field['column']]
+        return out
+
+    def select(self, table: str, params: List[tuple]) -> tuple:
+        query = dict(params)
+        where, values = self._where(table, params)
+        total = self.conn.execute(f"SELECT COUNT(*) FROM {table}{where}", values).fetchone()[0]
+        sql = f"SELECT * FROM {table}{where}{self._order(table, query.get('order'))}"
+        if 'limit' in query:
+            sql += f" LIMIT {int(query['limit'])} OFFSET {int(query.get('offset', 0))}"
+        rows = self.conn.execute(sql, values).fetchall()
+        fields = _parse_select(query.get('select'))
+        return [self._shape(table, row, fields) for row in rows], total
+
+    def _encode(self, value):
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, ensure_ascii=False)
+        if isinstance(value, bool):
+            return int(value)
+        return value
+
+    def insert(self, table: str, params: List[tuple], body, prefer: str) -> List[Dict]:
+        rows = body if isinstance(body, list) else [body]
+        if not rows:
+            return []
+        query = dict(params)
+        table_columns = self._columns(table)
+        columns = [c for c in table_columns if any(c in row for row in rows)]
+        unknown = {k for row in rows for k in row} - set(table_columns)
+        if unknown:
+            raise StubError(400, 'PGRST204', f"column(s) {sorted(unknown)} not found in {table}")
+
+        conflict = ""
+        if 'resolution=' in prefer:
+            target = query.get('on_conflict', '').split(',') if query.get('on_conflict') else self._pk(table)
+            target = [t.strip().strip('"') for t in target if t.strip()]
+            updates = [c for c in columns if c not in target]
+            if 'ignore-duplicates' in prefer or not updates:
+                conflict = f" ON CONFLICT ({', '.join(target)}) DO NOTHING"
+            else:
+                conflict = f" ON CONFLICT ({', '.join(target)}) DO UPDATE SET " + \
+                    ", ".join(f"{c} = excluded.{c}" for c in updates)
+        returned = []
+        try:
+            for row in rows:
+                # Cột không có trong row dùng DEFAULT của bảng
+                present = [c for c in columns if c in row]
+                sql = (f"INSERT INTO {table} ({', '.join(present)}) VALUES ({', '.join('?' * len(present))})"
+                       f"{conflict} RETURNING *")
+                returned.extend(self.conn.execute(sql, [self._encode(row[c]) for c in present]).fetchall())
+            self.conn.commit()
+        except sqlite3.IntegrityError as e:
+            self.conn.rollback()
+            raise StubError(409, '23505', str(e))
+        fields = _parse_select(query.get('select'))
+        return [self._shape(table, row, fields) for row in returned]
+
+    def update(self, table: str, params: List[tuple], body: Dict) -> List[Dict]:
+        where, values = self._where(table, params)
+        columns = list(body)
+        unknown = set(columns) - set(self._columns(table))
+        if unknown:
+            raise StubError(400, 'PGRST204', f"column(s) {sorted(unknown)} not found in {table}")
+        rows = self.conn.execute(
+            f"UPDATE {table} SET {', '.join(f'{c} = ?' for c in columns)}{where} RETURNING *",
+            [self._encode(body[c]) for c in columns] + values).fetchall()
+        self.conn.commit()
+        fields = _parse_select(dict(params).get('select'))
+        return [self._shape(table, row, fields) for row in rows]
+
+    def delete(self, table: str, params: List[tuple]) -> List[Dict]:
+        where, values = self._where(table, params)
+        rows = self.conn.execute(f"DELETE FROM {table}{where} RETURNING *", values).fetchall()
+        self.conn.commit()
+        fields = _parse_select(dict(params).get('select'))
+        return [self._shape(table, row, fields) for row in rows]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    stub: PostgrestStub = None
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True   # header và body gửi riêng: không chờ delayed ACK
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.stub.lock:
+            self.stub.connections += 1
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionError:
+            pass   # client đóng / reset kết nối (timeout, thử lại)
+
+    def _abort(self) -> None:
+        """Đóng kết nối bằng RST (SO_LINGER 0) thay vì FIN."""
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        self.close_connection = True
+
+    def _handle(self, method: str) -> None:
+        url = urlsplit(self.path)
+        params = parse_qsl(url.query, keep_blank_values=True)
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        prefer = self.headers.get('Prefer', '')
+        path = url.path.rstrip('/')
+        status, headers, payload = 200, {}, None
+        target = path
+        fault = self.stub._draw_fault()
+        if self.stub.latency:
+            time.sleep(self.stub.latency)
+        if fault in ('reset', 'hang'):
+            if fault == 'hang':
+                time.sleep(self.stub.hang_seconds)
+            self.stub._record(method, path, 0, len(raw), 0)
+            self._abort()
+            return
+
+        try:
+            if fault == 'error':
+                raise StubError(503, 'PGRST001', 'database connection error (giả lập)')
+            if not path.startswith('/rest/v1/'):
+                raise StubError(404, 'PGRST000', f'unknown path {path}')
+            target = path[len('/rest/v1/'):]
+            body = json.loads(raw) if raw else None
+            with self.stub.lock:
+                if target.startswith('rpc/'):
+                    name = target[4:]
+                    if name not in self.stub.rpc:
+                        raise StubError(404, 'PGRST202', f'function {name} not found')
+                    args = body if body is not None else {k: v for k, v in params}
+                    payload = self.stub.rpc[name](self.stub.conn, **(args or {}))
+                elif method in ('GET', 'HEAD'):
+                    payload, total = self.stub.select(target, params)
+                    if 'count=' in prefer:
+                        end = len(payload) - 1
+                        headers['Content-Range'] = f"0-{end}/{total}" if payload else f"*/{total}"
+                elif method == 'POST':
+                    payload = self.stub.insert(target, params, body, prefer)
+                    status = 201
+                elif method == 'PATCH':
+                    payload = self.stub.update(target, params, body or {})
+                elif method == 'DELETE':
+                    payload = self.stub.delete(target, params)
+                else:
+                    raise StubError(405, 'PGRST000', f'method {method} not allowed')
+
+            if method in ('POST', 'PATCH', 'DELETE') and not target.startswith('rpc/') \
+                    and 'return=representation' not in prefer:
+                payload = None
+                status = 201 if method == 'POST' else 204
+            elif 'application/vnd.pgrst.object+json' in self.headers.get('Accept', ''):
+                if len(payload) != 1:
+                    raise StubError(406, 'PGRST116', f'JSON object requested, {len(payload)} rows returned')
+                payload = payload[0]
+        except StubError as e:
+            status, payload = e.status, {'code': e.code, 'message': str(e), 'details': None, 'hint': None}
+        except (sqlite3.Error, ValueError, TypeError) as e:
+            status, payload = 400, {'code': 'PGRST000', 'message': str(e), 'details': None, 'hint': None}
+
+        data = b'' if payload is None else json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        if fault == 'drop':
+            # Đã xử lý (và commit) nhưng client không nhận được response
+            self.stub._record(method, target, 0, len(raw), 0)
+            self.close_connection = True
+            return
+        # Ghi nhận trước khi trả response: client có thể đọc counters ngay khi nhận xong
+        self.stub._record(method, target, status, len(raw), len(data) if method != 'HEAD' else 0)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        if method != 'HEAD':
+            self.wfile.write(data)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_HEAD(self):
+        self._handle('HEAD')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
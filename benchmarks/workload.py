@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Sinh dữ liệu giả giống user thật cho benchmark (database SQLite riêng của user,
+như DB_LAYOUT per_user):
+  - 2-4 công việc, lương giờ tăng hằng năm (lịch sử lương job_rates)
+  - 1-3 ca mỗi ngày làm, có ca qua đêm (22:00 - 06:00, 17:00 - 02:00), ngày
+    nghỉ cuối tuần / nghỉ phép; giờ làm và OT tính bằng calculations.calculate_full
+  - ngày lễ cố định mỗi năm, vài ngày nghỉ riêng; phần lớn ngày lễ không đi làm
+  - khung giờ mẫu thêm vào bộ mặc định, cài đặt lương (OT, ca đêm, ngày lễ)
+Cùng seed thì cùng dữ liệu. Ca được ghi theo lô (executemany) cho nhanh;
+công việc, lương, khung giờ mẫu và cài đặt đi qua API của database.py.
+
+Chạy: python benchmarks/workload.py --years 5 --users 3 --out /tmp/workload
+(mỗi user một file user_<i>.db trong thư mục --out)
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+from datetime import date, timedelta
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import calculations as calc  # noqa: E402
+import database  # noqa: E402
+import tenant_context  # noqa: E402
+
+JOB_NAMES = ('Kombini', 'Nhà hàng', 'Kho hàng', 'Khách sạn', 'Gia sư')
+JOB_COLORS = ('#667eea', '#f5576c', '#43e97b', '#fa709a', '#30cfd0')
+
+# Các kiểu ngày làm: danh sách ca (bắt đầu, kết thúc, giờ nghỉ), không chồng nhau
+ONE_SHIFT = [
+    [('08:00', '17:00', 1.0)],
+    [('09:00', '18:00', 1.0)],
+    [('13:00', '21:00', 0.5)],
+    [('22:00', '06:00', 1.0)],   # qua đêm
+    [('17:00', '02:00', 1.0)],   # qua đêm
+]
+TWO_SHIFTS = [
+    [('06:00', '11:00', 0.0), ('17:00', '22:00', 0.0)],
+    [('08:00', '16:00', 1.0), ('18:00', '23:00', 0.0)],
+    [('09:00', '14:00', 0.0), ('22:00', '06:00', 0.5)],
+]
+THREE_SHIFTS = [
+    [('06:00', '10:00', 0.0), ('11:00', '15:00', 0.5), ('18:00', '00:00', 0.0)],
+    [('07:00', '11:00', 0.0), ('13:00', '17:00', 0.0), ('22:00', '04:00', 0.0)],
+]
+
+# Ngày lễ cố định (tháng, ngày, mô tả)
+FIXED_HOLIDAYS = ((1, 1, 'Tết Dương lịch'), (4, 30, 'Giải phóng miền Nam'),
+                  (5, 1, 'Quốc tế Lao động'), (9, 2, 'Quốc khánh'))
+
+PRESETS = (('Ca đêm 22h', '22:00', '06:00', 1.0, 7.0, '🌙'),
+           ('Ca gãy sáng', '06:00', '11:00', 0.0, 5.0, '🌅'),
+           ('Ca chiều', '13:00', '21:00', 0.5, 7.5, '🌇'))
+
+NOTES = ('', '', '', '', 'đổi ca', 'tăng ca', 'kiểm kho', 'thay bạn')
+
+
+def _day_pattern(rng: random.Random, day: date) -> List[tuple]:
+    """Các ca của một ngày (rỗng: ngày nghỉ)."""
+    if day.weekday() >= 5 and rng.random() < 0.6:
+        return []
+    if rng.random() < 0.05:   # nghỉ phép / ốm
+        return []
+    roll = rng.random()
+    if roll < 0.6:
+        return rng.choice(ONE_SHIFT)
+    if roll < 0.9:
+        return rng.choice(TWO_SHIFTS)
+    return rng.choice(THREE_SHIFTS)
+
+
+def generate_user(db_path: str, years: int, seed: int = 0, end: date = None) -> Dict:
+    """
+    Tạo database của một user với years năm dữ liệu kết thúc ở end (mặc định hôm nay).
+
+    Returns:
+        Tóm tắt: khoảng ngày, số công việc / ca / ca qua đêm / ngày lễ / mốc lương
+    """
+    rng = random.Random(seed)
+    end = end or date.today()
+    start = date(end.year - years, end.month, 1)
+    standard_hours = 8.0
+
+    with tenant_context.use_tenant(db_path=db_path):
+        database.init_database()
+        for key, value in (('standard_hours', standard_hours), ('ot_rate', 1.25),
+                           ('night_rate', 1.3), ('holiday_rate', 2.0)):
+            database.update_setting(key, str(value))
+        for name, preset_start, preset_end, break_hours, total_hours, emoji in PRESETS:
+            database.add_preset(name, preset_start, preset_end, break_hours, total_hours, emoji=emoji)
+
+        # Công việc và lịch sử lương: tăng lương mỗi năm (ngày ngẫu nhiên trong tháng 4)
+        job_ids = []
+        rate_changes = 0
+        for i in range(rng.randint(2, 4)):
+            rate = float(rng.randrange(20_000, 40_000, 1_000))
+            job_id = database.add_job(JOB_NAMES[i], rate, color=JOB_COLORS[i])
+            for year in range(start.year + 1, end.year + 1):
+                rate += rng.randrange(1_000, 4_000, 500)
+                database.update_job(job_id, JOB_NAMES[i], rate, color=JOB_COLORS[i],
+                                    effective_from=date(year, 4, rng.randint(1, 28)))
+                rate_changes += 1
+            job_ids.append(job_id)
+        # Công việc mặc định của init_database vẫn có lương, phần lớn ca thuộc công việc mới
+        job_weights = [1] * (len(database.get_all_jobs()) - len(job_ids)) + [6] * len(job_ids)
+        all_job_ids = [job['id'] for job in database.get_all_jobs() if job['id'] not in job_ids] + job_ids
+
+    holidays = {}
+    for year in range(start.year, end.year + 1):
+        for month, day, description in FIXED_HOLIDAYS:
+            holidays[date(year, month, day)] = description
+        for _ in range(rng.randint(2, 6)):
+            holidays[date(year, rng.randint(1, 12), rng.randint(1, 28))] = 'Nghỉ riêng'
+    holidays = {day: description for day, description in holidays.items() if start <= day <= end}
+
+    shifts = []
+    overnight = 0
+    day = start
+    while day <= end:
+        pattern = [] if day in holidays and rng.random() < 0.7 else _day_pattern(rng, day)
+        for index, (shift_start, shift_end, break_hours) in enumerate(pattern, start=1):
+            result = calc.calculate_full(shift_start, shift_end, break_hours, standard_hours)
+            overnight += shift_end <= shift_start
+            shifts.append((day.isoformat(), f'Ca {index}', rng.choices(all_job_ids, job_weights)[0],
+                           shift_start, shift_end, break_hours, result['total_hours'],
+                           result['overtime_hours'], rng.choice(NOTES)))
+        day += timedelta(days=1)
+
+    conn = sqlite3.connect(db_path)
+    conn.executemany("""
+        INSERT INTO work_shifts (work_date, shift_name, job_id, start_time, end_time, break_hours,
+                                 total_hours, overtime_hours, notes)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, shifts)
+    conn.executemany("INSERT OR REPLACE INTO holidays (holiday_date, description) VALUES (?, ?)",
+                     [(day.isoformat(), description) for day, description in sorted(holidays.items())])
+    conn.commit()
+    conn.close()
+    database.clear_cache()
+
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'years': years,
+        'jobs': len(all_job_ids),
+        'rate_changes': rate_changes,
+        'shifts': len(shifts),
+        'overnight_shifts': overnight,
+        'holidays': len(holidays),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', type=int, default=5, choices=range(1, 11), metavar='1-10')
+    parser.add_argument('--users', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', required=True, help='thư mục chứa các file database')
+    args = parser.parse_args()
+
+    database.ENABLE_SYNC = False
+    os.makedirs(args.out, exist_ok=True)
+    for i in range(args.users):
+        db_path = os.path.join(args.out, f'user_{i}.db')
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        summary = generate_user(db_path, args.years, seed=args.seed + i)
+        print(f"{db_path}: {summary['shifts']:,} ca ({summary['overnight_shifts']:,} qua đêm), "
+              f"{summary['jobs']} công việc, {summary['rate_changes']} lần đổi lương, "
+              f"{summary['holidays']} ngày lễ, {summary['start']} → {summary['end']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,11 @@ Bao gồm các hàm validate và xử lý thời gian.
 """
 
 from datetime import datetime, time, date, timedelta
-from typing import Tuple, Optional, Dict, List
-import pandas as pd
+from typing import TYPE_CHECKING, Tuple, Optional, Dict, List, Union
+
+# pandas chỉ cần cho generate_report -> import khi dùng (giảm thời gian khởi động)
+if TYPE_CHECKING:
+    import pandas as pd
 
 # Constants (Avoiding magic numbers)
 DEFAULT_STANDARD_HOURS = 8.0
@@ -197,18 +200,19 @@ def format_hours(hours: float) -> str:
     return f"{h} giờ {m} phút"
 
 
-def generate_report(work_logs: List[Dict], standard_hours: float = DEFAULT_STANDARD_HOURS) -> Dict:
+def generate_report(work_logs: Union[List[Dict], "pd.DataFrame"], standard_hours: float = DEFAULT_STANDARD_HOURS) -> Dict:
     """
     Tạo báo cáo từ danh sách giờ làm.
     
     Args:
-        work_logs: Danh sách dict chứa thông tin giờ làm
+        work_logs: Danh sách dict chứa thông tin giờ làm, hoặc DataFrame theo ngày
+                   (report_data.daily_frame) để không phải tạo lại DataFrame
         standard_hours: Giờ làm chuẩn
     
     Returns:
         Dict chứa thống kê báo cáo
     """
-    if not work_logs:
+    if len(work_logs) == 0:
         return {
             "total_days": 0,
             "total_hours": 0.0,
@@ -219,7 +223,9 @@ def generate_report(work_logs: List[Dict], standard_hours: float = DEFAULT_STAND
             "max_overtime_hours": 0.0
         }
     
-    df = pd.DataFrame(work_logs)
+    import pandas as pd
+    
+    df = work_logs if isinstance(work_logs, pd.DataFrame) else pd.DataFrame(work_logs)
     
     # Ensure columns exist to avoid KeyError
     if 'total_hours' not in df.columns:
@@ -238,6 +244,8 @@ def generate_report(work_logs: List[Dict], standard_hours: float = DEFAULT_STAND
     # Check if there is any overtime at all
     if df.loc[max_idx, 'overtime_hours'] > 0:
         max_overtime_day = df.loc[max_idx, 'work_date']
+        if isinstance(max_overtime_day, pd.Timestamp):
+            max_overtime_day = max_overtime_day.date().isoformat()
         max_overtime_hours = df['overtime_hours'].max()
     else:
         max_overtime_day = None
@@ -245,12 +253,12 @@ def generate_report(work_logs: List[Dict], standard_hours: float = DEFAULT_STAND
     
     return {
         "total_days": total_days,
-        "total_hours": round(total_hours, 2),
-        "total_overtime": round(total_overtime, 2),
-        "average_hours": round(average_hours, 2),
+        "total_hours": round(float(total_hours), 2),
+        "total_overtime": round(float(total_overtime), 2),
+        "average_hours": round(float(average_hours), 2),
         "days_with_overtime": days_with_overtime,
         "max_overtime_day": max_overtime_day,
-        "max_overtime_hours": round(max_overtime_hours, 2)
+        "max_overtime_hours": round(float(max_overtime_hours), 2)
     }
 
 
@@ -0,0 +1,920 @@
+# -*- coding: utf-8 -*-
+"""
+Bản sao đọc SQLite cục bộ cho chế độ cloud (Supabase), mỗi user một file.
+
+Lần đầu dùng trong process (ngay sau đăng nhập: db_wrapper.init_database) bản sao
+được nạp bằng một request (RPC mirror_changes): jobs, lịch sử lương, khung giờ,
+cài đặt, ngày lễ, snapshot và ca làm việc WINDOW_MONTHS tháng gần đây. Sau đó
+mọi lần đọc chạy trên SQLite local; cứ REFRESH_SECONDS giây một thread nền tải
+phần thay đổi (theo updated_at) cùng danh sách khóa để nhận ra dòng đã xóa.
+Ghi: vào bản sao và outbox trong cùng transaction rồi trả về ngay (đọc thấy
+ngay, không chờ mạng); cloud_outbox đẩy lên Supabase ở nền. Khi outbox còn
+thao tác chưa gửi, bản local mới hơn server nên không làm mới; file bản sao vì
+vậy chỉ xóa được khi outbox đã trống.
+
+Cùng API với supabase_db; db_wrapper dùng module này khi CLOUD_MIRROR bật
+(mặc định). Khoảng ca làm việc ngoài cửa sổ, bản sao chưa nạp được hoặc lỗi
+SQLite thì đọc thẳng Supabase như trước.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import cloud_outbox
+import payroll
+import ref_cache
+import supabase_db
+import tenant_db
+
+# Thư mục chứa bản sao (user_<id>.db, kèm outbox các lần ghi chưa gửi lên Supabase)
+MIRROR_DIR = os.environ.get(
+    "CLOUD_MIRROR_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "user_data", "mirror")
+)
+
+# Số tháng ca làm việc giữ trong bản sao (tính cả tháng hiện tại)
+WINDOW_MONTHS = int(os.environ.get("CLOUD_MIRROR_MONTHS", "14"))
+
+# Khoảng cách tối thiểu giữa hai lần tải phần thay đổi (giây)
+REFRESH_SECONDS = float(os.environ.get("CLOUD_MIRROR_REFRESH_SECONDS", "30"))
+
+# Lùi mốc updated_at khi hỏi phần thay đổi: dòng của transaction commit muộn hơn
+# now() của nó vẫn được lấy ở lần sau (tải lại vài dòng trùng không sao)
+WATERMARK_OVERLAP = timedelta(minutes=2)
+
+# Khóa nhận diện dòng của từng bảng, khớp keys của RPC mirror_changes
+# (dòng local không còn trong danh sách khóa của server bị xóa)
+MIRROR_KEYS = {
+    'jobs': ('id',),
+    'job_rates': ('job_id', 'effective_from'),
+    'work_shifts': ('id',),
+    'shift_presets': ('id',),
+    'holidays': ('holiday_date',),
+    'settings': ('key',),
+    'payroll_snapshots': ('year', 'month'),
+}
+
+# Cột khi tải toàn bộ (project chưa áp dụng migration mirror_changes)
+_PULL_COLUMNS = {
+    'jobs': supabase_db.JOB_COLUMNS,
+    'job_rates': 'job_id,effective_from,hourly_rate',
+    'work_shifts': supabase_db.SHIFT_COLUMNS,
+    'shift_presets': supabase_db.PRESET_COLUMNS,
+    'holidays': supabase_db.HOLIDAY_COLUMNS,
+    'settings': 'key,value',
+    'payroll_snapshots': supabase_db.SNAPSHOT_COLUMNS,
+}
+
+# Bảng có thể chưa được tạo trên project cũ (supabase_db cũng coi là rỗng)
+_OPTIONAL_TABLES = {'job_rates', 'payroll_snapshots'}
+_MISSING_TABLE_CODES = ('42P01', 'PGRST205')
+
+_META_SCHEMA = "CREATE TABLE IF NOT EXISTS mirror_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+
+# Bật/tắt (cache sau lần đọc cấu hình đầu tiên)
+_enabled = None
+
+# RPC mirror_changes chưa có trên project -> tải toàn bộ từng bảng
+_rpc_missing = False
+
+
+def is_enabled() -> bool:
+    """CLOUD_MIRROR trong secrets, rồi biến môi trường; mặc định bật."""
+    global _enabled
+    if _enabled is not None:
+        return _enabled
+
+    value = None
+    try:
+        import streamlit as st
+        if "CLOUD_MIRROR" in st.secrets:
+            value = str(st.secrets["CLOUD_MIRROR"])
+    except Exception:
+        pass
+    value = (value or os.environ.get("CLOUD_MIRROR", "1")).strip().lower()
+    _enabled = value not in ('0', 'false', 'off', 'no')
+    return _enabled
+
+
+def mirror_path(user_id: int) -> str:
+    """File bản sao của user."""
+    return os.path.join(MIRROR_DIR, f"user_{user_id}.db")
+
+
+def _window_start() -> str:
+    """Ngày đầu của cửa sổ ca làm việc (đầu tháng, WINDOW_MONTHS tháng tính cả tháng này)."""
+    today = date.today()
+    year, month = payroll.months_back(today.year, today.month, WINDOW_MONTHS)[0]
+    return date(year, month, 1).isoformat()
+
+
+def _key(value) -> tuple:
+    """Khóa từ JSON (giá trị đơn hoặc mảng) -> tuple để so với dòng SQLite."""
+    return tuple(value) if isinstance(value, list) else (value,)
+
+
+# ==================== TẢI TỪ SUPABASE ====================
+
+def fetch_changes(user_id: int, since: Optional[str], shifts_from: str) -> Optional[Dict]:
+    """
+    Các dòng thay đổi sau since (None: toàn bộ) và khóa hiện có của từng bảng.
+
+    Returns:
+        {'server_time', 'oldest_shift', 'tables': {bảng: [dòng]}, 'keys': {bảng: [khóa]}}
+        hoặc None nếu lỗi (bản sao giữ nguyên)
+    """
+    global _rpc_missing
+    client = supabase_db.get_supabase_client()
+    if not client:
+        return None
+
+    if not _rpc_missing:
+        try:
+            return client.rpc('mirror_changes', {
+                'p_user_id': user_id,
+                'p_since': since,
+                'p_shifts_from': shifts_from,
+            }).execute().data
+        except Exception as e:
+            if getattr(e, 'code', None) not in ('PGRST202', '42883'):
+                print(f"Error calling mirror_changes: {e}")
+                return None
+            _rpc_missing = True
+
+    try:
+        return _pull_all(client, user_id, shifts_from)
+    except Exception as e:
+        print(f"Error pulling mirror tables: {e}")
+        return None
+
+
+def _pull_all(client, user_id: int, shifts_from: str) -> Dict:
+    """Tải toàn bộ từng bảng (mỗi bảng một request), cùng dạng với mirror_changes."""
+    tables = {}
+    for table, columns in _PULL_COLUMNS.items():
+        query = client.table(table).select(columns).eq('user_id', user_id)
+        if table == 'work_shifts':
+            query = query.gte('work_date', shifts_from)
+        try:
+            tables[table] = query.execute().data or []
+        except Exception as e:
+            if table not in _OPTIONAL_TABLES or getattr(e, 'code', None) not in _MISSING_TABLE_CODES:
+                raise
+            tables[table] = []
+
+    oldest = client.table('work_shifts').select('work_date').eq('user_id', user_id) \
+        .order('work_date').limit(1).execute().data
+    return {
+        'server_time': None,
+        'oldest_shift': oldest[0]['work_date'] if oldest else None,
+        'tables': tables,
+        'keys': {
+            table: [[row[column] for column in MIRROR_KEYS[table]] for row in rows]
+            for table, rows in tables.items()
+        },
+    }
+
+
+# ==================== BẢN SAO CỦA MỘT USER ====================
+
+class UserMirror:
+    """
+    Bản sao của một user: file SQLite (schema tenant_db + mirror_meta + outbox),
+    mốc đồng bộ và khóa áp dụng thay đổi. Lần làm mới bị bỏ nếu có lần ghi local
+    xen giữa lúc tải (dữ liệu tải về có thể cũ hơn bản sao); mốc không tiến nên
+    lần sau tải lại.
+    """
+
+    def __init__(self, user_id: int, db_path: str):
+        self.user_id = user_id
+        self.db_path = db_path
+        self.meta: Dict[str, str] = {}
+        self.columns: Dict[str, List[str]] = {}
+        self.synced_at: Optional[float] = None     # time.monotonic() lần làm mới thành công gần nhất
+        self.attempted_at: Optional[float] = None  # lần thử làm mới gần nhất (kể cả lỗi)
+        self.write_seq = 0
+        self.full_refresh_due = False              # server từ chối một lần ghi: lần làm mới sau tải toàn bộ
+        self.refresh_after_drain = False           # outbox gửi xong thì làm mới ở nền (cloud_outbox)
+        self.id_map: Dict[int, int] = {}           # id tạm -> id thật (cloud_outbox)
+        self._lock = threading.Lock()              # áp dụng thay đổi (làm mới / ghi local / outbox)
+        self._refresh_lock = threading.Lock()      # mỗi user một lần làm mới tại một thời điểm
+        self._init_schema()
+
+    @contextmanager
+    def connection(self):
+        """Kết nối tới file bản sao (commit nếu khối lệnh thành công)."""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA synchronous=NORMAL")
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _init_schema(self) -> None:
+        with self.connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in tenant_db.SCHEMA + [_META_SCHEMA] + cloud_outbox.SCHEMA:
+                conn.execute(statement)
+            self.meta = {row['key']: row['value'] for row in conn.execute("SELECT key, value FROM mirror_meta")}
+            self.columns = {
+                table: [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+                for table in MIRROR_KEYS
+            }
+            self.id_map = cloud_outbox.load_id_map(conn)
+            pending = cloud_outbox.pending_count(conn)
+        if pending:
+            # Lần chạy trước tắt khi outbox chưa gửi hết
+            cloud_outbox.schedule(self.user_id)
+
+    # ---------- trạng thái ----------
+
+    @property
+    def usable(self) -> bool:
+        """Đã nạp và đã làm mới thành công trong process này (file của lần chạy trước có thể đã cũ)."""
+        return bool(self.meta.get('hydrated_at')) and self.synced_at is not None
+
+    @property
+    def complete(self) -> bool:
+        """Bản sao có toàn bộ ca làm việc (không có ca nào trước cửa sổ)."""
+        oldest = self.meta.get('oldest_shift')
+        return not oldest or oldest >= self.meta.get('window_start', '')
+
+    def covers(self, start_date: date) -> bool:
+        """Ca làm việc từ start_date trở đi có đủ trong bản sao không."""
+        return str(start_date) >= self.meta.get('window_start', '9999') or self.complete
+
+    def invalidate(self) -> None:
+        """Đọc thẳng Supabase cho đến khi làm mới thành công (lần đọc sau thử ngay)."""
+        self.synced_at = None
+        self.attempted_at = None
+
+    def expire(self) -> None:
+        """Lần đọc sau làm mới ở nền (bản hiện có vẫn dùng được)."""
+        if self.synced_at is not None:
+            self.synced_at = time.monotonic() - REFRESH_SECONDS
+
+    def resync(self) -> None:
+        """Bản local có thể đã lệch server (lần ghi bị từ chối): tải lại toàn bộ."""
+        self.full_refresh_due = True
+        self.invalidate()
+        self.changed()
+
+    def changed(self, *tables: str) -> None:
+        """Dữ liệu của user đổi ngoài các hàm ghi của db_wrapper: hủy cache dùng chung (ref_cache)."""
+        tables = [table for table in (tables or ref_cache.TABLES) if table in ref_cache.TABLES]
+        if tables:
+            ref_cache.invalidate(ref_cache.user_scope(self.user_id), *tables)
+
+    def resolve(self, row_id: Optional[int]) -> Optional[int]:
+        """Id tạm đã được server cấp id thật -> id thật (giao diện có thể còn giữ id tạm)."""
+        return self.id_map.get(row_id, row_id)
+
+    def ensure_fresh(self) -> bool:
+        """
+        Chuẩn bị cho một lần đọc: chưa dùng được thì làm mới ngay (chờ),
+        đã quá REFRESH_SECONDS thì làm mới ở nền và vẫn đọc bản hiện có.
+
+        Returns:
+            True nếu đọc được từ bản sao
+        """
+        now = time.monotonic()
+        if self.usable:
+            if now - self.synced_at >= REFRESH_SECONDS and not self._refresh_lock.locked():
+                threading.Thread(target=self.refresh, kwargs={'blocking': False},
+                                 name=f"cloud-mirror-{self.user_id}", daemon=True).start()
+            return True
+        # Lỗi mạng: không thử lại ở mọi lần đọc, chỉ sau REFRESH_SECONDS
+        if self.attempted_at is None or now - self.attempted_at >= REFRESH_SECONDS:
+            self.refresh(only_if_unusable=True)
+        return self.usable
+
+    # ---------- làm mới ----------
+
+    def refresh(self, full: bool = False, blocking: bool = True, only_if_unusable: bool = False) -> bool:
+        """
+        Tải phần thay đổi (full: toàn bộ) từ Supabase và áp dụng vào bản sao.
+
+        Returns:
+            True nếu bản sao đã khớp server tại thời điểm tải, hoặc outbox còn
+            thao tác chưa gửi (bản local mới hơn server, dùng tiếp bản local)
+        """
+        if not self._refresh_lock.acquire(blocking=blocking):
+            return False
+        try:
+            if only_if_unusable and self.usable:
+                return True  # thread khác vừa làm mới xong
+            self.attempted_at = time.monotonic()
+            seq = self.write_seq
+            hydrated = bool(self.meta.get('hydrated_at'))
+            if hydrated:
+                with self.connection() as conn:
+                    pending = cloud_outbox.pending_count(conn)
+                if pending:
+                    # Đọc tiếp bản local; phần thay đổi của server được tải ở
+                    # lần làm mới theo lịch sau khi outbox gửi xong
+                    self.synced_at = time.monotonic()
+                    return True
+            full = full or self.full_refresh_due
+            since = (self.meta.get('watermark') or None) if hydrated and not full else None
+            window_start = self.meta.get('window_start') or _window_start()
+
+            changes = fetch_changes(self.user_id, since, window_start)
+            if changes is None:
+                return False
+            with self._lock:
+                if self.write_seq != seq:
+                    return False
+                with self.connection() as conn:
+                    changed = self._apply(conn, changes, window_start)
+            self.changed(*changed)
+            if full:
+                self.full_refresh_due = False
+            self.synced_at = time.monotonic()
+            return True
+        except (sqlite3.Error, OSError, KeyError, TypeError, ValueError) as e:
+            print(f"Cloud mirror refresh error: {e}")
+            return False
+        finally:
+            self._refresh_lock.release()
+
+    def _apply(self, conn: sqlite3.Connection, changes: Dict, window_start: str) -> List[str]:
+        """
+        Ghi các dòng thay đổi, xóa dòng không còn trên server, cập nhật mốc (một transaction).
+
+        Returns:
+            Các bảng có dòng được ghi hoặc xóa
+        """
+        tables = changes.get('tables') or {}
+        keys = changes.get('keys') or {}
+        changed = []
+        for table, key_columns in MIRROR_KEYS.items():
+            for row in tables.get(table) or []:
+                self._upsert(conn, table, row)
+            live = {_key(value) for value in keys.get(table) or []}
+            stale = [tuple(row) for row in conn.execute(f"SELECT {', '.join(key_columns)} FROM {table}")
+                     if tuple(row) not in live]
+            if tables.get(table) or stale:
+                changed.append(table)
+            if stale:
+                conn.executemany(
+                    f"DELETE FROM {table} WHERE " + " AND ".join(f"{column} = ?" for column in key_columns),
+                    stale
+                )
+
+        server_time = changes.get('server_time')
+        watermark = ''
+        if server_time:
+            watermark = (datetime.fromisoformat(server_time) - WATERMARK_OVERLAP).isoformat(timespec='milliseconds')
+        self._set_meta(conn, {
+            'watermark': watermark,
+            'window_start': window_start,
+            'oldest_shift': changes.get('oldest_shift') or '',
+            'hydrated_at': datetime.now().isoformat(),
+        })
+        return changed
+
+    def _upsert(self, conn: sqlite3.Connection, table: str, row: Dict) -> None:
+        data = {column: value for column, value in row.items() if column in self.columns[table]}
+        data['user_id'] = self.user_id
+        for column, value in data.items():
+            if isinstance(value, (dict, list)):
+                data[column] = json.dumps(value, ensure_ascii=False)
+        conn.execute(
+            f"INSERT OR REPLACE INTO {table} ({', '.join(data)}) VALUES ({', '.join('?' * len(data))})",
+            tuple(data.values())
+        )
+
+    def _set_meta(self, conn: sqlite3.Connection, values: Dict[str, str]) -> None:
+        conn.executemany("INSERT OR REPLACE INTO mirror_meta (key, value) VALUES (?, ?)", values.items())
+        self.meta.update(values)
+
+    # ---------- ghi ----------
+
+    @contextmanager
+    def local_write(self):
+        """Một transaction ghi vào file bản sao (lần làm mới đang tải dở bị bỏ)."""
+        with self._lock:
+            self.write_seq += 1
+            with self.connection() as conn:
+                yield conn
+
+    def submit(self, op: Dict, apply: Callable[[sqlite3.Connection, Optional[int]], None]) -> Optional[int]:
+        """
+        Ghi vào bản sao và outbox trong cùng transaction (fsync), rồi hẹn gửi ở nền.
+
+        Args:
+            op: Thao tác của cloud_outbox
+            apply: Ghi vào bản sao, nhận (conn, id tạm của dòng mới hoặc None);
+                   bỏ qua khi bản sao chưa nạp (lần làm mới sau sẽ có dữ liệu)
+
+        Returns:
+            Id tạm của dòng mới (insert), None với thao tác khác
+        """
+        with self.local_write() as conn:
+            conn.execute("PRAGMA synchronous=FULL")
+            if self.meta.get('hydrated_at'):
+                provisional = cloud_outbox.enqueue(conn, op)
+                apply(conn, provisional)
+            else:
+                # Bản sao chưa nạp: dòng chỉ có trên server sau khi gửi, làm mới lúc đó
+                provisional = cloud_outbox.enqueue(conn, dict(op, refresh=True))
+        cloud_outbox.schedule(self.user_id)
+        return provisional
+
+    def note_shift_date(self, conn: sqlite3.Connection, work_date: str) -> bool:
+        """Cập nhật ca cũ nhất; True nếu ngày nằm trong cửa sổ (ca được lưu vào bản sao)."""
+        oldest = self.meta.get('oldest_shift')
+        if not oldest or work_date < oldest:
+            self._set_meta(conn, {'oldest_shift': work_date})
+        return work_date >= self.meta.get('window_start', '9999')
+
+
+_mirrors: Dict[int, UserMirror] = {}
+_mirrors_lock = threading.Lock()
+
+
+def get_mirror(user_id: int) -> UserMirror:
+    """Bản sao của user (mở lần đầu khi cần, dùng chung trong process)."""
+    mirror = _mirrors.get(user_id)
+    if mirror is None:
+        with _mirrors_lock:
+            mirror = _mirrors.get(user_id)
+            if mirror is None:
+                os.makedirs(MIRROR_DIR, exist_ok=True)
+                mirror = UserMirror(user_id, mirror_path(user_id))
+                _mirrors[user_id] = mirror
+    return mirror
+
+
+def hydrate(user_id: int) -> bool:
+    """Nạp lại toàn bộ bản sao của user từ Supabase."""
+    return get_mirror(user_id).refresh(full=True)
+
+
+def refresh(user_id: int) -> bool:
+    """Tải phần thay đổi ngay (không chờ REFRESH_SECONDS)."""
+    return get_mirror(user_id).refresh()
+
+
+def reset() -> None:
+    """Quên các bản sao đã mở (file giữ nguyên; lần đọc sau làm mới lại)."""
+    with _mirrors_lock:
+        _mirrors.clear()
+
+
+def _read(user_id: int, remote: Callable, query: Callable[[sqlite3.Connection], object],
+          start_date: Optional[date] = None):
+    """Đọc từ bản sao nếu dùng được (và có đủ ca từ start_date), không thì gọi remote."""
+    try:
+        mirror = get_mirror(user_id)
+        if mirror.ensure_fresh() and (start_date is None or mirror.covers(start_date)):
+            with mirror.connection() as conn:
+                return query(conn)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Cloud mirror read error: {e}")
+        if user_id in _mirrors:
+            _mirrors[user_id].invalidate()
+    return remote()
+
+
+def _rows(sql: str, params: tuple) -> Callable[[sqlite3.Connection], List[Dict]]:
+    return lambda conn: [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+
+def _submit(user_id: int, op: Dict, apply: Callable[[sqlite3.Connection, Optional[int]], None]):
+    """
+    Ghi qua bản sao + outbox của user.
+
+    Returns:
+        Id tạm (insert), True (thao tác khác), hoặc None nếu lỗi SQLite (đĩa đầy,
+        file hỏng): lần ghi không được nhận
+    """
+    try:
+        provisional = get_mirror(user_id).submit(op, apply)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Cloud outbox write error: {e}")
+        return None
+    return True if provisional is None else provisional
+
+
+def _resolve(user_id: int, row_id: Optional[int]) -> Optional[int]:
+    return get_mirror(user_id).resolve(row_id)
+
+
+def resolve_id(user_id: int, row_id: Optional[int]) -> Optional[int]:
+    """Id giao diện đang giữ (có thể là id tạm đã được server cấp id thật) -> id trong bản sao."""
+    return _resolve(user_id, row_id)
+
+
+def get_outbox_status(user_id: int) -> Dict:
+    """Trạng thái gửi (cloud_outbox.get_status) kèm số thao tác chờ gửi / bị từ chối của user."""
+    status = cloud_outbox.get_status()
+    try:
+        with get_mirror(user_id).connection() as conn:
+            status.update(cloud_outbox.counts(conn))
+    except (sqlite3.Error, OSError) as e:
+        print(f"Cloud outbox status error: {e}")
+    return status
+
+
+# ==================== JOBS ====================
+
+def get_all_jobs(user_id: int) -> List[Dict]:
+    """Lấy tất cả công việc của user."""
+    return _read(user_id, lambda: supabase_db.get_all_jobs(user_id), _rows(
+        f"SELECT {supabase_db.JOB_COLUMNS} FROM jobs WHERE user_id = ? ORDER BY job_name", (user_id,)))
+
+
+def add_job(user_id: int, job_name: str, hourly_rate: float, description: str = "", color: str = "#667eea") -> Optional[int]:
+    """Thêm công việc mới (trùng tên thì cập nhật, giữ id cũ; công việc mới nhận id tạm)."""
+    existing = [job['id'] for job in get_all_jobs(user_id) if job['job_name'] == job_name]
+    row = {'user_id': user_id, 'job_name': job_name, 'hourly_rate': hourly_rate,
+           'description': description, 'color': color}
+
+    def apply(conn, job_id):
+        conn.execute("""
+            INSERT INTO jobs (id, user_id, job_name, hourly_rate, description, color) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, job_name) DO UPDATE SET hourly_rate = excluded.hourly_rate,
+                description = excluded.description, color = excluded.color
+        """, (job_id, user_id, job_name, hourly_rate, description, color))
+    job_id = _submit(user_id, cloud_outbox.upsert('jobs', row, 'user_id,job_name', returns_id=not existing), apply)
+    if job_id is None:
+        return None
+    return existing[0] if existing else job_id
+
+
+def update_job(user_id: int, job_id: int, job_name: str, hourly_rate: float, description: str = "",
+               color: str = "#667eea") -> bool:
+    """Cập nhật công việc của user."""
+    job_id = _resolve(user_id, job_id)
+    values = {'job_name': job_name, 'hourly_rate': hourly_rate, 'description': description, 'color': color}
+    op = cloud_outbox.update('jobs', values, {'id': job_id, 'user_id': user_id})
+    return bool(_submit(user_id, op, lambda conn, _: conn.execute("""
+        UPDATE jobs SET job_name = ?, hourly_rate = ?, description = ?, color = ? WHERE id = ? AND user_id = ?
+    """, (job_name, hourly_rate, description, color, job_id, user_id))))
+
+
+def get_shift_counts_by_job(user_id: int) -> Dict[int, int]:
+    """Đếm số ca của từng công việc (từ bản sao khi bản sao có toàn bộ ca)."""
+    def query(conn):
+        rows = conn.execute("SELECT job_id, COUNT(*) FROM work_shifts WHERE user_id = ? GROUP BY job_id", (user_id,))
+        return {job_id: count for job_id, count in rows}
+    return _read(user_id, lambda: supabase_db.get_shift_counts_by_job(user_id), query, start_date=date.min)
+
+
+def get_job_rates(user_id: int) -> List[Dict]:
+    """Lấy lịch sử lương giờ (theo ngày hiệu lực) của các công việc của user."""
+    return _read(user_id, lambda: supabase_db.get_job_rates(user_id), _rows("""
+        SELECT job_id, effective_from, hourly_rate FROM job_rates WHERE user_id = ? ORDER BY effective_from
+    """, (user_id,)))
+
+
+def record_rate_change(user_id: int, job_id: int, old_rate: float, new_rate: float,
+                       effective_from: date, epoch: str) -> bool:
+    """Ghi mốc lương mới; giữ mức cũ làm mốc gốc nếu công việc chưa có lịch sử."""
+    job_id = _resolve(user_id, job_id)
+
+    def apply(conn, _):
+        conn.execute("""
+            INSERT OR IGNORE INTO job_rates (user_id, job_id, effective_from, hourly_rate)
+            SELECT ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM job_rates WHERE job_id = ?)
+        """, (user_id, job_id, epoch, old_rate, job_id))
+        conn.execute("""
+            INSERT INTO job_rates (user_id, job_id, effective_from, hourly_rate) VALUES (?, ?, ?, ?)
+            ON CONFLICT(job_id, effective_from) DO UPDATE SET hourly_rate = excluded.hourly_rate
+        """, (user_id, job_id, effective_from.isoformat(), new_rate))
+    op = cloud_outbox.rate_change(user_id, job_id, old_rate, new_rate, effective_from.isoformat(), epoch)
+    return bool(_submit(user_id, op, apply))
+
+
+def delete_job(user_id: int, job_id: int) -> bool:
+    """
+    Xóa công việc; ca / lịch sử lương phụ thuộc do server quyết định, bản sao
+    nhận lại sau khi outbox gửi xong (lần làm mới ở nền).
+    """
+    job_id = _resolve(user_id, job_id)
+
+    def apply(conn, _):
+        conn.execute("DELETE FROM jobs WHERE id = ? AND user_id = ?", (job_id, user_id))
+        conn.execute("DELETE FROM job_rates WHERE job_id = ? AND user_id = ?", (job_id, user_id))
+    op = cloud_outbox.delete('jobs', {'id': job_id, 'user_id': user_id}, refresh=True)
+    return bool(_submit(user_id, op, apply))
+
+
+# ==================== WORK SHIFTS ====================
+
+def add_work_shift(
+    user_id: int,
+    work_date: date,
+    shift_name: str,
+    start_time: str,
+    end_time: str,
+    break_hours: float,
+    total_hours: float,
+    notes: str = "",
+    job_id: int = None
+) -> Optional[int]:
+    """Thêm ca làm việc mới (id tạm cho tới khi outbox gửi xong)."""
+    job_id = _resolve(user_id, job_id)
+    row = {'user_id': user_id, 'work_date': work_date.isoformat(), 'shift_name': shift_name, 'job_id': job_id,
+           'start_time': start_time, 'end_time': end_time, 'break_hours': break_hours,
+           'total_hours': total_hours, 'notes': notes}
+
+    def apply(conn, shift_id):
+        if get_mirror(user_id).note_shift_date(conn, work_date.isoformat()):
+            conn.execute("""
+                INSERT OR REPLACE INTO work_shifts (id, user_id, work_date, shift_name, job_id, start_time,
+                                                    end_time, break_hours, total_hours, notes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (shift_id, user_id, work_date.isoformat(), shift_name, job_id, start_time, end_time,
+                  break_hours, total_hours, notes))
+    return _submit(user_id, cloud_outbox.insert('work_shifts', row), apply)
+
+
+def update_work_shift(
+    user_id: int,
+    shift_id: int,
+    shift_name: str,
+    start_time: str,
+    end_time: str,
+    break_hours: float,
+    total_hours: float,
+    notes: str = ""
+) -> bool:
+    """Cập nhật ca làm việc của user."""
+    shift_id = _resolve(user_id, shift_id)
+    values = {'shift_name': shift_name, 'start_time': start_time, 'end_time': end_time,
+              'break_hours': break_hours, 'total_hours': total_hours, 'notes': notes}
+    op = cloud_outbox.update('work_shifts', values, {'id': shift_id, 'user_id': user_id})
+    return bool(_submit(user_id, op, lambda conn, _: conn.execute("""
+        UPDATE work_shifts SET shift_name = ?, start_time = ?, end_time = ?, break_hours = ?,
+                               total_hours = ?, notes = ?
+        WHERE id = ? AND user_id = ?
+    """, (shift_name, start_time, end_time, break_hours, total_hours, notes, shift_id, user_id))))
+
+
+def delete_work_shift(user_id: int, shift_id: int) -> bool:
+    """Xóa ca làm việc của user."""
+    shift_id = _resolve(user_id, shift_id)
+    op = cloud_outbox.delete('work_shifts', {'id': shift_id, 'user_id': user_id})
+    return bool(_submit(user_id, op, lambda conn, _: conn.execute(
+        "DELETE FROM work_shifts WHERE id = ? AND user_id = ?", (shift_id, user_id))))
+
+
+def get_shifts_by_date(user_id: int, work_date: date) -> List[Dict]:
+    """Lấy các ca làm việc theo ngày."""
+    return _read(user_id, lambda: supabase_db.get_shifts_by_date(user_id, work_date), _rows(f"""
+        SELECT {supabase_db.SHIFT_COLUMNS} FROM work_shifts WHERE user_id = ? AND work_date = ?
+        ORDER BY start_time, id
+    """, (user_id, work_date.isoformat())), start_date=work_date)
+
+
+def get_shifts_by_range(user_id: int, start_date: date, end_date: date) -> List[Dict]:
+    """Lấy các ca làm việc trong khoảng thời gian."""
+    return _read(user_id, lambda: supabase_db.get_shifts_by_range(user_id, start_date, end_date), _rows(f"""
+        SELECT {supabase_db.SHIFT_COLUMNS} FROM work_shifts WHERE user_id = ? AND work_date BETWEEN ? AND ?
+        ORDER BY work_date, start_time, id
+    """, (user_id, start_date.isoformat(), end_date.isoformat())), start_date=start_date)
+
+
+def get_shift_by_id(user_id: int, shift_id: int) -> Optional[Dict]:
+    """Lấy ca làm việc của user theo ID (ca ngoài cửa sổ đọc từ Supabase)."""
+    shift_id = _resolve(user_id, shift_id)
+    rows = _read(user_id, lambda: [], _rows(
+        f"SELECT {supabase_db.SHIFT_COLUMNS} FROM work_shifts WHERE id = ? AND user_id = ?", (shift_id, user_id)))
+    return rows[0] if rows else supabase_db.get_shift_by_id(user_id, shift_id)
+
+
+# ==================== PAYROLL SNAPSHOTS ====================
+
+def get_closed_months(user_id: int) -> List[tuple]:
+    """Lấy danh sách (năm, tháng) đã chốt lương."""
+    return _read(user_id, lambda: supabase_db.get_closed_months(user_id), lambda conn: [
+        (row['year'], row['month']) for row in conn.execute(
+            "SELECT year, month FROM payroll_snapshots WHERE user_id = ? ORDER BY year, month", (user_id,))
+    ])
+
+
+def get_payroll_snapshot(user_id: int, year: int, month: int) -> Optional[Dict]:
+    """Lấy snapshot lương của tháng đã chốt."""
+    def query(conn):
+        row = conn.execute("""
+            SELECT year, month, salary_json, daily_json, closed_at FROM payroll_snapshots
+            WHERE user_id = ? AND year = ? AND month = ?
+        """, (user_id, year, month)).fetchone()
+        if not row:
+            return None
+        return {
+            'year': row['year'],
+            'month': row['month'],
+            'salary': json.loads(row['salary_json']),
+            'daily': json.loads(row['daily_json']),
+            'closed_at': row['closed_at']
+        }
+    return _read(user_id, lambda: supabase_db.get_payroll_snapshot(user_id, year, month), query)
+
+
+def get_payroll_snapshots(user_id: int, first: tuple, last: tuple) -> Dict[tuple, Dict]:
+    """Lấy snapshot lương của các tháng đã chốt từ tháng first đến last."""
+    return _read(user_id, lambda: supabase_db.get_payroll_snapshots(user_id, first, last), lambda conn: {
+        (row['year'], row['month']): json.loads(row['salary_json']) for row in conn.execute("""
+            SELECT year, month, salary_json FROM payroll_snapshots
+            WHERE user_id = ? AND (year * 100 + month) BETWEEN ? AND ?
+        """, (user_id, first[0] * 100 + first[1], last[0] * 100 + last[1]))
+    })
+
+
+def save_payroll_snapshot(user_id: int, year: int, month: int, salary: Dict, daily: List[Dict]) -> bool:
+    """Lưu (hoặc ghi đè) snapshot của một tháng."""
+    row = {'user_id': user_id, 'year': year, 'month': month, 'salary_json': salary, 'daily_json': daily,
+           'closed_at': datetime.now().isoformat()}
+    op = cloud_outbox.upsert('payroll_snapshots', row, 'user_id,year,month')
+    return bool(_submit(user_id, op, lambda conn, _: conn.execute("""
+        INSERT OR REPLACE INTO payroll_snapshots (user_id, year, month, salary_json, daily_json, closed_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (user_id, year, month, json.dumps(salary, ensure_ascii=False), json.dumps(daily, ensure_ascii=False),
+          row['closed_at']))))
+
+
+def delete_payroll_snapshot(user_id: int, year: int, month: int) -> bool:
+    """Xóa snapshot (mở lại tháng)."""
+    op = cloud_outbox.delete('payroll_snapshots', {'user_id': user_id, 'year': year, 'month': month})
+    return bool(_submit(user_id, op, lambda conn, _: conn.execute(
+        "DELETE FROM payroll_snapshots WHERE user_id = ? AND year = ? AND month = ?", (user_id, year, month))))
+
+
+# ==================== AGGREGATES ====================
+# Tính trên bản sao bằng SQL của tenant_db (cùng kết quả với RPC, xem check_aggregate_parity)
+
+def get_daily_aggregates(user_id: int, start_date: date, end_date: date) -> Optional[List[Dict]]:
+    """Tổng hợp giờ làm theo ngày."""
+    return _read(user_id, lambda: supabase_db.get_daily_aggregates(user_id, start_date, end_date),
+                 lambda conn: tenant_db.query_daily_aggregates(conn, user_id, start_date.isoformat(), end_date.isoformat()),
+                 start_date=start_date)
+
+
+def get_payroll_aggregates(user_id: int, start_date: date, end_date: date) -> Optional[Dict]:
+    """Tổng hợp lương theo (tháng, công việc), cùng dạng với RPC payroll_aggregates."""
+    return _read(user_id, lambda: supabase_db.get_payroll_aggregates(user_id, start_date, end_date),
+                 lambda conn: tenant_db.query_payroll_aggregates(conn, user_id, start_date.isoformat(), end_date.isoformat()),
+                 start_date=start_date)
+
+
+def get_data_generation(user_id: int, start_date: Optional[date] = None) -> Optional[str]:
+    """
+    Thế hệ dữ liệu của bản sao (trigger của tenant_db.SCHEMA đổi token khi ghi
+    local, làm mới hay outbox cấp id thật). None khi lần đọc từ start_date đi
+    thẳng Supabase (bản sao chưa dùng được hoặc ngoài cửa sổ ca làm việc).
+    """
+    try:
+        mirror = get_mirror(user_id)
+        if mirror.ensure_fresh() and (start_date is None or mirror.covers(start_date)):
+            with mirror.connection() as conn:
+                return tenant_db.query_data_generation(conn, user_id)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Cloud mirror read error: {e}")
+    return None
+
+
+# ==================== HOLIDAYS ====================
+
+def add_holiday(user_id: int, holiday_date: date, description: str) -> bool:
+    """Thêm ngày nghỉ."""
+    row = {'user_id': user_id, 'holiday_date': holiday_date.isoformat(), 'description': description}
+    return bool(_submit(user_id, cloud_outbox.upsert('holidays', row, 'user_id,holiday_date'), lambda conn, _: conn.execute("""
+        INSERT INTO holidays (user_id, holiday_date, description) VALUES (?, ?, ?)
+        ON CONFLICT(user_id, holiday_date) DO UPDATE SET description = excluded.description
+    """, (user_id, holiday_date.isoformat(), description))))
+
+
+def remove_holiday(user_id: int, holiday_date: date) -> bool:
+    """Xóa ngày nghỉ."""
+    op = cloud_outbox.delete('holidays', {'user_id': user_id, 'holiday_date': holiday_date.isoformat()})
+    return bool(_submit(user_id, op, lambda conn, _: conn.execute(
+        "DELETE FROM holidays WHERE user_id = ? AND holiday_date = ?", (user_id, holiday_date.isoformat()))))
+
+
+def get_all_holidays(user_id: int) -> List[Dict]:
+    """Lấy tất cả ngày nghỉ."""
+    return _read(user_id, lambda: supabase_db.get_all_holidays(user_id), _rows(
+        f"SELECT {supabase_db.HOLIDAY_COLUMNS} FROM holidays WHERE user_id = ? ORDER BY holiday_date", (user_id,)))
+
+
+def get_holidays_by_range(user_id: int, start_date: date, end_date: date) -> List[Dict]:
+    """Lấy ngày nghỉ trong khoảng thời gian."""
+    return _read(user_id, lambda: supabase_db.get_holidays_by_range(user_id, start_date, end_date), _rows(f"""
+        SELECT {supabase_db.HOLIDAY_COLUMNS} FROM holidays WHERE user_id = ? AND holiday_date BETWEEN ? AND ?
+        ORDER BY holiday_date
+    """, (user_id, start_date.isoformat(), end_date.isoformat())))
+
+
+def is_holiday(user_id: int, check_date: date) -> tuple:
+    """Kiểm tra ngày nghỉ."""
+    def query(conn):
+        row = conn.execute("SELECT description FROM holidays WHERE user_id = ? AND holiday_date = ?",
+                           (user_id, check_date.isoformat())).fetchone()
+        return (True, row['description']) if row else (False, "")
+    return _read(user_id, lambda: supabase_db.is_holiday(user_id, check_date), query)
+
+
+# ==================== SETTINGS ====================
+
+def get_all_settings(user_id: int) -> Dict[str, str]:
+    """Lấy toàn bộ cài đặt của user."""
+    return _read(user_id, lambda: supabase_db.get_all_settings(user_id), lambda conn: {
+        row['key']: row['value'] for row in conn.execute("SELECT key, value FROM settings WHERE user_id = ?", (user_id,))
+    })
+
+
+def get_setting(user_id: int, key: str) -> Optional[str]:
+    """Lấy cài đặt."""
+    return get_all_settings(user_id).get(key)
+
+
+def update_setting(user_id: int, key: str, value: str) -> bool:
+    """Cập nhật cài đặt."""
+    row = {'user_id': user_id, 'key': key, 'value': value}
+    return bool(_submit(user_id, cloud_outbox.upsert('settings', row, 'user_id,key'), lambda conn, _: conn.execute("""
+        INSERT INTO settings (user_id, key, value) VALUES (?, ?, ?)
+        ON CONFLICT(user_id, key) DO UPDATE SET value = excluded.value
+    """, (user_id, key, value))))
+
+
+# ==================== SHIFT PRESETS ====================
+
+def get_all_presets(user_id: int) -> List[Dict]:
+    """Lấy tất cả khung giờ mẫu của user."""
+    return _read(user_id, lambda: supabase_db.get_all_presets(user_id), _rows(
+        f"SELECT {supabase_db.PRESET_COLUMNS} FROM shift_presets WHERE user_id = ? ORDER BY sort_order, id", (user_id,)))
+
+
+def add_preset(user_id: int, preset_name: str, start_time: str, end_time: str,
+               break_hours: float, total_hours: float,
+               job_id: int = None, emoji: str = "⏰", sort_order: int = 0) -> Optional[int]:
+    """Thêm khung giờ mẫu mới (id tạm cho tới khi outbox gửi xong)."""
+    job_id = _resolve(user_id, job_id)
+    row = {'user_id': user_id, 'preset_name': preset_name, 'start_time': start_time, 'end_time': end_time,
+           'break_hours': break_hours, 'total_hours': total_hours, 'job_id': job_id,
+           'emoji': emoji, 'sort_order': sort_order}
+    return _submit(user_id, cloud_outbox.insert('shift_presets', row), lambda conn, preset_id: conn.execute("""
+        INSERT OR REPLACE INTO shift_presets (id, user_id, preset_name, start_time, end_time, break_hours,
+                                              total_hours, job_id, emoji, sort_order)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (preset_id, user_id, preset_name, start_time, end_time, break_hours, total_hours,
+          job_id, emoji, sort_order)))
+
+
+def update_preset(user_id: int, preset_id: int, **kwargs) -> bool:
+    """Cập nhật khung giờ mẫu."""
+    allowed_fields = ['preset_name', 'start_time', 'end_time', 'break_hours',
+                      'total_hours', 'job_id', 'emoji', 'sort_order']
+    values = {key: value for key, value in kwargs.items() if key in allowed_fields}
+    if not values:
+        return True
+    preset_id = _resolve(user_id, preset_id)
+    if 'job_id' in values:
+        values['job_id'] = _resolve(user_id, values['job_id'])
+    op = cloud_outbox.update('shift_presets', values, {'id': preset_id, 'user_id': user_id})
+    return bool(_submit(user_id, op, lambda conn, _: conn.execute(
+        f"UPDATE shift_presets SET {', '.join(f'{key} = ?' for key in values)} WHERE id = ? AND user_id = ?",
+        tuple(values.values()) + (preset_id, user_id)
+    )))
+
+
+def delete_preset(user_id: int, preset_id: int) -> bool:
+    """Xóa khung giờ mẫu."""
+    preset_id = _resolve(user_id, preset_id)
+    op = cloud_outbox.delete('shift_presets', {'id': preset_id, 'user_id': user_id})
+    return bool(_submit(user_id, op, lambda conn, _: conn.execute(
+        "DELETE FROM shift_presets WHERE id = ? AND user_id = ?", (preset_id, user_id))))
+
+
+# ==================== PROVISIONING ====================
+
+def is_user_provisioned(user_id: int) -> bool:
+    """User đã được khởi tạo dữ liệu mặc định chưa (lần gọi đầu nạp bản sao)."""
+    return _read(user_id, lambda: supabase_db.is_user_provisioned(user_id), lambda conn: conn.execute(
+        "SELECT 1 FROM settings WHERE user_id = ? AND key = ?", (user_id, supabase_db.PROVISIONED_KEY)
+    ).fetchone() is not None)
+
+
+def provision_user(user_id: int, new_user: bool = False) -> bool:
+    """Tạo dữ liệu mặc định trên Supabase rồi nạp lại bản sao ngay (trước các lần ghi qua outbox)."""
+    provisioned = supabase_db.provision_user(user_id, new_user)
+    mirror = get_mirror(user_id)
+    if not mirror.refresh(full=True):
+        mirror.invalidate()
+    return provisioned
+
+
+def __getattr__(name: str):
+    # Phần còn lại của API supabase_db (users, auth tokens, ...) không qua bản sao
+    return getattr(supabase_db, name)
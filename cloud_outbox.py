@@ -0,0 +1,529 @@
+# -*- coding: utf-8 -*-
+"""
+Hàng đợi ghi bền vững (outbox) cho chế độ cloud, nằm trong file bản sao của
+user (cloud_mirror).
+
+Hàm ghi của cloud_mirror ghi thay đổi vào bản sao và một dòng outbox trong
+cùng transaction SQLite rồi trả về ngay, không chờ mạng; dòng mới nhận id tạm
+(PROVISIONAL_BASE + seq, vẫn > 0 như id thật). Một thread nền đẩy outbox lên
+Supabase theo đúng thứ tự, gộp các thao tác liền nhau cùng loại thành một
+request, thử lại với backoff khi mất mạng / server quá tải, rồi đổi id tạm
+thành id thật trong bản sao (id tạm cũ vẫn dùng được qua outbox_ids).
+
+Gửi lại an toàn: ca làm việc và khung giờ mẫu mang client_ref (khóa của dòng
+outbox, unique trên server, xem supabase/migrations/*_outbox_client_ref.sql);
+các thao tác khác là upsert theo khóa tự nhiên, update hoặc delete theo khóa.
+Mất response giữa chừng hay app tắt trước khi kịp ghi nhận thì lần chạy sau
+gửi lại vẫn cho cùng kết quả.
+
+Server từ chối hẳn (ràng buộc, dữ liệu sai) thì không thử lại: dòng outbox
+chuyển sang 'failed' (giữ lại để xem) và bản sao tải lại toàn bộ theo server.
+"""
+
+import atexit
+import json
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import supabase_db
+
+# Id tạm của dòng mới: PROVISIONAL_BASE + seq của outbox (id identity trên
+# server không bao giờ tới mức này, vẫn nằm trong số nguyên an toàn của JSON)
+PROVISIONAL_BASE = 1 << 50
+
+# Số dòng outbox đọc mỗi lượt (các thao tác liền nhau cùng loại gộp một request)
+BATCH_SIZE = 100
+
+# Thử lại khi lỗi mạng: 2s, 4s, 8s, ... tối đa BACKOFF_MAX_SECONDS
+BACKOFF_BASE_SECONDS = 2
+BACKOFF_MAX_SECONDS = 120
+
+# Thời gian tối đa chờ worker xong lượt đang gửi khi tắt app (phần còn lại gửi ở lần chạy sau)
+SHUTDOWN_TIMEOUT_SECONDS = 5
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS outbox (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        op_key TEXT NOT NULL UNIQUE,
+        op TEXT NOT NULL,
+        provisional INTEGER,
+        state TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS outbox_ids (
+        provisional INTEGER PRIMARY KEY,
+        real_id INTEGER NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+# Cột chứa id (có thể là id tạm) trong dữ liệu của thao tác
+_ID_FIELDS = ('id', 'job_id')
+
+# Bảng tham chiếu jobs.id (đổi id tạm của công việc thì đổi cả ở đây)
+_JOB_REFERENCES = ('work_shifts', 'shift_presets', 'job_rates')
+
+# Mã lỗi nên thử lại: mất kết nối (08), xung đột transaction, server quá tải
+# (53, 57), PostgREST không tới được database (PGRST000-003)
+_TRANSIENT_CODES = ('08', '40001', '40P01', '53', '57', 'PGRST000', 'PGRST001', 'PGRST002', 'PGRST003')
+
+# Project chưa áp dụng migration client_ref (thiếu cột / thiếu unique index)
+_CLIENT_REF_MISSING_CODES = ('PGRST204', '42703', '42P10')
+
+_MINIMAL = 'minimal'
+
+_cond = threading.Condition()
+_stop_event = threading.Event()
+_worker: Optional[threading.Thread] = None
+
+# user_id -> thời điểm (time.monotonic) cần đẩy outbox của user
+_due: Dict[int, float] = {}
+# user_id -> số lần lỗi mạng liên tiếp (tính backoff)
+_failures: Dict[int, int] = {}
+_active: Optional[int] = None
+
+# client_ref chưa có trên server -> insert thường (gửi lại có thể tạo dòng trùng)
+_client_ref_missing = False
+
+_status = {
+    'state': 'idle',          # idle | pending | sending | retrying
+    'last_success_at': None,  # time.time()
+    'last_error': None,
+    'sent': 0,                # số thao tác đã gửi
+    'requests': 0,            # số request đã gửi (gộp nhiều thao tác)
+    'retries': 0,
+    'rejected': 0,
+}
+
+
+class Rejected(Exception):
+    """Thao tác không gửi được và không nên thử lại."""
+
+
+def is_provisional(value) -> bool:
+    """Id tạm (dòng chưa được server ghi nhận)."""
+    return isinstance(value, int) and value >= PROVISIONAL_BASE
+
+
+def is_transient(error: Exception) -> bool:
+    """Lỗi nên thử lại (mạng, timeout, server quá tải) hay server đã từ chối dữ liệu."""
+    if isinstance(error, (OSError, TimeoutError)) or type(error).__module__.split('.')[0] in ('httpx', 'httpcore'):
+        return True
+    if isinstance(error, Rejected) or not hasattr(error, 'code'):
+        return False
+    code = str(error.code or '')
+    if not code:
+        return True   # response không phải lỗi PostgREST (gateway, proxy)
+    if len(code) == 3 and code.isdigit():
+        return code == '429' or code >= '500'
+    return code.startswith(_TRANSIENT_CODES)
+
+
+# ==================== THAO TÁC ====================
+# Dữ liệu JSON của một dòng outbox: bảng, loại thao tác và tham số của request
+
+def insert(table: str, row: Dict) -> Dict:
+    """Thêm dòng có id identity (nhận id tạm, gửi kèm client_ref)."""
+    return {'table': table, 'action': 'insert', 'row': row}
+
+
+def upsert(table: str, row: Dict, on_conflict: str, returns_id: bool = False) -> Dict:
+    """Upsert theo khóa tự nhiên (returns_id: dòng có thể là mới, nhận id tạm)."""
+    op = {'table': table, 'action': 'upsert', 'row': row, 'on_conflict': on_conflict}
+    if returns_id:
+        op['returns_id'] = True
+    return op
+
+
+def update(table: str, values: Dict, match: Dict) -> Dict:
+    return {'table': table, 'action': 'update', 'values': values, 'match': match}
+
+
+def delete(table: str, match: Dict, refresh: bool = False) -> Dict:
+    """Xóa theo khóa (refresh: server đổi cả dòng phụ thuộc, bản sao làm mới sau khi gửi)."""
+    op = {'table': table, 'action': 'delete', 'match': match}
+    if refresh:
+        op['refresh'] = True
+    return op
+
+
+def rate_change(user_id: int, job_id: int, old_rate: float, new_rate: float, effective_from: str, epoch: str) -> Dict:
+    """Mốc lương mới, kèm mốc gốc nếu server chưa có lịch sử (như supabase_db.record_rate_change)."""
+    return {'table': 'job_rates', 'action': 'rate_change', 'row': {
+        'user_id': user_id, 'job_id': job_id, 'old_rate': old_rate, 'new_rate': new_rate,
+        'effective_from': effective_from, 'epoch': epoch,
+    }}
+
+
+# ==================== OUTBOX TRONG FILE BẢN SAO ====================
+
+def enqueue(conn, op: Dict) -> Optional[int]:
+    """
+    Thêm thao tác vào outbox (trong transaction của lần ghi bản sao).
+
+    Returns:
+        Id tạm của dòng mới (insert / upsert returns_id), None với thao tác khác
+    """
+    cursor = conn.execute("INSERT INTO outbox (op_key, op) VALUES (?, ?)",
+                          (uuid.uuid4().hex, json.dumps(op, ensure_ascii=False)))
+    if op['action'] != 'insert' and not op.get('returns_id'):
+        return None
+    provisional = PROVISIONAL_BASE + cursor.lastrowid
+    conn.execute("UPDATE outbox SET provisional = ? WHERE seq = ?", (provisional, cursor.lastrowid))
+    return provisional
+
+
+def load_id_map(conn) -> Dict[int, int]:
+    """Id tạm -> id thật của các dòng đã gửi."""
+    return {provisional: real_id for provisional, real_id in
+            conn.execute("SELECT provisional, real_id FROM outbox_ids")}
+
+
+def pending_count(conn) -> int:
+    return conn.execute("SELECT COUNT(*) FROM outbox WHERE state = 'pending'").fetchone()[0]
+
+
+def counts(conn) -> Dict[str, int]:
+    """Số thao tác đang chờ gửi và bị server từ chối."""
+    found = dict(conn.execute("SELECT state, COUNT(*) FROM outbox GROUP BY state").fetchall())
+    return {'pending': found.get('pending', 0), 'failed': found.get('failed', 0)}
+
+
+def _load(conn, limit: int) -> List[Dict]:
+    rows = conn.execute("""
+        SELECT seq, op_key, op, provisional FROM outbox WHERE state = 'pending' ORDER BY seq LIMIT ?
+    """, (limit,)).fetchall()
+    return [{'seq': seq, 'op_key': op_key, 'op': json.loads(op), 'provisional': provisional}
+            for seq, op_key, op, provisional in rows]
+
+
+def _complete(conn, batch: List[Dict], mapping: Dict[int, int]) -> None:
+    """Xóa các dòng đã gửi, đổi id tạm thành id thật trong bản sao."""
+    conn.executemany("DELETE FROM outbox WHERE seq = ?", [(entry['seq'],) for entry in batch])
+    table = batch[0]['op']['table']
+    for provisional, real_id in mapping.items():
+        conn.execute("INSERT OR REPLACE INTO outbox_ids (provisional, real_id) VALUES (?, ?)", (provisional, real_id))
+        conn.execute(f"UPDATE OR REPLACE {table} SET id = ? WHERE id = ?", (real_id, provisional))
+        if table == 'jobs':
+            for reference in _JOB_REFERENCES:
+                conn.execute(f"UPDATE OR REPLACE {reference} SET job_id = ? WHERE job_id = ?", (real_id, provisional))
+
+
+def _prune(conn) -> None:
+    """Outbox đã gửi hết: bỏ các ánh xạ id tạm cũ (giao diện không còn giữ id tạm lâu như vậy)."""
+    conn.execute("DELETE FROM outbox_ids WHERE created_at < datetime('now', '-7 days')")
+
+
+# ==================== GỬI LÊN SUPABASE ====================
+
+def _resolve(values: Dict, id_map: Dict[int, int]) -> Dict:
+    """Thay id tạm bằng id thật (dòng được tham chiếu đã gửi trước theo thứ tự outbox)."""
+    resolved = dict(values)
+    for field in _ID_FIELDS:
+        value = resolved.get(field)
+        if is_provisional(value):
+            if value not in id_map:
+                raise Rejected(f"{field} {value} thuộc thao tác đã bị server từ chối")
+            resolved[field] = id_map[value]
+    return resolved
+
+
+def _varying(matches: List[Dict]) -> List[str]:
+    """Các khóa có giá trị khác nhau giữa các điều kiện delete."""
+    return [key for key in matches[0] if len({json.dumps(match[key]) for match in matches}) > 1]
+
+
+def _compatible(batch: List[Dict], op: Dict) -> bool:
+    """Thao tác op gộp được vào cùng request với batch (liền nhau, cùng loại)."""
+    first = batch[0]['op']
+    if (op['table'], op['action'], op.get('on_conflict')) != (first['table'], first['action'], first.get('on_conflict')):
+        return False
+    if op['action'] == 'insert':
+        return True
+    if op['action'] == 'upsert':
+        return not first.get('returns_id') and not op.get('returns_id')
+    if op['action'] == 'delete':
+        if set(op['match']) != set(first['match']):
+            return False
+        return len(_varying([entry['op']['match'] for entry in batch] + [op['match']])) <= 1
+    return False
+
+
+def _next_batch(entries: List[Dict], single: bool) -> List[Dict]:
+    batch = [entries[0]]
+    if not single:
+        for entry in entries[1:]:
+            if not _compatible(batch, entry['op']):
+                break
+            batch.append(entry)
+    return batch
+
+
+def _send(client, batch: List[Dict], id_map: Dict[int, int]) -> Dict[int, int]:
+    """
+    Gửi một nhóm thao tác bằng một request (rate_change: hai request).
+
+    Returns:
+        Id tạm -> id thật của các dòng mới
+    """
+    op = batch[0]['op']
+    table, action = op['table'], op['action']
+
+    if action == 'insert':
+        return _send_inserts(client, table, batch, id_map)
+
+    if action == 'upsert':
+        # Cùng khóa trong một request thì Postgres báo lỗi: giữ thao tác sau cùng
+        key_columns = op['on_conflict'].split(',')
+        rows = {}
+        for entry in batch:
+            row = _resolve(entry['op']['row'], id_map)
+            rows.pop(tuple(row[column] for column in key_columns), None)
+            rows[tuple(row[column] for column in key_columns)] = row
+        if op.get('returns_id'):
+            data = client.table(table).upsert(list(rows.values()), on_conflict=op['on_conflict']) \
+                .select('id').execute().data
+            return {batch[0]['provisional']: data[0]['id']}
+        client.table(table).upsert(list(rows.values()), on_conflict=op['on_conflict'], returning=_MINIMAL).execute()
+        return {}
+
+    if action == 'update':
+        query = client.table(table).update(_resolve(op['values'], id_map), returning=_MINIMAL)
+        for key, value in _resolve(op['match'], id_map).items():
+            query = query.eq(key, value)
+        query.execute()
+        return {}
+
+    if action == 'delete':
+        matches = [_resolve(entry['op']['match'], id_map) for entry in batch]
+        varying = _varying(matches)
+        query = client.table(table).delete(returning=_MINIMAL)
+        for key, value in matches[0].items():
+            query = query.in_(key, [match[key] for match in matches]) if key in varying else query.eq(key, value)
+        query.execute()
+        return {}
+
+    if action == 'rate_change':
+        row = _resolve(op['row'], id_map)
+        rows = [{'user_id': row['user_id'], 'job_id': row['job_id'],
+                 'effective_from': row['effective_from'], 'hourly_rate': row['new_rate']}]
+        existing = client.table('job_rates').select('job_id').eq('job_id', row['job_id']).limit(1).execute()
+        if not existing.data:
+            rows.insert(0, {'user_id': row['user_id'], 'job_id': row['job_id'],
+                            'effective_from': row['epoch'], 'hourly_rate': row['old_rate']})
+        client.table('job_rates').upsert(rows, on_conflict='job_id,effective_from', returning=_MINIMAL).execute()
+        return {}
+
+    raise Rejected(f"Thao tác không hỗ trợ: {action}")
+
+
+def _send_inserts(client, table: str, batch: List[Dict], id_map: Dict[int, int]) -> Dict[int, int]:
+    """Insert nhiều dòng; upsert theo client_ref để gửi lại không tạo dòng trùng."""
+    global _client_ref_missing
+    rows = [_resolve(entry['op']['row'], id_map) for entry in batch]
+    if not _client_ref_missing:
+        try:
+            data = client.table(table).upsert(
+                [dict(row, client_ref=entry['op_key']) for row, entry in zip(rows, batch)],
+                on_conflict='client_ref'
+            ).select('id,client_ref').execute().data
+            ids = {row['client_ref']: row['id'] for row in data}
+            return {entry['provisional']: ids[entry['op_key']] for entry in batch}
+        except Exception as e:
+            if getattr(e, 'code', None) not in _CLIENT_REF_MISSING_CODES:
+                raise
+            print(f"Outbox: client_ref chưa có trên server, insert không idempotent ({e})")
+            _client_ref_missing = True
+
+    data = client.table(table).insert(rows).select('id').execute().data
+    return {entry['provisional']: row['id'] for entry, row in zip(batch, data)}
+
+
+def drain(mirror) -> Optional[float]:
+    """
+    Gửi outbox của một bản sao cho tới khi hết hoặc gặp lỗi mạng.
+
+    Args:
+        mirror: cloud_mirror.UserMirror
+
+    Returns:
+        None nếu đã gửi hết, không thì số giây chờ trước khi thử lại
+    """
+    client = supabase_db.get_supabase_client()
+    if not client:
+        return _retry_delay(mirror.user_id, "Chưa kết nối được Supabase")
+
+    single_until = 0
+    while not _stop_event.is_set():
+        with mirror.connection() as conn:
+            entries = _load(conn, BATCH_SIZE)
+            # Bản sao có thể vừa được mở lại (cloud_mirror.reset) trong lúc worker gửi
+            mirror.id_map.update(load_id_map(conn))
+        if not entries:
+            with mirror.connection() as conn:
+                _prune(conn)
+            if mirror.refresh_after_drain:
+                mirror.refresh_after_drain = False
+                mirror.expire()
+            return None
+
+        # Nhóm vừa bị từ chối: gửi lại từng thao tác để chỉ bỏ thao tác lỗi
+        batch = _next_batch(entries, single=entries[0]['seq'] <= single_until)
+        try:
+            mapping = _send(client, batch, mirror.id_map)
+        except Exception as e:
+            if is_transient(e):
+                with mirror.connection() as conn:
+                    conn.execute("UPDATE outbox SET attempts = attempts + 1, last_error = ? WHERE seq = ?",
+                                 (str(e), batch[0]['seq']))
+                return _retry_delay(mirror.user_id, str(e))
+            if len(batch) > 1:
+                single_until = batch[-1]['seq']
+                continue
+            print(f"Outbox: server từ chối {batch[0]['op']['action']} {batch[0]['op']['table']}: {e}")
+            with mirror.local_write() as conn:
+                conn.execute("UPDATE outbox SET state = 'failed', attempts = attempts + 1, last_error = ? "
+                             "WHERE seq = ?", (str(e), batch[0]['seq']))
+            mirror.resync()
+            with _cond:
+                _status['rejected'] += 1
+                _status['last_error'] = str(e)
+            continue
+
+        with mirror.local_write() as conn:
+            _complete(conn, batch, mapping)
+        mirror.id_map.update(mapping)
+        # Server đã có thay đổi (đọc thẳng Supabase thấy khác), id tạm trong bản sao đã đổi
+        table = batch[0]['op']['table']
+        mirror.changed(table, *(_JOB_REFERENCES if table == 'jobs' and mapping else ()))
+        if any(entry['op'].get('refresh') for entry in batch):
+            mirror.refresh_after_drain = True
+        with _cond:
+            _failures.pop(mirror.user_id, None)
+            _status['sent'] += len(batch)
+            _status['requests'] += 1
+            _status['last_success_at'] = time.time()
+    return None
+
+
+def _retry_delay(user_id: int, error: str) -> float:
+    with _cond:
+        failures = _failures.get(user_id, 0)
+        _failures[user_id] = failures + 1
+        _status['retries'] += 1
+        _status['last_error'] = error
+    return min(BACKOFF_BASE_SECONDS * 2 ** failures, BACKOFF_MAX_SECONDS)
+
+
+# ==================== WORKER NỀN ====================
+
+def _ensure_worker() -> None:
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    _stop_event.clear()
+    _worker = threading.Thread(target=_run, name="cloud-outbox-worker", daemon=True)
+    _worker.start()
+
+
+def schedule(user_id: int, delay: float = 0) -> None:
+    """Yêu cầu đẩy outbox của user (không chặn; đang chờ backoff thì giữ lịch cũ)."""
+    with _cond:
+        due = time.monotonic() + delay
+        if user_id in _due and (_failures.get(user_id) or _due[user_id] <= due):
+            return
+        _due[user_id] = due
+        if _status['state'] == 'idle':
+            _status['state'] = 'pending'
+        _ensure_worker()
+        _cond.notify_all()
+
+
+def _run() -> None:
+    """Vòng lặp của worker: lấy user đến hạn, đẩy outbox, hẹn lại nếu lỗi mạng."""
+    global _active
+    import cloud_mirror
+
+    while True:
+        with _cond:
+            while True:
+                if _stop_event.is_set():
+                    return
+                now = time.monotonic()
+                ready = [user_id for user_id, due in _due.items() if due <= now]
+                if ready:
+                    _active = min(ready, key=_due.get)
+                    del _due[_active]
+                    break
+                _cond.wait(min(_due.values()) - now if _due else None)
+            user_id = _active
+            _status['state'] = 'sending'
+
+        try:
+            delay = drain(cloud_mirror.get_mirror(user_id))
+        except Exception as e:
+            print(f"Outbox worker error: {e}")
+            delay = _retry_delay(user_id, str(e))
+
+        with _cond:
+            _active = None
+            if delay is not None:
+                _due[user_id] = time.monotonic() + delay
+            if _due:
+                _status['state'] = 'retrying' if _failures else 'pending'
+            else:
+                _status['state'] = 'idle'
+            _cond.notify_all()
+
+
+def wait_idle(timeout: float) -> bool:
+    """
+    Chờ worker gửi xong mọi outbox đã hẹn (benchmark, kiểm thử).
+
+    Returns:
+        False nếu hết thời gian (còn user đang chờ thử lại)
+    """
+    deadline = time.monotonic() + timeout
+    with _cond:
+        while _due or _active is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            _cond.wait(remaining)
+    return True
+
+
+def shutdown(timeout: float = SHUTDOWN_TIMEOUT_SECONDS) -> bool:
+    """
+    Dừng worker sau lượt đang gửi; outbox còn lại nằm trong file, gửi ở lần chạy sau.
+
+    Returns:
+        True nếu worker đã dừng trong thời gian cho phép
+    """
+    worker = _worker
+    if worker is None or not worker.is_alive():
+        return True
+    with _cond:
+        _stop_event.set()
+        _due.clear()
+        _failures.clear()
+        _cond.notify_all()
+    worker.join(timeout)
+    return not worker.is_alive()
+
+
+def get_status() -> Dict:
+    """Trạng thái gửi của process (bản sao, an toàn khi đọc từ thread khác)."""
+    with _cond:
+        return dict(_status)
+
+
+atexit.register(shutdown)
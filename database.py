@@ -5,10 +5,16 @@ Lưu trữ giờ làm (hỗ trợ nhiều ca/ngày), ngày nghỉ, và cài đ
 """
 
 import sqlite3
+import json
 from datetime import datetime, date
 from typing import List, Dict, Optional, Tuple, Union
 import os
 import sys
+from contextlib import contextmanager
+
+import payroll
+import sqlite_writer
+import tenant_context
 
 # Thiết lập UTF-8 encoding cho Windows
 os.environ['PYTHONIOENCODING'] = 'utf-8'
@@ -24,25 +30,33 @@ except:
 DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "work_hours.db")
 
 def get_db_path() -> str:
-    """Lấy đường dẫn database. Ưu tiên database của user nếu đã đăng nhập."""
-    try:
-        import streamlit as st
-        if "user_db_path" in st.session_state and st.session_state["user_db_path"]:
-            return st.session_state["user_db_path"]
-    except:
-        pass
-    return DEFAULT_DB_PATH
+    """Lấy đường dẫn database: database của tenant hiện tại (tenant_context), nếu không có thì DEFAULT_DB_PATH."""
+    return tenant_context.current_db_path() or DEFAULT_DB_PATH
 
 # Alias cho tương thích
 DB_PATH = DEFAULT_DB_PATH
 
-# Cache đơn giản để tối ưu đọc database
+# Ngày hiệu lực của mức lương gốc (áp dụng cho mọi ca trước lần đổi lương đầu tiên)
+RATE_EPOCH = "0001-01-01"
+
+# Bảng dữ liệu của user: mọi lần ghi đổi thế hệ dữ liệu (get_data_generation)
+DATA_TABLES = ('jobs', 'job_rates', 'work_shifts', 'shift_presets', 'holidays', 'settings', 'payroll_snapshots')
+
+# Cache đơn giản để tối ưu đọc database, key (đường dẫn database, tên)
 _cache = {}
 _cache_timeout = 5  # giây
 
+# Chỉ mục lương theo ngày hiệu lực (bisect), cache theo database
+_rate_index_cache = {}
+
+# Số lần cache bị xóa: lần tải đang chạy khi cache bị xóa (có thể đọc dữ liệu cũ)
+# không được lưu lại (như ref_cache)
+_cache_epoch = 0
+
 
 def _get_cache(key):
-    """Lấy dữ liệu từ cache nếu còn hiệu lực."""
+    """Lấy dữ liệu từ cache nếu còn hiệu lực (cache riêng cho từng database)."""
+    key = (get_db_path(), key)
     if key in _cache:
         data, timestamp = _cache[key]
         if (datetime.now() - timestamp).seconds < _cache_timeout:
@@ -50,15 +64,23 @@ def _get_cache(key):
     return None
 
 
-def _set_cache(key, data):
-    """Lưu dữ liệu vào cache."""
-    _cache[key] = (data, datetime.now())
+def _set_cache(key, data, epoch: Optional[int] = None):
+    """Lưu dữ liệu vào cache (bỏ qua nếu cache đã bị xóa từ lúc bắt đầu tải, epoch)."""
+    if epoch is not None and epoch != _cache_epoch:
+        return
+    _cache[(get_db_path(), key)] = (data, datetime.now())
 
 
-def clear_cache():
-    """Xóa toàn bộ cache."""
-    global _cache
-    _cache = {}
+def clear_cache(db_path: Optional[str] = None):
+    """Xóa toàn bộ cache, hoặc chỉ cache của database db_path."""
+    global _cache, _cache_epoch
+    _cache_epoch += 1
+    if db_path is None:
+        _cache = {}
+        _rate_index_cache.clear()
+        return
+    _cache = {key: value for key, value in _cache.items() if key[0] != db_path}
+    _rate_index_cache.pop(db_path, None)
 
 
 def get_connection() -> sqlite3.Connection:
@@ -68,11 +90,25 @@ def get_connection() -> sqlite3.Connection:
     db_dir = os.path.dirname(db_path)
     if db_dir and not os.path.exists(db_dir):
         os.makedirs(db_dir)
-    conn = sqlite3.connect(db_path)
+    conn = sqlite_writer.connect(db_path)
     conn.row_factory = sqlite3.Row  # Cho phép truy cập cột theo tên
     return conn
 
 
+@contextmanager
+def write_connection():
+    """
+    Kết nối cho một lần ghi: transaction BEGIN IMMEDIATE dưới khóa ghi của file
+    database (sqlite_writer), commit khi khối lệnh thành công, luôn đóng kết nối.
+    """
+    conn = get_connection()
+    try:
+        with sqlite_writer.transaction(conn, get_db_path()):
+            yield conn
+    finally:
+        conn.close()
+
+
 def normalize_date(date_input: Union[date, str]) -> str:
     """Chuyển đổi date input thành ISO string cho database."""
     if isinstance(date_input, date):
@@ -85,8 +121,12 @@ def normalize_date(date_input: Union[date, str]) -> str:
 
 def init_database() -> None:
     """Khởi tạo database và tạo các bảng nếu chưa tồn tại."""
-    conn = get_connection()
-    cursor = conn.cursor()
+    with write_connection() as conn:
+        _create_schema(conn.cursor())
+
+
+def _create_schema(cursor: sqlite3.Cursor) -> None:
+    """Tạo bảng, trigger, migration và dữ liệu mặc định (trong transaction của init_database)."""
     
     # Bảng lưu giờ làm hàng ngày (giữ lại để tương thích ngược & migration)
     cursor.execute("""
@@ -186,11 +226,72 @@ def init_database() -> None:
         )
     """)
     
+    # Bảng lịch sử lương giờ theo ngày hiệu lực
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_rates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id INTEGER NOT NULL,
+            effective_from TEXT NOT NULL,
+            hourly_rate REAL NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (job_id, effective_from),
+            FOREIGN KEY (job_id) REFERENCES jobs(id) ON DELETE CASCADE
+        )
+    """)
+
+    # Bảng snapshot lương của các tháng đã chốt
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS payroll_snapshots (
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            salary_json TEXT NOT NULL,
+            daily_json TEXT NOT NULL,
+            closed_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (year, month)
+        )
+    """)
+
+    # Tháng đã chốt: không thêm / sửa / xóa ca kể cả khi ghi không qua db_wrapper
+    # (script, CLI, process chạy code cũ); lỗi IntegrityError 'closed_period'
+    closed_month = """EXISTS (
+        SELECT 1 FROM payroll_snapshots
+        WHERE year = CAST(substr({row}.work_date, 1, 4) AS INTEGER)
+          AND month = CAST(substr({row}.work_date, 6, 2) AS INTEGER))"""
+    for op, condition in (('INSERT', closed_month.format(row='NEW')),
+                          ('UPDATE', f"{closed_month.format(row='OLD')} OR {closed_month.format(row='NEW')}"),
+                          ('DELETE', closed_month.format(row='OLD'))):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_work_shifts_{op.lower()}_closed_period BEFORE {op} ON work_shifts
+            WHEN {condition}
+            BEGIN
+                SELECT RAISE(ABORT, 'closed_period: tháng đã chốt lương, cần mở lại tháng trước khi sửa');
+            END
+        """)
+
+    # Thế hệ dữ liệu: token đổi trong cùng transaction với mọi lần ghi (result_cache)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS data_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            token TEXT NOT NULL
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO data_generation (id, token) VALUES (1, lower(hex(randomblob(8))))")
+    for table in DATA_TABLES:
+        for op in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{op.lower()}_generation AFTER {op} ON {table}
+                BEGIN
+                    UPDATE data_generation SET token = lower(hex(randomblob(8))) WHERE id = 1;
+                END
+            """)
+
     # Thêm cài đặt mặc định nếu chưa có
     default_settings = [
         ("standard_hours", "8.0"),
         ("break_hours", "1.0"),
-        ("ot_rate", "1.5"),  # Hệ số lương OT
+        ("ot_rate", str(payroll.DEFAULT_OT_RATE)),  # Hệ số lương OT
+        ("night_rate", str(payroll.DEFAULT_NIGHT_RATE)),  # Hệ số phụ cấp ca đêm
+        ("holiday_rate", str(payroll.DEFAULT_HOLIDAY_RATE)),  # Hệ số phụ cấp ngày lễ
     ]
     
     for key, value in default_settings:
@@ -213,6 +314,13 @@ def init_database() -> None:
                 VALUES (?, ?, ?, ?)
             """, (name, rate, desc, color))
     
+    # Migration: công việc chưa có lịch sử lương -> mức hiện tại áp dụng từ đầu
+    cursor.execute("""
+        INSERT INTO job_rates (job_id, effective_from, hourly_rate)
+        SELECT id, ?, hourly_rate FROM jobs
+        WHERE id NOT IN (SELECT job_id FROM job_rates)
+    """, (RATE_EPOCH,))
+
     # Thêm khung giờ mẫu mặc định nếu chưa có
     cursor.execute("SELECT COUNT(*) FROM shift_presets")
     if cursor.fetchone()[0] == 0:
@@ -228,18 +336,24 @@ def init_database() -> None:
                 INSERT INTO shift_presets (preset_name, start_time, end_time, break_hours, total_hours, emoji, sort_order)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
             """, (name, start, end, brk, total, emoji, order))
-    
-    conn.commit()
-    conn.close()
 
 
-# Cờ để kiểm soát việc sync (tránh sync quá nhiều)
-ENABLE_SYNC = False # Tắt tạm thời do yêu cầu sửa lỗi
+# Cờ để kiểm soát việc sync (worker nền chỉ chạy khi GitHub đã được cấu hình)
+ENABLE_SYNC = True
 
 def _sync_to_github():
-    """Đồng bộ database của user hiện tại lên GitHub (Placeholder)."""
-    # TODO: Implement actual sync logic properly later
-    pass
+    """
+    Đồng bộ database của user hiện tại lên GitHub.
+    Chỉ đưa yêu cầu vào hàng đợi của sync_worker; việc đẩy chạy ở thread nền
+    nên không làm chậm thao tác ghi.
+    """
+    if not ENABLE_SYNC:
+        return
+    try:
+        import sync_worker
+        sync_worker.schedule_sync(get_db_path())
+    except Exception as e:
+        print(f"❌ Lỗi lên lịch đồng bộ: {e}")
 
 
 # ==================== SHIFT PRESETS (Khung giờ mẫu) ====================
@@ -262,21 +376,20 @@ def add_preset(preset_name: str, start_time: str, end_time: str,
                job_id: int = None, emoji: str = "⏰") -> Optional[int]:
     """Thêm khung giờ mẫu mới."""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        with write_connection() as conn:
+            cursor = conn.cursor()
         
-        # Lấy sort_order tiếp theo
-        cursor.execute("SELECT COALESCE(MAX(sort_order), 0) + 1 FROM shift_presets")
-        next_order = cursor.fetchone()[0]
+            # Lấy sort_order tiếp theo
+            cursor.execute("SELECT COALESCE(MAX(sort_order), 0) + 1 FROM shift_presets")
+            next_order = cursor.fetchone()[0]
         
-        cursor.execute("""
-            INSERT INTO shift_presets (preset_name, start_time, end_time, break_hours, total_hours, job_id, emoji, sort_order)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (preset_name, start_time, end_time, break_hours, total_hours, job_id, emoji, next_order))
+            cursor.execute("""
+                INSERT INTO shift_presets (preset_name, start_time, end_time, break_hours, total_hours, job_id, emoji, sort_order)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (preset_name, start_time, end_time, break_hours, total_hours, job_id, emoji, next_order))
         
-        preset_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+            preset_id = cursor.lastrowid
+        _sync_to_github()
         return preset_id
     except Exception as e:
         print(f"Error adding preset: {e}")
@@ -289,28 +402,27 @@ def update_preset(preset_id: int, **kwargs) -> bool:
         if not kwargs:
             return False
         
-        conn = get_connection()
-        cursor = conn.cursor()
+        with write_connection() as conn:
+            cursor = conn.cursor()
         
-        fields = []
-        values = []
-        allowed = ['preset_name', 'start_time', 'end_time', 'break_hours', 
-                    'total_hours', 'job_id', 'emoji', 'sort_order']
+            fields = []
+            values = []
+            allowed = ['preset_name', 'start_time', 'end_time', 'break_hours', 
+                        'total_hours', 'job_id', 'emoji', 'sort_order']
         
-        for key, value in kwargs.items():
-            if key in allowed:
-                fields.append(f"{key} = ?")
-                values.append(value)
+            for key, value in kwargs.items():
+                if key in allowed:
+                    fields.append(f"{key} = ?")
+                    values.append(value)
         
-        if not fields:
-            conn.close()
-            return False
+            if not fields:
+                return False
         
-        values.append(preset_id)
-        cursor.execute(f"UPDATE shift_presets SET {', '.join(fields)} WHERE id = ?", values)
-        conn.commit()
+            values.append(preset_id)
+            cursor.execute(f"UPDATE shift_presets SET {', '.join(fields)} WHERE id = ?", values)
         success = cursor.rowcount > 0
-        conn.close()
+        if success:
+            _sync_to_github()
         return success
     except Exception as e:
         print(f"Error updating preset: {e}")
@@ -320,12 +432,12 @@ def update_preset(preset_id: int, **kwargs) -> bool:
 def delete_preset(preset_id: int) -> bool:
     """Xóa khung giờ mẫu."""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM shift_presets WHERE id = ?", (preset_id,))
-        conn.commit()
+        with write_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM shift_presets WHERE id = ?", (preset_id,))
         success = cursor.rowcount > 0
-        conn.close()
+        if success:
+            _sync_to_github()
         return success
     except Exception as e:
         print(f"Error deleting preset: {e}")
@@ -337,80 +449,103 @@ def delete_preset(preset_id: int) -> bool:
 def add_job(job_name: str, hourly_rate: float, description: str = "", color: str = "#667eea") -> int:
     """Thêm công việc mới. Nếu đã tồn tại, trả về ID của job đó."""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Kiểm tra xem job đã tồn tại chưa
-        cursor.execute("SELECT id FROM jobs WHERE job_name = ?", (job_name,))
-        existing = cursor.fetchone()
-        
-        if existing:
-            # Nếu đã tồn tại, cập nhật lương và trả về ID
-            cursor.execute("""
-                UPDATE jobs SET hourly_rate = ?, description = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE job_name = ?
-            """, (hourly_rate, description, job_name))
-            conn.commit()
-            conn.close()
-            clear_cache()
-            _sync_to_github()
-            return existing[0]
-        
-        # Thêm mới nếu chưa tồn tại
-        cursor.execute("""
-            INSERT INTO jobs (job_name, hourly_rate, description, color)
-            VALUES (?, ?, ?, ?)
-        """, (job_name, hourly_rate, description, color))
-        
-        job_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with write_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Kiểm tra xem job đã tồn tại chưa
+            cursor.execute("SELECT id FROM jobs WHERE job_name = ?", (job_name,))
+            existing = cursor.fetchone()
+            
+            if existing:
+                # Nếu đã tồn tại, cập nhật lương và trả về ID
+                _record_rate_change(cursor, existing[0], hourly_rate, date.today())
+                cursor.execute("""
+                    UPDATE jobs SET hourly_rate = ?, description = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE job_name = ?
+                """, (hourly_rate, description, job_name))
+                job_id = existing[0]
+            else:
+                # Thêm mới nếu chưa tồn tại
+                cursor.execute("""
+                    INSERT INTO jobs (job_name, hourly_rate, description, color)
+                    VALUES (?, ?, ?, ?)
+                """, (job_name, hourly_rate, description, color))
+                
+                job_id = cursor.lastrowid
+                cursor.execute("""
+                    INSERT INTO job_rates (job_id, effective_from, hourly_rate) VALUES (?, ?, ?)
+                """, (job_id, RATE_EPOCH, hourly_rate))
         clear_cache()
         _sync_to_github()
         return job_id
-    except Exception:
+    except Exception as e:
+        print(f"Error in add_job: {e}")
         return -1
 
 
-def update_job(job_id: int, job_name: str, hourly_rate: float, description: str = "", color: str = "#667eea") -> bool:
-    """Cập nhật thông tin công việc."""
+def _record_rate_change(cursor: sqlite3.Cursor, job_id: int, hourly_rate: float,
+                        effective_from: Union[date, str]) -> None:
+    """
+    Ghi mốc lương mới vào job_rates nếu lương giờ thay đổi.
+    Mức lương cũ được giữ làm mốc gốc để các tháng trước không bị tính lại.
+    """
+    cursor.execute("SELECT hourly_rate FROM jobs WHERE id = ?", (job_id,))
+    row = cursor.fetchone()
+    if not row or row[0] == hourly_rate:
+        return
+
+    cursor.execute("""
+        INSERT OR IGNORE INTO job_rates (job_id, effective_from, hourly_rate) VALUES (?, ?, ?)
+    """, (job_id, RATE_EPOCH, row[0]))
+    cursor.execute("""
+        INSERT INTO job_rates (job_id, effective_from, hourly_rate) VALUES (?, ?, ?)
+        ON CONFLICT(job_id, effective_from) DO UPDATE SET hourly_rate = excluded.hourly_rate
+    """, (job_id, normalize_date(effective_from), hourly_rate))
+
+
+def update_job(job_id: int, job_name: str, hourly_rate: float, description: str = "",
+               color: str = "#667eea", effective_from: Optional[date] = None) -> bool:
+    """
+    Cập nhật thông tin công việc.
+    Nếu đổi lương giờ, mức mới áp dụng từ effective_from (mặc định: hôm nay).
+    """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            UPDATE jobs SET
-                job_name = ?,
-                hourly_rate = ?,
-                description = ?,
-                color = ?,
-                updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        """, (job_name, hourly_rate, description, color, job_id))
+        with write_connection() as conn:
+            cursor = conn.cursor()
+
+            _record_rate_change(cursor, job_id, hourly_rate, effective_from or date.today())
+            cursor.execute("""
+                UPDATE jobs SET
+                    job_name = ?,
+                    hourly_rate = ?,
+                    description = ?,
+                    color = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (job_name, hourly_rate, description, color, job_id))
         
-        conn.commit()
-        conn.close()
         clear_cache()  # Xóa cache khi cập nhật
         _sync_to_github()
         return True
-    except Exception:
+    except Exception as e:
+        print(f"Error in update_job: {e}")
         return False
 
 
 def delete_job(job_id: int) -> bool:
     """Xóa công việc."""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        with write_connection() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            cursor.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            cursor.execute("DELETE FROM job_rates WHERE job_id = ?", (job_id,))
         
-        conn.commit()
-        conn.close()
         clear_cache()  # Xóa cache khi xóa
         _sync_to_github()
         return True
-    except Exception:
+    except Exception as e:
+        print(f"Error in delete_job: {e}")
         return False
 
 
@@ -420,6 +555,7 @@ def get_all_jobs() -> List[Dict]:
     if cached is not None:
         return cached
     
+    epoch = _cache_epoch
     conn = get_connection()
     cursor = conn.cursor()
     
@@ -428,7 +564,7 @@ def get_all_jobs() -> List[Dict]:
     conn.close()
     
     result = [dict(row) for row in rows]
-    _set_cache('all_jobs', result)
+    _set_cache('all_jobs', result, epoch)
     return result
 
 
@@ -446,117 +582,207 @@ def get_job_by_id(job_id: int) -> Optional[Dict]:
     return None
 
 
+def get_shift_counts_by_job() -> Dict[int, int]:
+    """Đếm số ca của từng công việc (một truy vấn GROUP BY)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("SELECT job_id, COUNT(*) AS shift_count FROM work_shifts GROUP BY job_id")
+    counts = {row['job_id']: row['shift_count'] for row in cursor.fetchall()}
+    conn.close()
+    
+    return counts
+
+
+def get_job_rates(job_id: Optional[int] = None) -> List[Dict]:
+    """Lấy lịch sử lương giờ (theo ngày hiệu lực) của một hoặc tất cả công việc."""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    if job_id is None:
+        cursor.execute("SELECT * FROM job_rates ORDER BY job_id ASC, effective_from ASC")
+    else:
+        cursor.execute("""
+            SELECT * FROM job_rates WHERE job_id = ? ORDER BY effective_from ASC
+        """, (job_id,))
+    rows = cursor.fetchall()
+    conn.close()
+
+    return [dict(row) for row in rows]
+
+
+def get_rate_index() -> Dict:
+    """Lấy chỉ mục lương theo ngày hiệu lực (bisect) của mọi công việc (có cache)."""
+    db_path = get_db_path()
+    index = _rate_index_cache.get(db_path)
+    if index is None:
+        epoch = _cache_epoch
+        index = payroll.build_rate_index(get_job_rates())
+        if epoch == _cache_epoch:
+            _rate_index_cache[db_path] = index
+    return index
+
+
 def get_ot_rate() -> float:
     """Lấy hệ số lương OT."""
     value = get_setting("ot_rate")
-    return float(value) if value else 1.5
+    return float(value) if value else payroll.DEFAULT_OT_RATE
 
 
-def calculate_salary_by_month(year: int, month: int) -> Dict:
-    """
-    Tính lương theo tháng, phân chia theo từng công việc.
-    
-    Returns:
-        Dict với thông tin lương theo từng công việc và tổng lương
-    """
-    from datetime import timedelta
-    
-    start_date = date(year, month, 1)
-    if month == 12:
-        end_date = date(year + 1, 1, 1) - timedelta(days=1)
-    else:
-        end_date = date(year, month + 1, 1) - timedelta(days=1)
-    
+def get_payroll_rules(start_date: date, end_date: date) -> Dict:
+    """Biên dịch quy tắc tính lương (cài đặt, lương theo ngày, ngày lễ) cho một khoảng thời gian."""
     conn = get_connection()
     cursor = conn.cursor()
-    
-    # Lấy tất cả ca làm việc trong tháng với thông tin công việc
+
+    # Ngày lễ trong khoảng và cài đặt - dùng chung một kết nối
     cursor.execute("""
-        SELECT 
-            ws.*, 
-            j.job_name, 
-            j.hourly_rate,
-            j.color
-        FROM work_shifts ws
-        LEFT JOIN jobs j ON ws.job_id = j.id
-        WHERE ws.work_date BETWEEN ? AND ?
-        ORDER BY ws.work_date ASC
+        SELECT holiday_date FROM holidays
+        WHERE holiday_date BETWEEN ? AND ?
+    """, (start_date.isoformat(), end_date.isoformat()))
+    holidays = [row['holiday_date'] for row in cursor.fetchall()]
+
+    cursor.execute("SELECT key, value FROM settings")
+    settings = {row['key']: row['value'] for row in cursor.fetchall()}
+    conn.close()
+
+    return payroll.compile_rules(get_all_jobs(), holidays, settings, get_rate_index())
+
+
+def calculate_salary_by_range(start_date: date, end_date: date) -> Dict:
+    """Tính lương trong khoảng thời gian, theo lương giờ có hiệu lực tại ngày của từng ca."""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute("""
+        SELECT * FROM work_shifts
+        WHERE work_date BETWEEN ? AND ?
+        ORDER BY work_date ASC, start_time ASC, id ASC
     """, (start_date.isoformat(), end_date.isoformat()))
-    
     shifts = [dict(row) for row in cursor.fetchall()]
     conn.close()
-    
-    # Lấy cài đặt
-    standard_hours = get_standard_hours()
-    ot_rate = get_ot_rate()
-    
-    # Tính theo từng công việc
-    job_salary = {}
-    total_hours_all = 0
-    total_salary_all = 0
-    
-    for shift in shifts:
-        job_id = shift.get('job_id') or 0
-        job_name = shift.get('job_name') or 'Chưa phân loại'
-        hourly_rate = shift.get('hourly_rate') or 0
-        color = shift.get('color') or '#667eea'
-        hours = shift['total_hours']
-        
-        if job_id not in job_salary:
-            job_salary[job_id] = {
-                'job_id': job_id,
-                'job_name': job_name,
-                'hourly_rate': hourly_rate,
-                'color': color,
-                'total_hours': 0,
-                'shift_count': 0,
-                'base_salary': 0
-            }
-        
-        job_salary[job_id]['total_hours'] += hours
-        job_salary[job_id]['shift_count'] += 1
-        job_salary[job_id]['base_salary'] += hours * hourly_rate
-        total_hours_all += hours
-    
-    # Tính OT (tính theo tổng giờ ngày, không theo từng ca)
-    daily_hours = {}
-    for shift in shifts:
-        day = shift['work_date']
-        if day not in daily_hours:
-            daily_hours[day] = 0
-        daily_hours[day] += shift['total_hours']
-    
-    total_ot_hours = 0
-    for day, hours in daily_hours.items():
-        if hours > standard_hours:
-            total_ot_hours += hours - standard_hours
-    
-    # Tính tổng lương
-    for job_id, data in job_salary.items():
-        total_salary_all += data['base_salary']
-    
-    # Thêm tiền OT
-    if total_hours_all > 0 and total_salary_all > 0:
-        avg_hourly_rate = total_salary_all / total_hours_all
-        ot_bonus = total_ot_hours * avg_hourly_rate * (ot_rate - 1)  # Phần thưởng OT
-    else:
-        avg_hourly_rate = 0
-        ot_bonus = 0
-    
+
+    return payroll.calculate_payroll(shifts, get_payroll_rules(start_date, end_date))
+
+
+def calculate_salary_by_month(year: int, month: int) -> Dict:
+    """
+    Tính lương theo tháng, phân chia theo từng công việc.
+    Dùng chung bộ tính lương trong module payroll với chế độ Supabase.
+
+    Returns:
+        Dict với thông tin lương theo từng công việc và tổng lương
+    """
+    start_date, end_date = payroll.month_range(year, month)
+    result = calculate_salary_by_range(start_date, end_date)
+    return {'year': year, 'month': month, **result}
+
+
+# ==================== PAYROLL SNAPSHOTS (Chốt tháng) ====================
+
+def get_closed_months() -> List[Tuple[int, int]]:
+    """Lấy danh sách (năm, tháng) đã chốt lương."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT year, month FROM payroll_snapshots ORDER BY year ASC, month ASC")
+        rows = cursor.fetchall()
+        conn.close()
+        return [(row['year'], row['month']) for row in rows]
+    except Exception as e:
+        print(f"Error in get_closed_months: {e}")
+        return []
+
+
+def get_payroll_snapshot(year: int, month: int) -> Optional[Dict]:
+    """Lấy snapshot lương và tổng hợp theo ngày của tháng đã chốt."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT * FROM payroll_snapshots WHERE year = ? AND month = ?
+        """, (year, month))
+        row = cursor.fetchone()
+        conn.close()
+    except Exception as e:
+        print(f"Error in get_payroll_snapshot: {e}")
+        return None
+
+    if not row:
+        return None
     return {
-        'year': year,
-        'month': month,
-        'jobs': list(job_salary.values()),
-        'total_hours': round(total_hours_all, 2),
-        'total_ot_hours': round(total_ot_hours, 2),
-        'total_days': len(daily_hours),
-        'base_salary': round(total_salary_all, 0),
-        'ot_bonus': round(ot_bonus, 0),
-        'total_salary': round(total_salary_all + ot_bonus, 0),
-        'ot_rate': ot_rate
+        'year': row['year'],
+        'month': row['month'],
+        'salary': json.loads(row['salary_json']),
+        'daily': json.loads(row['daily_json']),
+        'closed_at': row['closed_at']
     }
 
 
+def get_payroll_snapshots(first: Tuple[int, int], last: Tuple[int, int]) -> Dict[Tuple[int, int], Dict]:
+    """Lấy snapshot lương của các tháng đã chốt từ tháng first đến last (một truy vấn)."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT year, month, salary_json FROM payroll_snapshots
+            WHERE year * 100 + month BETWEEN ? AND ?
+        """, (first[0] * 100 + first[1], last[0] * 100 + last[1]))
+        rows = cursor.fetchall()
+        conn.close()
+    except Exception as e:
+        print(f"Error in get_payroll_snapshots: {e}")
+        return {}
+
+    return {(row['year'], row['month']): json.loads(row['salary_json']) for row in rows}
+
+
+def save_payroll_snapshot(year: int, month: int, salary: Dict, daily: List[Dict]) -> bool:
+    """Lưu (hoặc ghi đè) snapshot của một tháng."""
+    try:
+        with write_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT OR REPLACE INTO payroll_snapshots (year, month, salary_json, daily_json, closed_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            """, (year, month, json.dumps(salary, ensure_ascii=False), json.dumps(daily, ensure_ascii=False)))
+        _sync_to_github()
+        return True
+    except Exception as e:
+        print(f"Error in save_payroll_snapshot: {e}")
+        return False
+
+
+def delete_payroll_snapshot(year: int, month: int) -> bool:
+    """Xóa snapshot (mở lại tháng)."""
+    try:
+        with write_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM payroll_snapshots WHERE year = ? AND month = ?", (year, month))
+        success = cursor.rowcount > 0
+        _sync_to_github()
+        return success
+    except Exception as e:
+        print(f"Error in delete_payroll_snapshot: {e}")
+        return False
+
+
+# ==================== DATA GENERATION ====================
+
+def get_data_generation() -> Optional[str]:
+    """
+    Thế hệ dữ liệu của database: token ngẫu nhiên do trigger đổi mỗi khi bảng
+    dữ liệu bị ghi (kể cả từ process khác). None nếu database chưa khởi tạo.
+    """
+    try:
+        conn = get_connection()
+        row = conn.execute("SELECT token FROM data_generation WHERE id = 1").fetchone()
+        conn.close()
+        return row['token'] if row else None
+    except Exception as e:
+        print(f"Error in get_data_generation: {e}")
+        return None
+
+
 # ==================== WORK SHIFTS (Nhiều ca/ngày) ====================
 
 def add_shift(
@@ -576,22 +802,20 @@ def add_shift(
         if not job:
             raise ValueError(f"Job ID {job_id} không tồn tại!")
         
-        conn = get_connection()
-        cursor = conn.cursor()
+        with write_connection() as conn:
+            cursor = conn.cursor()
         
-        work_date_str = normalize_date(work_date)
+            work_date_str = normalize_date(work_date)
         
-        cursor.execute("""
-            INSERT INTO work_shifts 
-            (work_date, job_id, start_time, end_time, break_hours, 
-             total_hours, overtime_hours, notes)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (work_date_str, job_id, start_time, end_time, 
-              break_hours, total_hours, overtime_hours, notes))
-        
-        shift_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+            cursor.execute("""
+                INSERT INTO work_shifts 
+                (work_date, job_id, start_time, end_time, break_hours, 
+                 total_hours, overtime_hours, notes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (work_date_str, job_id, start_time, end_time, 
+                  break_hours, total_hours, overtime_hours, notes))
+        
+            shift_id = cursor.lastrowid
         _sync_to_github()
         
         return shift_id
@@ -619,35 +843,32 @@ def update_shift(shift_id: int, **kwargs) -> bool:
         if not kwargs:
             return False
         
-        conn = get_connection()
-        cursor = conn.cursor()
+        with write_connection() as conn:
+            cursor = conn.cursor()
         
-        fields = []
-        values = []
-        allowed_fields = ['work_date', 'job_id', 'start_time', 'end_time', 
-                         'break_hours', 'total_hours', 'overtime_hours', 'notes', 'shift_name']
+            fields = []
+            values = []
+            allowed_fields = ['work_date', 'job_id', 'start_time', 'end_time', 
+                             'break_hours', 'total_hours', 'overtime_hours', 'notes', 'shift_name']
         
-        for key, value in kwargs.items():
-            if key in allowed_fields:
-                if key == 'work_date':
-                    value = normalize_date(value)
-                fields.append(f"{key} = ?")
-                values.append(value)
+            for key, value in kwargs.items():
+                if key in allowed_fields:
+                    if key == 'work_date':
+                        value = normalize_date(value)
+                    fields.append(f"{key} = ?")
+                    values.append(value)
         
-        if not fields:
-            conn.close()
-            return False
+            if not fields:
+                return False
         
-        values.append(shift_id)
-        # Update updated_at automatically
-        fields.append("updated_at = CURRENT_TIMESTAMP")
+            values.append(shift_id)
+            # Update updated_at automatically
+            fields.append("updated_at = CURRENT_TIMESTAMP")
         
-        query = f"UPDATE work_shifts SET {', '.join(fields)} WHERE id = ?"
+            query = f"UPDATE work_shifts SET {', '.join(fields)} WHERE id = ?"
         
-        cursor.execute(query, values)
-        conn.commit()
+            cursor.execute(query, values)
         success = cursor.rowcount > 0
-        conn.close()
         _sync_to_github()
         
         return success
@@ -663,12 +884,10 @@ def update_work_shift(shift_id, shift_name, start_time, end_time, break_hours, t
 def delete_shift(shift_id: int) -> bool:
     """Xóa ca làm việc."""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM work_shifts WHERE id = ?", (shift_id,))
-        conn.commit()
+        with write_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM work_shifts WHERE id = ?", (shift_id,))
         success = cursor.rowcount > 0
-        conn.close()
         _sync_to_github()
         return success
     except Exception as e:
@@ -746,7 +965,7 @@ def get_shifts_by_range(start_date: date, end_date: date) -> List[Dict]:
         cursor.execute("""
             SELECT * FROM work_shifts 
             WHERE work_date BETWEEN ? AND ?
-            ORDER BY work_date ASC, start_time ASC
+            ORDER BY work_date ASC, start_time ASC, id ASC
         """, (start_date.isoformat(), end_date.isoformat()))
         
         rows = cursor.fetchall()
@@ -846,13 +1065,12 @@ def delete_work_log(work_date: date) -> bool:
             delete_shift(shift['id'])
         
         # Cleanup legacy table too
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM work_logs WHERE work_date = ?", (work_date.isoformat(),))
-        conn.commit()
-        conn.close()
+        with write_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM work_logs WHERE work_date = ?", (work_date.isoformat(),))
         return True
-    except Exception:
+    except Exception as e:
+        print(f"Error in delete_work_log: {e}")
         return False
 
 
@@ -861,16 +1079,14 @@ def delete_work_log(work_date: date) -> bool:
 def add_holiday(holiday_date: date, description: str) -> bool:
     """Thêm ngày nghỉ lễ."""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        with write_connection() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute("""
-            INSERT OR REPLACE INTO holidays (holiday_date, description)
-            VALUES (?, ?)
-        """, (holiday_date.isoformat(), description))
+            cursor.execute("""
+                INSERT OR REPLACE INTO holidays (holiday_date, description)
+                VALUES (?, ?)
+            """, (holiday_date.isoformat(), description))
         
-        conn.commit()
-        conn.close()
         _sync_to_github()
         return True
     except Exception as e:
@@ -881,14 +1097,12 @@ def add_holiday(holiday_date: date, description: str) -> bool:
 def remove_holiday(holiday_date: date) -> bool:
     """Xóa ngày nghỉ lễ."""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        with write_connection() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute("DELETE FROM holidays WHERE holiday_date = ?", 
-                      (holiday_date.isoformat(),))
+            cursor.execute("DELETE FROM holidays WHERE holiday_date = ?", 
+                          (holiday_date.isoformat(),))
         
-        conn.commit()
-        conn.close()
         _sync_to_github()
         return True
     except Exception as e:
@@ -958,21 +1172,31 @@ def get_setting(key: str) -> Optional[str]:
     return None
 
 
+def get_all_settings() -> Dict[str, str]:
+    """Lấy toàn bộ cài đặt (key -> value) trong một truy vấn."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("SELECT key, value FROM settings")
+    settings = {row['key']: row['value'] for row in cursor.fetchall()}
+    conn.close()
+    
+    return settings
+
+
 def update_setting(key: str, value: str) -> bool:
     """Cập nhật một cài đặt."""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        with write_connection() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute("""
-            INSERT INTO settings (key, value) VALUES (?, ?)
-            ON CONFLICT(key) DO UPDATE SET 
-            value = excluded.value,
-            updated_at = CURRENT_TIMESTAMP
-        """, (key, value))
+            cursor.execute("""
+                INSERT INTO settings (key, value) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET 
+                value = excluded.value,
+                updated_at = CURRENT_TIMESTAMP
+            """, (key, value))
         
-        conn.commit()
-        conn.close()
         _sync_to_github()
         return True
     except Exception as e:
@@ -3,15 +3,29 @@
 Database Wrapper - Tự động chọn Supabase (cloud) hoặc SQLite (local).
 Chế độ ưu tiên: Supabase ONLY khi available, SQLite chỉ khi không có Supabase.
 Không còn fallback: khi dùng Supabase thì KHÔNG lưu SQLite.
+
+SQLite có hai cách bố trí (DB_LAYOUT): "per_user" (mặc định, mỗi user một file,
+module database) hoặc "multi_tenant" (một file chung phân vùng theo user_id,
+module tenant_db, cùng API với supabase_db).
 """
 
+import functools
+import os
+import threading
 from datetime import date
-from typing import List, Dict, Optional, Union
+from typing import Callable, List, Dict, Optional, Union
 import database as sqlite_db
+import payroll
+import ref_cache
+import result_cache
+import sqlite_writer
+import tenant_context
+import tenant_db
 
 # Thử import Supabase
 try:
     import supabase_db
+    import cloud_mirror
     _SUPABASE_MODULE_OK = True
 except Exception:
     _SUPABASE_MODULE_OK = False
@@ -22,6 +36,16 @@ _DEFAULT_USER_ID = 1
 # Cache trạng thái Supabase (tránh check liên tục)
 _supabase_available = None
 
+# Cách bố trí SQLite: "per_user" | "multi_tenant" (cache sau lần đọc cấu hình đầu tiên)
+DB_LAYOUTS = ('per_user', 'multi_tenant')
+_db_layout = None
+
+# User đã được provision trong process này ((tên backend, user_id)); xem init_database
+_provisioned_users = set()
+
+# Memo đọc theo lượt chạy script (một rerun của Streamlit chạy trên một thread)
+_request_state = threading.local()
+
 
 def _check_supabase() -> bool:
     """Kiểm tra Supabase có sẵn không (cache kết quả)."""
@@ -39,9 +63,56 @@ def _check_supabase() -> bool:
     return _supabase_available
 
 
+def get_db_layout() -> str:
+    """Cách bố trí SQLite: DB_LAYOUT trong secrets, rồi biến môi trường, mặc định per_user."""
+    global _db_layout
+    if _db_layout is not None:
+        return _db_layout
+
+    layout = None
+    try:
+        import streamlit as st
+        if "DB_LAYOUT" in st.secrets:
+            layout = st.secrets["DB_LAYOUT"]
+    except Exception:
+        pass
+    layout = (layout or os.environ.get("DB_LAYOUT", "per_user")).strip().lower()
+    if layout not in DB_LAYOUTS:
+        print(f"⚠️ DB_LAYOUT không hợp lệ: {layout}, dùng per_user")
+        layout = 'per_user'
+    _db_layout = layout
+    return _db_layout
+
+
+def is_multi_tenant() -> bool:
+    """Đang dùng SQLite một file chung cho mọi user (không áp dụng khi có Supabase)."""
+    return not _check_supabase() and get_db_layout() == 'multi_tenant'
+
+
+def _is_partitioned() -> bool:
+    """Dữ liệu phân vùng theo user_id (Supabase hoặc SQLite multi-tenant)."""
+    return _check_supabase() or get_db_layout() == 'multi_tenant'
+
+
+def _partitioned_db():
+    """
+    Module backend phân vùng theo user_id: tenant_db, hoặc khi có Supabase
+    cloud_mirror (bản sao đọc SQLite local, CLOUD_MIRROR bật) / supabase_db.
+    """
+    if not _check_supabase():
+        return tenant_db
+    return cloud_mirror if cloud_mirror.is_enabled() else supabase_db
+
+
+def current_user_id() -> int:
+    """user_id dùng cho backend phân vùng (Supabase / multi-tenant)."""
+    return _uid()
+
+
 def _uid() -> int:
-    """Luôn trả về default user ID (không cần login)."""
-    return _DEFAULT_USER_ID
+    """user_id của tenant hiện tại (tenant_context), mặc định _DEFAULT_USER_ID (không cần login)."""
+    user_id = tenant_context.current_user_id()
+    return _DEFAULT_USER_ID if user_id is None else user_id
 
 
 def is_cloud_mode() -> bool:
@@ -49,38 +120,192 @@ def is_cloud_mode() -> bool:
     return _check_supabase()
 
 
+def get_outbox_status() -> Optional[Dict]:
+    """Trạng thái gửi các lần ghi lên Supabase (chỉ khi ghi qua bản sao cloud_mirror)."""
+    if not _SUPABASE_MODULE_OK or _partitioned_db() is not cloud_mirror:
+        return None
+    return cloud_mirror.get_outbox_status(_uid())
+
+
+# ==================== REQUEST MEMO ====================
+
+def begin_request():
+    """
+    Bắt đầu một lượt chạy script (gọi ở đầu app.py mỗi rerun).
+    Các lần đọc giống nhau trong cùng lượt chỉ truy vấn database một lần;
+    mọi thao tác ghi xóa memo. Ngoài lượt chạy (script, thread khác) không có memo.
+    """
+    _request_state.memo = {}
+
+
+def _memoized(key: tuple, loader: Callable):
+    """Trả về kết quả đã đọc trong lượt chạy hiện tại, hoặc gọi loader."""
+    memo = getattr(_request_state, 'memo', None)
+    if memo is None:
+        return loader()
+    if key not in memo:
+        memo[key] = loader()
+    return memo[key]
+
+
+def _invalidate_memo():
+    """Xóa memo đọc của lượt chạy hiện tại (sau khi ghi)."""
+    memo = getattr(_request_state, 'memo', None)
+    if memo:
+        memo.clear()
+
+
+def _writes(func: Callable) -> Callable:
+    """Đánh dấu hàm ghi: xóa memo đọc sau khi chạy (kể cả khi lỗi)."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _invalidate_memo()
+    return wrapper
+
+
+# ==================== REFERENCE CACHE ====================
+# Dữ liệu tham chiếu (công việc, lương, khung giờ mẫu, ngày nghỉ, cài đặt) dùng
+# chung giữa các session qua ref_cache; hàm ghi hủy đúng các bảng nó sửa.
+
+def _ref_scope() -> tuple:
+    """Phạm vi dữ liệu hiện tại: user của backend phân vùng, hoặc file SQLite của user."""
+    if _is_partitioned():
+        return ref_cache.user_scope(_uid())
+    return ref_cache.db_scope(sqlite_db.get_db_path())
+
+
+def _reference(table: str, key: tuple, loader: Callable):
+    """Đọc dữ liệu tham chiếu: memo của lượt chạy, rồi cache dùng chung của process."""
+    backend = _partitioned_db().__name__ if _is_partitioned() else 'database'
+    return _memoized(key, lambda: ref_cache.get_or_load(_ref_scope(), table, (backend,) + key, loader))
+
+
+def _writes_to(*tables: str) -> Callable:
+    """Hàm ghi vào các bảng tham chiếu: như _writes, và hủy cache của các bảng đó."""
+    def decorate(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            scope = _ref_scope()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                ref_cache.invalidate(scope, *tables)
+        return _writes(wrapper)
+    return decorate
+
+
+def get_reference_cache_stats() -> Dict:
+    """Số lần trúng / trượt của cache dữ liệu tham chiếu (panel debug)."""
+    return ref_cache.get_stats()
+
+
+# ==================== RESULT CACHE ====================
+# Kết quả tổng hợp (lương theo tháng, tổng hợp theo ngày, file xuất) dùng chung
+# giữa các process qua result_cache (file SQLite local, RESULT_CACHE bật). Khóa
+# gồm thế hệ dữ liệu của user (trigger đổi khi ghi) nên hàm ghi không cần hủy.
+# Kết quả lưu theo thế hệ mới phải được tính từ dữ liệu của thế hệ đó: thế hệ
+# đổi (kể cả do process khác ghi) thì bỏ cache trong process của phạm vi đó
+# (ref_cache, cache của database.py, memo) trước khi tính.
+
+# Thế hệ dữ liệu process này thấy gần nhất, theo phạm vi
+_seen_generations: Dict[str, str] = {}
+_seen_generations_lock = threading.Lock()
+
+
+def _drop_stale_local_caches(scope: str, generation: str) -> None:
+    """Bỏ cache trong process của phạm vi nếu thế hệ dữ liệu khác lần thấy trước (hoặc chưa thấy)."""
+    with _seen_generations_lock:
+        if _seen_generations.get(scope) == generation:
+            return
+        _seen_generations[scope] = generation
+    ref_cache.invalidate(_ref_scope())
+    if not _is_partitioned():
+        sqlite_db.clear_cache(sqlite_db.get_db_path())
+    _invalidate_memo()
+
+
+def _data_generation(start_date: Optional[date] = None) -> Optional[tuple]:
+    """(phạm vi, thế hệ dữ liệu) hiện tại; None nếu backend không có (Supabase đọc thẳng)."""
+    def load():
+        if _is_partitioned():
+            backend = _partitioned_db()
+            generation = backend.get_data_generation(_uid(), start_date)
+            scope = f"{backend.__name__}:{_uid()}"
+        else:
+            generation = sqlite_db.get_data_generation()
+            scope = os.path.abspath(sqlite_db.get_db_path())
+        if generation is None:
+            return None
+        _drop_stale_local_caches(scope, generation)
+        return scope, generation
+    return _memoized(('data_generation', start_date), load)
+
+
+def cached_result(kind: str, params: tuple, compute: Callable, start_date: Optional[date] = None):
+    """
+    Kết quả tổng hợp qua result_cache (mọi process cùng thế hệ dữ liệu dùng chung).
+
+    Args:
+        kind, params: Loại kết quả và tham số (phần còn lại của khóa)
+        compute: Tính kết quả khi chưa có trong cache
+        start_date: Ngày sớm nhất kết quả đọc tới (bản sao cloud chỉ giữ các tháng gần đây)
+    """
+    if not result_cache.is_enabled():
+        return compute()
+    current = _data_generation(start_date)
+    if current is None:
+        return compute()
+    return result_cache.get_or_compute(*current, kind, params, compute)
+
+
+def get_result_cache_stats() -> Optional[Dict]:
+    """Số liệu của cache kết quả trên đĩa (panel debug); None khi tắt."""
+    return result_cache.get_stats() if result_cache.is_enabled() else None
+
+
+def get_write_stats() -> Dict:
+    """Số liệu ghi SQLite của process: transaction, chờ khóa ghi, lỗi khóa (sqlite_writer)."""
+    return sqlite_writer.get_stats()
+
+
 # ==================== SHIFT PRESETS ====================
 
 def get_all_presets() -> List[Dict]:
     """Lấy tất cả khung giờ mẫu."""
-    if _check_supabase():
-        return supabase_db.get_all_presets(_uid())
-    return sqlite_db.get_all_presets()
+    if _is_partitioned():
+        return _reference('shift_presets', ('presets',), lambda: _partitioned_db().get_all_presets(_uid()))
+    return _reference('shift_presets', ('presets',), sqlite_db.get_all_presets)
 
 
+@_writes_to('shift_presets')
 def add_preset(preset_name: str, start_time: str, end_time: str,
                break_hours: float, total_hours: float,
                job_id: int = None, emoji: str = "⏰") -> Optional[int]:
     """Thêm khung giờ mẫu mới."""
-    if _check_supabase():
-        return supabase_db.add_preset(
+    if _is_partitioned():
+        return _partitioned_db().add_preset(
             _uid(), preset_name, start_time, end_time,
             break_hours, total_hours, job_id, emoji
         )
     return sqlite_db.add_preset(preset_name, start_time, end_time, break_hours, total_hours, job_id, emoji)
 
 
+@_writes_to('shift_presets')
 def update_preset(preset_id: int, **kwargs) -> bool:
     """Cập nhật khung giờ mẫu."""
-    if _check_supabase():
-        return supabase_db.update_preset(_uid(), preset_id, **kwargs)
+    if _is_partitioned():
+        return _partitioned_db().update_preset(_uid(), preset_id, **kwargs)
     return sqlite_db.update_preset(preset_id, **kwargs)
 
 
+@_writes_to('shift_presets')
 def delete_preset(preset_id: int) -> bool:
     """Xóa khung giờ mẫu."""
-    if _check_supabase():
-        return supabase_db.delete_preset(_uid(), preset_id)
+    if _is_partitioned():
+        return _partitioned_db().delete_preset(_uid(), preset_id)
     return sqlite_db.delete_preset(preset_id)
 
 
@@ -88,45 +313,87 @@ def delete_preset(preset_id: int) -> bool:
 
 def get_all_jobs() -> List[Dict]:
     """Lấy tất cả công việc."""
-    if _check_supabase():
-        return supabase_db.get_all_jobs(_uid())
-    return sqlite_db.get_all_jobs()
+    if _is_partitioned():
+        return _reference('jobs', ('jobs',), lambda: _partitioned_db().get_all_jobs(_uid()))
+    return _reference('jobs', ('jobs',), sqlite_db.get_all_jobs)
 
 
+@_writes_to('jobs', 'job_rates')
 def add_job(job_name: str, hourly_rate: float, description: str = "", color: str = "#667eea") -> Optional[int]:
-    """Thêm công việc mới."""
-    if _check_supabase():
-        return supabase_db.add_job(_uid(), job_name, hourly_rate, description, color)
+    """Thêm công việc mới (trùng tên thì cập nhật; lương đổi thì ghi mốc lương từ hôm nay)."""
+    if _is_partitioned():
+        current = next((job for job in get_all_jobs() if job['job_name'] == job_name), None)
+        if current and current.get('hourly_rate') != hourly_rate:
+            _partitioned_db().record_rate_change(
+                _uid(), current['id'], current.get('hourly_rate') or 0, hourly_rate,
+                date.today(), sqlite_db.RATE_EPOCH
+            )
+        return _partitioned_db().add_job(_uid(), job_name, hourly_rate, description, color)
     return sqlite_db.add_job(job_name, hourly_rate, description, color)
 
 
-def update_job(job_id: int, job_name: str, hourly_rate: float, description: str = "", color: str = "#667eea") -> bool:
-    """Cập nhật công việc."""
-    if _check_supabase():
-        return supabase_db.update_job(job_id, job_name, hourly_rate, description, color)
-    return sqlite_db.update_job(job_id, job_name, hourly_rate, description, color)
+@_writes_to('jobs', 'job_rates')
+def update_job(job_id: int, job_name: str, hourly_rate: float, description: str = "",
+               color: str = "#667eea", effective_from: Optional[date] = None) -> bool:
+    """Cập nhật công việc. Lương giờ mới áp dụng từ effective_from (mặc định: hôm nay)."""
+    if _is_partitioned():
+        current = get_job_by_id(job_id)
+        if current and current.get('hourly_rate') != hourly_rate:
+            _partitioned_db().record_rate_change(
+                _uid(), job_id, current.get('hourly_rate') or 0, hourly_rate,
+                effective_from or date.today(), sqlite_db.RATE_EPOCH
+            )
+        return _partitioned_db().update_job(_uid(), job_id, job_name, hourly_rate, description, color)
+    return sqlite_db.update_job(job_id, job_name, hourly_rate, description, color, effective_from)
 
 
+@_writes_to('jobs', 'job_rates', 'shift_presets')
 def delete_job(job_id: int) -> bool:
     """Xóa công việc."""
-    if _check_supabase():
-        return supabase_db.delete_job(job_id)
+    if _is_partitioned():
+        return _partitioned_db().delete_job(_uid(), job_id)
     return sqlite_db.delete_job(job_id)
 
 
 def get_job_by_id(job_id: int) -> Optional[Dict]:
     """Lấy thông tin công việc theo ID."""
-    if _check_supabase():
-        jobs = supabase_db.get_all_jobs(_uid())
-        for job in jobs:
+    if _is_partitioned():
+        if _partitioned_db() is cloud_mirror:
+            job_id = cloud_mirror.resolve_id(_uid(), job_id)
+        for job in get_all_jobs():
             if job['id'] == job_id:
                 return job
         return None
-    return sqlite_db.get_job_by_id(job_id)
+    return _reference('jobs', ('job', job_id), lambda: sqlite_db.get_job_by_id(job_id))
+
+
+def get_shift_counts_by_job() -> Dict[int, int]:
+    """Số ca đang dùng từng công việc."""
+    if _is_partitioned():
+        return _memoized(('shift_counts',), lambda: _partitioned_db().get_shift_counts_by_job(_uid()))
+    return _memoized(('shift_counts',), sqlite_db.get_shift_counts_by_job)
+
+
+def get_job_rates(job_id: Optional[int] = None) -> List[Dict]:
+    """Lấy lịch sử lương giờ theo ngày hiệu lực."""
+    if _is_partitioned():
+        rates = _reference('job_rates', ('job_rates',), lambda: _partitioned_db().get_job_rates(_uid()))
+        if job_id is not None:
+            rates = [r for r in rates if r['job_id'] == job_id]
+        return rates
+    return _reference('job_rates', ('job_rates', job_id), lambda: sqlite_db.get_job_rates(job_id))
+
+
+def get_rate_index() -> Dict:
+    """Lấy chỉ mục lương theo ngày hiệu lực (bisect, cache cùng lịch sử lương)."""
+    if _is_partitioned():
+        return _reference('job_rates', ('rate_index',), lambda: payroll.build_rate_index(get_job_rates()))
+    return sqlite_db.get_rate_index()
 
 
 # ==================== WORK SHIFTS ====================
 
+@_writes
 def add_shift(
     work_date: Union[date, str],
     job_id: int,
@@ -137,14 +404,16 @@ def add_shift(
     overtime_hours: float = 0.0,
     notes: str = ""
 ) -> Optional[int]:
-    """Thêm ca làm việc mới."""
-    if _check_supabase():
+    """Thêm ca làm việc mới (bị từ chối nếu ngày thuộc tháng đã chốt)."""
+    if _reject_closed_period('add_shift', work_date):
+        return None
+    if _is_partitioned():
         if isinstance(work_date, str):
             work_date_obj = date.fromisoformat(work_date)
         else:
             work_date_obj = work_date
         
-        return supabase_db.add_work_shift(
+        return _partitioned_db().add_work_shift(
             user_id=_uid(),
             work_date=work_date_obj,
             shift_name="Ca làm",
@@ -161,10 +430,17 @@ def add_shift(
     )
 
 
+@_writes
 def update_shift(shift_id: int, **kwargs) -> bool:
-    """Cập nhật ca làm việc."""
-    if _check_supabase():
-        return supabase_db.update_work_shift(
+    """Cập nhật ca làm việc (bị từ chối nếu ca thuộc tháng đã chốt)."""
+    current = get_shift_by_id(shift_id)
+    if current and _reject_closed_period('update_shift', current['work_date']):
+        return False
+    if 'work_date' in kwargs and _reject_closed_period('update_shift', kwargs['work_date']):
+        return False
+    if _is_partitioned():
+        return _partitioned_db().update_work_shift(
+            user_id=_uid(),
             shift_id=shift_id,
             shift_name=kwargs.get('shift_name', 'Ca làm'),
             start_time=kwargs.get('start_time', '09:00'),
@@ -176,39 +452,38 @@ def update_shift(shift_id: int, **kwargs) -> bool:
     return sqlite_db.update_shift(shift_id, **kwargs)
 
 
+@_writes
 def delete_shift(shift_id: int) -> bool:
-    """Xóa ca làm việc."""
-    if _check_supabase():
-        return supabase_db.delete_work_shift(shift_id)
+    """Xóa ca làm việc (bị từ chối nếu ca thuộc tháng đã chốt)."""
+    current = get_shift_by_id(shift_id)
+    if current and _reject_closed_period('delete_shift', current['work_date']):
+        return False
+    if _is_partitioned():
+        return _partitioned_db().delete_work_shift(_uid(), shift_id)
     return sqlite_db.delete_shift(shift_id)
 
 
 def get_shift_by_id(shift_id: int) -> Optional[Dict]:
     """Lấy shift theo ID."""
-    if _check_supabase():
-        # Supabase chưa có hàm riêng, tìm trong tất cả shifts
-        from datetime import timedelta
-        today = date.today()
-        shifts = get_shifts_by_range(today - timedelta(days=365), today + timedelta(days=30))
-        for s in shifts:
-            if s['id'] == shift_id:
-                return s
-        return None
-    return sqlite_db.get_shift_by_id(shift_id)
+    if _is_partitioned():
+        return _memoized(('shift', shift_id), lambda: _partitioned_db().get_shift_by_id(_uid(), shift_id))
+    return _memoized(('shift', shift_id), lambda: sqlite_db.get_shift_by_id(shift_id))
 
 
 def get_shifts_by_date(work_date: date) -> List[Dict]:
     """Lấy các ca làm việc theo ngày."""
-    if _check_supabase():
-        return supabase_db.get_shifts_by_date(_uid(), work_date)
-    return sqlite_db.get_shifts_by_date(work_date)
+    key = ('shifts_by_date', work_date.isoformat())
+    if _is_partitioned():
+        return _memoized(key, lambda: _partitioned_db().get_shifts_by_date(_uid(), work_date))
+    return _memoized(key, lambda: sqlite_db.get_shifts_by_date(work_date))
 
 
 def get_shifts_by_range(start_date: date, end_date: date) -> List[Dict]:
     """Lấy các ca làm việc trong khoảng thời gian."""
-    if _check_supabase():
-        return supabase_db.get_shifts_by_range(_uid(), start_date, end_date)
-    return sqlite_db.get_shifts_by_range(start_date, end_date)
+    key = ('shifts_by_range', start_date.isoformat(), end_date.isoformat())
+    if _is_partitioned():
+        return _memoized(key, lambda: _partitioned_db().get_shifts_by_range(_uid(), start_date, end_date))
+    return _memoized(key, lambda: sqlite_db.get_shifts_by_range(start_date, end_date))
 
 
 # Legacy aliases
@@ -261,7 +536,36 @@ def get_daily_summary(work_date: date, standard_hours: float = 8.0) -> Dict:
 
 
 def get_daily_summaries_by_range(start_date: date, end_date: date, standard_hours: float = 8.0) -> List[Dict]:
-    """Lấy tổng hợp giờ làm theo ngày trong khoảng thời gian."""
+    """Lấy tổng hợp giờ làm theo ngày; tháng đã chốt đọc từ snapshot."""
+    return cached_result('daily_summaries', (start_date, end_date, standard_hours),
+                         lambda: _daily_summaries(start_date, end_date, standard_hours), start_date)
+
+
+def _daily_summaries(start_date: date, end_date: date, standard_hours: float) -> List[Dict]:
+    """Tổng hợp theo ngày không qua result_cache (snapshot cho tháng đã chốt)."""
+    closed_months = get_closed_months()
+    if not closed_months:
+        return _summarize_days(start_date, end_date, standard_hours)
+
+    result = []
+    for month_key, seg_start, seg_end in payroll.split_closed_periods(start_date, end_date, closed_months):
+        snapshot = get_month_snapshot(*month_key) if month_key else None
+        if snapshot is not None:
+            result.extend(snapshot['daily'])
+        else:
+            result.extend(_summarize_days(seg_start, seg_end, standard_hours))
+    return result
+
+
+def _summarize_days(start_date: date, end_date: date, standard_hours: float) -> List[Dict]:
+    """Gộp các ca làm việc (dữ liệu gốc) theo ngày."""
+    if _is_partitioned():
+        key = ('daily_aggregates', start_date.isoformat(), end_date.isoformat())
+        rows = _memoized(key, lambda: _partitioned_db().get_daily_aggregates(_uid(), start_date, end_date))
+        if rows is not None:
+            # Tổng hợp phía backend: một dòng mỗi ngày, không kèm danh sách ca (như snapshot)
+            return [payroll.summarize_day(row, standard_hours) for row in rows]
+
     shifts = get_shifts_by_range(start_date, end_date)
     
     if not shifts:
@@ -306,100 +610,132 @@ def get_daily_summaries_by_range(start_date: date, end_date: date, standard_hour
 
 
 def get_daily_summaries_by_month(year: int, month: int, standard_hours: float = 8.0) -> List[Dict]:
-    """Lấy tổng hợp giờ làm theo ngày trong một tháng."""
-    from datetime import timedelta
-    start_date = date(year, month, 1)
-    if month == 12:
-        end_date = date(year + 1, 1, 1) - timedelta(days=1)
-    else:
-        end_date = date(year, month + 1, 1) - timedelta(days=1)
-    return get_daily_summaries_by_range(start_date, end_date, standard_hours)
+    """Lấy tổng hợp giờ làm theo ngày trong một tháng (tháng đã chốt: một lần đọc snapshot)."""
+    start_date, end_date = payroll.month_range(year, month)
+
+    def compute():
+        snapshot = get_month_snapshot(year, month)
+        if snapshot is not None:
+            return snapshot['daily']
+        return _summarize_days(start_date, end_date, standard_hours)
+    return cached_result('daily_summaries_month', (year, month, standard_hours), compute, start_date)
 
 
 # ==================== HOLIDAYS ====================
 
+@_writes_to('holidays')
 def add_holiday(holiday_date: date, description: str) -> bool:
     """Thêm ngày nghỉ."""
-    if _check_supabase():
-        return supabase_db.add_holiday(_uid(), holiday_date, description)
+    if _is_partitioned():
+        return _partitioned_db().add_holiday(_uid(), holiday_date, description)
     return sqlite_db.add_holiday(holiday_date, description)
 
 
+@_writes_to('holidays')
 def remove_holiday(holiday_date: date) -> bool:
     """Xóa ngày nghỉ."""
-    if _check_supabase():
-        return supabase_db.remove_holiday(_uid(), holiday_date)
+    if _is_partitioned():
+        return _partitioned_db().remove_holiday(_uid(), holiday_date)
     return sqlite_db.remove_holiday(holiday_date)
 
 
 def get_all_holidays() -> List[Dict]:
     """Lấy tất cả ngày nghỉ."""
-    if _check_supabase():
-        return supabase_db.get_all_holidays(_uid())
-    return sqlite_db.get_all_holidays()
+    if _is_partitioned():
+        return _reference('holidays', ('holidays',), lambda: _partitioned_db().get_all_holidays(_uid()))
+    return _reference('holidays', ('holidays',), sqlite_db.get_all_holidays)
+
+
+def get_holidays_by_range(start_date: date, end_date: date) -> List[Dict]:
+    """Lấy ngày nghỉ trong khoảng thời gian (backend lọc, không tải cả bảng)."""
+    key = ('holidays', start_date.isoformat(), end_date.isoformat())
+    if _is_partitioned():
+        return _reference('holidays', key, lambda: _partitioned_db().get_holidays_by_range(_uid(), start_date, end_date))
+    return _reference('holidays', key, lambda: [
+        h for h in sqlite_db.get_all_holidays()
+        if start_date.isoformat() <= str(h.get('holiday_date', '')) <= end_date.isoformat()
+    ])
 
 
 def get_holidays_by_year(year: int) -> List[Dict]:
     """Lấy danh sách ngày nghỉ trong năm."""
-    all_holidays = get_all_holidays()
-    return [h for h in all_holidays if str(h.get('holiday_date', '')).startswith(str(year))]
+    if _is_partitioned():
+        return get_holidays_by_range(date(year, 1, 1), date(year, 12, 31))
+    return _reference('holidays', ('holidays', year), lambda: sqlite_db.get_holidays_by_year(year))
 
 
 def is_holiday(check_date: date) -> tuple:
     """Kiểm tra ngày nghỉ."""
-    if _check_supabase():
-        return supabase_db.is_holiday(_uid(), check_date)
-    return sqlite_db.is_holiday(check_date)
+    key = ('is_holiday', check_date.isoformat())
+    if _is_partitioned():
+        return _reference('holidays', key, lambda: _partitioned_db().is_holiday(_uid(), check_date))
+    return _reference('holidays', key, lambda: sqlite_db.is_holiday(check_date))
 
 
 # ==================== SETTINGS ====================
 
+def get_all_settings() -> Dict[str, str]:
+    """Lấy toàn bộ cài đặt trong một truy vấn (dùng chung cho mọi get_setting trong lượt chạy)."""
+    if _is_partitioned():
+        return _reference('settings', ('settings',), lambda: _partitioned_db().get_all_settings(_uid()))
+    return _reference('settings', ('settings',), sqlite_db.get_all_settings)
+
+
 def get_setting(key: str) -> Optional[str]:
     """Lấy cài đặt."""
-    if _check_supabase():
-        return supabase_db.get_setting(_uid(), key)
-    return sqlite_db.get_setting(key)
+    return get_all_settings().get(key)
+
+
+def _get_float_setting(key: str, default: float) -> float:
+    """Lấy cài đặt dạng số, dùng mặc định nếu chưa có."""
+    value = get_setting(key)
+    return float(value) if value else default
 
 
+@_writes_to('settings')
 def update_setting(key: str, value: str) -> bool:
     """Cập nhật cài đặt."""
-    if _check_supabase():
-        return supabase_db.update_setting(_uid(), key, value)
+    if _is_partitioned():
+        return _partitioned_db().update_setting(_uid(), key, value)
     return sqlite_db.update_setting(key, value)
 
 
 def get_standard_hours() -> float:
     """Lấy số giờ chuẩn."""
-    if _check_supabase():
-        return supabase_db.get_standard_hours(_uid())
-    return sqlite_db.get_standard_hours()
+    return _get_float_setting('standard_hours', payroll.DEFAULT_STANDARD_HOURS)
 
 
 def get_default_break_hours() -> float:
     """Lấy giờ nghỉ mặc định."""
-    if _check_supabase():
-        return supabase_db.get_default_break_hours(_uid())
-    return sqlite_db.get_default_break_hours()
+    return _get_float_setting('break_hours', 1.0)
 
 
 def get_ot_rate() -> float:
     """Lấy hệ số OT."""
-    if _check_supabase():
-        value = supabase_db.get_setting(_uid(), 'ot_rate')
-        return float(value) if value else 1.25
-    return sqlite_db.get_ot_rate()
+    return _get_float_setting('ot_rate', payroll.DEFAULT_OT_RATE)
 
 
 # ==================== DATABASE INIT ====================
 
+@_writes
 def init_database():
     """Khởi tạo database."""
-    if _check_supabase():
-        # Chỉ dùng Supabase — không cần init SQLite
+    if _is_partitioned():
+        # Supabase / multi-tenant: khởi tạo dữ liệu mặc định của user một lần;
+        # sau đó cả process không kiểm tra lại (không tốn round trip mỗi rerun).
+        # Với cloud_mirror lần kiểm tra này nạp bản sao local của user (sau đăng nhập)
+        backend = _partitioned_db()
+        key = (backend.__name__, _uid())
+        if key in _provisioned_users:
+            return
         try:
-            supabase_db.init_user_default_data(_uid())
+            if backend.is_user_provisioned(_uid()):
+                _provisioned_users.add(key)
+            elif backend.provision_user(_uid()):
+                _provisioned_users.add(key)
+                ref_cache.invalidate(_ref_scope())   # dữ liệu mặc định vừa tạo
         except Exception as e:
-            print(f"Supabase init warning: {e}")
+            print(f"Partitioned DB init warning: {e}")
     else:
         # Fallback: dùng SQLite khi không có Supabase
         try:
@@ -410,92 +746,238 @@ def init_database():
 
 def clear_cache():
     """Xóa cache."""
+    _invalidate_memo()
+    ref_cache.clear()
+    _provisioned_users.clear()
     sqlite_db.clear_cache()
+    if _SUPABASE_MODULE_OK:
+        cloud_mirror.reset()
 
 
 # ==================== SALARY ====================
 
-def calculate_salary_by_month(year: int, month: int) -> Dict:
-    """Tính lương theo tháng, phân chia theo từng công việc."""
-    from datetime import timedelta
-    
-    start_date = date(year, month, 1)
-    if month == 12:
-        end_date = date(year + 1, 1, 1) - timedelta(days=1)
-    else:
-        end_date = date(year, month + 1, 1) - timedelta(days=1)
-    
+def get_payroll_rules(start_date: date, end_date: date) -> Dict:
+    """Biên dịch quy tắc tính lương cho một khoảng thời gian."""
+    if not _is_partitioned():
+        return sqlite_db.get_payroll_rules(start_date, end_date)
+
+    holidays = get_holidays_by_range(start_date, end_date)
+    return payroll.compile_rules(get_all_jobs(), holidays, get_all_settings(), get_rate_index())
+
+
+def calculate_salary_by_range(start_date: date, end_date: date) -> Dict:
+    """
+    Tính lương trong khoảng thời gian, theo lương giờ có hiệu lực tại ngày của từng ca.
+    Tháng đã chốt nằm trọn trong khoảng được lấy từ snapshot.
+    """
+    closed_months = get_closed_months()
+    if not closed_months:
+        return _calculate_salary_open(start_date, end_date)
+
+    results = []
+    for month_key, seg_start, seg_end in payroll.split_closed_periods(start_date, end_date, closed_months):
+        snapshot = get_month_snapshot(*month_key) if month_key else None
+        if snapshot is not None:
+            results.append(snapshot['salary'])
+        else:
+            results.append(_calculate_salary_open(seg_start, seg_end))
+    return payroll.merge_payroll(results)
+
+
+def _payroll_aggregates(start_date: date, end_date: date) -> Optional[tuple]:
+    """
+    Số liệu lương tổng hợp phía backend (RPC payroll_aggregates) cho khoảng thời gian.
+
+    Returns:
+        (danh sách tháng {year, month, total_days, jobs}, rules) hoặc None nếu backend không hỗ trợ
+    """
+    key = ('payroll_aggregates', start_date.isoformat(), end_date.isoformat())
+    data = _memoized(key, lambda: _partitioned_db().get_payroll_aggregates(_uid(), start_date, end_date))
+    if data is None:
+        return None
+    return data.get('months') or [], payroll.compile_rules([], [], data.get('settings') or {})
+
+
+def _calculate_salary_open(start_date: date, end_date: date) -> Dict:
+    """Tính lương trực tiếp từ các ca làm việc (không dùng snapshot)."""
+    if not _is_partitioned():
+        return sqlite_db.calculate_salary_by_range(start_date, end_date)
+
+    aggregated = _payroll_aggregates(start_date, end_date)
+    if aggregated is not None:
+        months, rules = aggregated
+        return payroll.assemble_payroll([job for month in months for job in month['jobs']],
+                                        sum(month['total_days'] for month in months), rules)
+
     shifts = get_shifts_by_range(start_date, end_date)
-    all_jobs = get_all_jobs()
-    
-    # Build job lookup
-    job_lookup = {j['id']: j for j in all_jobs}
-    
-    standard_hours = get_standard_hours()
-    ot_rate_val = get_ot_rate()
-    
-    job_salary = {}
-    total_hours_all = 0
-    total_salary_all = 0
-    
-    for shift in shifts:
-        job_id = shift.get('job_id') or 0
-        job_info = job_lookup.get(job_id, {})
-        job_name = job_info.get('job_name') or shift.get('job_name') or 'Chưa phân loại'
-        hourly_rate = job_info.get('hourly_rate') or shift.get('hourly_rate') or 0
-        color = job_info.get('color') or shift.get('color') or '#667eea'
-        hours = shift.get('total_hours', 0)
-        
-        if job_id not in job_salary:
-            job_salary[job_id] = {
-                'job_id': job_id,
-                'job_name': job_name,
-                'hourly_rate': hourly_rate,
-                'color': color,
-                'total_hours': 0,
-                'shift_count': 0,
-                'base_salary': 0
-            }
-        
-        job_salary[job_id]['total_hours'] += hours
-        job_salary[job_id]['shift_count'] += 1
-        job_salary[job_id]['base_salary'] += hours * hourly_rate
-        total_hours_all += hours
-    
-    # Tính OT theo ngày
-    daily_hours = {}
-    for shift in shifts:
-        day = shift['work_date']
-        if day not in daily_hours:
-            daily_hours[day] = 0
-        daily_hours[day] += shift.get('total_hours', 0)
-    
-    total_ot_hours = 0
-    for day, hours in daily_hours.items():
-        if hours > standard_hours:
-            total_ot_hours += hours - standard_hours
-    
-    for job_id, data in job_salary.items():
-        total_salary_all += data['base_salary']
-    
-    if total_hours_all > 0 and total_salary_all > 0:
-        avg_hourly_rate = total_salary_all / total_hours_all
-        ot_bonus = total_ot_hours * avg_hourly_rate * (ot_rate_val - 1)
-    else:
-        ot_bonus = 0
-    
-    return {
-        'year': year,
-        'month': month,
-        'jobs': list(job_salary.values()),
-        'total_hours': round(total_hours_all, 2),
-        'total_ot_hours': round(total_ot_hours, 2),
-        'total_days': len(daily_hours),
-        'base_salary': round(total_salary_all, 0),
-        'ot_bonus': round(ot_bonus, 0),
-        'total_salary': round(total_salary_all + ot_bonus, 0),
-        'ot_rate': ot_rate_val
-    }
+    return payroll.calculate_payroll(shifts, get_payroll_rules(start_date, end_date))
+
+
+def calculate_salary_by_month(year: int, month: int) -> Dict:
+    """Tính lương theo tháng, phân chia theo từng công việc (tháng đã chốt: đọc snapshot)."""
+    start_date, end_date = payroll.month_range(year, month)
+
+    def compute():
+        snapshot = get_month_snapshot(year, month)
+        if snapshot is not None:
+            return snapshot['salary']
+        return {'year': year, 'month': month, **_calculate_salary_open(start_date, end_date)}
+    return cached_result('salary_by_month', (year, month), compute, start_date)
+
+
+# ==================== PAYROLL SNAPSHOTS (Chốt tháng) ====================
+
+def get_closed_months() -> List[tuple]:
+    """Lấy danh sách (năm, tháng) đã chốt lương."""
+    if _is_partitioned():
+        return _memoized(('closed_months',), lambda: _partitioned_db().get_closed_months(_uid()))
+    return _memoized(('closed_months',), sqlite_db.get_closed_months)
+
+
+def is_month_closed(year: int, month: int) -> bool:
+    """Kiểm tra tháng đã chốt lương chưa."""
+    return (year, month) in get_closed_months()
+
+
+def is_date_closed(work_date: Union[date, str]) -> bool:
+    """Kiểm tra ngày có thuộc tháng đã chốt không."""
+    if isinstance(work_date, str):
+        work_date = date.fromisoformat(work_date[:10])
+    return is_month_closed(work_date.year, work_date.month)
+
+
+def _reject_closed_period(action: str, work_date: Union[date, str]) -> bool:
+    """Trả về True (và ghi log) nếu thao tác ghi rơi vào tháng đã chốt."""
+    if not is_date_closed(work_date):
+        return False
+    print(f"Error in {action}: {work_date} thuộc tháng đã chốt, cần mở lại tháng trước khi sửa")
+    return True
+
+
+def get_month_snapshot(year: int, month: int) -> Optional[Dict]:
+    """Lấy snapshot của tháng đã chốt (None nếu tháng còn mở)."""
+    if _is_partitioned():
+        return _memoized(('snapshot', year, month), lambda: _partitioned_db().get_payroll_snapshot(_uid(), year, month))
+    return _memoized(('snapshot', year, month), lambda: sqlite_db.get_payroll_snapshot(year, month))
+
+
+@_writes
+def close_month(year: int, month: int) -> bool:
+    """
+    Chốt lương tháng: lưu kết quả tính lương và tổng hợp theo ngày vào snapshot.
+    Sau khi chốt, báo cáo đọc từ snapshot và mọi thao tác sửa ca trong tháng bị từ chối.
+    """
+    start_date, end_date = payroll.month_range(year, month)
+    salary = recalculate_month(year, month)
+    # Snapshot chỉ giữ số liệu tổng hợp theo ngày, không giữ danh sách ca gốc
+    daily = [
+        {k: v for k, v in day.items() if k != 'shifts'}
+        for day in _summarize_days(start_date, end_date, get_standard_hours())
+    ]
+    if _is_partitioned():
+        return _partitioned_db().save_payroll_snapshot(_uid(), year, month, salary, daily)
+    return sqlite_db.save_payroll_snapshot(year, month, salary, daily)
+
+
+def recalculate_month(year: int, month: int) -> Dict:
+    """Tính lương của tháng từ các ca làm việc, bỏ qua snapshot (để chốt hoặc đối chiếu snapshot)."""
+    start_date, end_date = payroll.month_range(year, month)
+    return {'year': year, 'month': month, **_calculate_salary_open(start_date, end_date)}
+
+
+def get_payroll_snapshots(first: tuple, last: tuple) -> Dict[tuple, Dict]:
+    """Lấy kết quả lương đã chốt của các tháng trong khoảng [first, last]."""
+    if _is_partitioned():
+        return _partitioned_db().get_payroll_snapshots(_uid(), first, last)
+    return sqlite_db.get_payroll_snapshots(first, last)
+
+
+@_writes
+def reopen_month(year: int, month: int) -> bool:
+    """Mở lại tháng đã chốt (xóa snapshot) để có thể sửa ca."""
+    if _is_partitioned():
+        return _partitioned_db().delete_payroll_snapshot(_uid(), year, month)
+    return sqlite_db.delete_payroll_snapshot(year, month)
+
+
+# ==================== COMPARATIVE REPORTS ====================
+
+def calculate_salary_by_months(month_keys: List[tuple]) -> Dict[tuple, Dict]:
+    """
+    Tính lương cho nhiều tháng trong một lần gọi.
+    Tháng đã chốt lấy từ snapshot (một truy vấn); các tháng còn mở dùng chung
+    một truy vấn ca làm việc cho cả khoảng và một bộ quy tắc đã biên dịch.
+
+    Returns:
+        Dict (năm, tháng) -> kết quả lương của tháng
+    """
+    if not month_keys:
+        return {}
+    keys = sorted(set(month_keys))
+    return cached_result('salary_by_months', tuple(keys), lambda: _salary_by_months(keys),
+                         payroll.month_range(*keys[0])[0])
+
+
+def _consecutive_runs(keys: List[tuple]) -> List[List[tuple]]:
+    """Tách các tháng (đã sắp xếp) thành các đoạn tháng liên tiếp."""
+    runs = [[keys[0]]]
+    for key in keys[1:]:
+        year, month = runs[-1][-1]
+        if key == ((year, month + 1) if month < 12 else (year + 1, 1)):
+            runs[-1].append(key)
+        else:
+            runs.append([key])
+    return runs
+
+
+def _salary_by_months(keys: List[tuple]) -> Dict[tuple, Dict]:
+    """
+    Lương của các tháng keys (đã sắp xếp) không qua result_cache. Mỗi đoạn tháng
+    liên tiếp được đọc riêng: các tháng rời nhau (so sánh cùng kỳ 2021 và 2026)
+    không kéo theo dữ liệu của những năm ở giữa.
+    """
+    results = {}
+    for run in _consecutive_runs(keys):
+        results.update(_salary_by_consecutive_months(run))
+    return results
+
+
+def _salary_by_consecutive_months(keys: List[tuple]) -> Dict[tuple, Dict]:
+    """Lương của một đoạn tháng liên tiếp: snapshot một truy vấn, tháng còn mở một lần đọc."""
+    results = get_payroll_snapshots(keys[0], keys[-1])
+
+    open_keys = [key for key in keys if key not in results]
+    if open_keys:
+        start_date = payroll.month_range(*open_keys[0])[0]
+        end_date = payroll.month_range(*open_keys[-1])[1]
+        aggregated = _payroll_aggregates(start_date, end_date) if _is_partitioned() else None
+        if aggregated is not None:
+            months, rules = aggregated
+            by_key = {(month['year'], month['month']): month for month in months}
+            for key in open_keys:
+                month = by_key.get(key, {'jobs': [], 'total_days': 0})
+                result = payroll.assemble_payroll(month['jobs'], month['total_days'], rules)
+                results[key] = {'year': key[0], 'month': key[1], **result}
+            return results
+        grouped = payroll.group_shifts_by_month(get_shifts_by_range(start_date, end_date))
+        rules = get_payroll_rules(start_date, end_date)
+        for key in open_keys:
+            result = payroll.calculate_payroll(grouped.get(key, []), rules)
+            results[key] = {'year': key[0], 'month': key[1], **result}
+    return results
+
+
+def get_monthly_series(end_year: int, end_month: int, months: int = 12) -> Dict:
+    """Chuỗi số liệu theo tháng (giờ, lương, OT, theo công việc) của N tháng gần nhất."""
+    month_keys = payroll.months_back(end_year, end_month, months)
+    return payroll.monthly_series(month_keys, calculate_salary_by_months(month_keys))
+
+
+def get_year_over_year(years: List[int]) -> Dict[int, Dict]:
+    """So sánh cùng kỳ: chuỗi 12 tháng của từng năm, chỉ đọc dữ liệu của các năm được chọn."""
+    month_keys = {year: [(year, month) for month in range(1, 13)] for year in years}
+    results = calculate_salary_by_months([key for keys in month_keys.values() for key in keys])
+    return {year: payroll.monthly_series(keys, results) for year, keys in month_keys.items()}
 
 
 # ==================== COMPATIBILITY ====================
@@ -6,18 +6,41 @@ Tự động tải/upload database SQLite từ repository GitHub.
 
 import os
 import streamlit as st
-from github import Github, GithubException
 import base64
+import gzip
+import hashlib
+import json
+import time
+from typing import Dict, List, Optional
+
+import snapshots
+
+# PyGithub chỉ được import khi thực sự đồng bộ (giảm thời gian khởi động app)
 
 # Tên file database chứa thông tin users
 USERS_DB_NAME = "users.db"
 DATA_DIR = "user_data"
 
+# Snapshot trên GitHub được nén gzip: user_data/<tên>.db.gz (file .db cũ vẫn đọc được)
+COMPRESSED_SUFFIX = ".gz"
+
+# Trạng thái đồng bộ (sha trên repo, bộ đếm thay đổi của SQLite) của từng file
+SYNC_STATE_FILE = os.path.join(DATA_DIR, ".sync_state.json")
+
+# Gộp các lần ghi liên tiếp: mỗi file chỉ được đẩy tối đa một lần trong khoảng này
+DEBOUNCE_SECONDS = 30
+
+# repo_path -> thời điểm đẩy gần nhất (time.monotonic)
+_last_push_at = {}
+# repo_path -> (local_path, message) của các lần đẩy đang chờ do debounce
+_pending_pushes = {}
+
 def get_github_client():
     """Lấy GitHub client từ token trong secrets."""
     # Kiểm tra xem có token trong secrets không
     if "GITHUB_TOKEN" not in st.secrets:
         return None
+    from github import Github
     return Github(st.secrets["GITHUB_TOKEN"])
 
 def get_repo():
@@ -47,6 +70,7 @@ def download_file(file_path_in_repo: str, local_path: str) -> bool:
         if not repo:
             print("⚠️ Chưa cấu hình GITHUB_TOKEN hoặc GITHUB_REPO trong secrets.")
             return False
+        from github import GithubException
             
         try:
             contents = repo.get_contents(file_path_in_repo)
@@ -83,9 +107,14 @@ def upload_file(local_path: str, file_path_in_repo: str, message: str) -> bool:
         if not os.path.exists(local_path):
             print(f"❌ File local không tồn tại: {local_path}")
             return False
+        from github import GithubException
             
-        with open(local_path, "rb") as f:
-            content = f.read()
+        if is_sqlite_file(local_path):
+            # Database SQLite: upload bản sao nhất quán (đã VACUUM) thay vì đọc file đang được ghi
+            content = snapshots.snapshot_bytes(local_path, compress=False, compact=True)
+        else:
+            with open(local_path, "rb") as f:
+                content = f.read()
             
         try:
             # Kiểm tra file đã tồn tại chưa để update hay create
@@ -106,26 +135,234 @@ def upload_file(local_path: str, file_path_in_repo: str, message: str) -> bool:
         print(f"❌ Lỗi upload: {e}")
         return False
 
+# ==================== DELTA SYNC ====================
+
+def git_blob_sha(content: bytes) -> str:
+    """Tính sha của nội dung theo cách git/GitHub (dùng làm content hash)."""
+    header = f"blob {len(content)}\0".encode()
+    return hashlib.sha1(header + content).hexdigest()
+
+
+def _load_sync_state() -> Dict:
+    """Đọc trạng thái đồng bộ đã lưu."""
+    try:
+        with open(SYNC_STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_sync_state(state: Dict) -> None:
+    """Lưu trạng thái đồng bộ (ghi file tạm rồi đổi tên)."""
+    os.makedirs(os.path.dirname(SYNC_STATE_FILE) or ".", exist_ok=True)
+    tmp_path = SYNC_STATE_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_path, SYNC_STATE_FILE)
+
+
+def is_sqlite_file(path: str) -> bool:
+    """File có header SQLite (kể cả database WAL)."""
+    try:
+        with open(path, "rb") as f:
+            return f.read(16) == b"SQLite format 3\0"
+    except OSError:
+        return False
+
+
+def db_change_marker(db_path: str) -> Optional[List[int]]:
+    """
+    Dấu thay đổi của file SQLite, chỉ đọc 100 byte header: bộ đếm thay đổi
+    (file change counter, tăng sau mỗi transaction ghi) và kích thước file.
+
+    Database WAL (users.db, tenants.db): transaction ghi vào file -wal, header và
+    kích thước file chính không đổi -> trả về None, push_db so sha của snapshot.
+    """
+    try:
+        with open(db_path, "rb") as f:
+            header = f.read(100)
+        if len(header) < 100 or not header.startswith(b"SQLite format 3\0"):
+            return None
+        if header[18] == 2 or header[19] == 2:   # file format version 2: WAL
+            return None
+        return [int.from_bytes(header[24:28], "big"), os.path.getsize(db_path)]
+    except OSError:
+        return None
+
+
+def build_db_snapshot(db_path: str) -> bytes:
+    """
+    Tạo snapshot nhất quán của database để upload (online backup API, không đọc
+    file đang ghi dở), VACUUM bản sao tạm (bỏ trang trống) rồi nén gzip với
+    mtime=0 để nội dung ổn định.
+    """
+    return snapshots.snapshot_bytes(db_path, compress=True, compact=True)
+
+
+def push_db(local_path: str, repo_path: str, message: str, force: bool = False) -> bool:
+    """
+    Đẩy snapshot nén của database lên GitHub, bỏ qua khi không có thay đổi.
+
+    - Bộ đếm thay đổi SQLite không đổi -> bỏ qua, không đọc file (database WAL
+      không có dấu này, luôn tạo snapshot để so sha).
+    - sha của snapshot trùng sha đã đẩy -> bỏ qua, không gọi API.
+    - Dùng sha đã lưu để update trực tiếp; chỉ gọi get_contents khi sha lệch
+      (ví dụ máy khác vừa đẩy).
+    """
+    try:
+        if not os.path.exists(local_path):
+            print(f"❌ File local không tồn tại: {local_path}")
+            return False
+
+        state = _load_sync_state()
+        entry = state.get(repo_path, {})
+        marker = db_change_marker(local_path)
+        if not force and marker is not None and entry.get('marker') == marker:
+            return True
+
+        snapshot = build_db_snapshot(local_path)
+        sha = git_blob_sha(snapshot)
+        if sha != entry.get('sha'):
+            repo = get_repo()
+            if not repo:
+                return False
+            from github import GithubException
+
+            try:
+                if entry.get('sha'):
+                    repo.update_file(repo_path, message, snapshot, entry['sha'])
+                else:
+                    repo.create_file(repo_path, message, snapshot)
+            except GithubException as e:
+                if e.status not in (404, 409, 422):
+                    raise
+                # sha đã lưu không còn khớp với repo -> lấy sha hiện tại và thử lại
+                try:
+                    current = repo.get_contents(repo_path)
+                    repo.update_file(repo_path, message, snapshot, current.sha)
+                except GithubException as e2:
+                    if e2.status != 404:
+                        raise
+                    repo.create_file(repo_path, message, snapshot)
+            print(f"✅ Đã đẩy {repo_path} lên GitHub ({len(snapshot):,} bytes).")
+
+        state[repo_path] = {'sha': sha, 'marker': marker, 'synced_at': time.time()}
+        _save_sync_state(state)
+        return True
+    except Exception as e:
+        print(f"❌ Lỗi upload: {e}")
+        return False
+
+
+def pull_db(repo_path: str, local_path: str) -> bool:
+    """
+    Kéo database từ GitHub (ưu tiên bản nén .gz, hỗ trợ file .db cũ).
+    Chỉ tải khi sha trên repo khác sha đã đồng bộ lần trước.
+    """
+    try:
+        repo = get_repo()
+        if not repo:
+            print("⚠️ Chưa cấu hình GITHUB_TOKEN hoặc GITHUB_REPO trong secrets.")
+            return False
+        from github import GithubException
+
+        # Một lần liệt kê thư mục lấy sha của mọi file, không tải nội dung
+        try:
+            listing = repo.get_contents(os.path.dirname(repo_path))
+        except GithubException as e:
+            if e.status == 404:
+                print(f"ℹ️ Thư mục {os.path.dirname(repo_path)} chưa tồn tại trên GitHub.")
+                return False
+            raise
+        remote = {item.path: item.sha for item in listing}
+
+        compressed_path = repo_path + COMPRESSED_SUFFIX
+        if compressed_path in remote:
+            path, compressed = compressed_path, True
+        elif repo_path in remote:
+            path, compressed = repo_path, False
+        else:
+            print(f"ℹ️ File {repo_path} chưa tồn tại trên GitHub.")
+            return False
+
+        state = _load_sync_state()
+        if os.path.exists(local_path) and state.get(path, {}).get('sha') == remote[path]:
+            return True
+
+        blob = repo.get_git_blob(remote[path])
+        content = base64.b64decode(blob.content)
+        if compressed:
+            content = gzip.decompress(content)
+
+        os.makedirs(os.path.dirname(local_path) or ".", exist_ok=True)
+        tmp_path = local_path + ".download"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        if not snapshots.check_integrity(tmp_path):
+            os.remove(tmp_path)
+            print(f"❌ {path} trên GitHub bị lỗi (integrity_check), giữ bản local.")
+            return False
+        os.replace(tmp_path, local_path)
+
+        state[path] = {'sha': remote[path], 'marker': db_change_marker(local_path), 'synced_at': time.time()}
+        _save_sync_state(state)
+        print(f"✅ Đã tải {path} từ GitHub.")
+        return True
+    except Exception as e:
+        print(f"❌ Lỗi download: {e}")
+        return False
+
+
+def request_push(local_path: str, repo_path: str, message: str, force: bool = False) -> bool:
+    """
+    Đẩy có debounce: trong DEBOUNCE_SECONDS sau lần đẩy trước, yêu cầu chỉ được
+    ghi nhận (lần sau hoặc flush_pending_pushes sẽ đẩy trạng thái mới nhất).
+    """
+    now = time.monotonic()
+    last = _last_push_at.get(repo_path)
+    if not force and last is not None and now - last < DEBOUNCE_SECONDS:
+        _pending_pushes[repo_path] = (local_path, message)
+        return False
+
+    _pending_pushes.pop(repo_path, None)
+    _last_push_at[repo_path] = now
+    return push_db(local_path, repo_path, message)
+
+
+def flush_pending_pushes() -> int:
+    """Đẩy ngay các yêu cầu đang chờ do debounce. Trả về số file đẩy thành công."""
+    pushed = 0
+    for repo_path, (local_path, message) in list(_pending_pushes.items()):
+        if request_push(local_path, repo_path, message, force=True):
+            pushed += 1
+    return pushed
+
+
+def _user_db_filename(username: str) -> str:
+    """Tên file database riêng của user."""
+    safe_name = username.lower().replace(" ", "_")
+    return f"user_{safe_name}.db"
+
+
 def sync_pull_users_db():
     """Kéo users.db về."""
     local_path = os.path.join(DATA_DIR, USERS_DB_NAME)
-    download_file(f"{DATA_DIR}/{USERS_DB_NAME}", local_path)
+    return pull_db(f"{DATA_DIR}/{USERS_DB_NAME}", local_path)
 
-def sync_push_users_db():
-    """Đẩy users.db lên."""
+def sync_push_users_db(force: bool = False):
+    """Đẩy users.db lên (bỏ qua nếu không đổi, có debounce)."""
     local_path = os.path.join(DATA_DIR, USERS_DB_NAME)
-    upload_file(local_path, f"{DATA_DIR}/{USERS_DB_NAME}", "Update users.db")
+    return request_push(local_path, f"{DATA_DIR}/{USERS_DB_NAME}{COMPRESSED_SUFFIX}", "Update users.db", force)
 
 def sync_pull_user_db(username: str):
     """Kéo DB riêng của user về."""
-    safe_name = username.lower().replace(" ", "_")
-    filename = f"user_{safe_name}.db"
+    filename = _user_db_filename(username)
     local_path = os.path.join(DATA_DIR, filename)
-    download_file(f"{DATA_DIR}/{filename}", local_path)
+    return pull_db(f"{DATA_DIR}/{filename}", local_path)
 
-def sync_push_user_db(username: str):
-    """Đẩy DB riêng của user lên."""
-    safe_name = username.lower().replace(" ", "_")
-    filename = f"user_{safe_name}.db"
+def sync_push_user_db(username: str, force: bool = False):
+    """Đẩy DB riêng của user lên (bỏ qua nếu không đổi, có debounce)."""
+    filename = _user_db_filename(username)
     local_path = os.path.join(DATA_DIR, filename)
-    upload_file(local_path, f"{DATA_DIR}/{filename}", f"Update data for user {username}")
+    return request_push(local_path, f"{DATA_DIR}/{filename}{COMPRESSED_SUFFIX}",
+                        f"Update data for user {username}", force)
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Công cụ bảo trì song song cho tất cả database SQLite của user.
+
+Mỗi database được xử lý trong một process riêng (ProcessPoolExecutor):
+kiểm tra integrity, migration schema (dùng lại database.init_database),
+đối chiếu snapshot tháng đã chốt với ca làm việc, ANALYZE và VACUUM; kết quả
+là báo cáo có cấu trúc cho từng database.
+
+Tác vụ rollups chỉ báo cáo tháng bị lệch; ghi đè snapshot (tính lại từ ca làm
+việc) cần thêm --rewrite-rollups và tổng lương cũ / mới được in ra cho từng tháng.
+
+Ví dụ:
+    python maintenance.py                         # integrity + migrate + analyze
+    python maintenance.py --tasks all --workers 4
+    python maintenance.py --tasks migrate --include-default --json
+    python maintenance.py --tasks rollups --rewrite-rollups --backup
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Sequence
+
+import sqlite_writer
+import tenant_context
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+USER_DATA_DIR = os.path.join(BASE_DIR, "user_data")
+
+# Thứ tự chạy cố định: kiểm tra trước khi sửa, VACUUM sau cùng
+TASKS = ('integrity', 'migrate', 'rollups', 'analyze', 'vacuum')
+DEFAULT_TASKS = ('integrity', 'migrate', 'analyze')
+
+
+# File dùng chung trong user_data, không phải database riêng của user
+# (cache kết quả result_cache thêm theo RESULT_CACHE_PATH, xem _shared_db_names)
+SHARED_DB_NAMES = ('users.db', 'tenants.db')
+
+
+def _shared_db_names() -> set:
+    """Tên file dùng chung: SHARED_DB_NAMES và file cache kết quả (result_cache.CACHE_PATH)."""
+    import result_cache
+    return set(SHARED_DB_NAMES) | {os.path.basename(result_cache.CACHE_PATH)}
+
+
+def _is_tenant_db(db_path: str) -> bool:
+    import tenant_db
+    return os.path.abspath(db_path) == os.path.abspath(tenant_db.TENANT_DB_PATH)
+
+
+def find_user_dbs(data_dir: str = USER_DATA_DIR, include_default: bool = False,
+                  include_tenants: bool = False) -> List[str]:
+    """
+    Liệt kê các database cần bảo trì.
+
+    Args:
+        data_dir: Thư mục chứa database của user
+        include_default: Thêm cả database mặc định (work_hours.db)
+        include_tenants: Thêm cả file multi-tenant (tenant_db.TENANT_DB_PATH)
+    """
+    paths = []
+    if os.path.isdir(data_dir):
+        shared = _shared_db_names()
+        paths = sorted(
+            os.path.join(data_dir, name) for name in os.listdir(data_dir)
+            if name.endswith('.db') and name not in shared
+            and os.path.isfile(os.path.join(data_dir, name))
+        )
+    if include_default:
+        import database
+        if os.path.exists(database.DEFAULT_DB_PATH):
+            paths.insert(0, database.DEFAULT_DB_PATH)
+    if include_tenants:
+        import tenant_db
+        if os.path.exists(tenant_db.TENANT_DB_PATH):
+            paths.append(tenant_db.TENANT_DB_PATH)
+    return paths
+
+
+# Mọi kết nối qua sqlite_writer: chờ khóa của app đang chạy tối đa BUSY_TIMEOUT_SECONDS,
+# lệnh ghi lấy khóa ghi của file như các lần ghi của app
+
+def _table_names(db_path: str) -> List[str]:
+    conn = sqlite_writer.connect(db_path)
+    try:
+        return [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    finally:
+        conn.close()
+
+
+def _task_integrity(db_path: str) -> Dict:
+    conn = sqlite_writer.connect(db_path)
+    try:
+        problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    finally:
+        conn.close()
+    ok = problems == ['ok']
+    return {'ok': ok, 'detail': 'ok' if ok else '; '.join(problems[:5])}
+
+
+def _task_migrate(db_path: str) -> Dict:
+    import database
+    import tenant_db
+    before = set(_table_names(db_path))
+    if _is_tenant_db(db_path):
+        tenant_db.init_schema(db_path)
+    else:
+        database.init_database()
+    added = sorted(set(_table_names(db_path)) - before)
+    return {'ok': True, 'detail': f"thêm bảng: {', '.join(added)}" if added else 'schema đã mới nhất'}
+
+
+def _task_rollups(db_path: str, rewrite: bool = False) -> Dict:
+    """
+    Đối chiếu snapshot của các tháng đã chốt với lương tính lại từ ca làm việc.
+    Mặc định chỉ báo cáo tháng lệch (drift); rewrite=True ghi đè snapshot lệch
+    bằng kết quả tính lại và in tổng lương cũ / mới.
+    """
+    import database
+    import db_wrapper as db
+    if _is_tenant_db(db_path):
+        return {'ok': True, 'detail': 'bỏ qua (file multi-tenant)'}
+    drift = []
+    closed_months = database.get_closed_months()
+    for year, month in closed_months:
+        snapshot = database.get_payroll_snapshot(year, month)
+        old_total = snapshot['salary'].get('total_salary') if snapshot else None
+        new_total = db.recalculate_month(year, month).get('total_salary')
+        if old_total == new_total:
+            continue
+        drift.append({'year': year, 'month': month, 'old_total': old_total, 'new_total': new_total})
+        if rewrite:
+            print(f"⚠️ {os.path.basename(db_path)}: ghi đè snapshot {month:02d}/{year}, "
+                  f"tổng lương {old_total} -> {new_total}")
+            if not db.close_month(year, month):
+                return {'ok': False, 'detail': f"lỗi khi ghi đè snapshot {month:02d}/{year}", 'drift': drift}
+
+    detail = f"đối chiếu {len(closed_months)} tháng"
+    if drift:
+        months = ', '.join(f"{d['month']:02d}/{d['year']} ({d['old_total']} -> {d['new_total']})" for d in drift)
+        detail += f", {'đã ghi đè' if rewrite else 'lệch (chưa ghi đè)'}: {months}"
+    return {'ok': True, 'detail': detail, 'drift': drift}
+
+
+def _task_analyze(db_path: str) -> Dict:
+    conn = sqlite_writer.connect(db_path)
+    try:
+        with sqlite_writer.transaction(conn, db_path):
+            conn.execute("ANALYZE")
+            conn.execute("PRAGMA optimize")
+    finally:
+        conn.close()
+    return {'ok': True, 'detail': 'đã cập nhật thống kê truy vấn'}
+
+
+def _task_vacuum(db_path: str) -> Dict:
+    size_before = os.path.getsize(db_path)
+    # VACUUM không chạy được trong transaction: giữ khóa ghi của file, khóa của SQLite chờ theo busy_timeout
+    conn = sqlite_writer.connect(db_path, isolation_level=None)
+    try:
+        with sqlite_writer.write_lock(db_path):
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+    size_after = os.path.getsize(db_path)
+    return {'ok': True, 'detail': f"{size_before:,} -> {size_after:,} bytes"}
+
+
+_TASK_FUNCS = {
+    'integrity': _task_integrity,
+    'migrate': _task_migrate,
+    'rollups': _task_rollups,
+    'analyze': _task_analyze,
+    'vacuum': _task_vacuum,
+}
+
+
+def _init_worker() -> None:
+    """Khởi tạo process con: luôn dùng SQLite local, không đồng bộ GitHub, tắt cảnh báo Streamlit."""
+    from streamlit import logger as st_logger
+    st_logger.set_log_level(logging.ERROR)
+    import database
+    import db_wrapper as db
+    database.ENABLE_SYNC = False
+    db._supabase_available = False
+    db._db_layout = 'per_user'
+
+
+def maintain_db(db_path: str, tasks: Sequence[str], backup: bool = False,
+                rewrite_rollups: bool = False) -> Dict:
+    """
+    Chạy các tác vụ bảo trì cho một database (trong process con).
+    rewrite_rollups: tác vụ rollups ghi đè snapshot lệch (mặc định chỉ báo cáo).
+
+    Returns:
+        Dict {db, ok, size_before, size_after, duration_ms, backup, tasks: {tên: {ok, detail, ms}}, error}
+    """
+    import database
+    import db_wrapper as db
+
+    started = time.perf_counter()
+    report = {
+        'db': os.path.basename(db_path),
+        'ok': True,
+        'size_before': os.path.getsize(db_path),
+        'size_after': None,
+        'duration_ms': 0,
+        'backup': None,
+        'tasks': {},
+        'error': None,
+    }
+    # Các tác vụ dùng database/db_wrapper đọc đường dẫn từ tenant của process con
+    task_options = {'rollups': {'rewrite': rewrite_rollups}}
+    token = tenant_context.set_tenant(db_path=db_path)
+    database.clear_cache()
+    db.begin_request()
+
+    try:
+        if backup:
+            import snapshots
+            report['backup'] = snapshots.create_snapshot(db_path)
+
+        for name in TASKS:
+            if name not in tasks:
+                continue
+            task_started = time.perf_counter()
+            try:
+                result = _TASK_FUNCS[name](db_path, **task_options.get(name, {}))
+            except Exception as e:
+                result = {'ok': False, 'detail': str(e)}
+            result['ms'] = round((time.perf_counter() - task_started) * 1000, 1)
+            report['tasks'][name] = result
+            if not result['ok']:
+                report['ok'] = False
+                # Database lỗi: không sửa tiếp để tránh làm hỏng thêm
+                break
+    except Exception as e:
+        report['ok'] = False
+        report['error'] = str(e)
+    finally:
+        tenant_context.reset_tenant(token)
+
+    report['size_after'] = os.path.getsize(db_path)
+    report['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return report
+
+
+def run_maintenance(db_paths: Sequence[str], tasks: Sequence[str] = DEFAULT_TASKS,
+                    workers: Optional[int] = None, backup: bool = False,
+                    rewrite_rollups: bool = False) -> List[Dict]:
+    """
+    Bảo trì nhiều database song song.
+
+    Args:
+        db_paths: Danh sách database
+        tasks: Các tác vụ trong TASKS
+        workers: Số process (mặc định: số CPU)
+        backup: Sao lưu từng database trước khi chạy
+        rewrite_rollups: Tác vụ rollups ghi đè snapshot lệch (mặc định chỉ báo cáo)
+
+    Returns:
+        Danh sách báo cáo (theo thứ tự db_paths)
+    """
+    unknown = set(tasks) - set(TASKS)
+    if unknown:
+        raise ValueError(f"Tác vụ không hợp lệ: {', '.join(sorted(unknown))}")
+    if not db_paths:
+        return []
+
+    reports = {}
+    workers = min(workers or os.cpu_count() or 1, len(db_paths))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {pool.submit(maintain_db, path, tuple(tasks), backup, rewrite_rollups): path for path in db_paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                reports[path] = future.result()
+            except Exception as e:
+                reports[path] = {'db': os.path.basename(path), 'ok': False, 'tasks': {}, 'error': str(e)}
+    return [reports[path] for path in db_paths]
+
+
+def print_report(reports: List[Dict]) -> None:
+    """In báo cáo dạng bảng."""
+    for report in reports:
+        status = "OK " if report['ok'] else "LỖI"
+        print(f"[{status}] {report['db']} ({report.get('duration_ms', 0):,.0f} ms)")
+        for name, result in report['tasks'].items():
+            mark = "✓" if result['ok'] else "✗"
+            print(f"    {mark} {name:<10} {result['detail']} ({result['ms']:,.0f} ms)")
+        if report.get('backup'):
+            print(f"    sao lưu: {report['backup']}")
+        if report.get('error'):
+            print(f"    lỗi: {report['error']}")
+    failed = sum(1 for report in reports if not report['ok'])
+    print(f"\nTổng: {len(reports)} database, {failed} lỗi")
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Bảo trì song song các database SQLite của user")
+    parser.add_argument('--tasks', default=','.join(DEFAULT_TASKS),
+                        help=f"Danh sách tác vụ, cách nhau bằng dấu phẩy, hoặc 'all' ({', '.join(TASKS)})")
+    parser.add_argument('--workers', type=int, default=None, help="Số process (mặc định: số CPU)")
+    parser.add_argument('--data-dir', default=USER_DATA_DIR, help="Thư mục chứa database của user")
+    parser.add_argument('--include-default', action='store_true', help="Bảo trì cả work_hours.db")
+    parser.add_argument('--include-tenants', action='store_true', help="Bảo trì cả file multi-tenant (tenants.db)")
+    parser.add_argument('--backup', action='store_true', help="Sao lưu từng database trước khi bảo trì")
+    parser.add_argument('--rewrite-rollups', action='store_true',
+                        help="Tác vụ rollups ghi đè snapshot lệch bằng kết quả tính lại (mặc định chỉ báo cáo)")
+    parser.add_argument('--json', action='store_true', help="In báo cáo dạng JSON")
+    args = parser.parse_args(argv)
+
+    tasks = TASKS if args.tasks == 'all' else tuple(t.strip() for t in args.tasks.split(',') if t.strip())
+    db_paths = find_user_dbs(args.data_dir, args.include_default, args.include_tenants)
+    try:
+        reports = run_maintenance(db_paths, tasks, args.workers, args.backup, args.rewrite_rollups)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.json:
+        print(json.dumps(reports, ensure_ascii=False, indent=2))
+    else:
+        print_report(reports)
+    return 0 if all(report['ok'] for report in reports) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Gộp các database SQLite riêng của từng user (user_data/user_<tên>.db) vào file
+multi-tenant (tenant_db.TENANT_DB_PATH), gán user_id theo users.db.
+
+ID của công việc được cấp mới trong file chung; job_id trong ca làm việc,
+khung giờ mẫu, lịch sử lương và snapshot lương đã chốt được đổi theo.
+Mỗi user được chép trong một transaction và đối chiếu số dòng sau khi chép.
+
+Ví dụ:
+    python migrate_to_tenants.py
+    python migrate_to_tenants.py --include-default --default-user-id 1
+    python migrate_to_tenants.py --replace      # chép lại user đã có trong file chung
+Sau đó đặt DB_LAYOUT = "multi_tenant" trong secrets (hoặc biến môi trường).
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from typing import Dict, List, Optional, Sequence
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tenant_db  # noqa: E402
+
+USER_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "user_data")
+DEFAULT_USER_ID = 1
+
+
+def _safe_username(username: str) -> str:
+    """Giống user_auth.get_user_db_path: chỉ giữ chữ, số và gạch dưới."""
+    return "".join(c for c in username.lower() if c.isalnum() or c == "_")
+
+
+def _load_users(users_db_path: str) -> List[Dict]:
+    if not os.path.exists(users_db_path):
+        return []
+    conn = sqlite3.connect(users_db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        return [dict(row) for row in conn.execute("SELECT * FROM users ORDER BY id")]
+    except sqlite3.Error:
+        return []
+    finally:
+        conn.close()
+
+
+def plan_sources(data_dir: str = USER_DATA_DIR, include_default: bool = False,
+                 default_user_id: int = DEFAULT_USER_ID) -> List[Dict]:
+    """
+    Xác định file nguồn và user tương ứng.
+
+    Returns:
+        List dict {path, user_id, username, password_hash, display_name}
+    """
+    users = _load_users(os.path.join(data_dir, "users.db"))
+    by_file = {f"user_{_safe_username(u['username'])}.db": u for u in users}
+    next_id = max([u['id'] for u in users] + [default_user_id]) + 1
+
+    sources = []
+    if include_default:
+        import database
+        if os.path.exists(database.DEFAULT_DB_PATH):
+            sources.append({'path': database.DEFAULT_DB_PATH, 'user_id': default_user_id,
+                            'username': None, 'password_hash': '', 'display_name': None})
+
+    if os.path.isdir(data_dir):
+        for name in sorted(os.listdir(data_dir)):
+            if not (name.startswith("user_") and name.endswith(".db")):
+                continue
+            user = by_file.get(name)
+            if user is None:
+                # File không có trong users.db: cấp user_id mới (chưa đăng nhập được)
+                user = {'id': next_id, 'username': name[len("user_"):-len(".db")],
+                        'password_hash': '', 'display_name': None}
+                next_id += 1
+            sources.append({'path': os.path.join(data_dir, name), 'user_id': user['id'],
+                            'username': user['username'], 'password_hash': user['password_hash'],
+                            'display_name': user.get('display_name')})
+
+    user_ids = [s['user_id'] for s in sources]
+    duplicates = sorted({uid for uid in user_ids if user_ids.count(uid) > 1})
+    if duplicates:
+        raise ValueError(f"Trùng user_id giữa các file nguồn: {duplicates} (đổi --default-user-id)")
+    return sources
+
+
+def _columns(conn: sqlite3.Connection, schema: str, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _count(conn: sqlite3.Connection, sql: str, params: tuple = ()) -> int:
+    return conn.execute(sql, params).fetchone()[0]
+
+
+def _copy_plain(conn: sqlite3.Connection, table: str, user_id: int, job_expr: Optional[str] = None,
+                join_jobs: bool = False) -> int:
+    """Chép bảng từ src sang main, thêm user_id; job_id đổi qua temp.job_map."""
+    src_cols = set(_columns(conn, 'src', table))
+    if not src_cols:
+        return 0
+    cols = [c for c in _columns(conn, 'main', table)
+            if c in src_cols and c not in ('id', 'user_id', 'job_id')]
+    select = [f"s.{c}" for c in cols]
+    if job_expr:
+        cols.append('job_id')
+        select.append(job_expr)
+    join = "LEFT JOIN temp.job_map m ON m.old_id = s.job_id" if job_expr else ""
+    if join_jobs:
+        join = "JOIN temp.job_map m ON m.old_id = s.job_id"
+    cursor = conn.execute(
+        f"INSERT INTO main.{table} (user_id, {', '.join(cols)}) "
+        f"SELECT ?, {', '.join(select)} FROM src.{table} s {join}",
+        (user_id,)
+    )
+    return cursor.rowcount
+
+
+def migrate_source(conn: sqlite3.Connection, source: Dict, replace: bool = False) -> Dict:
+    """Chép dữ liệu của một user vào file chung (một transaction)."""
+    user_id = source['user_id']
+    report = {'file': os.path.basename(source['path']), 'user_id': user_id,
+              'status': 'ok', 'rows': {}, 'error': None}
+
+    existing = _count(conn, "SELECT COUNT(*) FROM jobs WHERE user_id = ?", (user_id,)) + \
+        _count(conn, "SELECT COUNT(*) FROM work_shifts WHERE user_id = ?", (user_id,))
+    if existing and not replace:
+        report['status'] = 'skipped'
+        report['error'] = "user đã có dữ liệu trong file chung (dùng --replace để chép lại)"
+        return report
+
+    conn.execute("ATTACH DATABASE ? AS src", (source['path'],))
+    try:
+        conn.execute("BEGIN")
+        if replace:
+            # Ngược thứ tự phụ thuộc: snapshot trước, ca của tháng đã chốt mới xóa được
+            for table in reversed(tenant_db.TENANT_TABLES):
+                conn.execute(f"DELETE FROM main.{table} WHERE user_id = ?", (user_id,))
+
+        if source['username']:
+            conn.execute("""
+                INSERT OR IGNORE INTO main.users (id, username, password_hash, display_name)
+                VALUES (?, ?, ?, ?)
+            """, (user_id, source['username'], source['password_hash'] or '', source['display_name']))
+
+        # Công việc: cấp id mới, ghi lại ánh xạ id cũ -> id mới
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS job_map (old_id INTEGER PRIMARY KEY, new_id INTEGER)")
+        conn.execute("DELETE FROM temp.job_map")
+        job_cols = [c for c in _columns(conn, 'main', 'jobs')
+                    if c in set(_columns(conn, 'src', 'jobs')) and c not in ('id', 'user_id')]
+        job_map = {}
+        if job_cols:
+            for row in conn.execute(f"SELECT id, {', '.join(job_cols)} FROM src.jobs").fetchall():
+                cursor = conn.execute(
+                    f"INSERT INTO main.jobs (user_id, {', '.join(job_cols)}) VALUES (?, {', '.join('?' * len(job_cols))})",
+                    (user_id,) + tuple(row[1:])
+                )
+                job_map[row[0]] = cursor.lastrowid
+            conn.executemany("INSERT INTO temp.job_map (old_id, new_id) VALUES (?, ?)", job_map.items())
+        report['rows']['jobs'] = len(job_map)
+
+        # Ca của công việc đã xóa -> job_id 0 (chưa phân loại), không trỏ sang job của user khác
+        report['rows']['work_shifts'] = _copy_plain(conn, 'work_shifts', user_id, "COALESCE(m.new_id, 0)")
+        report['rows']['shift_presets'] = _copy_plain(conn, 'shift_presets', user_id, "m.new_id")
+        report['rows']['job_rates'] = _copy_plain(conn, 'job_rates', user_id, "m.new_id", join_jobs=True)
+        report['rows']['holidays'] = _copy_plain(conn, 'holidays', user_id)
+        report['rows']['settings'] = _copy_plain(conn, 'settings', user_id)
+
+        snapshots = 0
+        if _columns(conn, 'src', 'payroll_snapshots'):
+            for year, month, salary_json, daily_json, closed_at in conn.execute(
+                    "SELECT year, month, salary_json, daily_json, closed_at FROM src.payroll_snapshots").fetchall():
+                salary = json.loads(salary_json)
+                for job in salary.get('jobs', []):
+                    job['job_id'] = job_map.get(job.get('job_id'), job.get('job_id'))
+                conn.execute("""
+                    INSERT INTO main.payroll_snapshots (user_id, year, month, salary_json, daily_json, closed_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (user_id, year, month, json.dumps(salary, ensure_ascii=False), daily_json, closed_at))
+                snapshots += 1
+        report['rows']['payroll_snapshots'] = snapshots
+
+        # Đối chiếu số dòng trước khi commit
+        for table in ('work_shifts', 'holidays', 'settings', 'payroll_snapshots'):
+            if _columns(conn, 'src', table):
+                expected = _count(conn, f"SELECT COUNT(*) FROM src.{table}")
+                if expected != report['rows'][table]:
+                    raise RuntimeError(f"{table}: chép {report['rows'][table]}/{expected} dòng")
+
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        report['status'] = 'failed'
+        report['error'] = str(e)
+    finally:
+        conn.execute("DETACH DATABASE src")
+    return report
+
+
+def migrate(sources: Sequence[Dict], target_path: Optional[str] = None, replace: bool = False) -> List[Dict]:
+    """Gộp các file nguồn vào file multi-tenant. Trả về báo cáo theo từng file."""
+    target_path = target_path or tenant_db.TENANT_DB_PATH
+    tenant_db.init_schema(target_path)
+    conn = sqlite3.connect(target_path, isolation_level=None)
+    try:
+        return [migrate_source(conn, source, replace) for source in sources]
+    finally:
+        conn.close()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Gộp database riêng của từng user vào file multi-tenant")
+    parser.add_argument('--data-dir', default=USER_DATA_DIR, help="Thư mục chứa user_<tên>.db và users.db")
+    parser.add_argument('--target', default=None, help=f"File đích (mặc định: {tenant_db.TENANT_DB_PATH})")
+    parser.add_argument('--include-default', action='store_true', help="Gộp cả work_hours.db")
+    parser.add_argument('--default-user-id', type=int, default=DEFAULT_USER_ID,
+                        help="user_id cho dữ liệu của work_hours.db")
+    parser.add_argument('--replace', action='store_true', help="Xóa và chép lại user đã có trong file chung")
+    args = parser.parse_args(argv)
+
+    try:
+        sources = plan_sources(args.data_dir, args.include_default, args.default_user_id)
+    except ValueError as e:
+        parser.error(str(e))
+
+    reports = migrate(sources, args.target, args.replace)
+    for report in reports:
+        rows = ", ".join(f"{table}={count}" for table, count in report['rows'].items())
+        print(f"[{report['status']:<7}] {report['file']} -> user_id {report['user_id']} {rows}")
+        if report['error']:
+            print(f"          {report['error']}")
+    failed = sum(1 for report in reports if report['status'] == 'failed')
+    print(f"\nTổng: {len(reports)} file, {failed} lỗi")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
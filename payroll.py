@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+"""
+Module tính lương (payroll rules engine) dùng chung cho SQLite và Supabase.
+Cài đặt, lương giờ theo công việc và ngày nghỉ lễ được biên dịch một lần thành
+bảng tra cứu, sau đó áp dụng trong một lượt duyệt duy nhất qua các ca làm việc.
+"""
+
+from bisect import bisect_right
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Giá trị mặc định khi chưa có cài đặt
+DEFAULT_STANDARD_HOURS = 8.0
+DEFAULT_OT_RATE = 1.5
+DEFAULT_NIGHT_RATE = 1.0    # 1.0 = không có phụ cấp ca đêm
+DEFAULT_HOLIDAY_RATE = 1.0  # 1.0 = không có phụ cấp ngày lễ
+
+# Khung giờ đêm: 22:00 - 05:00 hôm sau
+NIGHT_START_HOUR = 22.0
+NIGHT_END_HOUR = 5.0
+
+UNCATEGORIZED_JOB_NAME = 'Chưa phân loại'
+DEFAULT_JOB_COLOR = '#667eea'
+
+# Các key trong bảng settings mà bộ tính lương cần
+SETTING_KEYS = ('standard_hours', 'ot_rate', 'night_rate', 'holiday_rate')
+
+
+def month_range(year: int, month: int) -> Tuple[date, date]:
+    """Lấy ngày đầu tháng và cuối tháng."""
+    start_date = date(year, month, 1)
+    if month == 12:
+        end_date = date(year + 1, 1, 1) - timedelta(days=1)
+    else:
+        end_date = date(year, month + 1, 1) - timedelta(days=1)
+    return start_date, end_date
+
+
+def months_back(end_year: int, end_month: int, count: int) -> List[Tuple[int, int]]:
+    """Danh sách (năm, tháng) của count tháng liên tiếp, kết thúc ở tháng đã cho."""
+    index = end_year * 12 + end_month - 1
+    return [(i // 12, i % 12 + 1) for i in range(index - count + 1, index + 1)]
+
+
+def split_closed_periods(
+    start_date: date,
+    end_date: date,
+    closed_months: Iterable[Tuple[int, int]]
+) -> List[Tuple[Optional[Tuple[int, int]], date, date]]:
+    """
+    Chia khoảng thời gian thành các đoạn: tháng đã chốt (đọc từ snapshot) và
+    các đoạn liên tục còn mở (tính từ ca làm việc).
+
+    Returns:
+        Danh sách (year, month) hoặc None, ngày bắt đầu, ngày kết thúc.
+        Chỉ tháng đã chốt nằm trọn trong khoảng mới được đọc từ snapshot.
+    """
+    closed = set(closed_months)
+    segments = []
+    open_start = None
+    cursor = date(start_date.year, start_date.month, 1)
+    while cursor <= end_date:
+        month_start, month_end = month_range(cursor.year, cursor.month)
+        seg_start = max(month_start, start_date)
+        seg_end = min(month_end, end_date)
+        key = (cursor.year, cursor.month)
+        if key in closed and seg_start == month_start and seg_end == month_end:
+            if open_start is not None:
+                segments.append((None, open_start, seg_start - timedelta(days=1)))
+                open_start = None
+            segments.append((key, seg_start, seg_end))
+        elif open_start is None:
+            open_start = seg_start
+        cursor = month_end + timedelta(days=1)
+    if open_start is not None:
+        segments.append((None, open_start, end_date))
+    return segments
+
+
+def _to_float(value, default: float) -> float:
+    """Chuyển giá trị cài đặt (chuỗi) sang float, dùng mặc định nếu lỗi."""
+    try:
+        return float(value) if value not in (None, "") else default
+    except (TypeError, ValueError):
+        return default
+
+
+def _parse_hours(time_str) -> Optional[float]:
+    """Chuyển "HH:MM" (hoặc "HH:MM:SS" từ Supabase) thành số giờ."""
+    try:
+        parts = str(time_str).split(':')
+        return int(parts[0]) + int(parts[1]) / 60.0
+    except (IndexError, ValueError):
+        return None
+
+
+def build_rate_index(rate_history: Iterable[Dict]) -> Dict[int, Tuple[List[str], List[float]]]:
+    """
+    Tạo chỉ mục tra cứu lương theo ngày hiệu lực cho từng công việc.
+
+    Returns:
+        Dict job_id -> (danh sách effective_from đã sắp xếp, danh sách lương giờ)
+    """
+    timelines = {}
+    for entry in rate_history:
+        timelines.setdefault(entry['job_id'], []).append(
+            (str(entry['effective_from']), entry['hourly_rate'] or 0)
+        )
+
+    rate_index = {}
+    for job_id, points in timelines.items():
+        points.sort()
+        rate_index[job_id] = ([p[0] for p in points], [p[1] for p in points])
+    return rate_index
+
+
+def compile_rules(
+    jobs: Iterable[Dict],
+    holidays: Iterable,
+    settings: Dict[str, Optional[str]],
+    rate_index: Optional[Dict[int, Tuple[List[str], List[float]]]] = None
+) -> Dict:
+    """
+    Biên dịch quy tắc tính lương thành các bảng tra cứu.
+
+    Args:
+        jobs: Danh sách công việc (id, job_name, hourly_rate, color)
+        holidays: Danh sách ngày nghỉ (dict có holiday_date hoặc chuỗi ISO)
+        settings: Dict key -> value (chuỗi) của bảng settings
+        rate_index: Chỉ mục lương theo ngày hiệu lực (xem build_rate_index)
+
+    Returns:
+        Dict chứa hệ số, bảng công việc, chỉ mục lương theo ngày và tập ngày lễ
+    """
+    job_table = {}
+    for job in jobs:
+        job_table[job['id']] = {
+            'job_name': job.get('job_name') or UNCATEGORIZED_JOB_NAME,
+            'hourly_rate': job.get('hourly_rate') or 0,
+            'color': job.get('color') or DEFAULT_JOB_COLOR,
+        }
+
+    holiday_dates = set()
+    for holiday in holidays:
+        value = holiday.get('holiday_date') if isinstance(holiday, dict) else holiday
+        if value:
+            holiday_dates.add(str(value))
+
+    return {
+        'standard_hours': _to_float(settings.get('standard_hours'), DEFAULT_STANDARD_HOURS),
+        'ot_rate': _to_float(settings.get('ot_rate'), DEFAULT_OT_RATE),
+        'night_rate': _to_float(settings.get('night_rate'), DEFAULT_NIGHT_RATE),
+        'holiday_rate': _to_float(settings.get('holiday_rate'), DEFAULT_HOLIDAY_RATE),
+        'jobs': job_table,
+        'rate_index': rate_index or {},
+        'holidays': frozenset(holiday_dates),
+    }
+
+
+def resolve_rate(rules: Dict, job_id: int, work_date: str, fallback: float = 0) -> float:
+    """Lấy lương giờ có hiệu lực của công việc tại ngày làm việc."""
+    index = rules['rate_index'].get(job_id)
+    if index:
+        dates, rates = index
+        pos = bisect_right(dates, work_date) - 1
+        # Ca trước mốc hiệu lực đầu tiên dùng mức lương sớm nhất đã biết
+        return rates[max(pos, 0)]
+    job = rules['jobs'].get(job_id)
+    if job:
+        return job['hourly_rate']
+    return fallback
+
+
+def night_hours(start_time: str, end_time: str, total_hours: float) -> float:
+    """
+    Tính số giờ làm rơi vào khung giờ đêm (hỗ trợ ca qua đêm).
+    Giờ nghỉ được phân bổ theo tỷ lệ trên toàn bộ ca.
+    """
+    start = _parse_hours(start_time)
+    end = _parse_hours(end_time)
+    if start is None or end is None or not total_hours:
+        return 0.0
+    if end <= start:
+        end += 24.0
+    span = end - start
+
+    # Khung đêm lặp lại mỗi ngày: [-2, 5), [22, 29), [46, 53)
+    overlap = 0.0
+    for base in (-24.0, 0.0, 24.0):
+        window_start = NIGHT_START_HOUR + base
+        window_end = NIGHT_END_HOUR + 24.0 + base
+        overlap += max(0.0, min(end, window_end) - max(start, window_start))
+
+    return overlap * total_hours / span
+
+
+def calculate_payroll(shifts: List[Dict], rules: Dict) -> Dict:
+    """
+    Tính lương cho danh sách ca làm việc trong một lượt duyệt.
+
+    OT được tính theo tổng giờ của ngày: phần giờ vượt giờ chuẩn được gán cho
+    các ca (theo thứ tự giờ bắt đầu) làm vượt, và trả theo lương giờ của ca đó.
+
+    Returns:
+        Dict với thông tin lương theo từng công việc và tổng lương
+    """
+    standard_hours = rules['standard_hours']
+    ot_extra = rules['ot_rate'] - 1
+    night_extra = rules['night_rate'] - 1
+    holiday_extra = rules['holiday_rate'] - 1
+    holiday_dates = rules['holidays']
+    job_table = rules['jobs']
+
+    job_salary = {}
+    daily_hours = {}
+    totals = {
+        'hours': 0.0, 'ot_hours': 0.0, 'night_hours': 0.0, 'holiday_hours': 0.0,
+        'base': 0.0, 'ot': 0.0, 'night': 0.0, 'holiday': 0.0,
+    }
+
+    ordered = sorted(shifts, key=lambda s: (str(s['work_date']), str(s.get('start_time') or '')))
+    for shift in ordered:
+        job_id = shift.get('job_id') or 0
+        work_date = str(shift['work_date'])
+        hours = shift.get('total_hours') or 0
+        job_info = job_table.get(job_id, {})
+        hourly_rate = resolve_rate(rules, job_id, work_date, shift.get('hourly_rate') or 0)
+
+        # Giờ OT của ca = phần vượt giờ chuẩn của tổng giờ trong ngày
+        before = daily_hours.get(work_date, 0.0)
+        after = before + hours
+        daily_hours[work_date] = after
+        ot_hours = max(0.0, after - max(before, standard_hours))
+
+        shift_night = night_hours(shift.get('start_time'), shift.get('end_time'), hours)
+        holiday_hours = hours if work_date in holiday_dates else 0.0
+
+        base_pay = hours * hourly_rate
+        ot_pay = ot_hours * hourly_rate * ot_extra
+        night_pay = shift_night * hourly_rate * night_extra
+        holiday_pay = holiday_hours * hourly_rate * holiday_extra
+
+        if job_id not in job_salary:
+            job_salary[job_id] = {
+                'job_id': job_id,
+                'job_name': job_info.get('job_name') or shift.get('job_name') or UNCATEGORIZED_JOB_NAME,
+                'hourly_rate': hourly_rate,
+                'color': job_info.get('color') or shift.get('color') or DEFAULT_JOB_COLOR,
+                'total_hours': 0,
+                'shift_count': 0,
+                'base_salary': 0,
+                'ot_hours': 0,
+                'ot_bonus': 0,
+                'night_hours': 0,
+                'night_bonus': 0,
+                'holiday_hours': 0,
+                'holiday_bonus': 0,
+                'total_salary': 0
+            }
+
+        entry = job_salary[job_id]
+        entry['hourly_rate'] = hourly_rate  # Mức lương của ca gần nhất
+        entry['total_hours'] += hours
+        entry['shift_count'] += 1
+        entry['base_salary'] += base_pay
+        entry['ot_hours'] += ot_hours
+        entry['ot_bonus'] += ot_pay
+        entry['night_hours'] += shift_night
+        entry['night_bonus'] += night_pay
+        entry['holiday_hours'] += holiday_hours
+        entry['holiday_bonus'] += holiday_pay
+        entry['total_salary'] += base_pay + ot_pay + night_pay + holiday_pay
+
+        totals['hours'] += hours
+        totals['ot_hours'] += ot_hours
+        totals['night_hours'] += shift_night
+        totals['holiday_hours'] += holiday_hours
+        totals['base'] += base_pay
+        totals['ot'] += ot_pay
+        totals['night'] += night_pay
+        totals['holiday'] += holiday_pay
+
+    total_salary = totals['base'] + totals['ot'] + totals['night'] + totals['holiday']
+
+    return {
+        'jobs': list(job_salary.values()),
+        'total_hours': round(totals['hours'], 2),
+        'total_ot_hours': round(totals['ot_hours'], 2),
+        'total_night_hours': round(totals['night_hours'], 2),
+        'total_holiday_hours': round(totals['holiday_hours'], 2),
+        'total_days': len(daily_hours),
+        'base_salary': round(totals['base'], 0),
+        'ot_bonus': round(totals['ot'], 0),
+        'night_bonus': round(totals['night'], 0),
+        'holiday_bonus': round(totals['holiday'], 0),
+        'total_salary': round(total_salary, 0),
+        'ot_rate': rules['ot_rate'],
+        'night_rate': rules['night_rate'],
+        'holiday_rate': rules['holiday_rate']
+    }
+
+
+def assemble_payroll(job_rows: Iterable[Dict], total_days: int, rules: Dict) -> Dict:
+    """
+    Dựng kết quả giống calculate_payroll từ số liệu đã tổng hợp theo công việc
+    (RPC payroll_aggregates trên Supabase / tenant_db.query_payroll_aggregates).
+
+    Mỗi dòng có giờ (total_hours, ot_hours, night_hours, holiday_hours) và
+    "giờ x lương giờ" tương ứng (base_amount, ot_amount, night_amount,
+    holiday_amount); hệ số OT/đêm/lễ áp dụng ở đây theo rules. Một công việc
+    có thể có nhiều dòng (nhiều tháng, theo thứ tự thời gian): được cộng dồn
+    trước khi làm tròn tổng, như tính một lần cho cả khoảng.
+    """
+    ot_extra = rules['ot_rate'] - 1
+    night_extra = rules['night_rate'] - 1
+    holiday_extra = rules['holiday_rate'] - 1
+
+    job_salary = {}
+    for row in job_rows:
+        job_info = rules['jobs'].get(row['job_id'], {})
+        ot_bonus = (row['ot_amount'] or 0) * ot_extra
+        night_bonus = (row['night_amount'] or 0) * night_extra
+        holiday_bonus = (row['holiday_amount'] or 0) * holiday_extra
+        entry = job_salary.get(row['job_id'])
+        if entry is None:
+            entry = job_salary[row['job_id']] = {
+                'job_id': row['job_id'],
+                'job_name': None,
+                'hourly_rate': 0,
+                'color': None,
+                'total_hours': 0,
+                'shift_count': 0,
+                'base_salary': 0,
+                'ot_hours': 0,
+                'ot_bonus': 0,
+                'night_hours': 0,
+                'night_bonus': 0,
+                'holiday_hours': 0,
+                'holiday_bonus': 0,
+                'total_salary': 0
+            }
+        # Tên, màu và mức lương lấy theo dòng gần nhất
+        entry['job_name'] = row.get('job_name') or job_info.get('job_name') or UNCATEGORIZED_JOB_NAME
+        entry['color'] = row.get('color') or job_info.get('color') or DEFAULT_JOB_COLOR
+        entry['hourly_rate'] = row['hourly_rate'] or 0
+        entry['total_hours'] += row['total_hours'] or 0
+        entry['shift_count'] += row['shift_count']
+        entry['base_salary'] += row['base_amount'] or 0
+        entry['ot_hours'] += row['ot_hours'] or 0
+        entry['ot_bonus'] += ot_bonus
+        entry['night_hours'] += row['night_hours'] or 0
+        entry['night_bonus'] += night_bonus
+        entry['holiday_hours'] += row['holiday_hours'] or 0
+        entry['holiday_bonus'] += holiday_bonus
+        entry['total_salary'] += (row['base_amount'] or 0) + ot_bonus + night_bonus + holiday_bonus
+    jobs = list(job_salary.values())
+
+    def total(key: str, digits: int) -> float:
+        return round(sum(job[key] for job in jobs), digits)
+
+    return {
+        'jobs': jobs,
+        'total_hours': total('total_hours', 2),
+        'total_ot_hours': total('ot_hours', 2),
+        'total_night_hours': total('night_hours', 2),
+        'total_holiday_hours': total('holiday_hours', 2),
+        'total_days': total_days,
+        'base_salary': total('base_salary', 0),
+        'ot_bonus': total('ot_bonus', 0),
+        'night_bonus': total('night_bonus', 0),
+        'holiday_bonus': total('holiday_bonus', 0),
+        'total_salary': total('total_salary', 0),
+        'ot_rate': rules['ot_rate'],
+        'night_rate': rules['night_rate'],
+        'holiday_rate': rules['holiday_rate']
+    }
+
+
+def summarize_day(row: Dict, standard_hours: float) -> Dict:
+    """Hoàn thiện một dòng tổng hợp theo ngày (RPC daily_summaries) giống _summarize_days."""
+    total_hours = round(row['total_hours'] or 0, 2)
+    return {
+        'work_date': str(row['work_date']),
+        'total_hours': total_hours,
+        'shift_count': row['shift_count'],
+        'start_time': row.get('start_time') or '',
+        'end_time': row.get('end_time') or '',
+        'break_hours': row.get('break_hours') or 0.0,
+        'notes': row.get('notes') or '',
+        'overtime_hours': round(max(0, total_hours - standard_hours), 2),
+    }
+
+
+def merge_payroll(results: List[Dict]) -> Dict:
+    """
+    Gộp kết quả tính lương của các khoảng không chồng nhau (ví dụ từng tháng).
+    OT tính theo ngày nên gộp theo tháng cho kết quả giống tính một lần.
+    """
+    job_salary = {}
+    sum_keys = ('total_hours', 'shift_count', 'base_salary', 'ot_hours', 'ot_bonus',
+                'night_hours', 'night_bonus', 'holiday_hours', 'holiday_bonus', 'total_salary')
+    for result in results:
+        for job in result['jobs']:
+            entry = job_salary.get(job['job_id'])
+            if entry is None:
+                job_salary[job['job_id']] = dict(job)
+                continue
+            for key in sum_keys:
+                entry[key] += job[key]
+            # Tên, màu và mức lương lấy theo khoảng gần nhất
+            entry.update(job_name=job['job_name'], color=job['color'], hourly_rate=job['hourly_rate'])
+
+    def total(key: str, digits: int) -> float:
+        return round(sum(r[key] for r in results), digits)
+
+    latest = results[-1] if results else {}
+    return {
+        'jobs': list(job_salary.values()),
+        'total_hours': total('total_hours', 2),
+        'total_ot_hours': total('total_ot_hours', 2),
+        'total_night_hours': total('total_night_hours', 2),
+        'total_holiday_hours': total('total_holiday_hours', 2),
+        'total_days': sum(r['total_days'] for r in results),
+        'base_salary': total('base_salary', 0),
+        'ot_bonus': total('ot_bonus', 0),
+        'night_bonus': total('night_bonus', 0),
+        'holiday_bonus': total('holiday_bonus', 0),
+        'total_salary': total('total_salary', 0),
+        'ot_rate': latest.get('ot_rate', DEFAULT_OT_RATE),
+        'night_rate': latest.get('night_rate', DEFAULT_NIGHT_RATE),
+        'holiday_rate': latest.get('holiday_rate', DEFAULT_HOLIDAY_RATE)
+    }
+
+
+def group_shifts_by_month(shifts: Iterable[Dict]) -> Dict[Tuple[int, int], List[Dict]]:
+    """Nhóm các ca làm việc theo (năm, tháng) của work_date."""
+    grouped = {}
+    for shift in shifts:
+        work_date = str(shift['work_date'])
+        key = (int(work_date[:4]), int(work_date[5:7]))
+        grouped.setdefault(key, []).append(shift)
+    return grouped
+
+
+def monthly_series(month_keys: List[Tuple[int, int]], results: Dict[Tuple[int, int], Dict]) -> Dict:
+    """
+    Chuyển kết quả lương từng tháng thành các mảng gọn (một phần tử mỗi tháng)
+    để vẽ biểu đồ trực tiếp, không cần DataFrame theo từng dòng.
+
+    Returns:
+        Dict gồm labels, year, month, các mảng giờ/lương và jobs
+        (mỗi công việc: job_name, color, hours[], salary[])
+    """
+    fields = ('total_hours', 'total_ot_hours', 'base_salary', 'ot_bonus',
+              'night_bonus', 'holiday_bonus', 'total_salary')
+    series = {
+        'labels': [f"{month:02d}/{year}" for year, month in month_keys],
+        'year': [year for year, _ in month_keys],
+        'month': [month for _, month in month_keys],
+    }
+    for field in fields:
+        series[field] = [results[key][field] if key in results else 0 for key in month_keys]
+
+    size = len(month_keys)
+    jobs = {}
+    for pos, key in enumerate(month_keys):
+        for job in results.get(key, {}).get('jobs', []):
+            entry = jobs.get(job['job_id'])
+            if entry is None:
+                entry = jobs[job['job_id']] = {
+                    'job_id': job['job_id'],
+                    'job_name': job['job_name'],
+                    'color': job['color'],
+                    'hours': [0.0] * size,
+                    'salary': [0.0] * size,
+                }
+            entry['hours'][pos] = round(job['total_hours'], 2)
+            entry['salary'][pos] = round(job['total_salary'], 0)
+    series['jobs'] = list(jobs.values())
+    return series
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Cache dùng chung trong process cho dữ liệu tham chiếu (công việc, lịch sử lương,
+khung giờ mẫu, ngày nghỉ, cài đặt): mọi session Streamlit (nhiều tab, user quay
+lại) đọc chung một bản thay vì mỗi session tự truy vấn.
+
+- Khóa: phạm vi dữ liệu (user_scope: user_id của backend phân vùng; db_scope:
+  file SQLite của user) + bảng + khóa truy vấn (db_wrapper: tên backend và tham số)
+- Hủy theo bảng: hàm ghi của db_wrapper hủy đúng các bảng nó sửa trong phạm vi
+  của nó; cloud_mirror hủy khi làm mới nhận thay đổi từ server và khi outbox gửi xong
+- Giới hạn REF_CACHE_MAX_ENTRIES mục (LRU) và REF_CACHE_TTL_SECONDS giây (thay đổi
+  từ process / thiết bị khác không đi qua các hàm ghi ở đây)
+- Lần tải đang chạy khi bảng bị hủy không được lưu (số thế hệ của bảng, như
+  write_seq của cloud_mirror); kết quả rỗng chỉ giữ EMPTY_TTL_SECONDS giây
+  (backend cloud trả danh sách rỗng cả khi lỗi mạng)
+
+Giá trị trả về là bản sao nông (list / dict mới, từng dòng là dict mới): người
+gọi sửa kết quả không ảnh hưởng session khác.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
+MAX_ENTRIES = int(os.environ.get("REF_CACHE_MAX_ENTRIES", "512"))
+TTL_SECONDS = float(os.environ.get("REF_CACHE_TTL_SECONDS", "60"))
+# Kết quả rỗng: có thể là lỗi đã bị nuốt (supabase_db trả [] khi lỗi mạng), giữ ngắn
+EMPTY_TTL_SECONDS = float(os.environ.get("REF_CACHE_EMPTY_TTL_SECONDS", "5"))
+
+# Bảng được cache (tên bảng như trên Supabase / tenant_db)
+TABLES = ('jobs', 'job_rates', 'shift_presets', 'holidays', 'settings')
+
+
+def user_scope(user_id: int) -> tuple:
+    """Phạm vi dữ liệu của một user trên backend phân vùng (Supabase, bản sao, multi-tenant)."""
+    return ('user', user_id)
+
+
+def db_scope(db_path: str) -> tuple:
+    """Phạm vi dữ liệu của một file SQLite riêng (DB_LAYOUT per_user)."""
+    return ('db', os.path.abspath(db_path))
+
+
+def _copy(value):
+    if isinstance(value, list):
+        return [dict(item) if isinstance(item, dict) else item for item in value]
+    if isinstance(value, dict):
+        return {key: dict(item) if isinstance(item, dict) else item for key, item in value.items()}
+    return value
+
+
+class ReferenceCache:
+    """LRU có TTL, an toàn khi nhiều thread (mỗi session Streamlit một thread) dùng chung."""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, ttl_seconds: float = TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()   # (scope, bảng, khóa) -> (giá trị, hết hạn lúc)
+        self._generations: Dict[tuple, int] = {}                    # (scope, bảng) -> số lần bị hủy
+        self._epoch = 0                                              # số lần clear()
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0,
+                           'invalidations': 0, 'stale_loads': 0}
+            self._table_stats = {table: {'hits': 0, 'misses': 0} for table in TABLES}
+
+    def get_or_load(self, scope: tuple, table: str, key: Hashable, loader: Callable):
+        """Giá trị đã cache của (scope, table, key), hoặc gọi loader và lưu lại."""
+        entry_key = (scope, table, key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is not None and now < entry[1]:
+                self._entries.move_to_end(entry_key)
+                self._count(table, 'hits')
+                return _copy(entry[0])
+            if entry is not None:
+                del self._entries[entry_key]
+                self._stats['expired'] += 1
+            self._count(table, 'misses')
+            generation = (self._epoch, self._generations.get((scope, table), 0))
+
+        value = loader()
+        ttl = self.ttl_seconds if value else min(self.ttl_seconds, EMPTY_TTL_SECONDS)
+
+        with self._lock:
+            if (self._epoch, self._generations.get((scope, table), 0)) != generation:
+                # Bảng bị ghi trong lúc tải: kết quả có thể đã cũ
+                self._stats['stale_loads'] += 1
+                return value
+            self._entries[entry_key] = (value, now + ttl)
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return _copy(value)
+
+    def invalidate(self, scope: tuple, *tables: str) -> None:
+        """Hủy mọi mục của các bảng trong phạm vi scope (không truyền bảng: mọi bảng)."""
+        tables = tables or TABLES
+        with self._lock:
+            for table in tables:
+                self._generations[(scope, table)] = self._generations.get((scope, table), 0) + 1
+            stale = [entry_key for entry_key in self._entries
+                     if entry_key[0] == scope and entry_key[1] in tables]
+            for entry_key in stale:
+                del self._entries[entry_key]
+            self._stats['invalidations'] += len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+
+    def _count(self, table: str, outcome: str) -> None:
+        self._stats[outcome] += 1
+        table_stats = self._table_stats.setdefault(table, {'hits': 0, 'misses': 0})
+        table_stats[outcome] += 1
+
+    def get_stats(self) -> Dict:
+        """Số lần trúng / trượt (tổng và theo bảng), số mục, số phạm vi đang cache."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['tables'] = {table: dict(counts) for table, counts in self._table_stats.items()}
+            stats['entries'] = len(self._entries)
+            stats['scopes'] = len({entry_key[0] for entry_key in self._entries})
+        stats['max_entries'] = self.max_entries
+        stats['ttl_seconds'] = self.ttl_seconds
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+# Cache của process (mọi session dùng chung)
+_cache = ReferenceCache()
+
+
+def get_or_load(scope: tuple, table: str, key: Hashable, loader: Callable):
+    return _cache.get_or_load(scope, table, key, loader)
+
+
+def invalidate(scope: tuple, *tables: str) -> None:
+    _cache.invalidate(scope, *tables)
+
+
+def clear() -> None:
+    _cache.clear()
+
+
+def get_stats() -> Dict:
+    return _cache.get_stats()
+
+
+def reset_stats() -> None:
+    _cache.reset_stats()
+
+
+def configure(max_entries: Optional[int] = None, ttl_seconds: Optional[float] = None) -> None:
+    """Đổi giới hạn của cache process (benchmark / thử nghiệm); mục đang có được giữ."""
+    if max_entries is not None:
+        _cache.max_entries = max_entries
+    if ttl_seconds is not None:
+        _cache.ttl_seconds = ttl_seconds
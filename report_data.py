@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Lớp dữ liệu báo cáo dạng cột (columnar) cho biểu đồ, thống kê và xuất file.
+Đọc ca làm việc bằng pd.read_sql với kiểu dữ liệu gọn (ngày datetime64,
+công việc categorical, giờ float32) thay vì tạo DataFrame từ danh sách dict
+chứa danh sách ca lồng nhau.
+"""
+
+from datetime import date
+from io import BytesIO
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+import database as sqlite_db
+import db_wrapper as db
+import payroll
+import tenant_db
+
+# Cột đọc từ work_shifts và kiểu dữ liệu tương ứng
+SHIFT_COLUMNS = ['work_date', 'job_id', 'shift_name', 'start_time', 'end_time',
+                 'break_hours', 'total_hours', 'notes']
+SHIFT_DTYPES = {
+    'job_id': 'int32',
+    'shift_name': 'string',
+    'start_time': 'string',
+    'end_time': 'string',
+    'break_hours': 'float32',
+    'total_hours': 'float32',
+    'notes': 'string',
+}
+
+
+def _empty_shift_frame() -> pd.DataFrame:
+    """DataFrame rỗng đúng schema của load_shift_frame."""
+    frame = pd.DataFrame({col: pd.Series(dtype=SHIFT_DTYPES.get(col, 'object')) for col in SHIFT_COLUMNS})
+    frame['work_date'] = pd.to_datetime(frame['work_date'])
+    frame['job'] = pd.Categorical([])
+    return frame
+
+
+def load_shift_frame(start_date: date, end_date: date) -> pd.DataFrame:
+    """
+    Đọc các ca làm việc trong khoảng thời gian thành DataFrame dạng cột.
+
+    Returns:
+        DataFrame với work_date (datetime64), job_id (int32), job (categorical),
+        break_hours/total_hours (float32) và các cột chuỗi, sắp theo ngày và giờ bắt đầu
+    """
+    params = (start_date.isoformat(), end_date.isoformat())
+    if db.is_cloud_mode():
+        records = db.get_shifts_by_range(start_date, end_date)
+        frame = pd.DataFrame.from_records(records, columns=SHIFT_COLUMNS)
+        if frame.empty:
+            return _empty_shift_frame()
+        frame['job_id'] = frame['job_id'].fillna(0)
+        frame = frame.astype(SHIFT_DTYPES)
+    else:
+        # Multi-tenant: cùng truy vấn trên file chung, lọc theo user_id (index ghép user_id, work_date)
+        if db.is_multi_tenant():
+            conn = tenant_db.get_connection()
+            tenant_filter = "user_id = ? AND "
+            params = (db.current_user_id(),) + params
+        else:
+            conn = sqlite_db.get_connection()
+            tenant_filter = ""
+        try:
+            frame = pd.read_sql(
+                f"""
+                SELECT {', '.join(SHIFT_COLUMNS)} FROM work_shifts
+                WHERE {tenant_filter}work_date BETWEEN ? AND ?
+                ORDER BY work_date ASC, start_time ASC
+                """,
+                conn,
+                params=params,
+                dtype=SHIFT_DTYPES,
+            )
+        finally:
+            conn.close()
+        if frame.empty:
+            return _empty_shift_frame()
+
+    frame['work_date'] = pd.to_datetime(frame['work_date'].astype(str).str[:10])
+    job_names = {job['id']: job['job_name'] for job in db.get_all_jobs()}
+    frame['job'] = pd.Categorical(
+        frame['job_id'].map(job_names).fillna(payroll.UNCATEGORIZED_JOB_NAME)
+    )
+    return frame
+
+
+def daily_frame(shifts: pd.DataFrame, standard_hours: float = payroll.DEFAULT_STANDARD_HOURS) -> pd.DataFrame:
+    """Gộp ca làm việc theo ngày: tổng giờ, số ca và giờ vượt chuẩn."""
+    if shifts.empty:
+        return pd.DataFrame({
+            'work_date': pd.Series(dtype='datetime64[ns]'),
+            'total_hours': pd.Series(dtype='float32'),
+            'shift_count': pd.Series(dtype='int32'),
+            'overtime_hours': pd.Series(dtype='float32'),
+        })
+
+    daily = shifts.groupby('work_date', sort=True).agg(
+        total_hours=('total_hours', 'sum'),
+        shift_count=('total_hours', 'size'),
+    ).reset_index()
+    daily['total_hours'] = daily['total_hours'].round(2).astype('float32')
+    daily['shift_count'] = daily['shift_count'].astype('int32')
+    daily['overtime_hours'] = (daily['total_hours'] - standard_hours).clip(lower=0).round(2).astype('float32')
+    return daily
+
+
+def resolve_rates(shifts: pd.DataFrame, rules: Dict) -> pd.Series:
+    """Lương giờ có hiệu lực của từng ca (tra bisect theo từng công việc, vector hóa)."""
+    rates = pd.Series(0.0, index=shifts.index, dtype='float64')
+    if shifts.empty:
+        return rates
+
+    iso_dates = shifts['work_date'].dt.strftime('%Y-%m-%d').to_numpy()
+    for job_id, positions in shifts.groupby('job_id').indices.items():
+        index = rules['rate_index'].get(job_id)
+        if index:
+            dates, job_rates = index
+            pos = np.searchsorted(np.asarray(dates), iso_dates[positions], side='right') - 1
+            rates.iloc[positions] = np.asarray(job_rates, dtype='float64')[np.maximum(pos, 0)]
+        else:
+            rates.iloc[positions] = rules['jobs'].get(job_id, {}).get('hourly_rate', 0)
+    return rates
+
+
+def export_frame(shifts: pd.DataFrame, rules: Dict) -> pd.DataFrame:
+    """
+    Bảng xuất Excel/CSV: một dòng mỗi ca, kèm lương giờ và lương ca (chưa có dòng tổng).
+    Giờ float32 đưa về float64 làm tròn 2 chữ số (giá trị lưu trong database) trước
+    khi nhân và ghi ra file, để không lộ nhiễu float32 (7.6999998).
+    """
+    hourly_rate = resolve_rates(shifts, rules)
+    total_hours = shifts['total_hours'].astype('float64').round(2)
+    return pd.DataFrame({
+        'Ngày': shifts['work_date'].dt.strftime('%Y-%m-%d'),
+        'Ca làm': shifts['shift_name'],
+        'Nơi làm': shifts['job'],
+        'Giờ BĐ': shifts['start_time'],
+        'Giờ KT': shifts['end_time'],
+        'Nghỉ (h)': shifts['break_hours'].astype('float64').round(2),
+        'Tổng giờ': total_hours,
+        'Lương/h': hourly_rate,
+        'Lương ca': (total_hours * hourly_rate).round(2),
+        'Ghi chú': shifts['notes'].fillna(''),
+    })
+
+
+def build_export(start_date: date, end_date: date) -> Optional[Dict]:
+    """
+    File xuất báo cáo của khoảng thời gian (dòng tổng cộng ở cuối), qua result_cache:
+    các process dùng chung file đã tạo cho đến khi dữ liệu của user đổi.
+
+    Returns:
+        {'xlsx': bytes, 'csv': bytes, 'total_salary': float}, None nếu không có ca nào
+    """
+    return db.cached_result('report_export', (start_date, end_date),
+                            lambda: _build_export(start_date, end_date), start_date)
+
+
+def export_file(start_date: date, end_date: date, file_format: str) -> bytes:
+    """Nội dung file xuất ('xlsx' / 'csv') cho nút tải của báo cáo, rỗng nếu không có ca nào."""
+    export = build_export(start_date, end_date)
+    return export[file_format] if export else b''
+
+
+def _build_export(start_date: date, end_date: date) -> Optional[Dict]:
+    shifts = load_shift_frame(start_date, end_date)
+    if shifts.empty:
+        return None
+    frame = export_frame(shifts, db.get_payroll_rules(start_date, end_date))
+    total_salary = round(float(frame['Lương ca'].sum()), 2)
+    summary_row = {
+        'Ngày': 'TỔNG CỘNG',
+        'Ca làm': '',
+        'Nơi làm': '',
+        'Giờ BĐ': '',
+        'Giờ KT': '',
+        'Nghỉ (h)': '',
+        'Tổng giờ': round(float(frame['Tổng giờ'].sum()), 2),
+        'Lương/h': '',
+        'Lương ca': total_salary,
+        'Ghi chú': ''
+    }
+    frame = pd.concat([frame, pd.DataFrame([summary_row])], ignore_index=True)
+
+    # openpyxl chỉ tải khi thật sự tạo file
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        frame.to_excel(writer, sheet_name='Bao Cao Gio Lam', index=False)
+    return {
+        'xlsx': output.getvalue(),
+        'csv': frame.to_csv(index=False).encode('utf-8-sig'),
+        'total_salary': total_salary,
+    }
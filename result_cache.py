@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Cache kết quả tổng hợp trên đĩa (một file SQLite local), dùng chung giữa các
+process Streamlit của cùng máy (nhiều worker sau load balancer) và qua các lần
+khởi động lại: lương theo tháng, tổng hợp theo ngày, file xuất báo cáo.
+
+- Khóa: phạm vi dữ liệu (database / user của backend) + thế hệ dữ liệu + loại
+  kết quả + tham số. Thế hệ dữ liệu là token do trigger SQLite đổi trong cùng
+  transaction với mọi lần ghi (database.get_data_generation,
+  tenant_db.query_data_generation) nên mục cũ không bao giờ được đọc lại, không
+  cần hủy cache khi ghi, kể cả ghi từ process khác
+- Lưu mục mới của một phạm vi thì xóa các mục của thế hệ cũ trong phạm vi đó
+- Giới hạn RESULT_CACHE_MAX_MB (tổng kích thước giá trị): vượt thì bỏ các mục
+  dùng lâu nhất đến còn EVICT_TO_RATIO giới hạn
+- Lỗi SQLite (file bị khóa lâu, hỏng) chỉ làm bỏ qua cache, không làm lỗi trang
+
+Tắt mặc định; bật bằng RESULT_CACHE = "1" (secrets hoặc biến môi trường).
+Giá trị lưu bằng pickle: file chỉ do chính ứng dụng ghi, không nhận từ ngoài.
+"""
+
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Hashable, Optional
+
+CACHE_PATH = os.environ.get(
+    "RESULT_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "user_data", "result_cache.db")
+)
+
+MAX_BYTES = int(float(os.environ.get("RESULT_CACHE_MAX_MB", "64")) * 1024 * 1024)
+EVICT_TO_RATIO = 0.8
+
+# Lần trúng chỉ cập nhật thời điểm dùng nếu đã cũ hơn TOUCH_SECONDS (ít ghi khi đọc)
+TOUCH_SECONDS = 60
+
+# Chờ khóa ghi của process khác (giây) trước khi bỏ qua cache
+BUSY_TIMEOUT_SECONDS = 2.0
+
+# Đổi khi cách tính / dạng kết quả đổi: mục của phiên bản cũ không còn được đọc
+FORMAT_VERSION = 1
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS results (
+        key TEXT PRIMARY KEY,
+        scope TEXT NOT NULL,
+        generation TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        value BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        used_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_results_used ON results(used_at)",
+    "CREATE INDEX IF NOT EXISTS idx_results_scope ON results(scope, generation)",
+]
+
+# Bật/tắt (cache sau lần đọc cấu hình đầu tiên)
+_enabled = None
+
+# Mỗi thread một kết nối (theo file)
+_local = threading.local()
+
+_stats_lock = threading.Lock()
+_stats: Dict = {}
+
+
+def is_enabled() -> bool:
+    """RESULT_CACHE trong secrets, rồi biến môi trường; mặc định tắt."""
+    global _enabled
+    if _enabled is not None:
+        return _enabled
+
+    value = None
+    try:
+        import streamlit as st
+        if "RESULT_CACHE" in st.secrets:
+            value = str(st.secrets["RESULT_CACHE"])
+    except Exception:
+        pass
+    value = (value or os.environ.get("RESULT_CACHE", "0")).strip().lower()
+    _enabled = value in ('1', 'true', 'on', 'yes')
+    return _enabled
+
+
+def configure(enabled: Optional[bool] = None, path: Optional[str] = None,
+              max_bytes: Optional[int] = None) -> None:
+    """Đổi cấu hình của process (benchmark / thử nghiệm)."""
+    global _enabled, CACHE_PATH, MAX_BYTES
+    if enabled is not None:
+        _enabled = enabled
+    if path is not None:
+        CACHE_PATH = path
+    if max_bytes is not None:
+        MAX_BYTES = max_bytes
+
+
+# ==================== KẾT NỐI ====================
+
+def _connection() -> sqlite3.Connection:
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(CACHE_PATH)
+    if conn is None:
+        os.makedirs(os.path.dirname(CACHE_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(CACHE_PATH, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            conn.execute(statement)
+        conns[CACHE_PATH] = conn
+    return conn
+
+
+def _drop_connection() -> None:
+    conns = getattr(_local, 'conns', None) or {}
+    conn = conns.pop(CACHE_PATH, None)
+    if conn is not None:
+        conn.close()
+
+
+def _entry_key(scope: str, generation: str, kind: str, params: Hashable) -> str:
+    raw = repr((FORMAT_VERSION, scope, generation, kind, params))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+# ==================== ĐỌC / GHI ====================
+
+def get_or_compute(scope: str, generation: str, kind: str, params: Hashable, compute: Callable):
+    """
+    Kết quả đã lưu của (scope, generation, kind, params), hoặc gọi compute và lưu lại.
+    Kết quả rỗng không được lưu (có thể là lỗi đã bị nuốt ở tầng dưới).
+    """
+    key = _entry_key(scope, generation, kind, params)
+    try:
+        row = _connection().execute("SELECT value, used_at FROM results WHERE key = ?", (key,)).fetchone()
+    except sqlite3.Error as e:
+        _error('read', e)
+        return compute()
+
+    if row is not None:
+        try:
+            value = pickle.loads(row[0])
+        except Exception as e:
+            _error('decode', e)
+        else:
+            _count('hits')
+            if time.time() - row[1] > TOUCH_SECONDS:
+                _touch(key)
+            return value
+
+    _count('misses')
+    value = compute()
+    if value:
+        _store(key, scope, generation, kind, value)
+    return value
+
+
+def _touch(key: str) -> None:
+    try:
+        _connection().execute("UPDATE results SET used_at = ? WHERE key = ?", (time.time(), key))
+    except sqlite3.Error:
+        pass   # chỉ ảnh hưởng thứ tự bỏ mục
+
+
+def _store(key: str, scope: str, generation: str, kind: str, value) -> None:
+    """Lưu một mục (xóa các thế hệ cũ của scope), rồi bỏ mục dùng lâu nhất nếu vượt giới hạn."""
+    blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(blob) > MAX_BYTES * EVICT_TO_RATIO:
+        return
+    conn = _connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            superseded = conn.execute("DELETE FROM results WHERE scope = ? AND generation <> ?",
+                                      (scope, generation)).rowcount
+            conn.execute("""
+                INSERT OR REPLACE INTO results (key, scope, generation, kind, value, size, used_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (key, scope, generation, kind, blob, len(blob), time.time()))
+            evicted = _evict(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    except sqlite3.Error as e:
+        _error('write', e)
+        return
+    _count('stores')
+    _count('superseded', superseded)
+    _count('evictions', evicted)
+
+
+def _evict(conn: sqlite3.Connection) -> int:
+    """Bỏ mục dùng lâu nhất đến khi tổng kích thước còn EVICT_TO_RATIO giới hạn."""
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+    if total <= MAX_BYTES:
+        return 0
+    target = MAX_BYTES * EVICT_TO_RATIO
+    evicted = 0
+    while total > target:
+        rows = conn.execute("SELECT key, size FROM results ORDER BY used_at LIMIT 64").fetchall()
+        if not rows:
+            break
+        for key, size in rows:
+            if total <= target:
+                break
+            conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+    return evicted
+
+
+def clear() -> None:
+    """Xóa mọi mục trong file cache."""
+    try:
+        _connection().execute("DELETE FROM results")
+    except sqlite3.Error as e:
+        _error('write', e)
+
+
+# ==================== SỐ LIỆU ====================
+
+def reset_stats() -> None:
+    with _stats_lock:
+        _stats.clear()
+        _stats.update({'hits': 0, 'misses': 0, 'stores': 0, 'superseded': 0,
+                       'evictions': 0, 'errors': 0})
+
+
+def _count(key: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def _error(action: str, error: Exception) -> None:
+    print(f"Result cache {action} error: {error}")
+    _count('errors')
+    if action != 'decode':
+        _drop_connection()   # lần sau mở lại (file có thể đã bị xóa / thay)
+
+
+def get_stats() -> Dict:
+    """Số liệu của process (từ lần reset_stats() gần nhất) và kích thước file cache hiện tại."""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+    stats['max_bytes'] = MAX_BYTES
+    try:
+        entries, size = _connection().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        stats['entries'], stats['bytes'] = entries, size
+    except sqlite3.Error:
+        stats['entries'], stats['bytes'] = None, None
+    return stats
+
+
+reset_stats()
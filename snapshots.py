@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Sao lưu / khôi phục database SQLite bằng online backup API (sqlite3.Connection.backup).
+Bản sao luôn nhất quán kể cả khi app đang ghi (chép theo từng nhóm trang,
+không khóa người đọc), có thể nén gzip, giữ số bản giới hạn và kiểm tra
+integrity trước khi khôi phục.
+"""
+
+import gzip
+import os
+import sqlite3
+import tempfile
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Thư mục chứa bản sao lưu local: user_data/backups/<tên db>-<thời điểm>.db.gz
+BACKUP_DIR = os.path.join("user_data", "backups")
+
+# Số bản sao lưu giữ lại cho mỗi database (bản cũ nhất bị xóa trước)
+KEEP_SNAPSHOTS = 10
+
+# Bản sao lưu tự động trước khi khôi phục: tên có đuôi -pre-restore, xoay vòng riêng
+# (không chiếm chỗ của bản sao lưu thường và ngược lại)
+PRE_RESTORE_TAG = "pre-restore"
+KEEP_PRE_RESTORE = 3
+
+# Mỗi bước backup chép BACKUP_PAGES trang rồi nhường BACKUP_SLEEP giây cho các kết nối khác
+BACKUP_PAGES = 256
+BACKUP_SLEEP = 0.005
+BACKUP_MAX_RESTARTS = 3
+BACKUP_MAX_BUSY_STEPS = 200
+BACKUP_LOCK_TIMEOUT_MS = 30000
+
+SQLITE_HEADER = b"SQLite format 3\0"
+COMPRESSED_SUFFIX = ".gz"
+
+
+class _BackupStarved(Exception):
+    """Backup theo trang không tiến triển được vì database liên tục được ghi."""
+
+
+def backup_to_file(db_path: str, dest_path: str) -> None:
+    """
+    Chép database sang file mới bằng online backup (theo từng nhóm trang).
+
+    Nếu database bị ghi liên tục khiến backup phải chép lại từ đầu quá
+    BACKUP_MAX_RESTARTS lần (hoặc bận quá BACKUP_MAX_BUSY_STEPS bước), giữ một
+    transaction đọc trên kết nối nguồn và chép một lượt (người ghi chờ trong lúc chép).
+    """
+    progress_state = {'remaining': None, 'restarts': 0, 'busy': 0}
+
+    def on_progress(status, remaining, total):
+        if status in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED):
+            progress_state['busy'] += 1
+        elif progress_state['remaining'] is not None and remaining > progress_state['remaining']:
+            progress_state['restarts'] += 1
+        if (progress_state['restarts'] > BACKUP_MAX_RESTARTS
+                or progress_state['busy'] > BACKUP_MAX_BUSY_STEPS):
+            raise _BackupStarved()
+        progress_state['remaining'] = remaining
+
+    # timeout=0: bước bị khóa trả về BUSY ngay (backup tự chờ BACKUP_SLEEP rồi thử lại)
+    src = sqlite3.connect(db_path, timeout=0)
+    dst = sqlite3.connect(dest_path)
+    try:
+        try:
+            src.backup(dst, pages=BACKUP_PAGES, progress=on_progress, sleep=BACKUP_SLEEP)
+        except _BackupStarved:
+            src.execute(f"PRAGMA busy_timeout = {BACKUP_LOCK_TIMEOUT_MS}")
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            src.backup(dst, pages=-1)
+            src.rollback()
+    finally:
+        dst.close()
+        src.close()
+
+
+def check_integrity(db_path: str) -> bool:
+    """PRAGMA integrity_check trả về 'ok' hay không."""
+    try:
+        conn = sqlite3.connect(db_path)
+        try:
+            row = conn.execute("PRAGMA integrity_check").fetchone()
+        finally:
+            conn.close()
+        return bool(row) and row[0] == "ok"
+    except sqlite3.DatabaseError:
+        return False
+
+
+def _normalize_header(content: bytes) -> bytes:
+    """
+    Đưa bộ đếm thay đổi trong header về 0 (cả bản sao 'version-valid-for' để
+    header vẫn hợp lệ): transaction không đổi dữ liệu cho ra snapshot giống hệt.
+    """
+    if len(content) < 100 or not content.startswith(SQLITE_HEADER):
+        return content
+    return content[:24] + bytes(4) + content[28:92] + bytes(4) + content[96:]
+
+
+def compact_file(db_path: str) -> None:
+    """
+    VACUUM một file database không ai dùng (bản sao tạm): bỏ trang trống và
+    xếp lại trang, bản sao nhỏ hơn và nén tốt hơn. Không khóa database gốc.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def snapshot_bytes(db_path: str, compress: bool = True, compact: bool = False) -> bytes:
+    """
+    Snapshot nhất quán của database dưới dạng bytes (dùng để upload).
+    compact: VACUUM bản sao tạm trước khi đọc (compact_file).
+    Nén gzip với mtime=0 để cùng nội dung luôn cho cùng bytes (cùng sha).
+    """
+    tmp_dir = tempfile.mkdtemp()
+    tmp_path = os.path.join(tmp_dir, "snapshot.db")
+    try:
+        backup_to_file(db_path, tmp_path)
+        if compact:
+            compact_file(tmp_path)
+        with open(tmp_path, "rb") as f:
+            content = _normalize_header(f.read())
+        return gzip.compress(content, mtime=0) if compress else content
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        os.rmdir(tmp_dir)
+
+
+def _snapshot_prefix(db_path: str) -> str:
+    """Tiền tố tên file sao lưu của một database (user_abc.db -> 'user_abc-')."""
+    return os.path.splitext(os.path.basename(db_path))[0] + "-"
+
+
+def create_snapshot(db_path: str, backup_dir: str = BACKUP_DIR, compress: bool = True,
+                    keep: int = KEEP_SNAPSHOTS, tag: str = "") -> Optional[str]:
+    """
+    Tạo bản sao lưu của database rồi xóa bớt bản cũ.
+
+    Args:
+        db_path: Database cần sao lưu
+        backup_dir: Thư mục chứa bản sao lưu
+        compress: Nén gzip (.db.gz)
+        keep: Số bản cùng tag giữ lại (0 = không xóa bản nào)
+        tag: Loại bản sao lưu (vd. PRE_RESTORE_TAG), thêm vào cuối tên file
+
+    Returns:
+        Đường dẫn file sao lưu, None nếu lỗi
+    """
+    try:
+        if not os.path.exists(db_path):
+            print(f"❌ Database không tồn tại: {db_path}")
+            return None
+        os.makedirs(backup_dir, exist_ok=True)
+
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        suffix = f"-{tag}" if tag else ""
+        dest_path = os.path.join(backup_dir, f"{_snapshot_prefix(db_path)}{stamp}{suffix}.db")
+        if compress:
+            dest_path += COMPRESSED_SUFFIX
+
+        tmp_path = dest_path + ".tmp"
+        if compress:
+            with open(tmp_path, "wb") as f:
+                f.write(snapshot_bytes(db_path, compress=True))
+        else:
+            backup_to_file(db_path, tmp_path)
+        os.replace(tmp_path, dest_path)
+
+        if keep:
+            rotate_snapshots(db_path, keep, backup_dir, tag)
+        return dest_path
+    except Exception as e:
+        print(f"❌ Lỗi sao lưu: {e}")
+        return None
+
+
+def list_snapshots(db_path: str, backup_dir: str = BACKUP_DIR) -> List[Dict]:
+    """
+    Danh sách bản sao lưu của database, mới nhất trước.
+
+    Returns:
+        List dict {path, name, created_at (datetime), size, tag}
+    """
+    if not os.path.isdir(backup_dir):
+        return []
+
+    prefix = _snapshot_prefix(db_path)
+    snapshots = []
+    for name in os.listdir(backup_dir):
+        if not name.startswith(prefix) or not (name.endswith(".db") or name.endswith(".db" + COMPRESSED_SUFFIX)):
+            continue
+        # <thời điểm>[-<tag>]: thời điểm có dạng YYYYmmdd-HHMMSS-ffffff
+        parts = name[len(prefix):].split(".db")[0].split("-", 3)
+        stamp = "-".join(parts[:3])
+        try:
+            created_at = datetime.strptime(stamp, "%Y%m%d-%H%M%S-%f")
+        except ValueError:
+            continue
+        path = os.path.join(backup_dir, name)
+        snapshots.append({
+            'path': path,
+            'name': name,
+            'created_at': created_at,
+            'size': os.path.getsize(path),
+            'tag': parts[3] if len(parts) > 3 else "",
+        })
+    snapshots.sort(key=lambda s: s['created_at'], reverse=True)
+    return snapshots
+
+
+def rotate_snapshots(db_path: str, keep: int = KEEP_SNAPSHOTS, backup_dir: str = BACKUP_DIR,
+                     tag: str = "") -> int:
+    """Xóa các bản sao lưu cũ cùng tag, chỉ giữ `keep` bản mới nhất. Trả về số bản đã xóa."""
+    removed = 0
+    same_tag = [snapshot for snapshot in list_snapshots(db_path, backup_dir) if snapshot['tag'] == tag]
+    for snapshot in same_tag[keep:]:
+        try:
+            os.remove(snapshot['path'])
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def restore_snapshot(snapshot_path: str, db_path: str, backup_dir: str = BACKUP_DIR) -> bool:
+    """
+    Khôi phục database từ bản sao lưu.
+
+    Bản sao lưu được giải nén ra file tạm và phải qua integrity_check; database
+    hiện tại được sao lưu trước (tag PRE_RESTORE_TAG, giữ KEEP_PRE_RESTORE bản, để
+    có thể hoàn tác), rồi nội dung được chép đè bằng backup API nên các kết nối
+    khác không thấy file dở dang. Không sao lưu được bản hiện tại thì không khôi phục.
+
+    Returns:
+        True nếu khôi phục thành công
+    """
+    tmp_dir = tempfile.mkdtemp()
+    tmp_path = os.path.join(tmp_dir, "restore.db")
+    try:
+        with open(snapshot_path, "rb") as f:
+            content = f.read()
+        if snapshot_path.endswith(COMPRESSED_SUFFIX):
+            content = gzip.decompress(content)
+        if not content.startswith(SQLITE_HEADER):
+            print(f"❌ {snapshot_path} không phải database SQLite")
+            return False
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+
+        if not check_integrity(tmp_path):
+            print(f"❌ Bản sao lưu {snapshot_path} bị lỗi (integrity_check)")
+            return False
+
+        if os.path.exists(db_path):
+            if not create_snapshot(db_path, backup_dir, keep=KEEP_PRE_RESTORE, tag=PRE_RESTORE_TAG):
+                print(f"❌ Không sao lưu được database hiện tại, hủy khôi phục: {db_path}")
+                return False
+
+        src = sqlite3.connect(tmp_path)
+        dst = sqlite3.connect(db_path)
+        try:
+            src.backup(dst, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP)
+        finally:
+            dst.close()
+            src.close()
+        return check_integrity(db_path)
+    except Exception as e:
+        print(f"❌ Lỗi khôi phục: {e}")
+        return False
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        os.rmdir(tmp_dir)
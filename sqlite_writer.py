@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Điều phối ghi SQLite cho các file database của ứng dụng (database của từng
+user, tenants.db, users.db).
+
+- Mỗi file một khóa ghi trong process: các thread (nhiều tab / session cùng
+  ghi một database) lần lượt ghi thay vì tranh nhau khóa của SQLite
+- Mỗi lần ghi là một transaction BEGIN IMMEDIATE: khóa ghi được lấy ngay đầu
+  transaction và process khác đang ghi thì chờ (busy_timeout) tối đa
+  BUSY_TIMEOUT_SECONDS. Transaction mặc định (DEFERRED) đọc trước rồi mới
+  nâng lên khóa ghi; khi hai kết nối cùng nâng khóa SQLite trả về
+  "database is locked" ngay, không chờ
+- Số liệu (get_stats): số transaction, số lần phải chờ khóa, thời gian chờ,
+  lỗi khóa (hết BUSY_TIMEOUT_SECONDS), rollback
+
+Chỉnh thời gian chờ bằng biến môi trường SQLITE_BUSY_TIMEOUT_SECONDS.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+BUSY_TIMEOUT_SECONDS = float(os.environ.get("SQLITE_BUSY_TIMEOUT_SECONDS", "30"))
+
+# Chờ lâu hơn ngưỡng này (ms) mới tính là một lần phải chờ khóa
+CONTENDED_MS = 1.0
+
+# Khóa ghi theo file database (đường dẫn tuyệt đối); RLock: hàm ghi lồng nhau
+# trong cùng thread không tự khóa chính nó
+_locks: Dict[str, threading.RLock] = {}
+_locks_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats: Dict = {}
+
+
+def connect(db_path: str, **kwargs) -> sqlite3.Connection:
+    """sqlite3.connect với busy_timeout BUSY_TIMEOUT_SECONDS (cả lần đọc khi file đang được commit)."""
+    kwargs.setdefault('timeout', BUSY_TIMEOUT_SECONDS)
+    return sqlite3.connect(db_path, **kwargs)
+
+
+def _lock_for(db_path: str) -> threading.RLock:
+    key = os.path.abspath(db_path)
+    lock = _locks.get(key)
+    if lock is None:
+        with _locks_lock:
+            lock = _locks.setdefault(key, threading.RLock())
+    return lock
+
+
+def _is_lock_error(error: sqlite3.OperationalError) -> bool:
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection, db_path: str):
+    """
+    Một transaction ghi trên conn (kết nối tới db_path): giữ khóa ghi của file
+    trong process, BEGIN IMMEDIATE, commit khi khối lệnh thành công và rollback
+    khi lỗi. Lỗi vẫn được ném ra cho người gọi.
+    """
+    lock = _lock_for(db_path)
+    started = time.perf_counter()
+    with lock:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            if _is_lock_error(e):
+                _record_wait(started, lock_error=True)
+            raise
+        _record_wait(started)
+        try:
+            yield conn
+            conn.commit()
+        except BaseException as e:
+            conn.rollback()
+            _count('rollbacks')
+            if isinstance(e, sqlite3.OperationalError) and _is_lock_error(e):
+                _count('lock_errors')
+            raise
+
+
+@contextmanager
+def write_lock(db_path: str):
+    """
+    Giữ khóa ghi của file trong process cho lệnh không chạy được trong transaction
+    (VACUUM); khóa của SQLite do chính lệnh lấy, chờ theo busy_timeout của kết nối.
+    """
+    with _lock_for(db_path):
+        yield
+
+
+# ==================== SỐ LIỆU ====================
+
+def reset_stats() -> None:
+    with _stats_lock:
+        _stats.clear()
+        _stats.update({
+            'transactions': 0,   # transaction đã lấy được khóa ghi
+            'contended': 0,      # transaction phải chờ khóa (thread khác / process khác đang ghi)
+            'wait_ms': 0.0,      # tổng thời gian chờ khóa
+            'max_wait_ms': 0.0,
+            'lock_errors': 0,    # hết BUSY_TIMEOUT_SECONDS vẫn chưa có khóa
+            'rollbacks': 0,
+        })
+
+
+def _count(key: str, amount=1) -> None:
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def _record_wait(started: float, lock_error: bool = False) -> None:
+    waited_ms = (time.perf_counter() - started) * 1000
+    with _stats_lock:
+        if lock_error:
+            _stats['lock_errors'] += 1
+        else:
+            _stats['transactions'] += 1
+        if waited_ms >= CONTENDED_MS:
+            _stats['contended'] += 1
+        _stats['wait_ms'] += waited_ms
+        _stats['max_wait_ms'] = max(_stats['max_wait_ms'], waited_ms)
+
+
+def get_stats() -> Dict:
+    """Số liệu từ lần reset_stats() gần nhất, kèm thời gian chờ trung bình mỗi transaction."""
+    with _stats_lock:
+        stats = dict(_stats)
+    attempts = stats['transactions'] + stats['lock_errors']
+    stats['avg_wait_ms'] = stats['wait_ms'] / attempts if attempts else 0.0
+    stats['busy_timeout_seconds'] = BUSY_TIMEOUT_SECONDS
+    return stats
+
+
+reset_stats()
@@ -0,0 +1,43 @@
+-- Lịch sử lương giờ theo ngày hiệu lực (supabase_db.get_job_rates / record_rate_change).
+--
+-- record_rate_change upsert theo (job_id, effective_from): cần unique constraint trên
+-- hai cột này, nếu không PostgREST trả lỗi 42P10 và mốc lương không được lưu.
+-- user_id để lọc theo user (get_job_rates) và cho hàm tổng hợp payroll_aggregates.
+-- Các migration sau (aggregate_rpcs, mirror_changes) đọc và ALTER bảng này.
+--
+-- Bản SQLite cùng cấu trúc: tenant_db.SCHEMA (job_rates).
+-- Project đã có bảng job_rates tạo tay: thêm cột / constraint còn thiếu, mốc trùng
+-- (job_id, effective_from) chỉ giữ dòng mới nhất.
+--
+-- Áp dụng: supabase db push   (hoặc dán vào SQL Editor của project)
+
+create table if not exists job_rates (
+    id bigint generated by default as identity primary key,
+    user_id bigint not null references users(id) on delete cascade,
+    job_id bigint not null references jobs(id) on delete cascade,
+    effective_from date not null,
+    hourly_rate double precision not null,
+    created_at timestamptz default now(),
+    constraint uq_job_rates_job_effective unique (job_id, effective_from)
+);
+
+alter table job_rates add column if not exists user_id bigint references users(id) on delete cascade;
+update job_rates r set user_id = j.user_id from jobs j where r.user_id is null and j.id = r.job_id;
+delete from job_rates where user_id is null;
+alter table job_rates alter column user_id set not null;
+
+delete from job_rates r
+using job_rates newer
+where newer.job_id = r.job_id
+  and newer.effective_from = r.effective_from
+  and newer.id > r.id;
+
+do $$
+begin
+    if not exists (select 1 from pg_constraint where conname = 'uq_job_rates_job_effective') then
+        alter table job_rates add constraint uq_job_rates_job_effective unique (job_id, effective_from);
+    end if;
+end;
+$$;
+
+create index if not exists idx_job_rates_user on job_rates (user_id, effective_from);
@@ -0,0 +1,37 @@
+-- Snapshot lương của các tháng đã chốt (supabase_db.save_payroll_snapshot / get_payroll_snapshot...).
+--
+-- save_payroll_snapshot upsert theo (user_id, year, month): cần unique constraint trên
+-- ba cột này, nếu không PostgREST trả lỗi 42P10 và không chốt được tháng nào.
+-- salary_json / daily_json là jsonb (client gửi và nhận object, không phải chuỗi JSON).
+-- Migration mirror_changes sau đó ALTER và đọc bảng này.
+--
+-- Bản SQLite cùng cấu trúc: tenant_db.SCHEMA (payroll_snapshots).
+-- Project đã có bảng payroll_snapshots tạo tay: tháng chốt trùng chỉ giữ lần chốt mới nhất.
+--
+-- Áp dụng: supabase db push   (hoặc dán vào SQL Editor của project)
+
+create table if not exists payroll_snapshots (
+    user_id bigint not null references users(id) on delete cascade,
+    year integer not null,
+    month integer not null check (month between 1 and 12),
+    salary_json jsonb not null,
+    daily_json jsonb not null,
+    closed_at timestamptz default now(),
+    constraint uq_payroll_snapshots_user_month primary key (user_id, year, month)
+);
+
+delete from payroll_snapshots s
+using payroll_snapshots newer
+where newer.user_id = s.user_id
+  and newer.year = s.year
+  and newer.month = s.month
+  and (coalesce(newer.closed_at, '-infinity'), newer.ctid) > (coalesce(s.closed_at, '-infinity'), s.ctid);
+
+-- Bảng tạo tay có thể đã có khóa chính khác: thêm unique constraint (on_conflict dùng được cả hai)
+do $$
+begin
+    if not exists (select 1 from pg_constraint where conname = 'uq_payroll_snapshots_user_month') then
+        alter table payroll_snapshots add constraint uq_payroll_snapshots_user_month unique (user_id, year, month);
+    end if;
+end;
+$$;
@@ -0,0 +1,47 @@
+-- Tên công việc không trùng trong cùng user (supabase_db.add_job, outbox của cloud_mirror).
+--
+-- add_job upsert theo (user_id, job_name): cần unique constraint trên hai cột này, nếu
+-- không PostgREST trả lỗi 42P10 và không thêm được công việc nào.
+--
+-- Công việc trùng tên đã có (thêm hai lần khi còn select-rồi-insert) được gộp vào dòng
+-- có id nhỏ nhất: ca làm việc, khung giờ mẫu và mốc lương chuyển sang dòng giữ lại
+-- (mốc lương trùng ngày hiệu lực thì giữ mốc của dòng giữ lại), rồi xóa các dòng trùng.
+--
+-- Bản SQLite cùng cấu trúc: tenant_db.SCHEMA (UNIQUE (user_id, job_name)).
+--
+-- Áp dụng: supabase db push   (hoặc dán vào SQL Editor của project)
+
+create temporary table job_duplicates as
+select j.id as duplicate_id, k.keep_id
+from jobs j
+join (select user_id, job_name, min(id) as keep_id from jobs group by user_id, job_name having count(*) > 1) k
+  on k.user_id = j.user_id and k.job_name = j.job_name
+where j.id <> k.keep_id;
+
+update work_shifts w set job_id = d.keep_id from job_duplicates d where w.job_id = d.duplicate_id;
+update shift_presets p set job_id = d.keep_id from job_duplicates d where p.job_id = d.duplicate_id;
+
+delete from job_rates r
+using job_duplicates d
+where r.job_id = d.duplicate_id
+  and exists (select 1 from job_rates kept
+              where kept.job_id = d.keep_id and kept.effective_from = r.effective_from);
+update job_rates r set job_id = d.keep_id
+from job_duplicates d
+where r.job_id = d.duplicate_id
+  and not exists (select 1 from job_rates other
+                  join job_duplicates od on od.duplicate_id = other.job_id
+                  where od.keep_id = d.keep_id and other.effective_from = r.effective_from
+                    and other.id < r.id);
+delete from job_rates r using job_duplicates d where r.job_id = d.duplicate_id;
+
+delete from jobs j using job_duplicates d where j.id = d.duplicate_id;
+drop table job_duplicates;
+
+do $$
+begin
+    if not exists (select 1 from pg_constraint where conname = 'uq_jobs_user_name') then
+        alter table jobs add constraint uq_jobs_user_name unique (user_id, job_name);
+    end if;
+end;
+$$;
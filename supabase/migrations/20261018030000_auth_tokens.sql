@@ -0,0 +1,18 @@
+-- Token "ghi nhớ đăng nhập" (supabase_db.create_auth_token / get_auth_token / delete_auth_token).
+--
+-- Chỉ lưu sha256 của token (token_hash); get_auth_token embed users qua khóa ngoại
+-- user_id (select 'expires_at, user:users(...)'). Xóa user thì token của user bị xóa theo.
+--
+-- Bản SQLite cùng cấu trúc: user_auth.USERS_SCHEMA (auth_tokens).
+-- Chưa áp dụng migration này: create_auth_token báo lỗi, không lưu được token ghi nhớ đăng nhập.
+--
+-- Áp dụng: supabase db push   (hoặc dán vào SQL Editor của project)
+
+create table if not exists auth_tokens (
+    token_hash text primary key,
+    user_id bigint not null references users(id) on delete cascade,
+    expires_at timestamptz not null,
+    created_at timestamptz default now()
+);
+
+create index if not exists idx_auth_tokens_user on auth_tokens (user_id);
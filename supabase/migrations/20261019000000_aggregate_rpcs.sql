@@ -0,0 +1,154 @@
+-- Hàm tổng hợp phía server cho chế độ cloud (gọi qua client.rpc trong supabase_db).
+-- Chỉ các dòng tổng hợp gọn (mỗi ngày / mỗi tháng x công việc một dòng) đi qua mạng
+-- thay vì toàn bộ ca làm việc + jobs + job_rates + holidays + settings.
+--
+-- Bản SQLite cùng logic: tenant_db._DAILY_AGGREGATES_SQL / _PAYROLL_AGGREGATES_SQL
+-- (sửa một bên thì sửa cả bên kia; kiểm tra bằng benchmarks/check_aggregate_parity.py,
+-- chạy chính SQL này trên Postgres thật: benchmarks/check_migrations_postgres.py).
+-- App vẫn chạy khi chưa áp dụng migration này: supabase_db tự quay về cách tính phía client.
+--
+-- Áp dụng: supabase db push   (hoặc dán vào SQL Editor của project)
+
+create index if not exists idx_work_shifts_user_date
+    on work_shifts (user_id, work_date, start_time);
+
+-- Tổng hợp giờ làm theo ngày (như db_wrapper._summarize_days, không kèm danh sách ca)
+create or replace function public.daily_summaries(p_user_id bigint, p_start date, p_end date)
+returns table (
+    work_date date,
+    total_hours double precision,
+    shift_count integer,
+    start_time text,
+    end_time text,
+    break_hours double precision,
+    notes text
+)
+language sql
+stable
+as $$
+    select w.work_date,
+           sum(w.total_hours)::double precision,
+           count(*)::integer,
+           (array_agg(w.start_time::text order by w.start_time, w.id))[1],
+           (array_agg(w.end_time::text order by w.start_time desc, w.id desc))[1],
+           sum(coalesce(w.break_hours, 0))::double precision,
+           string_agg(nullif(w.notes, ''), '; ' order by w.start_time, w.id)
+    from work_shifts w
+    where w.user_id = p_user_id
+      and w.work_date between p_start and p_end
+    group by w.work_date
+    order by w.work_date;
+$$;
+
+-- Tổng hợp lương theo (tháng, công việc), cùng quy tắc với payroll.calculate_payroll:
+--   - lương giờ có hiệu lực tại ngày làm (job_rates), trước mốc đầu tiên dùng mốc sớm nhất,
+--     không có lịch sử thì dùng jobs.hourly_rate
+--   - OT theo tổng giờ trong ngày, phần vượt gán cho các ca theo thứ tự giờ bắt đầu
+--   - giờ đêm 22:00-05:00 (ca qua đêm), giờ nghỉ phân bổ theo tỷ lệ
+--   - giờ ngày lễ
+-- Trả về số giờ và "giờ x lương giờ"; hệ số OT/đêm/lễ do payroll.assemble_payroll áp dụng
+-- (settings đi kèm kết quả nên client không cần tải settings riêng).
+create or replace function public.payroll_aggregates(p_user_id bigint, p_start date, p_end date)
+returns jsonb
+language sql
+stable
+as $$
+    with std as (
+        select coalesce((
+            select case when value ~ '^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)\s*$' then value::double precision end
+            from settings where user_id = p_user_id and key = 'standard_hours'
+        ), 8.0) as hours
+    ),
+    shifts as (
+        select w.id, w.work_date, coalesce(w.job_id, 0) as job_id,
+               w.start_time::text as start_time, w.end_time::text as end_time,
+               coalesce(w.total_hours, 0)::double precision as hours,
+               coalesce(sum(w.total_hours) over (
+                   partition by w.work_date order by w.start_time, w.id
+                   rows between unbounded preceding and 1 preceding), 0)::double precision as before_hours,
+               row_number() over (order by w.work_date, w.start_time, w.id) as seq
+        from work_shifts w
+        where w.user_id = p_user_id
+          and w.work_date between p_start and p_end
+    ),
+    priced as (
+        select s.*,
+               coalesce(
+                   (select r.hourly_rate from job_rates r
+                    where r.user_id = p_user_id and r.job_id = s.job_id and r.effective_from::date <= s.work_date
+                    order by r.effective_from::date desc limit 1),
+                   (select r.hourly_rate from job_rates r
+                    where r.user_id = p_user_id and r.job_id = s.job_id
+                    order by r.effective_from::date limit 1),
+                   (select j.hourly_rate from jobs j where j.user_id = p_user_id and j.id = s.job_id),
+                   0)::double precision as rate,
+               greatest(0, s.before_hours + s.hours - greatest(s.before_hours, (select hours from std))) as ot_hours,
+               case when exists (select 1 from holidays h
+                                 where h.user_id = p_user_id and h.holiday_date = s.work_date)
+                    then s.hours else 0 end as holiday_hours,
+               split_part(s.start_time, ':', 1)::integer + split_part(s.start_time, ':', 2)::integer / 60.0 as start_h,
+               split_part(s.end_time, ':', 1)::integer + split_part(s.end_time, ':', 2)::integer / 60.0 as end_h
+        from shifts s
+    ),
+    timed as (
+        select p.*, case when p.end_h <= p.start_h then p.end_h + 24 else p.end_h end as end_t
+        from priced p
+    ),
+    night as (
+        select t.*,
+               case when t.hours = 0 then 0 else
+                   (greatest(0, least(t.end_t, 5.0) - greatest(t.start_h, -2.0))
+                    + greatest(0, least(t.end_t, 29.0) - greatest(t.start_h, 22.0))
+                    + greatest(0, least(t.end_t, 53.0) - greatest(t.start_h, 46.0))) * t.hours / (t.end_t - t.start_h)
+               end::double precision as night_hours,
+               first_value(t.rate) over (partition by date_trunc('month', t.work_date), t.job_id
+                                         order by t.seq desc) as last_rate
+        from timed t
+    ),
+    per_job as (
+        select extract(year from n.work_date)::integer as year,
+               extract(month from n.work_date)::integer as month,
+               min(n.seq) as first_seq,
+               jsonb_build_object(
+                   'job_id', n.job_id,
+                   'job_name', max(j.job_name),
+                   'color', max(j.color),
+                   'hourly_rate', max(n.last_rate),
+                   'total_hours', sum(n.hours),
+                   'shift_count', count(*),
+                   'base_amount', sum(n.hours * n.rate),
+                   'ot_hours', sum(n.ot_hours),
+                   'ot_amount', sum(n.ot_hours * n.rate),
+                   'night_hours', sum(n.night_hours),
+                   'night_amount', sum(n.night_hours * n.rate),
+                   'holiday_hours', sum(n.holiday_hours),
+                   'holiday_amount', sum(n.holiday_hours * n.rate)
+               ) as job
+        from night n
+        left join jobs j on j.user_id = p_user_id and j.id = n.job_id
+        group by 1, 2, n.job_id
+    ),
+    per_month as (
+        select p.year, p.month,
+               jsonb_build_object(
+                   'year', p.year,
+                   'month', p.month,
+                   'total_days', (select count(distinct s.work_date) from shifts s
+                                  where extract(year from s.work_date) = p.year
+                                    and extract(month from s.work_date) = p.month),
+                   'jobs', jsonb_agg(p.job order by p.first_seq)
+               ) as month_json
+        from per_job p
+        group by p.year, p.month
+    )
+    select jsonb_build_object(
+        'settings', coalesce((
+            select jsonb_object_agg(key, value) from settings
+            where user_id = p_user_id and key in ('standard_hours', 'ot_rate', 'night_rate', 'holiday_rate')
+        ), '{}'::jsonb),
+        'months', coalesce((select jsonb_agg(month_json order by year, month) from per_month), '[]'::jsonb)
+    );
+$$;
+
+grant execute on function public.daily_summaries(bigint, date, date) to anon, authenticated, service_role;
+grant execute on function public.payroll_aggregates(bigint, date, date) to anon, authenticated, service_role;
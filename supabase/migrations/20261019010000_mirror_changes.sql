@@ -0,0 +1,87 @@
+-- Đồng bộ bản sao đọc SQLite cục bộ (cloud_mirror.py) bằng một request cho mỗi lần làm mới.
+--
+-- - Mọi bảng dữ liệu của user có cột updated_at, trigger cập nhật khi sửa dòng.
+-- - mirror_changes(p_user_id, p_since, p_shifts_from) trả về các dòng đổi sau p_since
+--   (null: toàn bộ) và danh sách khóa hiện có của từng bảng để client nhận ra dòng đã xóa.
+--   Ca làm việc chỉ lấy từ ngày p_shifts_from (cửa sổ gần đây).
+--
+-- Bản SQLite cùng logic cho server giả lập: benchmarks/postgrest_stub.py (install_mirror_rpcs).
+-- App vẫn chạy khi chưa áp dụng migration này: cloud_mirror tải lại toàn bộ từng bảng.
+--
+-- Áp dụng: supabase db push   (hoặc dán vào SQL Editor của project)
+
+alter table jobs add column if not exists updated_at timestamptz not null default now();
+alter table job_rates add column if not exists updated_at timestamptz not null default now();
+alter table work_shifts add column if not exists updated_at timestamptz not null default now();
+alter table shift_presets add column if not exists updated_at timestamptz not null default now();
+alter table holidays add column if not exists updated_at timestamptz not null default now();
+alter table settings add column if not exists updated_at timestamptz not null default now();
+alter table payroll_snapshots add column if not exists updated_at timestamptz not null default now();
+
+create or replace function public.set_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.updated_at := now();
+    return new;
+end;
+$$;
+
+do $$
+declare
+    t text;
+begin
+    foreach t in array array['jobs', 'job_rates', 'work_shifts', 'shift_presets',
+                             'holidays', 'settings', 'payroll_snapshots'] loop
+        execute format('drop trigger if exists trg_%1$s_updated_at on %1$I', t);
+        execute format('create trigger trg_%1$s_updated_at before update on %1$I '
+                       'for each row execute function public.set_updated_at()', t);
+    end loop;
+end;
+$$;
+
+create index if not exists idx_work_shifts_user_updated on work_shifts (user_id, updated_at);
+
+-- Khóa của từng bảng phải khớp cloud_mirror.MIRROR_KEYS
+create or replace function public.mirror_changes(p_user_id bigint, p_since timestamptz, p_shifts_from date)
+returns jsonb
+language sql
+stable
+as $$
+    select jsonb_build_object(
+        'server_time', now(),
+        'oldest_shift', (select min(w.work_date) from work_shifts w where w.user_id = p_user_id),
+        'tables', jsonb_build_object(
+            'jobs', coalesce((select jsonb_agg(to_jsonb(t) - 'user_id') from jobs t
+                              where t.user_id = p_user_id and (p_since is null or t.updated_at > p_since)), '[]'::jsonb),
+            'job_rates', coalesce((select jsonb_agg(to_jsonb(t) - 'user_id' - 'id') from job_rates t
+                                   where t.user_id = p_user_id and (p_since is null or t.updated_at > p_since)), '[]'::jsonb),
+            'work_shifts', coalesce((select jsonb_agg(to_jsonb(t) - 'user_id') from work_shifts t
+                                     where t.user_id = p_user_id and t.work_date >= p_shifts_from
+                                       and (p_since is null or t.updated_at > p_since)), '[]'::jsonb),
+            'shift_presets', coalesce((select jsonb_agg(to_jsonb(t) - 'user_id') from shift_presets t
+                                       where t.user_id = p_user_id and (p_since is null or t.updated_at > p_since)), '[]'::jsonb),
+            'holidays', coalesce((select jsonb_agg(to_jsonb(t) - 'user_id') from holidays t
+                                  where t.user_id = p_user_id and (p_since is null or t.updated_at > p_since)), '[]'::jsonb),
+            'settings', coalesce((select jsonb_agg(to_jsonb(t) - 'user_id') from settings t
+                                  where t.user_id = p_user_id and (p_since is null or t.updated_at > p_since)), '[]'::jsonb),
+            'payroll_snapshots', coalesce((select jsonb_agg(to_jsonb(t) - 'user_id') from payroll_snapshots t
+                                           where t.user_id = p_user_id and (p_since is null or t.updated_at > p_since)), '[]'::jsonb)
+        ),
+        'keys', jsonb_build_object(
+            'jobs', coalesce((select jsonb_agg(t.id) from jobs t where t.user_id = p_user_id), '[]'::jsonb),
+            'job_rates', coalesce((select jsonb_agg(jsonb_build_array(t.job_id, t.effective_from)) from job_rates t
+                                   where t.user_id = p_user_id), '[]'::jsonb),
+            'work_shifts', coalesce((select jsonb_agg(t.id) from work_shifts t
+                                     where t.user_id = p_user_id and t.work_date >= p_shifts_from), '[]'::jsonb),
+            'shift_presets', coalesce((select jsonb_agg(t.id) from shift_presets t where t.user_id = p_user_id), '[]'::jsonb),
+            'holidays', coalesce((select jsonb_agg(t.holiday_date) from holidays t where t.user_id = p_user_id), '[]'::jsonb),
+            'settings', coalesce((select jsonb_agg(t.key) from settings t where t.user_id = p_user_id), '[]'::jsonb),
+            'payroll_snapshots', coalesce((select jsonb_agg(jsonb_build_array(t.year, t.month)) from payroll_snapshots t
+                                           where t.user_id = p_user_id), '[]'::jsonb)
+        )
+    );
+$$;
+
+grant execute on function public.mirror_changes(bigint, timestamptz, date) to anon, authenticated, service_role;
@@ -0,0 +1,19 @@
+-- Khóa idempotency cho outbox ghi của chế độ cloud (cloud_outbox.py).
+--
+-- Ca làm việc và khung giờ mẫu được thêm bằng upsert theo client_ref (khóa của
+-- dòng outbox do client sinh ra): gửi lại sau khi mất response hay app tắt giữa
+-- chừng trả về đúng dòng đã tạo thay vì tạo dòng trùng. Các bảng khác đã có khóa
+-- tự nhiên (upsert theo user_id + tên / ngày / key).
+--
+-- Bản SQLite cùng logic cho server giả lập: benchmarks/postgrest_stub.py (install_client_refs).
+-- App vẫn chạy khi chưa áp dụng migration này: outbox insert thường (gửi lại có thể tạo dòng trùng).
+--
+-- Áp dụng: supabase db push   (hoặc dán vào SQL Editor của project)
+
+alter table work_shifts add column if not exists client_ref text;
+alter table shift_presets add column if not exists client_ref text;
+
+-- Không dùng unique index có điều kiện (where client_ref is not null): on_conflict
+-- của PostgREST cần index không điều kiện; null không trùng nhau nên dòng cũ không sao
+create unique index if not exists uq_work_shifts_client_ref on work_shifts (client_ref);
+create unique index if not exists uq_shift_presets_client_ref on shift_presets (client_ref);
@@ -0,0 +1,54 @@
+-- Tháng đã chốt lương (có dòng payroll_snapshots): không thêm / sửa / xóa ca làm việc
+-- của tháng đó, kể cả khi ghi không qua db_wrapper (supabase_db gọi thẳng, outbox của
+-- cloud_mirror gửi thao tác tạo trước khi chốt, client khác chạy code cũ).
+--
+-- Lỗi check_violation (23514): supabase_db trả về None / False như các lỗi ghi khác,
+-- cloud_outbox coi là server từ chối (không thử lại) và làm mới bản sao.
+-- Xóa user (cascade) vẫn xóa được ca của các tháng đã chốt.
+--
+-- Bản SQLite cùng logic: tenant_db.CLOSED_PERIOD_TRIGGERS, trigger trong database.init_database.
+--
+-- Áp dụng: supabase db push   (hoặc dán vào SQL Editor của project)
+
+create or replace function public.is_month_closed(p_user_id bigint, p_work_date date)
+returns boolean
+language sql
+stable
+as $$
+    select exists (
+        select 1 from payroll_snapshots s
+        where s.user_id = p_user_id
+          and s.year = extract(year from p_work_date)::integer
+          and s.month = extract(month from p_work_date)::integer
+    );
+$$;
+
+create or replace function public.reject_closed_period()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        if tg_op = 'DELETE' and not exists (select 1 from users u where u.id = old.user_id) then
+            return old;
+        end if;
+        if public.is_month_closed(old.user_id, old.work_date) then
+            raise exception 'closed_period: tháng đã chốt lương, cần mở lại tháng trước khi sửa (%)', old.work_date
+                using errcode = 'check_violation';
+        end if;
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        if public.is_month_closed(new.user_id, new.work_date) then
+            raise exception 'closed_period: tháng đã chốt lương, cần mở lại tháng trước khi sửa (%)', new.work_date
+                using errcode = 'check_violation';
+        end if;
+        return new;
+    end if;
+    return old;
+end;
+$$;
+
+drop trigger if exists trg_work_shifts_closed_period on work_shifts;
+create trigger trg_work_shifts_closed_period
+    before insert or update or delete on work_shifts
+    for each row execute function public.reject_closed_period();
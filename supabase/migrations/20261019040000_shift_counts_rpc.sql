@@ -0,0 +1,26 @@
+-- Số ca của từng công việc (supabase_db.get_shift_counts_by_job, tab Cài đặt công việc).
+--
+-- Đếm phía server bằng GROUP BY: mỗi công việc một dòng thay vì tải cột job_id của mọi
+-- ca rồi đếm phía client (chậm, và bị max-rows của PostgREST cắt bớt nên đếm thiếu).
+--
+-- Bản SQLite cùng logic: tenant_db.get_shift_counts_by_job.
+-- App vẫn chạy khi chưa áp dụng migration này: supabase_db đếm từng công việc bằng
+-- request count=exact (không tải dòng nào).
+--
+-- Áp dụng: supabase db push   (hoặc dán vào SQL Editor của project)
+
+create index if not exists idx_work_shifts_user_job on work_shifts (user_id, job_id);
+
+create or replace function public.shift_counts_by_job(p_user_id bigint)
+returns table (
+    job_id bigint,
+    shift_count integer
+)
+language sql
+stable
+as $$
+    select w.job_id, count(*)::integer
+    from work_shifts w
+    where w.user_id = p_user_id
+    group by w.job_id;
+$$;
@@ -5,18 +5,34 @@ Thay thế SQLite để lưu trữ dữ liệu trên cloud.
 """
 
 import streamlit as st
-from supabase import create_client, Client
 from datetime import datetime, date
-from typing import List, Dict, Optional
+from typing import TYPE_CHECKING, List, Dict, Optional
 import os
 
+import payroll
+
+# Thư viện supabase chỉ được import khi có credentials (chế độ cloud)
+if TYPE_CHECKING:
+    from supabase import Client
+
+# Cột lấy về cho từng loại bản ghi (không dùng select('*'): ít byte hơn, không kéo cột mới thêm)
+USER_COLUMNS = 'id,username,password_hash,display_name'
+JOB_COLUMNS = 'id,job_name,hourly_rate,description,color'
+SHIFT_COLUMNS = 'id,work_date,shift_name,job_id,start_time,end_time,break_hours,total_hours,notes'
+HOLIDAY_COLUMNS = 'id,holiday_date,description'
+PRESET_COLUMNS = 'id,preset_name,start_time,end_time,break_hours,total_hours,job_id,emoji,sort_order'
+SNAPSHOT_COLUMNS = 'year,month,salary_json,daily_json,closed_at'
+
+# Lệnh ghi không cần dữ liệu trả về: Prefer: return=minimal (response rỗng)
+_MINIMAL = 'minimal'
+
 # ==================== SUPABASE CONNECTION ====================
 
 # Cached client singleton
 _cached_client = None
 _client_initialized = False
 
-def get_supabase_client() -> Optional[Client]:
+def get_supabase_client() -> Optional["Client"]:
     """Lấy Supabase client (cached singleton - tạo 1 lần dùng mãi)."""
     global _cached_client, _client_initialized
     
@@ -47,7 +63,9 @@ def get_supabase_client() -> Optional[Client]:
     # Create client if we have credentials
     if url and key:
         try:
-            _cached_client = create_client(url, key)
+            from supabase import create_client
+            import supabase_http
+            _cached_client = create_client(url, key, options=supabase_http.client_options())
         except Exception as e:
             print(f"Supabase client creation error: {e}")
             _cached_client = None
@@ -73,8 +91,10 @@ def is_supabase_available() -> bool:
             _last_supabase_error = "Client is None - credentials missing"
             return False
         
-        # Test connection with a simple query
-        result = client.table('users').select('id').limit(1).execute()
+        # Test connection with a simple query (ngân sách ngắn: Supabase treo thì chuyển SQLite nhanh)
+        import supabase_http
+        with supabase_http.operation('health'):
+            client.table('users').select('id').limit(1).execute()
         _last_supabase_error = None
         return True
     except Exception as e:
@@ -92,7 +112,7 @@ def get_user_by_username(username: str) -> Optional[Dict]:
         return None
     
     try:
-        result = client.table('users').select('*').eq('username', username.lower()).execute()
+        result = client.table('users').select(USER_COLUMNS).eq('username', username.lower()).limit(1).execute()
         if result.data:
             return result.data[0]
         return None
@@ -114,7 +134,7 @@ def create_user(username: str, password_hash: str, display_name: str = "") -> Op
             'display_name': display_name or username,
             'created_at': datetime.now().isoformat()
         }
-        result = client.table('users').insert(data).execute()
+        result = client.table('users').insert(data).select(USER_COLUMNS).execute()
         if result.data:
             return result.data[0]
         return None
@@ -132,12 +152,83 @@ def update_user_last_login(user_id: int) -> bool:
     try:
         client.table('users').update({
             'last_login': datetime.now().isoformat()
-        }).eq('id', user_id).execute()
+        }, returning=_MINIMAL).eq('id', user_id).execute()
         return True
     except:
         return False
 
 
+def update_user_password_hash(user_id: int, password_hash: str) -> bool:
+    """Cập nhật password hash (băm lại theo KDF mới khi đăng nhập)."""
+    client = get_supabase_client()
+    if not client:
+        return False
+
+    try:
+        client.table('users').update({'password_hash': password_hash}, returning=_MINIMAL).eq('id', user_id).execute()
+        return True
+    except Exception as e:
+        print(f"Error updating password hash: {e}")
+        return False
+
+
+# ==================== AUTH TOKENS ====================
+# Bảng token "ghi nhớ đăng nhập": supabase/migrations/*_auth_tokens.sql
+
+def create_auth_token(token_hash: str, user_id: int, expires_at: datetime) -> bool:
+    """Lưu token đăng nhập (chỉ lưu sha256 của token)."""
+    client = get_supabase_client()
+    if not client:
+        return False
+
+    try:
+        client.table('auth_tokens').insert({
+            'token_hash': token_hash,
+            'user_id': user_id,
+            'expires_at': expires_at.isoformat()
+        }, returning=_MINIMAL).execute()
+        return True
+    except Exception as e:
+        print(f"Error creating auth token: {e}")
+        return False
+
+
+def get_auth_token(token_hash: str) -> Optional[Dict]:
+    """
+    Tra token đăng nhập kèm user (một request).
+
+    Returns:
+        Dict {expires_at, user} hoặc None
+    """
+    client = get_supabase_client()
+    if not client:
+        return None
+
+    try:
+        result = client.table('auth_tokens').select('expires_at, user:users(id,username,display_name)') \
+            .eq('token_hash', token_hash).execute()
+        if result.data:
+            return result.data[0]
+        return None
+    except Exception as e:
+        print(f"Error getting auth token: {e}")
+        return None
+
+
+def delete_auth_token(token_hash: str) -> bool:
+    """Xóa token đăng nhập (đăng xuất / hết hạn)."""
+    client = get_supabase_client()
+    if not client:
+        return False
+
+    try:
+        client.table('auth_tokens').delete(returning=_MINIMAL).eq('token_hash', token_hash).execute()
+        return True
+    except Exception as e:
+        print(f"Error deleting auth token: {e}")
+        return False
+
+
 # ==================== JOBS ====================
 
 def get_all_jobs(user_id: int) -> List[Dict]:
@@ -147,38 +238,30 @@ def get_all_jobs(user_id: int) -> List[Dict]:
         return []
     
     try:
-        result = client.table('jobs').select('*').eq('user_id', user_id).order('job_name').execute()
+        result = client.table('jobs').select(JOB_COLUMNS).eq('user_id', user_id).order('job_name').execute()
         return result.data or []
     except:
         return []
 
 
 def add_job(user_id: int, job_name: str, hourly_rate: float, description: str = "", color: str = "#667eea") -> Optional[int]:
-    """Thêm công việc mới."""
+    """
+    Thêm công việc mới (trùng tên thì cập nhật) - một upsert theo unique constraint
+    (user_id, job_name) của supabase/migrations/*_jobs_unique_name.sql. Lương đổi thì
+    db_wrapper.add_job ghi mốc lương (record_rate_change) trước khi gọi hàm này.
+    """
     client = get_supabase_client()
     if not client:
         return None
     
     try:
-        # Kiểm tra job đã tồn tại
-        existing = client.table('jobs').select('id').eq('user_id', user_id).eq('job_name', job_name).execute()
-        if existing.data:
-            # Update existing
-            client.table('jobs').update({
-                'hourly_rate': hourly_rate,
-                'description': description,
-                'color': color
-            }).eq('id', existing.data[0]['id']).execute()
-            return existing.data[0]['id']
-        
-        # Create new
-        result = client.table('jobs').insert({
+        result = client.table('jobs').upsert({
             'user_id': user_id,
             'job_name': job_name,
             'hourly_rate': hourly_rate,
             'description': description,
             'color': color
-        }).execute()
+        }, on_conflict='user_id,job_name').select('id').execute()
         
         if result.data:
             return result.data[0]['id']
@@ -188,8 +271,9 @@ def add_job(user_id: int, job_name: str, hourly_rate: float, description: str =
         return None
 
 
-def update_job(job_id: int, job_name: str, hourly_rate: float, description: str = "", color: str = "#667eea") -> bool:
-    """Cập nhật công việc."""
+def update_job(user_id: int, job_id: int, job_name: str, hourly_rate: float, description: str = "",
+               color: str = "#667eea") -> bool:
+    """Cập nhật công việc của user."""
     client = get_supabase_client()
     if not client:
         return False
@@ -200,20 +284,93 @@ def update_job(job_id: int, job_name: str, hourly_rate: float, description: str
             'hourly_rate': hourly_rate,
             'description': description,
             'color': color
-        }).eq('id', job_id).execute()
+        }, returning=_MINIMAL).eq('id', job_id).eq('user_id', user_id).execute()
         return True
     except:
         return False
 
 
-def delete_job(job_id: int) -> bool:
-    """Xóa công việc."""
+def get_shift_counts_by_job(user_id: int) -> Dict[int, int]:
+    """
+    Đếm số ca của từng công việc của user: RPC shift_counts_by_job (đếm phía server,
+    supabase/migrations/*_shift_counts_rpc.sql). Chưa có RPC thì mỗi công việc một
+    request count=exact không tải dòng nào - không tải cột job_id của mọi ca, vốn
+    bị max-rows của PostgREST cắt bớt.
+    """
+    client = get_supabase_client()
+    if not client:
+        return {}
+
+    rows = _call_rpc('shift_counts_by_job', {'p_user_id': user_id})
+    if rows is not None:
+        return {row['job_id']: row['shift_count'] for row in rows}
+
+    try:
+        jobs = client.table('jobs').select('id').eq('user_id', user_id).execute()
+        counts = {}
+        for job in jobs.data or []:
+            result = client.table('work_shifts').select('id', count='exact', head=True) \
+                .eq('user_id', user_id).eq('job_id', job['id']).execute()
+            if result.count:
+                counts[job['id']] = result.count
+        return counts
+    except Exception as e:
+        print(f"Error counting shifts by job: {e}")
+        return {}
+
+
+def get_job_rates(user_id: int) -> List[Dict]:
+    """Lấy lịch sử lương giờ (theo ngày hiệu lực) của các công việc của user."""
+    client = get_supabase_client()
+    if not client:
+        return []
+
+    try:
+        result = client.table('job_rates').select('job_id,effective_from,hourly_rate').eq('user_id', user_id).order('effective_from').execute()
+        return result.data or []
+    except Exception as e:
+        # Bảng job_rates có thể chưa được tạo (supabase/migrations/*_job_rates.sql) -> dùng lương hiện tại của jobs
+        print(f"Error getting job rates: {e}")
+        return []
+
+
+def record_rate_change(user_id: int, job_id: int, old_rate: float, new_rate: float,
+                       effective_from: date, epoch: str) -> bool:
+    """Ghi mốc lương mới; giữ mức cũ làm mốc gốc nếu công việc chưa có lịch sử."""
+    client = get_supabase_client()
+    if not client:
+        return False
+
+    try:
+        rows = [{
+            'user_id': user_id,
+            'job_id': job_id,
+            'effective_from': effective_from.isoformat(),
+            'hourly_rate': new_rate
+        }]
+        existing = client.table('job_rates').select('job_id').eq('job_id', job_id).limit(1).execute()
+        if not existing.data:
+            rows.insert(0, {
+                'user_id': user_id,
+                'job_id': job_id,
+                'effective_from': epoch,
+                'hourly_rate': old_rate
+            })
+        client.table('job_rates').upsert(rows, on_conflict='job_id,effective_from', returning=_MINIMAL).execute()
+        return True
+    except Exception as e:
+        print(f"Error recording rate change: {e}")
+        return False
+
+
+def delete_job(user_id: int, job_id: int) -> bool:
+    """Xóa công việc của user."""
     client = get_supabase_client()
     if not client:
         return False
     
     try:
-        client.table('jobs').delete().eq('id', job_id).execute()
+        client.table('jobs').delete(returning=_MINIMAL).eq('id', job_id).eq('user_id', user_id).execute()
         return True
     except:
         return False
@@ -248,7 +405,7 @@ def add_work_shift(
             'break_hours': break_hours,
             'total_hours': total_hours,
             'notes': notes
-        }).execute()
+        }).select('id').execute()
         
         if result.data:
             return result.data[0]['id']
@@ -259,6 +416,7 @@ def add_work_shift(
 
 
 def update_work_shift(
+    user_id: int,
     shift_id: int,
     shift_name: str,
     start_time: str,
@@ -267,7 +425,7 @@ def update_work_shift(
     total_hours: float,
     notes: str = ""
 ) -> bool:
-    """Cập nhật ca làm việc."""
+    """Cập nhật ca làm việc của user."""
     client = get_supabase_client()
     if not client:
         return False
@@ -280,20 +438,20 @@ def update_work_shift(
             'break_hours': break_hours,
             'total_hours': total_hours,
             'notes': notes
-        }).eq('id', shift_id).execute()
+        }, returning=_MINIMAL).eq('id', shift_id).eq('user_id', user_id).execute()
         return True
     except:
         return False
 
 
-def delete_work_shift(shift_id: int) -> bool:
-    """Xóa ca làm việc."""
+def delete_work_shift(user_id: int, shift_id: int) -> bool:
+    """Xóa ca làm việc của user."""
     client = get_supabase_client()
     if not client:
         return False
     
     try:
-        client.table('work_shifts').delete().eq('id', shift_id).execute()
+        client.table('work_shifts').delete(returning=_MINIMAL).eq('id', shift_id).eq('user_id', user_id).execute()
         return True
     except:
         return False
@@ -306,7 +464,7 @@ def get_shifts_by_date(user_id: int, work_date: date) -> List[Dict]:
         return []
     
     try:
-        result = client.table('work_shifts').select('*').eq('user_id', user_id).eq('work_date', work_date.isoformat()).order('start_time').execute()
+        result = client.table('work_shifts').select(SHIFT_COLUMNS).eq('user_id', user_id).eq('work_date', work_date.isoformat()).order('start_time').execute()
         return result.data or []
     except:
         return []
@@ -319,12 +477,178 @@ def get_shifts_by_range(user_id: int, start_date: date, end_date: date) -> List[
         return []
     
     try:
-        result = client.table('work_shifts').select('*').eq('user_id', user_id).gte('work_date', start_date.isoformat()).lte('work_date', end_date.isoformat()).order('work_date').order('start_time').execute()
+        result = client.table('work_shifts').select(SHIFT_COLUMNS).eq('user_id', user_id).gte('work_date', start_date.isoformat()).lte('work_date', end_date.isoformat()).order('work_date').order('start_time').order('id').execute()
         return result.data or []
     except:
         return []
 
 
+def get_shift_by_id(user_id: int, shift_id: int) -> Optional[Dict]:
+    """Lấy ca làm việc của user theo ID."""
+    client = get_supabase_client()
+    if not client:
+        return None
+    
+    try:
+        result = client.table('work_shifts').select(SHIFT_COLUMNS).eq('id', shift_id).eq('user_id', user_id).limit(1).execute()
+        return result.data[0] if result.data else None
+    except:
+        return None
+
+
+# ==================== PAYROLL SNAPSHOTS ====================
+
+def get_closed_months(user_id: int) -> List[tuple]:
+    """Lấy danh sách (năm, tháng) đã chốt lương."""
+    client = get_supabase_client()
+    if not client:
+        return []
+
+    try:
+        result = client.table('payroll_snapshots').select('year,month').eq('user_id', user_id).execute()
+        return [(row['year'], row['month']) for row in result.data or []]
+    except Exception as e:
+        # Bảng payroll_snapshots có thể chưa được tạo (supabase/migrations/*_payroll_snapshots.sql)
+        # -> coi như chưa chốt tháng nào
+        print(f"Error getting closed months: {e}")
+        return []
+
+
+def get_payroll_snapshot(user_id: int, year: int, month: int) -> Optional[Dict]:
+    """Lấy snapshot lương của tháng đã chốt."""
+    client = get_supabase_client()
+    if not client:
+        return None
+
+    try:
+        result = client.table('payroll_snapshots').select(SNAPSHOT_COLUMNS).eq('user_id', user_id).eq('year', year).eq('month', month).limit(1).execute()
+        if not result.data:
+            return None
+        row = result.data[0]
+        return {
+            'year': row['year'],
+            'month': row['month'],
+            'salary': row['salary_json'],
+            'daily': row['daily_json'],
+            'closed_at': row.get('closed_at')
+        }
+    except Exception as e:
+        print(f"Error getting payroll snapshot: {e}")
+        return None
+
+
+def get_payroll_snapshots(user_id: int, first: tuple, last: tuple) -> Dict[tuple, Dict]:
+    """Lấy snapshot lương của các tháng đã chốt từ tháng first đến last (một truy vấn)."""
+    client = get_supabase_client()
+    if not client:
+        return {}
+
+    try:
+        query = client.table('payroll_snapshots').select('year,month,salary_json').eq('user_id', user_id)
+        if first[0] == last[0]:
+            query = query.eq('year', first[0]).gte('month', first[1]).lte('month', last[1])
+        else:
+            query = query.gte('year', first[0]).lte('year', last[0])
+        result = query.execute()
+        return {
+            (row['year'], row['month']): row['salary_json']
+            for row in result.data or []
+            if first <= (row['year'], row['month']) <= last
+        }
+    except Exception as e:
+        print(f"Error getting payroll snapshots: {e}")
+        return {}
+
+
+def save_payroll_snapshot(user_id: int, year: int, month: int, salary: Dict, daily: List[Dict]) -> bool:
+    """Lưu (hoặc ghi đè) snapshot của một tháng."""
+    client = get_supabase_client()
+    if not client:
+        return False
+
+    try:
+        client.table('payroll_snapshots').upsert({
+            'user_id': user_id,
+            'year': year,
+            'month': month,
+            'salary_json': salary,
+            'daily_json': daily,
+            'closed_at': datetime.now().isoformat()
+        }, on_conflict='user_id,year,month', returning=_MINIMAL).execute()
+        return True
+    except Exception as e:
+        print(f"Error saving payroll snapshot: {e}")
+        return False
+
+
+def delete_payroll_snapshot(user_id: int, year: int, month: int) -> bool:
+    """Xóa snapshot (mở lại tháng)."""
+    client = get_supabase_client()
+    if not client:
+        return False
+
+    try:
+        client.table('payroll_snapshots').delete(returning=_MINIMAL).eq('user_id', user_id).eq('year', year).eq('month', month).execute()
+        return True
+    except:
+        return False
+
+
+# ==================== AGGREGATES (RPC) ====================
+# Hàm tổng hợp phía server: supabase/migrations/*_aggregate_rpcs.sql, *_shift_counts_rpc.sql.
+# Project chưa áp dụng migration -> PostgREST trả PGRST202, ghi nhớ để không gọi lại
+# và trả None (db_wrapper tự tính phía client như trước).
+_missing_rpcs = set()
+
+
+def _call_rpc(name: str, params: Dict):
+    """Gọi RPC của migration; None nếu không có client, hàm chưa được tạo hoặc lỗi."""
+    client = get_supabase_client()
+    if not client or name in _missing_rpcs:
+        return None
+
+    try:
+        return client.rpc(name, params).execute().data
+    except Exception as e:
+        if getattr(e, 'code', None) in ('PGRST202', '42883'):
+            _missing_rpcs.add(name)
+        print(f"Error calling {name}: {e}")
+        return None
+
+
+def _call_aggregate_rpc(name: str, user_id: int, start_date: date, end_date: date):
+    """Gọi RPC tổng hợp theo khoảng ngày (_call_rpc)."""
+    return _call_rpc(name, {
+        'p_user_id': user_id,
+        'p_start': start_date.isoformat(),
+        'p_end': end_date.isoformat(),
+    })
+
+
+def get_daily_aggregates(user_id: int, start_date: date, end_date: date) -> Optional[List[Dict]]:
+    """Tổng hợp giờ làm theo ngày (RPC daily_summaries), None nếu không dùng được RPC."""
+    return _call_aggregate_rpc('daily_summaries', user_id, start_date, end_date)
+
+
+def get_payroll_aggregates(user_id: int, start_date: date, end_date: date) -> Optional[Dict]:
+    """
+    Tổng hợp lương theo (tháng, công việc) (RPC payroll_aggregates).
+
+    Returns:
+        {'settings': {...}, 'months': [{'year', 'month', 'total_days', 'jobs': [...]}]}
+        hoặc None nếu không dùng được RPC
+    """
+    return _call_aggregate_rpc('payroll_aggregates', user_id, start_date, end_date)
+
+
+def get_data_generation(user_id: int, start_date: Optional[date] = None) -> Optional[str]:
+    """
+    Thế hệ dữ liệu của user: Supabase không có (dữ liệu đổi từ thiết bị khác mà
+    không báo), luôn None - kết quả đọc thẳng server không vào result_cache.
+    """
+    return None
+
+
 # ==================== HOLIDAYS ====================
 
 def add_holiday(user_id: int, holiday_date: date, description: str) -> bool:
@@ -339,7 +663,7 @@ def add_holiday(user_id: int, holiday_date: date, description: str) -> bool:
             'user_id': user_id,
             'holiday_date': holiday_date.isoformat(),
             'description': description
-        }, on_conflict='user_id,holiday_date').execute()
+        }, on_conflict='user_id,holiday_date', returning=_MINIMAL).execute()
         return True
     except:
         return False
@@ -352,7 +676,7 @@ def remove_holiday(user_id: int, holiday_date: date) -> bool:
         return False
     
     try:
-        client.table('holidays').delete().eq('user_id', user_id).eq('holiday_date', holiday_date.isoformat()).execute()
+        client.table('holidays').delete(returning=_MINIMAL).eq('user_id', user_id).eq('holiday_date', holiday_date.isoformat()).execute()
         return True
     except:
         return False
@@ -365,12 +689,28 @@ def get_all_holidays(user_id: int) -> List[Dict]:
         return []
     
     try:
-        result = client.table('holidays').select('*').eq('user_id', user_id).order('holiday_date').execute()
+        result = client.table('holidays').select(HOLIDAY_COLUMNS).eq('user_id', user_id).order('holiday_date').execute()
         return result.data or []
     except:
         return []
 
 
+def get_holidays_by_range(user_id: int, start_date: date, end_date: date) -> List[Dict]:
+    """Lấy ngày nghỉ trong khoảng thời gian (lọc phía server)."""
+    client = get_supabase_client()
+    if not client:
+        return []
+
+    try:
+        result = client.table('holidays').select(HOLIDAY_COLUMNS).eq('user_id', user_id) \
+            .gte('holiday_date', start_date.isoformat()).lte('holiday_date', end_date.isoformat()) \
+            .order('holiday_date').execute()
+        return result.data or []
+    except Exception as e:
+        print(f"Error getting holidays: {e}")
+        return []
+
+
 def is_holiday(user_id: int, check_date: date) -> tuple:
     """Kiểm tra ngày nghỉ."""
     client = get_supabase_client()
@@ -378,7 +718,7 @@ def is_holiday(user_id: int, check_date: date) -> tuple:
         return False, ""
     
     try:
-        result = client.table('holidays').select('description').eq('user_id', user_id).eq('holiday_date', check_date.isoformat()).execute()
+        result = client.table('holidays').select('description').eq('user_id', user_id).eq('holiday_date', check_date.isoformat()).limit(1).execute()
         if result.data:
             return True, result.data[0]['description']
         return False, ""
@@ -395,7 +735,7 @@ def get_setting(user_id: int, key: str) -> Optional[str]:
         return None
     
     try:
-        result = client.table('settings').select('value').eq('user_id', user_id).eq('key', key).execute()
+        result = client.table('settings').select('value').eq('user_id', user_id).eq('key', key).limit(1).execute()
         if result.data:
             return result.data[0]['value']
         return None
@@ -403,6 +743,19 @@ def get_setting(user_id: int, key: str) -> Optional[str]:
         return None
 
 
+def get_all_settings(user_id: int) -> Dict[str, str]:
+    """Lấy toàn bộ cài đặt của user trong một request."""
+    client = get_supabase_client()
+    if not client:
+        return {}
+    
+    try:
+        result = client.table('settings').select('key,value').eq('user_id', user_id).execute()
+        return {row['key']: row['value'] for row in result.data or []}
+    except:
+        return {}
+
+
 def update_setting(user_id: int, key: str, value: str) -> bool:
     """Cập nhật cài đặt."""
     client = get_supabase_client()
@@ -414,7 +767,7 @@ def update_setting(user_id: int, key: str, value: str) -> bool:
             'user_id': user_id,
             'key': key,
             'value': value
-        }, on_conflict='user_id,key').execute()
+        }, on_conflict='user_id,key', returning=_MINIMAL).execute()
         return True
     except:
         return False
@@ -442,7 +795,7 @@ def get_all_presets(user_id: int) -> List[Dict]:
     if not client:
         raise ConnectionError("No Supabase client")
     
-    result = client.table('shift_presets').select('*').eq('user_id', user_id).order('sort_order').execute()
+    result = client.table('shift_presets').select(PRESET_COLUMNS).eq('user_id', user_id).order('sort_order').execute()
     return result.data or []
 
 
@@ -467,7 +820,7 @@ def add_preset(user_id: int, preset_name: str, start_time: str, end_time: str,
     if job_id is not None:
         data['job_id'] = job_id
     
-    result = client.table('shift_presets').insert(data).execute()
+    result = client.table('shift_presets').insert(data).select('id').execute()
     if result.data:
         return result.data[0]['id']
     return None
@@ -487,7 +840,7 @@ def update_preset(user_id: int, preset_id: int, **kwargs) -> bool:
             update_data[key] = value
     
     if update_data:
-        client.table('shift_presets').update(update_data).eq('id', preset_id).eq('user_id', user_id).execute()
+        client.table('shift_presets').update(update_data, returning=_MINIMAL).eq('id', preset_id).eq('user_id', user_id).execute()
     return True
 
 
@@ -497,44 +850,91 @@ def delete_preset(user_id: int, preset_id: int) -> bool:
     if not client:
         raise ConnectionError("No Supabase client")
     
-    client.table('shift_presets').delete().eq('id', preset_id).eq('user_id', user_id).execute()
+    client.table('shift_presets').delete(returning=_MINIMAL).eq('id', preset_id).eq('user_id', user_id).execute()
     return True
 
 
 # ==================== INIT DEFAULT DATA ====================
 
-def init_user_default_data(user_id: int):
-    """Khởi tạo dữ liệu mặc định cho user mới."""
+# ==================== PROVISIONING ====================
+# Setting đánh dấu user đã có dữ liệu mặc định (ghi sau cùng, cùng request với settings mặc định)
+PROVISIONED_KEY = 'provisioned'
+
+DEFAULT_JOBS = [
+    ("Bệnh viện", 1200, "Công việc chính", "#10B981"),
+    ("Kombini", 1100, "Công việc phụ", "#3B82F6"),
+]
+DEFAULT_SETTINGS = {
+    'standard_hours': '8.0',
+    'break_hours': '1.0',
+    'ot_rate': str(payroll.DEFAULT_OT_RATE),
+}
+DEFAULT_PRESETS = [
+    ('Ca Sáng 8h', '08:00', '17:00', 1.0, 8.0, '☀️', 1),
+    ('Ca Tối 8h', '17:00', '02:00', 1.0, 8.0, '🌙', 2),
+    ('Part-time 4h', '09:00', '13:00', 0.0, 4.0, '⏰', 3),
+    ('Full Day 10h', '07:00', '18:00', 1.0, 10.0, '🔥', 4),
+]
+
+
+def is_user_provisioned(user_id: int) -> bool:
+    """User đã được khởi tạo dữ liệu mặc định chưa (một request)."""
     client = get_supabase_client()
     if not client:
-        return
-    
+        return False
+
     try:
-        # Kiểm tra đã có jobs chưa
-        existing_jobs = get_all_jobs(user_id)
-        if not existing_jobs:
-            # Thêm jobs mặc định
-            add_job(user_id, "Bệnh viện", 1200, "Công việc chính", "#10B981")
-            add_job(user_id, "Kombini", 1100, "Công việc phụ", "#3B82F6")
-        
-        # Thêm settings mặc định
-        if not get_setting(user_id, 'standard_hours'):
-            update_setting(user_id, 'standard_hours', '8.0')
-        if not get_setting(user_id, 'break_hours'):
-            update_setting(user_id, 'break_hours', '1.0')
-        if not get_setting(user_id, 'ot_rate'):
-            update_setting(user_id, 'ot_rate', '1.25')
-        
-        # Thêm presets mặc định nếu chưa có
-        existing_presets = get_all_presets(user_id)
-        if not existing_presets:
-            default_presets = [
-                ('Ca Sáng 8h', '08:00', '17:00', 1.0, 8.0, '☀️', 1),
-                ('Ca Tối 8h', '17:00', '02:00', 1.0, 8.0, '🌙', 2),
-                ('Part-time 4h', '09:00', '13:00', 0.0, 4.0, '⏰', 3),
-                ('Full Day 10h', '07:00', '18:00', 1.0, 10.0, '🔥', 4),
-            ]
-            for name, start, end, brk, total, emoji, order in default_presets:
-                add_preset(user_id, name, start, end, brk, total, emoji=emoji, sort_order=order)
-    except:
-        pass
+        result = client.table('settings').select('value').eq('user_id', user_id) \
+            .eq('key', PROVISIONED_KEY).limit(1).execute()
+        return bool(result.data)
+    except Exception as e:
+        print(f"Error checking provisioning: {e}")
+        return False
+
+
+def provision_user(user_id: int, new_user: bool = False) -> bool:
+    """
+    Tạo dữ liệu mặc định cho user bằng các lệnh ghi theo lô: jobs, presets,
+    rồi settings mặc định cùng cờ PROVISIONED_KEY (không ghi đè giá trị đã có).
+
+    Args:
+        user_id: ID user
+        new_user: User vừa đăng ký (bỏ qua bước kiểm tra jobs / presets đã có)
+
+    Returns:
+        True nếu đã đánh dấu provisioned
+    """
+    client = get_supabase_client()
+    if not client:
+        return False
+
+    try:
+        # User cũ (trước khi có cờ) chỉ được thêm jobs / presets khi chưa có cái nào
+        if new_user or not client.table('jobs').select('id').eq('user_id', user_id).limit(1).execute().data:
+            client.table('jobs').insert([
+                {'user_id': user_id, 'job_name': name, 'hourly_rate': rate, 'description': desc, 'color': color}
+                for name, rate, desc, color in DEFAULT_JOBS
+            ], returning=_MINIMAL).execute()
+
+        if new_user or not client.table('shift_presets').select('id').eq('user_id', user_id).limit(1).execute().data:
+            client.table('shift_presets').insert([
+                {'user_id': user_id, 'preset_name': name, 'start_time': start, 'end_time': end,
+                 'break_hours': brk, 'total_hours': total, 'emoji': emoji, 'sort_order': order}
+                for name, start, end, brk, total, emoji, order in DEFAULT_PRESETS
+            ], returning=_MINIMAL).execute()
+
+        settings = {**DEFAULT_SETTINGS, PROVISIONED_KEY: datetime.now().isoformat()}
+        client.table('settings').upsert(
+            [{'user_id': user_id, 'key': key, 'value': value} for key, value in settings.items()],
+            on_conflict='user_id,key', ignore_duplicates=True, returning=_MINIMAL
+        ).execute()
+        return True
+    except Exception as e:
+        print(f"Error provisioning user: {e}")
+        return False
+
+
+def init_user_default_data(user_id: int):
+    """Khởi tạo dữ liệu mặc định cho user nếu chưa làm (xem provision_user)."""
+    if not is_user_provisioned(user_id):
+        provision_user(user_id)
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Tầng HTTP của Supabase client (supabase_db.get_supabase_client): một httpx.Client
+dùng chung cho PostgREST và auth, với
+
+- pool kết nối keep-alive (mọi thread dùng chung: rerun Streamlit, làm mới
+  cloud_mirror, worker cloud_outbox), HTTP/2 khi có thư viện h2 và server hỗ trợ
+- ngân sách thời gian theo loại thao tác (BUDGETS): tổng thời gian của một lần
+  gọi kể cả các lần thử lại; request treo bị cắt khi hết ngân sách thay vì chờ
+  timeout mặc định 120 giây của postgrest-py
+- thử lại có jitter cho lần đọc (GET/HEAD, RPC chỉ đọc) khi lỗi mạng hoặc
+  502/503/504/520/429; lần ghi chỉ thử lại khi chưa kết nối được (request chưa
+  tới server). Lần ghi còn lại do cloud_outbox tự gửi lại (khóa idempotency).
+- số liệu (get_stats): số request, kết nối mới / dùng lại, thử lại, timeout
+
+Cấu hình qua biến môi trường SUPABASE_HTTP_* (xem các hằng bên dưới).
+"""
+
+import contextvars
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import httpx
+
+# Pool kết nối: kết nối rảnh quá KEEPALIVE_SECONDS bị đóng trước khi server
+# (Supabase/Kong) tự đóng, tránh gửi vào kết nối đã chết
+MAX_CONNECTIONS = int(os.environ.get("SUPABASE_HTTP_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE = int(os.environ.get("SUPABASE_HTTP_MAX_KEEPALIVE", "10"))
+KEEPALIVE_SECONDS = float(os.environ.get("SUPABASE_HTTP_KEEPALIVE_SECONDS", "20"))
+HTTP2 = os.environ.get("SUPABASE_HTTP2", "1").strip().lower() not in ("0", "false", "no", "off")
+
+# Ngân sách (giây) cho một lần gọi theo loại thao tác, kể cả các lần thử lại
+CONNECT_TIMEOUT_SECONDS = float(os.environ.get("SUPABASE_HTTP_CONNECT_TIMEOUT", "3"))
+BUDGETS = {
+    'health': float(os.environ.get("SUPABASE_HTTP_HEALTH_BUDGET", "4")),
+    'read': float(os.environ.get("SUPABASE_HTTP_READ_BUDGET", "10")),
+    'rpc': float(os.environ.get("SUPABASE_HTTP_RPC_BUDGET", "20")),
+    'write': float(os.environ.get("SUPABASE_HTTP_WRITE_BUDGET", "15")),
+}
+
+# Thử lại lần đọc: tối đa MAX_RETRIES lần, chờ ngẫu nhiên trong [0, min(MAX, BASE * 2^n)].
+# Khi còn lượt thử lại, một attempt chỉ được nửa ngân sách còn lại (request treo
+# bị cắt sớm, phần còn lại để gửi lại)
+MAX_RETRIES = int(os.environ.get("SUPABASE_HTTP_RETRIES", "3"))
+RETRY_BASE_SECONDS = 0.2
+RETRY_MAX_SECONDS = 2.0
+RETRY_STATUSES = {429, 502, 503, 504, 520}
+
+# RPC chỉ đọc (gọi bằng POST nhưng gửi lại an toàn)
+READ_ONLY_RPCS = {'daily_summaries', 'payroll_aggregates', 'mirror_changes'}
+
+# Loại thao tác đặt tường minh cho các lần gọi trong khối operation(...)
+_operation: contextvars.ContextVar = contextvars.ContextVar('supabase_http_operation', default=None)
+
+_stats_lock = threading.Lock()
+_stats: Dict = {}
+
+
+# ==================== PHÂN LOẠI REQUEST ====================
+
+@contextmanager
+def operation(name: str):
+    """Các request trong khối dùng ngân sách BUDGETS[name] (vd 'health': kiểm tra kết nối nhanh)."""
+    token = _operation.set(name)
+    try:
+        yield
+    finally:
+        _operation.reset(token)
+
+
+def _rpc_name(request: httpx.Request) -> Optional[str]:
+    path = request.url.path
+    marker = '/rest/v1/rpc/'
+    return path[path.index(marker) + len(marker):] if marker in path else None
+
+
+def classify(request: httpx.Request) -> str:
+    """Loại thao tác của request: đặt qua operation(), hoặc suy ra từ method và đường dẫn."""
+    name = _operation.get()
+    if name in BUDGETS:
+        return name
+    if _rpc_name(request) is not None:
+        return 'rpc'
+    return 'read' if request.method in ('GET', 'HEAD') else 'write'
+
+
+def is_idempotent(request: httpx.Request) -> bool:
+    """Gửi lại không đổi dữ liệu trên server: GET/HEAD và RPC chỉ đọc."""
+    if request.method in ('GET', 'HEAD'):
+        return True
+    return request.method == 'POST' and _rpc_name(request) in READ_ONLY_RPCS
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+# ==================== SỐ LIỆU ====================
+
+def reset_stats() -> None:
+    with _stats_lock:
+        _stats.clear()
+        _stats.update({
+            'requests': 0,           # lần gọi (kể cả các lần thử lại bên trong = 1)
+            'attempts': 0,           # request HTTP thực sự gửi đi
+            'new_connections': 0,    # attempt phải mở kết nối TCP mới
+            'reused_connections': 0, # attempt đi trên kết nối keep-alive có sẵn
+            'retries': 0,
+            'timeouts': 0,
+            'errors': 0,             # lần gọi kết thúc bằng lỗi mạng (sau khi thử lại)
+            'http_versions': {},
+            'operations': {},        # loại thao tác -> số lần gọi
+            'elapsed_ms': 0.0,
+        })
+
+
+def _count(key: str, amount=1) -> None:
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def _count_in(key: str, name: str) -> None:
+    with _stats_lock:
+        _stats[key][name] = _stats[key].get(name, 0) + 1
+
+
+def get_stats() -> Dict:
+    """Số liệu từ lần reset_stats() gần nhất, kèm tỉ lệ dùng lại kết nối."""
+    with _stats_lock:
+        stats = {key: dict(value) if isinstance(value, dict) else value for key, value in _stats.items()}
+    attempts = stats['new_connections'] + stats['reused_connections']
+    stats['reuse_ratio'] = stats['reused_connections'] / attempts if attempts else 0.0
+    return stats
+
+
+reset_stats()
+
+
+# ==================== TRANSPORT ====================
+
+class TunedTransport(httpx.BaseTransport):
+    """
+    Bọc httpx.HTTPTransport: đặt timeout theo ngân sách còn lại cho từng attempt
+    (lần đọc còn lượt thử lại: nửa ngân sách còn lại),
+    thử lại lần đọc có jitter và ghi nhận kết nối mới / dùng lại (trace của httpcore).
+    """
+
+    def __init__(self, transport: httpx.BaseTransport):
+        self._transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        kind = classify(request)
+        idempotent = is_idempotent(request)
+        started = time.monotonic()
+        deadline = started + BUDGETS[kind]
+        _count('requests')
+        _count_in('operations', kind)
+        attempt = 0
+        try:
+            while True:
+                timeout = max(deadline - time.monotonic(), 0.05)
+                if idempotent and attempt < MAX_RETRIES:
+                    timeout /= 2
+                connected = []
+                request.extensions = {
+                    **request.extensions,
+                    'timeout': {
+                        'connect': min(CONNECT_TIMEOUT_SECONDS, timeout),
+                        'read': timeout,
+                        'write': timeout,
+                        'pool': timeout,
+                    },
+                    'trace': lambda event, info: connected.append(event)
+                    if event == 'connection.connect_tcp.complete' else None,
+                }
+                _count('attempts')
+                try:
+                    response = self._transport.handle_request(request)
+                except httpx.TransportError as e:
+                    _count('new_connections' if connected else 'reused_connections')
+                    if isinstance(e, httpx.TimeoutException):
+                        _count('timeouts')
+                    # Chưa kết nối được: request chưa tới server, gửi lại an toàn với mọi method
+                    unsent = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+                    if not self._retry(attempt, deadline, idempotent or unsent):
+                        _count('errors')
+                        raise
+                    attempt += 1
+                    continue
+
+                _count('new_connections' if connected else 'reused_connections')
+                _count_in('http_versions', response.extensions.get('http_version', b'').decode() or '?')
+                if response.status_code in RETRY_STATUSES and idempotent:
+                    response.read()   # đọc hết body: kết nối trở lại pool (cả trong lúc chờ)
+                    if self._retry(attempt, deadline, True):
+                        attempt += 1
+                        continue
+                return response
+        finally:
+            _count('elapsed_ms', (time.monotonic() - started) * 1000)
+
+    @staticmethod
+    def _retry(attempt: int, deadline: float, allowed: bool) -> bool:
+        """Chờ rồi trả về True nếu được thử lại (còn lượt và còn ngân sách sau khi chờ)."""
+        if not allowed or attempt >= MAX_RETRIES:
+            return False
+        delay = _backoff(attempt)
+        if time.monotonic() + delay >= deadline:
+            return False
+        _count('retries')
+        time.sleep(delay)
+        return True
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def build_http_client() -> httpx.Client:
+    """httpx.Client dùng chung cho Supabase client (pool keep-alive, HTTP/2, TunedTransport)."""
+    transport = httpx.HTTPTransport(
+        http2=HTTP2 and _http2_available(),
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE,
+            keepalive_expiry=KEEPALIVE_SECONDS,
+        ),
+    )
+    return httpx.Client(
+        transport=TunedTransport(transport),
+        timeout=httpx.Timeout(BUDGETS['read'], connect=CONNECT_TIMEOUT_SECONDS),
+        follow_redirects=True,
+    )
+
+
+def client_options():
+    """ClientOptions cho supabase.create_client dùng tầng HTTP này."""
+    from supabase import ClientOptions
+
+    # postgrest-py tự thử lại GET khi 503 (chờ 1, 2, 4 giây, ngoài ngân sách):
+    # để TunedTransport là nơi duy nhất quyết định thử lại
+    try:
+        from postgrest import base_request_builder
+        base_request_builder.MAX_RETRIES = 0
+    except (ImportError, AttributeError):
+        pass
+
+    return ClientOptions(
+        httpx_client=build_http_client(),
+        postgrest_client_timeout=BUDGETS['read'],
+    )
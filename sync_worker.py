@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Worker nền đồng bộ database SQLite lên GitHub.
+Các hàm ghi chỉ gọi schedule_sync() (đưa đường dẫn vào hàng đợi, không chờ
+mạng); một thread nền gộp các lần ghi liên tiếp của cùng database, đẩy bằng
+github_sync.push_db, thử lại với backoff khi lỗi và đẩy nốt khi tắt app.
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from typing import Dict, Optional
+
+import github_sync
+
+# Hàng đợi có giới hạn: mỗi database chỉ chiếm tối đa một chỗ nhờ gộp
+QUEUE_SIZE = 64
+
+# Chờ thêm các lần ghi tiếp theo trước khi đẩy (giây, tính từ lần ghi đầu)
+COALESCE_SECONDS = 10
+
+# Thử lại khi đẩy lỗi: 2s, 4s, 8s, ... tối đa BACKOFF_MAX_SECONDS
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 2
+BACKOFF_MAX_SECONDS = 120
+
+# Thời gian tối đa chờ đẩy nốt khi tắt app
+SHUTDOWN_TIMEOUT_SECONDS = 30
+
+_STOP = object()
+
+_queue = queue.Queue(maxsize=QUEUE_SIZE)
+_lock = threading.Lock()
+_stop_event = threading.Event()
+_worker: Optional[threading.Thread] = None
+_enabled: Optional[bool] = None
+
+# db_path -> thời điểm (time.monotonic) của lần ghi đầu tiên chưa được đẩy
+_pending: Dict[str, float] = {}
+
+_status = {
+    'state': 'idle',          # idle | pending | syncing | retrying | error | disabled
+    'last_success_at': None,  # time.time()
+    'last_error': None,
+    'pushed': 0,
+    'coalesced': 0,
+    'dropped': 0,
+    'retries': 0,
+}
+
+
+def is_enabled() -> bool:
+    """GitHub đã được cấu hình (GITHUB_TOKEN, GITHUB_REPO trong secrets) hay chưa."""
+    global _enabled
+    if _enabled is None:
+        try:
+            import streamlit as st
+            _enabled = "GITHUB_TOKEN" in st.secrets and "GITHUB_REPO" in st.secrets
+        except Exception:
+            _enabled = False
+        if not _enabled:
+            _status['state'] = 'disabled'
+    return _enabled
+
+
+def repo_path_for(db_path: str) -> str:
+    """Đường dẫn snapshot trên repo của một database local."""
+    return f"{github_sync.DATA_DIR}/{os.path.basename(db_path)}{github_sync.COMPRESSED_SUFFIX}"
+
+
+def _ensure_worker() -> None:
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    _stop_event.clear()
+    _worker = threading.Thread(target=_run, name="github-sync-worker", daemon=True)
+    _worker.start()
+
+
+def schedule_sync(db_path: str) -> bool:
+    """
+    Yêu cầu đồng bộ database lên GitHub (không chặn).
+
+    Args:
+        db_path: Đường dẫn file database vừa được ghi
+
+    Returns:
+        True nếu yêu cầu được nhận (kể cả khi gộp vào yêu cầu đang chờ)
+    """
+    if not is_enabled() or _stop_event.is_set():
+        return False
+
+    db_path = os.path.abspath(db_path)
+    with _lock:
+        if db_path in _pending:
+            _status['coalesced'] += 1
+            return True
+        try:
+            _queue.put_nowait(db_path)
+        except queue.Full:
+            _status['dropped'] += 1
+            _status['last_error'] = "Hàng đợi đồng bộ đầy, bỏ qua một yêu cầu"
+            return False
+        _pending[db_path] = time.monotonic()
+        if _status['state'] in ('idle', 'error'):
+            _status['state'] = 'pending'
+        _ensure_worker()
+    return True
+
+
+def _push_with_retry(db_path: str) -> bool:
+    """Đẩy một database, thử lại với backoff (chỉ một lần khi đang tắt app)."""
+    repo_path = repo_path_for(db_path)
+    message = f"Update {os.path.basename(db_path)}"
+    attempts = 1 if _stop_event.is_set() else MAX_ATTEMPTS
+
+    for attempt in range(attempts):
+        if github_sync.push_db(db_path, repo_path, message):
+            return True
+        if attempt + 1 < attempts:
+            _status['retries'] += 1
+            _status['state'] = 'retrying'
+            delay = min(BACKOFF_BASE_SECONDS * 2 ** attempt, BACKOFF_MAX_SECONDS)
+            if _stop_event.wait(delay):
+                # Đang tắt app: thử lần cuối rồi dừng
+                return github_sync.push_db(db_path, repo_path, message)
+    return False
+
+
+def _run() -> None:
+    """Vòng lặp của worker: lấy database từ hàng đợi, chờ gộp, rồi đẩy."""
+    while True:
+        db_path = _queue.get()
+        if db_path is _STOP:
+            _queue.task_done()
+            break
+
+        with _lock:
+            first_write = _pending.get(db_path, time.monotonic())
+        remaining = COALESCE_SECONDS - (time.monotonic() - first_write)
+        if remaining > 0:
+            _stop_event.wait(remaining)
+
+        # Lần ghi sau thời điểm này sẽ tạo yêu cầu mới
+        with _lock:
+            _pending.pop(db_path, None)
+        _status['state'] = 'syncing'
+
+        try:
+            ok = _push_with_retry(db_path)
+        except Exception as e:
+            ok = False
+            _status['last_error'] = str(e)
+
+        with _lock:
+            if ok:
+                _status['pushed'] += 1
+                _status['last_success_at'] = time.time()
+                _status['last_error'] = None
+                _status['state'] = 'pending' if _pending else 'idle'
+            else:
+                _status['last_error'] = _status['last_error'] or f"Không đẩy được {os.path.basename(db_path)}"
+                _status['state'] = 'error'
+        _queue.task_done()
+
+
+def flush(timeout: float = SHUTDOWN_TIMEOUT_SECONDS) -> bool:
+    """
+    Bỏ thời gian chờ gộp, đẩy ngay các yêu cầu đang chờ và dừng worker.
+
+    Returns:
+        True nếu worker đã đẩy xong trong thời gian cho phép
+    """
+    worker = _worker
+    if worker is None or not worker.is_alive():
+        return True
+    _stop_event.set()
+    _queue.put(_STOP)
+    worker.join(timeout)
+    return not worker.is_alive()
+
+
+def get_status() -> Dict:
+    """Trạng thái đồng bộ cho sidebar (bản sao, an toàn khi đọc từ thread khác)."""
+    is_enabled()
+    with _lock:
+        status = dict(_status)
+        status['pending'] = len(_pending)
+    return status
+
+
+atexit.register(flush)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Ngữ cảnh tenant (user hiện tại) cho tầng dữ liệu, dựa trên contextvars.
+
+App đặt tenant một lần mỗi lượt chạy script (từ session của user); database.py
+và db_wrapper.py chỉ đọc ngữ cảnh này, không phụ thuộc Streamlit. Thread và
+process pool nhận tenant qua bind() / submit(), nên job hàng loạt, worker nền
+và benchmark chạy đúng database mà không cần Streamlit.
+
+Ví dụ:
+    with tenant_context.use_tenant(user_id=5, db_path="user_data/user_alice.db"):
+        db.get_all_jobs()
+"""
+
+import contextlib
+import contextvars
+import functools
+from typing import Callable, NamedTuple, Optional
+
+
+class Tenant(NamedTuple):
+    """user_id cho backend phân vùng (Supabase / multi-tenant), db_path cho SQLite từng user."""
+    user_id: Optional[int] = None
+    db_path: Optional[str] = None
+
+
+_current = contextvars.ContextVar("tenant", default=Tenant())
+
+
+def get_tenant() -> Tenant:
+    """Tenant của ngữ cảnh hiện tại (Tenant() rỗng nếu chưa đặt)."""
+    return _current.get()
+
+
+def current_user_id() -> Optional[int]:
+    return _current.get().user_id
+
+
+def current_db_path() -> Optional[str]:
+    return _current.get().db_path
+
+
+def set_tenant(user_id: Optional[int] = None, db_path: Optional[str] = None) -> contextvars.Token:
+    """
+    Đặt tenant cho ngữ cảnh hiện tại (thread / task hiện tại).
+
+    Returns:
+        Token để khôi phục tenant cũ bằng reset_tenant()
+    """
+    return _current.set(Tenant(user_id, db_path))
+
+
+def reset_tenant(token: contextvars.Token) -> None:
+    _current.reset(token)
+
+
+@contextlib.contextmanager
+def use_tenant(user_id: Optional[int] = None, db_path: Optional[str] = None):
+    """Chạy một khối lệnh với tenant xác định, khôi phục tenant cũ khi xong."""
+    token = set_tenant(user_id, db_path)
+    try:
+        yield get_tenant()
+    finally:
+        reset_tenant(token)
+
+
+def bind(func: Callable) -> Callable:
+    """
+    Gắn tenant hiện tại vào hàm để chạy ở thread khác
+    (threading.Thread(target=bind(f)), ThreadPoolExecutor.submit(bind(f), ...)).
+    """
+    tenant = get_tenant()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with use_tenant(*tenant):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _call_with_tenant(tenant: Tenant, func: Callable, args: tuple, kwargs: dict):
+    with use_tenant(*tenant):
+        return func(*args, **kwargs)
+
+
+def submit(executor, func: Callable, *args, tenant: Optional[Tenant] = None, **kwargs):
+    """
+    executor.submit() kèm tenant (mặc định: tenant hiện tại). Dùng được với
+    ProcessPoolExecutor: tenant được pickle cùng tác vụ, func phải ở cấp module.
+    """
+    return executor.submit(_call_with_tenant, tenant or get_tenant(), func, args, kwargs)
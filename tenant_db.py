@@ -0,0 +1,944 @@
+# -*- coding: utf-8 -*-
+"""
+Backend SQLite nhiều user trong một file (multi-tenant).
+Mọi bảng có cột user_id và index ghép (user_id, ...), cùng schema và cùng API
+(user_id là tham số đầu) với supabase_db, thay cho mỗi user một file SQLite.
+
+Bật bằng DB_LAYOUT = "multi_tenant" (secrets hoặc biến môi trường);
+dữ liệu cũ chuyển sang bằng migrate_to_tenants.py.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+import payroll
+import sqlite_writer
+
+# File database dùng chung cho mọi user
+TENANT_DB_PATH = os.environ.get(
+    "TENANT_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "user_data", "tenants.db")
+)
+
+# Schema chỉ cần tạo một lần mỗi process (không phải mỗi user/mỗi kết nối)
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL UNIQUE,
+        password_hash TEXT NOT NULL,
+        display_name TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        last_login TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        job_name TEXT NOT NULL,
+        hourly_rate REAL NOT NULL DEFAULT 0.0,
+        description TEXT,
+        color TEXT DEFAULT '#667eea',
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (user_id, job_name)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS work_shifts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        work_date TEXT NOT NULL,
+        shift_name TEXT DEFAULT 'Ca 1',
+        job_id INTEGER NOT NULL,
+        start_time TEXT NOT NULL,
+        end_time TEXT NOT NULL,
+        break_hours REAL DEFAULT 1.0,
+        total_hours REAL NOT NULL,
+        overtime_hours REAL DEFAULT 0.0,
+        notes TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_tenant_shifts_user_date ON work_shifts(user_id, work_date, start_time)",
+    "CREATE INDEX IF NOT EXISTS idx_tenant_shifts_user_job ON work_shifts(user_id, job_id)",
+    """
+    CREATE TABLE IF NOT EXISTS job_rates (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        job_id INTEGER NOT NULL,
+        effective_from TEXT NOT NULL,
+        hourly_rate REAL NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (job_id, effective_from)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_tenant_rates_user ON job_rates(user_id, effective_from)",
+    """
+    CREATE TABLE IF NOT EXISTS shift_presets (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        preset_name TEXT NOT NULL,
+        start_time TEXT NOT NULL,
+        end_time TEXT NOT NULL,
+        break_hours REAL DEFAULT 0.0,
+        total_hours REAL NOT NULL,
+        job_id INTEGER,
+        emoji TEXT DEFAULT '⏰',
+        sort_order INTEGER DEFAULT 0,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_tenant_presets_user ON shift_presets(user_id, sort_order)",
+    """
+    CREATE TABLE IF NOT EXISTS holidays (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        holiday_date TEXT NOT NULL,
+        description TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (user_id, holiday_date)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS settings (
+        user_id INTEGER NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, key)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS payroll_snapshots (
+        user_id INTEGER NOT NULL,
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        salary_json TEXT NOT NULL,
+        daily_json TEXT NOT NULL,
+        closed_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, year, month)
+    )
+    """,
+]
+
+# Bảng chứa dữ liệu của user (theo thứ tự phụ thuộc: jobs trước)
+TENANT_TABLES = ['jobs', 'job_rates', 'work_shifts', 'shift_presets', 'holidays', 'settings', 'payroll_snapshots']
+
+# Thế hệ dữ liệu của từng user: trigger đổi token trong cùng transaction với mọi
+# lần ghi vào bảng của user, kể cả từ process khác (result_cache, query_data_generation).
+# Không dùng INSERT OR REPLACE: câu lệnh ngoài có ON CONFLICT sẽ thay cách xử lý
+# xung đột của lệnh trong trigger
+SCHEMA += [
+    "CREATE TABLE IF NOT EXISTS data_generations (user_id INTEGER PRIMARY KEY, token TEXT NOT NULL)",
+] + [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_{table}_{op.lower()}_generation AFTER {op} ON {table}
+    BEGIN
+        UPDATE data_generations SET token = lower(hex(randomblob(8))) WHERE user_id = {row}.user_id;
+        INSERT INTO data_generations (user_id, token)
+        SELECT {row}.user_id, lower(hex(randomblob(8)))
+        WHERE NOT EXISTS (SELECT 1 FROM data_generations WHERE user_id = {row}.user_id);
+    END
+    """
+    for table in TENANT_TABLES
+    for op, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD'))
+]
+
+
+def _closed_month(row: str) -> str:
+    """Điều kiện SQL: ca {row} (NEW / OLD) thuộc tháng user đã chốt lương."""
+    return f"""EXISTS (
+            SELECT 1 FROM payroll_snapshots
+            WHERE user_id = {row}.user_id
+              AND year = CAST(substr({row}.work_date, 1, 4) AS INTEGER)
+              AND month = CAST(substr({row}.work_date, 6, 2) AS INTEGER))"""
+
+
+# Tháng đã chốt: không thêm / sửa / xóa ca kể cả khi ghi không qua db_wrapper
+# (script, CLI, process chạy code cũ); lỗi IntegrityError 'closed_period'.
+# Không nằm trong SCHEMA: bản sao của cloud_mirror nhận cả ca của tháng đã chốt
+# từ server (server tự chặn bằng trigger của supabase/migrations).
+CLOSED_PERIOD_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_work_shifts_{op.lower()}_closed_period BEFORE {op} ON work_shifts
+    WHEN {condition}
+    BEGIN
+        SELECT RAISE(ABORT, 'closed_period: tháng đã chốt lương, cần mở lại tháng trước khi sửa');
+    END
+    """
+    for op, condition in (('INSERT', _closed_month('NEW')),
+                          ('UPDATE', f"{_closed_month('OLD')} OR {_closed_month('NEW')}"),
+                          ('DELETE', _closed_month('OLD')))
+]
+
+
+def init_schema(db_path: Optional[str] = None) -> None:
+    """Tạo bảng/index (một lần mỗi process) và bật WAL để nhiều user đọc/ghi đồng thời."""
+    db_path = db_path or TENANT_DB_PATH
+    if db_path in _schema_ready:
+        return
+    with _schema_lock:
+        if db_path in _schema_ready:
+            return
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in SCHEMA + CLOSED_PERIOD_TRIGGERS:
+                conn.execute(statement)
+            conn.commit()
+        finally:
+            conn.close()
+        _schema_ready.add(db_path)
+
+
+def get_connection() -> sqlite3.Connection:
+    """Tạo kết nối đến database multi-tenant."""
+    init_schema()
+    conn = sqlite_writer.connect(TENANT_DB_PATH)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _sync_to_github():
+    """Đồng bộ file dùng chung lên GitHub qua worker nền (như database._sync_to_github)."""
+    import database
+    if not database.ENABLE_SYNC:
+        return
+    try:
+        import sync_worker
+        sync_worker.schedule_sync(TENANT_DB_PATH)
+    except Exception as e:
+        print(f"❌ Lỗi lên lịch đồng bộ: {e}")
+
+
+def _fetch_all(sql: str, params: tuple = ()) -> List[Dict]:
+    conn = get_connection()
+    try:
+        return [dict(row) for row in conn.execute(sql, params).fetchall()]
+    finally:
+        conn.close()
+
+
+def _fetch_one(sql: str, params: tuple = ()) -> Optional[Dict]:
+    conn = get_connection()
+    try:
+        row = conn.execute(sql, params).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+
+@contextmanager
+def _write_connection():
+    """Kết nối cho một lần ghi (BEGIN IMMEDIATE dưới khóa ghi của file, như database.write_connection)."""
+    conn = get_connection()
+    try:
+        with sqlite_writer.transaction(conn, TENANT_DB_PATH):
+            yield conn
+    finally:
+        conn.close()
+
+
+def _execute(sql: str, params: tuple = ()) -> sqlite3.Cursor:
+    """Chạy một câu lệnh ghi trong transaction riêng."""
+    with _write_connection() as conn:
+        cursor = conn.execute(sql, params)
+    _sync_to_github()
+    return cursor
+
+
+# ==================== USERS ====================
+
+def get_user_by_username(username: str) -> Optional[Dict]:
+    """Lấy user theo username."""
+    try:
+        return _fetch_one("SELECT * FROM users WHERE username = ?", (username.lower(),))
+    except Exception as e:
+        print(f"Error getting user: {e}")
+        return None
+
+
+def create_user(username: str, password_hash: str, display_name: str = "") -> Optional[Dict]:
+    """Tạo user mới."""
+    try:
+        cursor = _execute(
+            "INSERT INTO users (username, password_hash, display_name) VALUES (?, ?, ?)",
+            (username.lower(), password_hash, display_name or username)
+        )
+        return _fetch_one("SELECT * FROM users WHERE id = ?", (cursor.lastrowid,))
+    except Exception as e:
+        print(f"Error creating user: {e}")
+        return None
+
+
+def update_user_last_login(user_id: int) -> bool:
+    """Cập nhật thời gian đăng nhập cuối."""
+    try:
+        _execute("UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?", (user_id,))
+        return True
+    except Exception as e:
+        print(f"Error updating last login: {e}")
+        return False
+
+
+# ==================== JOBS ====================
+
+def get_all_jobs(user_id: int) -> List[Dict]:
+    """Lấy tất cả công việc của user."""
+    try:
+        return _fetch_all("SELECT * FROM jobs WHERE user_id = ? ORDER BY job_name", (user_id,))
+    except Exception:
+        return []
+
+
+def add_job(user_id: int, job_name: str, hourly_rate: float, description: str = "", color: str = "#667eea") -> Optional[int]:
+    """Thêm công việc mới (trùng tên thì cập nhật)."""
+    try:
+        with _write_connection() as conn:
+            existing = conn.execute("SELECT id FROM jobs WHERE user_id = ? AND job_name = ?",
+                                    (user_id, job_name)).fetchone()
+            if existing:
+                conn.execute("""
+                    UPDATE jobs SET hourly_rate = ?, description = ?, color = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                """, (hourly_rate, description, color, existing['id']))
+                job_id = existing['id']
+            else:
+                job_id = conn.execute("""
+                    INSERT INTO jobs (user_id, job_name, hourly_rate, description, color) VALUES (?, ?, ?, ?, ?)
+                """, (user_id, job_name, hourly_rate, description, color)).lastrowid
+        _sync_to_github()
+        return job_id
+    except Exception as e:
+        print(f"Error adding job: {e}")
+        return None
+
+
+def update_job(user_id: int, job_id: int, job_name: str, hourly_rate: float, description: str = "",
+               color: str = "#667eea") -> bool:
+    """Cập nhật công việc của user."""
+    try:
+        cursor = _execute("""
+            UPDATE jobs SET job_name = ?, hourly_rate = ?, description = ?, color = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND user_id = ?
+        """, (job_name, hourly_rate, description, color, job_id, user_id))
+        return cursor.rowcount > 0
+    except Exception as e:
+        print(f"Error updating job: {e}")
+        return False
+
+
+def get_shift_counts_by_job(user_id: int) -> Dict[int, int]:
+    """Đếm số ca của từng công việc của user (một truy vấn GROUP BY)."""
+    try:
+        rows = _fetch_all(
+            "SELECT job_id, COUNT(*) AS shift_count FROM work_shifts WHERE user_id = ? GROUP BY job_id",
+            (user_id,)
+        )
+        return {row['job_id']: row['shift_count'] for row in rows}
+    except Exception:
+        return {}
+
+
+def get_job_rates(user_id: int) -> List[Dict]:
+    """Lấy lịch sử lương giờ (theo ngày hiệu lực) của các công việc của user."""
+    try:
+        return _fetch_all("""
+            SELECT job_id, effective_from, hourly_rate FROM job_rates
+            WHERE user_id = ? ORDER BY effective_from
+        """, (user_id,))
+    except Exception as e:
+        print(f"Error getting job rates: {e}")
+        return []
+
+
+def record_rate_change(user_id: int, job_id: int, old_rate: float, new_rate: float,
+                       effective_from: date, epoch: str) -> bool:
+    """Ghi mốc lương mới; giữ mức cũ làm mốc gốc nếu công việc chưa có lịch sử."""
+    try:
+        with _write_connection() as conn:
+            conn.execute("""
+                INSERT OR IGNORE INTO job_rates (user_id, job_id, effective_from, hourly_rate)
+                SELECT ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM job_rates WHERE job_id = ?)
+            """, (user_id, job_id, epoch, old_rate, job_id))
+            conn.execute("""
+                INSERT INTO job_rates (user_id, job_id, effective_from, hourly_rate) VALUES (?, ?, ?, ?)
+                ON CONFLICT(job_id, effective_from) DO UPDATE SET hourly_rate = excluded.hourly_rate
+            """, (user_id, job_id, effective_from.isoformat(), new_rate))
+        _sync_to_github()
+        return True
+    except Exception as e:
+        print(f"Error recording rate change: {e}")
+        return False
+
+
+def delete_job(user_id: int, job_id: int) -> bool:
+    """Xóa công việc của user (kèm lịch sử lương)."""
+    try:
+        with _write_connection() as conn:
+            deleted = conn.execute("DELETE FROM jobs WHERE id = ? AND user_id = ?", (job_id, user_id)).rowcount
+            conn.execute("DELETE FROM job_rates WHERE job_id = ? AND user_id = ?", (job_id, user_id))
+        _sync_to_github()
+        return deleted > 0
+    except Exception as e:
+        print(f"Error deleting job: {e}")
+        return False
+
+
+# ==================== WORK SHIFTS ====================
+
+def add_work_shift(
+    user_id: int,
+    work_date: date,
+    shift_name: str,
+    start_time: str,
+    end_time: str,
+    break_hours: float,
+    total_hours: float,
+    notes: str = "",
+    job_id: int = None
+) -> Optional[int]:
+    """Thêm ca làm việc mới."""
+    try:
+        cursor = _execute("""
+            INSERT INTO work_shifts (user_id, work_date, shift_name, job_id, start_time, end_time,
+                                     break_hours, total_hours, notes)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (user_id, work_date.isoformat(), shift_name, job_id, start_time, end_time,
+              break_hours, total_hours, notes))
+        return cursor.lastrowid
+    except Exception as e:
+        print(f"Error adding shift: {e}")
+        return None
+
+
+def update_work_shift(
+    user_id: int,
+    shift_id: int,
+    shift_name: str,
+    start_time: str,
+    end_time: str,
+    break_hours: float,
+    total_hours: float,
+    notes: str = ""
+) -> bool:
+    """Cập nhật ca làm việc của user."""
+    try:
+        cursor = _execute("""
+            UPDATE work_shifts SET shift_name = ?, start_time = ?, end_time = ?, break_hours = ?,
+                                   total_hours = ?, notes = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND user_id = ?
+        """, (shift_name, start_time, end_time, break_hours, total_hours, notes, shift_id, user_id))
+        return cursor.rowcount > 0
+    except Exception as e:
+        print(f"Error updating shift: {e}")
+        return False
+
+
+def delete_work_shift(user_id: int, shift_id: int) -> bool:
+    """Xóa ca làm việc của user."""
+    try:
+        return _execute("DELETE FROM work_shifts WHERE id = ? AND user_id = ?", (shift_id, user_id)).rowcount > 0
+    except Exception as e:
+        print(f"Error deleting shift: {e}")
+        return False
+
+
+def get_shifts_by_date(user_id: int, work_date: date) -> List[Dict]:
+    """Lấy các ca làm việc theo ngày."""
+    try:
+        return _fetch_all("""
+            SELECT * FROM work_shifts WHERE user_id = ? AND work_date = ? ORDER BY start_time
+        """, (user_id, work_date.isoformat()))
+    except Exception:
+        return []
+
+
+def get_shifts_by_range(user_id: int, start_date: date, end_date: date) -> List[Dict]:
+    """Lấy các ca làm việc trong khoảng thời gian."""
+    try:
+        return _fetch_all("""
+            SELECT * FROM work_shifts WHERE user_id = ? AND work_date BETWEEN ? AND ?
+            ORDER BY work_date, start_time, id
+        """, (user_id, start_date.isoformat(), end_date.isoformat()))
+    except Exception:
+        return []
+
+
+def get_shift_by_id(user_id: int, shift_id: int) -> Optional[Dict]:
+    """Lấy ca làm việc của user theo ID."""
+    try:
+        return _fetch_one("SELECT * FROM work_shifts WHERE id = ? AND user_id = ?", (shift_id, user_id))
+    except Exception:
+        return None
+
+
+# ==================== PAYROLL SNAPSHOTS ====================
+
+def get_closed_months(user_id: int) -> List[tuple]:
+    """Lấy danh sách (năm, tháng) đã chốt lương."""
+    try:
+        rows = _fetch_all("""
+            SELECT year, month FROM payroll_snapshots WHERE user_id = ? ORDER BY year, month
+        """, (user_id,))
+        return [(row['year'], row['month']) for row in rows]
+    except Exception as e:
+        print(f"Error getting closed months: {e}")
+        return []
+
+
+def get_payroll_snapshot(user_id: int, year: int, month: int) -> Optional[Dict]:
+    """Lấy snapshot lương của tháng đã chốt."""
+    try:
+        row = _fetch_one("""
+            SELECT * FROM payroll_snapshots WHERE user_id = ? AND year = ? AND month = ?
+        """, (user_id, year, month))
+        if not row:
+            return None
+        return {
+            'year': row['year'],
+            'month': row['month'],
+            'salary': json.loads(row['salary_json']),
+            'daily': json.loads(row['daily_json']),
+            'closed_at': row['closed_at']
+        }
+    except Exception as e:
+        print(f"Error getting payroll snapshot: {e}")
+        return None
+
+
+def get_payroll_snapshots(user_id: int, first: tuple, last: tuple) -> Dict[tuple, Dict]:
+    """Lấy snapshot lương của các tháng đã chốt từ tháng first đến last (một truy vấn)."""
+    try:
+        rows = _fetch_all("""
+            SELECT year, month, salary_json FROM payroll_snapshots
+            WHERE user_id = ? AND (year * 100 + month) BETWEEN ? AND ?
+        """, (user_id, first[0] * 100 + first[1], last[0] * 100 + last[1]))
+        return {(row['year'], row['month']): json.loads(row['salary_json']) for row in rows}
+    except Exception as e:
+        print(f"Error getting payroll snapshots: {e}")
+        return {}
+
+
+def save_payroll_snapshot(user_id: int, year: int, month: int, salary: Dict, daily: List[Dict]) -> bool:
+    """Lưu (hoặc ghi đè) snapshot của một tháng."""
+    try:
+        _execute("""
+            INSERT OR REPLACE INTO payroll_snapshots (user_id, year, month, salary_json, daily_json, closed_at)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        """, (user_id, year, month, json.dumps(salary, ensure_ascii=False), json.dumps(daily, ensure_ascii=False)))
+        return True
+    except Exception as e:
+        print(f"Error saving payroll snapshot: {e}")
+        return False
+
+
+def delete_payroll_snapshot(user_id: int, year: int, month: int) -> bool:
+    """Xóa snapshot (mở lại tháng)."""
+    try:
+        _execute("DELETE FROM payroll_snapshots WHERE user_id = ? AND year = ? AND month = ?",
+                 (user_id, year, month))
+        return True
+    except Exception as e:
+        print(f"Error deleting payroll snapshot: {e}")
+        return False
+
+
+# ==================== AGGREGATES ====================
+# Bản SQLite của các RPC trong supabase/migrations/*_aggregate_rpcs.sql (cùng cấu trúc CTE,
+# cùng kết quả) - sửa một bên thì sửa cả bên kia.
+
+_STANDARD_HOURS_SQL = """
+    SELECT COALESCE((SELECT CAST(NULLIF(TRIM(value), '') AS REAL) FROM settings
+                     WHERE user_id = :user_id AND key = 'standard_hours'), 8.0) AS hours
+"""
+
+_DAILY_AGGREGATES_SQL = """
+    WITH ordered AS (
+        SELECT work_date, start_time, end_time, total_hours, break_hours, notes,
+               FIRST_VALUE(start_time) OVER day_asc AS first_start,
+               FIRST_VALUE(end_time) OVER day_desc AS last_end
+        FROM work_shifts
+        WHERE user_id = :user_id AND work_date BETWEEN :start AND :end
+        WINDOW day_asc AS (PARTITION BY work_date ORDER BY start_time, id),
+               day_desc AS (PARTITION BY work_date ORDER BY start_time DESC, id DESC)
+        ORDER BY work_date, start_time, id
+    )
+    SELECT work_date,
+           SUM(total_hours) AS total_hours,
+           COUNT(*) AS shift_count,
+           MIN(first_start) AS start_time,
+           MIN(last_end) AS end_time,
+           SUM(COALESCE(break_hours, 0)) AS break_hours,
+           GROUP_CONCAT(NULLIF(notes, ''), '; ') AS notes
+    FROM ordered
+    GROUP BY work_date
+    ORDER BY work_date
+"""
+
+_PAYROLL_AGGREGATES_SQL = """
+    WITH std AS (""" + _STANDARD_HOURS_SQL + """),
+    shifts AS (
+        SELECT id, work_date, COALESCE(job_id, 0) AS job_id, start_time, end_time,
+               COALESCE(total_hours, 0) AS hours,
+               COALESCE(SUM(total_hours) OVER (
+                   PARTITION BY work_date ORDER BY start_time, id
+                   ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0) AS before_hours,
+               ROW_NUMBER() OVER (ORDER BY work_date, start_time, id) AS seq
+        FROM work_shifts
+        WHERE user_id = :user_id AND work_date BETWEEN :start AND :end
+    ),
+    priced AS (
+        SELECT s.*,
+               COALESCE(
+                   (SELECT r.hourly_rate FROM job_rates r WHERE r.user_id = :user_id AND r.job_id = s.job_id
+                    AND r.effective_from <= s.work_date ORDER BY r.effective_from DESC LIMIT 1),
+                   (SELECT r.hourly_rate FROM job_rates r WHERE r.user_id = :user_id AND r.job_id = s.job_id
+                    ORDER BY r.effective_from LIMIT 1),
+                   (SELECT j.hourly_rate FROM jobs j WHERE j.user_id = :user_id AND j.id = s.job_id),
+                   0) AS rate,
+               MAX(0, s.before_hours + s.hours - MAX(s.before_hours, (SELECT hours FROM std))) AS ot_hours,
+               CASE WHEN EXISTS (SELECT 1 FROM holidays h WHERE h.user_id = :user_id
+                                 AND h.holiday_date = s.work_date) THEN s.hours ELSE 0 END AS holiday_hours,
+               CAST(substr(s.start_time, 1, instr(s.start_time, ':') - 1) AS INTEGER)
+                   + CAST(substr(s.start_time, instr(s.start_time, ':') + 1, 2) AS INTEGER) / 60.0 AS start_h,
+               CAST(substr(s.end_time, 1, instr(s.end_time, ':') - 1) AS INTEGER)
+                   + CAST(substr(s.end_time, instr(s.end_time, ':') + 1, 2) AS INTEGER) / 60.0 AS end_h
+        FROM shifts s
+    ),
+    timed AS (
+        SELECT p.*, CASE WHEN end_h <= start_h THEN end_h + 24 ELSE end_h END AS end_t
+        FROM priced p
+    ),
+    night AS (
+        SELECT t.*,
+               CASE WHEN t.hours = 0 THEN 0 ELSE
+                   (MAX(0, MIN(t.end_t, 5.0) - MAX(t.start_h, -2.0))
+                    + MAX(0, MIN(t.end_t, 29.0) - MAX(t.start_h, 22.0))
+                    + MAX(0, MIN(t.end_t, 53.0) - MAX(t.start_h, 46.0))) * t.hours / (t.end_t - t.start_h)
+               END AS night_hours,
+               FIRST_VALUE(t.rate) OVER (PARTITION BY substr(t.work_date, 1, 7), t.job_id
+                                         ORDER BY t.seq DESC) AS last_rate
+        FROM timed t
+    ),
+    days AS (
+        SELECT substr(work_date, 1, 7) AS ym, COUNT(DISTINCT work_date) AS total_days
+        FROM shifts GROUP BY ym
+    )
+    SELECT CAST(substr(n.work_date, 1, 4) AS INTEGER) AS year,
+           CAST(substr(n.work_date, 6, 2) AS INTEGER) AS month,
+           d.total_days,
+           n.job_id, j.job_name, j.color,
+           MAX(n.last_rate) AS hourly_rate,
+           SUM(n.hours) AS total_hours,
+           COUNT(*) AS shift_count,
+           SUM(n.hours * n.rate) AS base_amount,
+           SUM(n.ot_hours) AS ot_hours,
+           SUM(n.ot_hours * n.rate) AS ot_amount,
+           SUM(n.night_hours) AS night_hours,
+           SUM(n.night_hours * n.rate) AS night_amount,
+           SUM(n.holiday_hours) AS holiday_hours,
+           SUM(n.holiday_hours * n.rate) AS holiday_amount
+    FROM night n
+    JOIN days d ON d.ym = substr(n.work_date, 1, 7)
+    LEFT JOIN jobs j ON j.user_id = :user_id AND j.id = n.job_id
+    GROUP BY year, month, n.job_id
+    ORDER BY year, month, MIN(n.seq)
+"""
+
+
+def query_daily_aggregates(conn: sqlite3.Connection, user_id: int, start_date, end_date) -> List[Dict]:
+    """Tổng hợp giờ làm theo ngày (một dòng mỗi ngày, không kèm danh sách ca)."""
+    params = {'user_id': user_id, 'start': str(start_date), 'end': str(end_date)}
+    return [dict(row) for row in conn.execute(_DAILY_AGGREGATES_SQL, params).fetchall()]
+
+
+def query_payroll_aggregates(conn: sqlite3.Connection, user_id: int, start_date, end_date) -> Dict:
+    """
+    Tổng hợp lương theo (tháng, công việc) cùng dạng với RPC payroll_aggregates.
+
+    Returns:
+        {'settings': {key: value}, 'months': [{'year', 'month', 'total_days', 'jobs': [...]}]}
+    """
+    params = {'user_id': user_id, 'start': str(start_date), 'end': str(end_date)}
+    placeholders = ','.join('?' * len(payroll.SETTING_KEYS))
+    settings = {
+        row['key']: row['value'] for row in conn.execute(
+            f"SELECT key, value FROM settings WHERE user_id = ? AND key IN ({placeholders})",
+            (user_id, *payroll.SETTING_KEYS))
+    }
+    months = {}
+    for row in conn.execute(_PAYROLL_AGGREGATES_SQL, params).fetchall():
+        row = dict(row)
+        key = (row.pop('year'), row.pop('month'))
+        total_days = row.pop('total_days')
+        month = months.setdefault(key, {'year': key[0], 'month': key[1], 'total_days': total_days, 'jobs': []})
+        month['jobs'].append(row)
+    return {'settings': settings, 'months': list(months.values())}
+
+
+def get_daily_aggregates(user_id: int, start_date: date, end_date: date) -> Optional[List[Dict]]:
+    """Tổng hợp theo ngày tính trong SQLite (xem query_daily_aggregates)."""
+    conn = get_connection()
+    try:
+        return query_daily_aggregates(conn, user_id, start_date.isoformat(), end_date.isoformat())
+    except sqlite3.Error as e:
+        print(f"Error aggregating days: {e}")
+        return None
+    finally:
+        conn.close()
+
+
+def get_payroll_aggregates(user_id: int, start_date: date, end_date: date) -> Optional[Dict]:
+    """Tổng hợp lương tính trong SQLite (xem query_payroll_aggregates)."""
+    conn = get_connection()
+    try:
+        return query_payroll_aggregates(conn, user_id, start_date.isoformat(), end_date.isoformat())
+    except sqlite3.Error as e:
+        print(f"Error aggregating payroll: {e}")
+        return None
+    finally:
+        conn.close()
+
+
+# ==================== DATA GENERATION ====================
+
+def query_data_generation(conn: sqlite3.Connection, user_id: int) -> str:
+    """Thế hệ dữ liệu của user (token đổi mỗi lần ghi); user chưa có thì tạo."""
+    sql = "SELECT token FROM data_generations WHERE user_id = ?"
+    row = conn.execute(sql, (user_id,)).fetchone()
+    if row is None:
+        # Chưa ghi lần nào từ khi có trigger
+        conn.execute("INSERT OR IGNORE INTO data_generations (user_id, token) VALUES (?, lower(hex(randomblob(8))))",
+                     (user_id,))
+        row = conn.execute(sql, (user_id,)).fetchone()
+    return row[0]
+
+
+def get_data_generation(user_id: int, start_date: Optional[date] = None) -> Optional[str]:
+    """Thế hệ dữ liệu của user (xem query_data_generation); cùng API với cloud_mirror."""
+    conn = get_connection()
+    try:
+        token = query_data_generation(conn, user_id)
+        conn.commit()
+        return token
+    except sqlite3.Error as e:
+        print(f"Error reading data generation: {e}")
+        return None
+    finally:
+        conn.close()
+
+
+# ==================== HOLIDAYS ====================
+
+def add_holiday(user_id: int, holiday_date: date, description: str) -> bool:
+    """Thêm ngày nghỉ."""
+    try:
+        _execute("""
+            INSERT INTO holidays (user_id, holiday_date, description) VALUES (?, ?, ?)
+            ON CONFLICT(user_id, holiday_date) DO UPDATE SET description = excluded.description
+        """, (user_id, holiday_date.isoformat(), description))
+        return True
+    except Exception as e:
+        print(f"Error adding holiday: {e}")
+        return False
+
+
+def remove_holiday(user_id: int, holiday_date: date) -> bool:
+    """Xóa ngày nghỉ."""
+    try:
+        _execute("DELETE FROM holidays WHERE user_id = ? AND holiday_date = ?",
+                 (user_id, holiday_date.isoformat()))
+        return True
+    except Exception as e:
+        print(f"Error removing holiday: {e}")
+        return False
+
+
+def get_all_holidays(user_id: int) -> List[Dict]:
+    """Lấy tất cả ngày nghỉ."""
+    try:
+        return _fetch_all("SELECT * FROM holidays WHERE user_id = ? ORDER BY holiday_date", (user_id,))
+    except Exception:
+        return []
+
+
+def get_holidays_by_range(user_id: int, start_date: date, end_date: date) -> List[Dict]:
+    """Lấy ngày nghỉ trong khoảng thời gian."""
+    try:
+        return _fetch_all("SELECT * FROM holidays WHERE user_id = ? AND holiday_date BETWEEN ? AND ? "
+                          "ORDER BY holiday_date", (user_id, start_date.isoformat(), end_date.isoformat()))
+    except Exception:
+        return []
+
+
+def is_holiday(user_id: int, check_date: date) -> tuple:
+    """Kiểm tra ngày nghỉ."""
+    try:
+        row = _fetch_one("SELECT description FROM holidays WHERE user_id = ? AND holiday_date = ?",
+                         (user_id, check_date.isoformat()))
+        return (True, row['description']) if row else (False, "")
+    except Exception:
+        return False, ""
+
+
+# ==================== SETTINGS ====================
+
+def get_setting(user_id: int, key: str) -> Optional[str]:
+    """Lấy cài đặt."""
+    try:
+        row = _fetch_one("SELECT value FROM settings WHERE user_id = ? AND key = ?", (user_id, key))
+        return row['value'] if row else None
+    except Exception:
+        return None
+
+
+def get_all_settings(user_id: int) -> Dict[str, str]:
+    """Lấy toàn bộ cài đặt của user trong một truy vấn."""
+    try:
+        rows = _fetch_all("SELECT key, value FROM settings WHERE user_id = ?", (user_id,))
+        return {row['key']: row['value'] for row in rows}
+    except Exception:
+        return {}
+
+
+def update_setting(user_id: int, key: str, value: str) -> bool:
+    """Cập nhật cài đặt."""
+    try:
+        _execute("""
+            INSERT INTO settings (user_id, key, value) VALUES (?, ?, ?)
+            ON CONFLICT(user_id, key) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP
+        """, (user_id, key, value))
+        return True
+    except Exception as e:
+        print(f"Error updating setting: {e}")
+        return False
+
+
+def get_standard_hours(user_id: int) -> float:
+    """Lấy số giờ chuẩn."""
+    value = get_setting(user_id, 'standard_hours')
+    return float(value) if value else 8.0
+
+
+def get_default_break_hours(user_id: int) -> float:
+    """Lấy giờ nghỉ mặc định."""
+    value = get_setting(user_id, 'break_hours')
+    return float(value) if value else 1.0
+
+
+# ==================== SHIFT PRESETS ====================
+
+def get_all_presets(user_id: int) -> List[Dict]:
+    """Lấy tất cả khung giờ mẫu của user."""
+    return _fetch_all("SELECT * FROM shift_presets WHERE user_id = ? ORDER BY sort_order, id", (user_id,))
+
+
+def add_preset(user_id: int, preset_name: str, start_time: str, end_time: str,
+               break_hours: float, total_hours: float,
+               job_id: int = None, emoji: str = "⏰", sort_order: int = 0) -> Optional[int]:
+    """Thêm khung giờ mẫu mới."""
+    cursor = _execute("""
+        INSERT INTO shift_presets (user_id, preset_name, start_time, end_time, break_hours,
+                                   total_hours, job_id, emoji, sort_order)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (user_id, preset_name, start_time, end_time, break_hours, total_hours, job_id, emoji, sort_order))
+    return cursor.lastrowid
+
+
+def update_preset(user_id: int, preset_id: int, **kwargs) -> bool:
+    """Cập nhật khung giờ mẫu."""
+    allowed_fields = ['preset_name', 'start_time', 'end_time', 'break_hours',
+                      'total_hours', 'job_id', 'emoji', 'sort_order']
+    fields = [key for key in kwargs if key in allowed_fields]
+    if fields:
+        _execute(
+            f"UPDATE shift_presets SET {', '.join(f'{key} = ?' for key in fields)} WHERE id = ? AND user_id = ?",
+            tuple(kwargs[key] for key in fields) + (preset_id, user_id)
+        )
+    return True
+
+
+def delete_preset(user_id: int, preset_id: int) -> bool:
+    """Xóa khung giờ mẫu."""
+    _execute("DELETE FROM shift_presets WHERE id = ? AND user_id = ?", (preset_id, user_id))
+    return True
+
+
+# ==================== INIT DEFAULT DATA ====================
+
+# ==================== PROVISIONING ====================
+# Setting đánh dấu user đã có dữ liệu mặc định
+PROVISIONED_KEY = 'provisioned'
+
+# Dữ liệu mặc định như database.init_database của file riêng
+DEFAULT_JOBS = [
+    ("Bệnh viện", 1200, "Làm việc tại bệnh viện", "#EF4444"),
+    ("Kombini", 1100, "Làm việc tại cửa hàng tiện lợi", "#3B82F6"),
+    ("Công việc khác", 1000, "Các công việc khác", "#6B7280"),
+]
+DEFAULT_SETTINGS = {
+    'standard_hours': "8.0",
+    'break_hours': "1.0",
+    'ot_rate': str(payroll.DEFAULT_OT_RATE),
+    'night_rate': str(payroll.DEFAULT_NIGHT_RATE),
+    'holiday_rate': str(payroll.DEFAULT_HOLIDAY_RATE),
+}
+DEFAULT_PRESETS = [
+    ('Ca Sáng 8h', '08:00', '17:00', 1.0, 8.0, '☀️', 1),
+    ('Ca Tối 8h', '17:00', '02:00', 1.0, 8.0, '🌙', 2),
+    ('Part-time 4h', '17:00', '21:00', 0.0, 4.0, '⏰', 3),
+    ('Full Day 10h', '08:00', '19:00', 1.0, 10.0, '🔥', 4),
+]
+
+
+def is_user_provisioned(user_id: int) -> bool:
+    """User đã được khởi tạo dữ liệu mặc định chưa."""
+    return _fetch_one("SELECT 1 FROM settings WHERE user_id = ? AND key = ?", (user_id, PROVISIONED_KEY)) is not None
+
+
+def provision_user(user_id: int, new_user: bool = False) -> bool:
+    """
+    Tạo dữ liệu mặc định cho user trong một transaction (jobs / presets chỉ khi
+    user chưa có cái nào; settings không ghi đè giá trị đã có), rồi đánh dấu provisioned.
+    """
+    try:
+        with _write_connection() as conn:
+            if new_user or not conn.execute("SELECT 1 FROM jobs WHERE user_id = ? LIMIT 1", (user_id,)).fetchone():
+                conn.executemany("""
+                    INSERT OR IGNORE INTO jobs (user_id, job_name, hourly_rate, description, color)
+                    VALUES (?, ?, ?, ?, ?)
+                """, [(user_id, *job) for job in DEFAULT_JOBS])
+            if new_user or not conn.execute("SELECT 1 FROM shift_presets WHERE user_id = ? LIMIT 1", (user_id,)).fetchone():
+                conn.executemany("""
+                    INSERT INTO shift_presets (user_id, preset_name, start_time, end_time, break_hours,
+                                               total_hours, emoji, sort_order)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, [(user_id, *preset) for preset in DEFAULT_PRESETS])
+            settings = {**DEFAULT_SETTINGS, PROVISIONED_KEY: datetime.now().isoformat()}
+            conn.executemany("INSERT OR IGNORE INTO settings (user_id, key, value) VALUES (?, ?, ?)",
+                             [(user_id, key, value) for key, value in settings.items()])
+        _sync_to_github()
+        return True
+    except Exception as e:
+        print(f"Error provisioning tenant user: {e}")
+        return False
+
+
+def init_user_default_data(user_id: int):
+    """Khởi tạo dữ liệu mặc định cho user nếu chưa làm (xem provision_user)."""
+    if not is_user_provisioned(user_id):
+        provision_user(user_id)
@@ -5,18 +5,27 @@ Hỗ trợ cả Supabase (cloud) và SQLite (local fallback).
 """
 
 import streamlit as st
+import base64
 import hashlib
+import hmac
 import os
+import secrets
 import sqlite3
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 try:
     import extra_streamlit_components as stx
     _COOKIE_MANAGER_OK = True
 except ImportError:
     stx = None
     _COOKIE_MANAGER_OK = False
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict
 
+import sqlite_writer
+
 # Thử import Supabase module
 try:
     import supabase_db
@@ -36,10 +45,6 @@ def _check_supabase() -> bool:
 # Đường dẫn thư mục chứa database của users (for SQLite fallback)
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "user_data")
 
-# Đảm bảo thư mục tồn tại
-if not os.path.exists(DATA_DIR):
-    os.makedirs(DATA_DIR)
-
 
 def get_users_db_path() -> str:
     """Lấy đường dẫn database chứa thông tin users."""
@@ -52,29 +57,292 @@ def get_user_db_path(username: str) -> str:
     return os.path.join(DATA_DIR, f"user_{safe_username}.db")
 
 
+# ==================== MẬT KHẨU ====================
+# Băm mật khẩu bằng KDF có salt. Tham số được lưu trong chuỗi hash
+# ("scrypt$n$r$p$salt$hash"), nên có thể tăng dần: hash cũ vẫn kiểm tra được
+# và được băm lại theo tham số mới ở lần đăng nhập thành công kế tiếp.
+PASSWORD_SCHEME = "scrypt" if hasattr(hashlib, "scrypt") else "pbkdf2_sha256"
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 600_000
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+# ==================== PHIÊN ĐĂNG NHẬP ====================
+# Cookie "ghi nhớ đăng nhập" chỉ chứa token ngẫu nhiên; database lưu sha256 của token
+COOKIE_NAME = "work_tracker_token"
+TOKEN_TTL_DAYS = 30
+# Số token đã xác thực giữ trong bộ nhớ (LRU)
+TOKEN_CACHE_SIZE = 512
+
+_token_cache = OrderedDict()  # token_hash -> (user_info, expires_at)
+_token_lock = threading.Lock()
+
+# ==================== USERS STORE (SQLite) ====================
+# Số kết nối tối đa tới users.db dùng chung trong process
+USERS_POOL_SIZE = 4
+# Số user (tra theo username) giữ trong bộ nhớ (LRU)
+USER_CACHE_SIZE = 256
+
+USERS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL UNIQUE,
+        password_hash TEXT NOT NULL,
+        display_name TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_login TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS auth_tokens (
+        token_hash TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        expires_at TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_auth_tokens_user ON auth_tokens(user_id);
+"""
+
+# Câu lệnh cố định để sqlite3 dùng lại statement đã prepare trên mỗi kết nối
+_SQL_USER_BY_NAME = "SELECT * FROM users WHERE lower(username) = ?"
+_SQL_INSERT_USER = "INSERT INTO users (username, password_hash, display_name) VALUES (?, ?, ?)"
+_SQL_UPDATE_HASH = "UPDATE users SET password_hash = ? WHERE id = ?"
+_SQL_TOUCH_LOGIN = "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?"
+_SQL_PURGE_TOKENS = "DELETE FROM auth_tokens WHERE expires_at < ?"
+_SQL_INSERT_TOKEN = "INSERT INTO auth_tokens (token_hash, user_id, expires_at) VALUES (?, ?, ?)"
+_SQL_TOKEN_USER = """
+    SELECT u.*, t.expires_at AS token_expires_at
+    FROM auth_tokens t JOIN users u ON u.id = t.user_id
+    WHERE t.token_hash = ?
+"""
+_SQL_DELETE_TOKEN = "DELETE FROM auth_tokens WHERE token_hash = ?"
+
+
+class UsersStore:
+    """
+    Truy cập users.db dùng chung trong process: schema khởi tạo một lần,
+    tối đa USERS_POOL_SIZE kết nối WAL dùng lại giữa các thread, và LRU
+    user theo username (xóa khi user đó được ghi).
+    """
+
+    def __init__(self, db_path: str, pool_size: int = USERS_POOL_SIZE, cache_size: int = USER_CACHE_SIZE):
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.cache_size = cache_size
+        self._pool = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._user_cache = OrderedDict()  # username (lower) -> user row
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite_writer.connect(self.db_path, check_same_thread=False, cached_statements=64)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def _init_schema(self) -> None:
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(USERS_SCHEMA)
+            try:
+                conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username_lower ON users(lower(username))")
+            except sqlite3.IntegrityError:
+                print("⚠️ users.db có username trùng nhau khi không phân biệt hoa thường, bỏ qua unique index")
+            conn.commit()
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _borrowed(self):
+        """Mượn một kết nối từ pool, trả lại khi xong."""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self.pool_size
+                if can_open:
+                    self._opened += 1
+            conn = self._connect() if can_open else self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Mượn một kết nối để đọc (commit nếu khối lệnh thành công, rollback nếu lỗi)."""
+        with self._borrowed() as conn:
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    @contextmanager
+    def writing(self):
+        """Mượn một kết nối cho một lần ghi (BEGIN IMMEDIATE dưới khóa ghi của users.db, sqlite_writer)."""
+        with self._borrowed() as conn:
+            with sqlite_writer.transaction(conn, self.db_path):
+                yield conn
+
+    def close(self) -> None:
+        """Đóng các kết nối đang rảnh trong pool."""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._opened -= 1
+
+    def _forget(self, username: Optional[str] = None) -> None:
+        with self._lock:
+            if username is None:
+                self._user_cache.clear()
+            else:
+                self._user_cache.pop(username.lower(), None)
+
+    def get_user_by_username(self, username: str) -> Optional[Dict]:
+        key = username.lower()
+        with self._lock:
+            user = self._user_cache.get(key)
+            if user is not None:
+                self._user_cache.move_to_end(key)
+                return dict(user)
+        with self.connection() as conn:
+            row = conn.execute(_SQL_USER_BY_NAME, (key,)).fetchone()
+        if row is None:
+            return None
+        user = dict(row)
+        with self._lock:
+            self._user_cache[key] = user
+            while len(self._user_cache) > self.cache_size:
+                self._user_cache.popitem(last=False)
+        return dict(user)
+
+    def create_user(self, username: str, password_hash: str, display_name: str) -> Optional[int]:
+        """Tạo user; None nếu username đã tồn tại."""
+        try:
+            with self.writing() as conn:
+                user_id = conn.execute(_SQL_INSERT_USER, (username.lower(), password_hash, display_name)).lastrowid
+        except sqlite3.IntegrityError:
+            return None
+        self._forget(username)
+        return user_id
+
+    def record_login(self, user: Dict, new_password_hash: Optional[str] = None) -> None:
+        """Cập nhật last_login (và password hash nếu được băm lại) trong một transaction."""
+        with self.writing() as conn:
+            if new_password_hash:
+                conn.execute(_SQL_UPDATE_HASH, (new_password_hash, user['id']))
+            conn.execute(_SQL_TOUCH_LOGIN, (user['id'],))
+        self._forget(user['username'])
+
+    def add_token(self, token_hash: str, user_id: int, expires_at: datetime) -> None:
+        with self.writing() as conn:
+            # Dọn token hết hạn cùng lúc tạo token mới
+            conn.execute(_SQL_PURGE_TOKENS, (datetime.now(timezone.utc).isoformat(),))
+            conn.execute(_SQL_INSERT_TOKEN, (token_hash, user_id, expires_at.isoformat()))
+
+    def get_token_user(self, token_hash: str) -> Optional[tuple]:
+        """(user, expires_at) của token, None nếu không có."""
+        with self.connection() as conn:
+            row = conn.execute(_SQL_TOKEN_USER, (token_hash,)).fetchone()
+        if row is None:
+            return None
+        user = dict(row)
+        return user, datetime.fromisoformat(user.pop('token_expires_at'))
+
+    def delete_token(self, token_hash: str) -> None:
+        with self.writing() as conn:
+            conn.execute(_SQL_DELETE_TOKEN, (token_hash,))
+
+
+_users_store = None
+_users_store_lock = threading.Lock()
+
+
+def get_users_store() -> UsersStore:
+    """UsersStore dùng chung của process (tạo lần đầu khi cần)."""
+    global _users_store
+    path = get_users_db_path()
+    if _users_store is None or _users_store.db_path != path:
+        with _users_store_lock:
+            if _users_store is None or _users_store.db_path != path:
+                if _users_store is not None:
+                    _users_store.close()
+                _users_store = UsersStore(path)
+    return _users_store
+
+
 def init_users_db() -> None:
-    """Khởi tạo database users (SQLite)."""
-    conn = sqlite3.connect(get_users_db_path())
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL UNIQUE,
-            password_hash TEXT NOT NULL,
-            display_name TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_login TIMESTAMP
-        )
-    """)
-    
-    conn.commit()
-    conn.close()
+    """Khởi tạo database users (SQLite) — một lần mỗi process."""
+    get_users_store()
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def _kdf(scheme: str, password: str, salt: bytes, params: tuple) -> bytes:
+    if scheme == "scrypt":
+        n, r, p = params
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r * p, dklen=HASH_BYTES)
+    (iterations,) = params
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations, dklen=HASH_BYTES)
+
+
+def _current_params() -> tuple:
+    if PASSWORD_SCHEME == "scrypt":
+        return (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return (PBKDF2_ITERATIONS,)
 
 
 def hash_password(password: str) -> str:
-    """Mã hóa mật khẩu."""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Băm mật khẩu (salt ngẫu nhiên, KDF theo PASSWORD_SCHEME)."""
+    salt = secrets.token_bytes(SALT_BYTES)
+    params = _current_params()
+    digest = _kdf(PASSWORD_SCHEME, password, salt, params)
+    return "$".join([PASSWORD_SCHEME, *map(str, params), _b64(salt), _b64(digest)])
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    """
+    Kiểm tra mật khẩu với hash đã lưu. Hỗ trợ cả hash sha256 không salt
+    của phiên bản cũ (được băm lại khi đăng nhập, xem needs_rehash).
+    """
+    if not password_hash:
+        return False
+    parts = password_hash.split("$")
+    try:
+        if len(parts) == 1:
+            legacy = hashlib.sha256(password.encode()).hexdigest()
+            return hmac.compare_digest(legacy, password_hash)
+        scheme, params, salt, digest = parts[0], tuple(int(x) for x in parts[1:-2]), parts[-2], parts[-1]
+        if scheme not in ("scrypt", "pbkdf2_sha256"):
+            return False
+        expected = _kdf(scheme, password, base64.b64decode(salt), params)
+        return hmac.compare_digest(expected, base64.b64decode(digest))
+    except (ValueError, TypeError):
+        return False
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """Hash được tạo bằng thuật toán / tham số cũ hơn cấu hình hiện tại."""
+    parts = password_hash.split("$")
+    return parts[0] != PASSWORD_SCHEME or parts[1:-2] != [str(x) for x in _current_params()]
+
+
+def _public_user(user: Dict) -> Dict:
+    """Thông tin user lưu trong session (không kèm password hash)."""
+    return {k: v for k, v in user.items() if k != 'password_hash'}
 
 
 def is_using_supabase() -> bool:
@@ -114,7 +382,7 @@ def register_user(username: str, password: str, display_name: str = "") -> tuple
             user = supabase_db.create_user(username, password_hash, display)
             if user:
                 # Init default data
-                supabase_db.init_user_default_data(user['id'])
+                supabase_db.provision_user(user['id'], new_user=True)
                 return True, "Đăng ký thành công! Bạn có thể đăng nhập ngay."
             else:
                 return False, "Lỗi khi tạo tài khoản"
@@ -123,24 +391,9 @@ def register_user(username: str, password: str, display_name: str = "") -> tuple
     
     # Fallback to SQLite
     try:
-        init_users_db()
-        
-        conn = sqlite3.connect(get_users_db_path())
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT id FROM users WHERE username = ?", (username.lower(),))
-        if cursor.fetchone():
-            conn.close()
+        if get_users_store().create_user(username, password_hash, display) is None:
             return False, "Tên đăng nhập đã tồn tại"
         
-        cursor.execute("""
-            INSERT INTO users (username, password_hash, display_name)
-            VALUES (?, ?, ?)
-        """, (username.lower(), password_hash, display))
-        
-        conn.commit()
-        conn.close()
-        
         return True, "Đăng ký thành công! Bạn có thể đăng nhập ngay."
     
     except Exception as e:
@@ -154,15 +407,15 @@ def login_user(username: str, password: str) -> tuple:
     Returns:
         (success, message, user_info)
     """
-    password_hash = hash_password(password)
-    
     # Thử Supabase trước
     if _check_supabase():
         try:
             user = supabase_db.get_user_by_username(username)
-            if user and user['password_hash'] == password_hash:
+            if user and verify_password(password, user['password_hash']):
+                if needs_rehash(user['password_hash']):
+                    supabase_db.update_user_password_hash(user['id'], hash_password(password))
                 supabase_db.update_user_last_login(user['id'])
-                return True, "Đăng nhập thành công!", user
+                return True, "Đăng nhập thành công!", _public_user(user)
             else:
                 return False, "Tên đăng nhập hoặc mật khẩu không đúng", None
         except Exception as e:
@@ -170,31 +423,14 @@ def login_user(username: str, password: str) -> tuple:
     
     # Fallback to SQLite
     try:
-        init_users_db()
-        
-        conn = sqlite3.connect(get_users_db_path())
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT * FROM users WHERE username = ? AND password_hash = ?
-        """, (username.lower(), password_hash))
-        
-        row = cursor.fetchone()
+        store = get_users_store()
+        user = store.get_user_by_username(username)
         
-        if row:
-            cursor.execute("""
-                UPDATE users SET last_login = CURRENT_TIMESTAMP
-                WHERE id = ?
-            """, (row['id'],))
-            conn.commit()
-            
-            user_info = dict(row)
-            conn.close()
-            
-            return True, "Đăng nhập thành công!", user_info
+        if user and verify_password(password, user['password_hash']):
+            new_hash = hash_password(password) if needs_rehash(user['password_hash']) else None
+            store.record_login(user, new_hash)
+            return True, "Đăng nhập thành công!", _public_user(user)
         else:
-            conn.close()
             return False, "Tên đăng nhập hoặc mật khẩu không đúng", None
     
     except Exception as e:
@@ -231,18 +467,114 @@ def get_cookie_manager():
         return None
 
 
-def set_remember_me_cookie(username: str, password_hash: str):
-    """Lưu cookie đăng nhập (30 ngày)."""
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _cache_token(token_hash: str, user: Dict, expires_at: datetime) -> None:
+    with _token_lock:
+        _token_cache[token_hash] = (user, expires_at)
+        _token_cache.move_to_end(token_hash)
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+
+
+def create_session_token(user: Dict) -> Optional[str]:
+    """
+    Tạo token đăng nhập ngẫu nhiên (hết hạn sau TOKEN_TTL_DAYS ngày).
+
+    Returns:
+        Token (chỉ trả về một lần, database chỉ lưu sha256), None nếu lỗi
+    """
+    token = secrets.token_urlsafe(32)
+    token_hash = _token_hash(token)
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(days=TOKEN_TTL_DAYS)
+    try:
+        if _check_supabase():
+            if not supabase_db.create_auth_token(token_hash, user['id'], expires_at):
+                return None
+        else:
+            get_users_store().add_token(token_hash, user['id'], expires_at)
+    except Exception as e:
+        print(f"Create token error: {e}")
+        return None
+    _cache_token(token_hash, _public_user(user), expires_at)
+    return token
+
+
+def validate_session_token(token: str) -> Optional[Dict]:
+    """
+    Kiểm tra token đăng nhập: trúng LRU trong bộ nhớ, hoặc một lần tra theo
+    khóa chính. Không chạy KDF.
+
+    Returns:
+        Thông tin user nếu token hợp lệ và chưa hết hạn, None nếu không
+    """
+    if not token:
+        return None
+    token_hash = _token_hash(token)
+    now = datetime.now(timezone.utc)
+
+    with _token_lock:
+        cached = _token_cache.get(token_hash)
+        if cached:
+            _token_cache.move_to_end(token_hash)
+    if cached:
+        user, expires_at = cached
+        if expires_at > now:
+            return user
+        revoke_session_token(token)
+        return None
+
+    if _check_supabase():
+        row = supabase_db.get_auth_token(token_hash)
+        if not row or not row.get('user'):
+            return None
+        user, expires_at = row['user'], datetime.fromisoformat(row['expires_at'])
+    else:
+        found = get_users_store().get_token_user(token_hash)
+        if not found:
+            return None
+        user, expires_at = found
+
+    if expires_at <= now:
+        revoke_session_token(token)
+        return None
+    user = _public_user(user)
+    _cache_token(token_hash, user, expires_at)
+    return user
+
+
+def revoke_session_token(token: str) -> None:
+    """Xóa token (đăng xuất / hết hạn) khỏi database và bộ nhớ."""
+    if not token:
+        return
+    token_hash = _token_hash(token)
+    with _token_lock:
+        _token_cache.pop(token_hash, None)
+    try:
+        if _check_supabase():
+            supabase_db.delete_auth_token(token_hash)
+        else:
+            get_users_store().delete_token(token_hash)
+    except Exception as e:
+        print(f"Revoke token error: {e}")
+
+
+def set_remember_me_cookie(user: Dict):
+    """Lưu cookie đăng nhập (token ngẫu nhiên, TOKEN_TTL_DAYS ngày)."""
     if not _COOKIE_MANAGER_OK:
         return
         
     try:
         cookie_manager = get_cookie_manager()
         if cookie_manager:
-            # Token format: username|password_hash
-            token = f"{username}|{password_hash}"
-            expires = datetime.now() + timedelta(days=30)
-            cookie_manager.set("work_tracker_token", token, expires_at=expires)
+            token = create_session_token(user)
+            if token:
+                expires = datetime.now() + timedelta(days=TOKEN_TTL_DAYS)
+                cookie_manager.set(COOKIE_NAME, token, expires_at=expires)
+                st.session_state["session_token"] = token
     except:
         pass
 
@@ -268,38 +600,18 @@ def check_auto_login() -> bool:
             return False
             
         cookies = cookie_manager.get_all()
-        token = cookies.get("work_tracker_token")
+        token = cookies.get(COOKIE_NAME)
         
-        if token and "|" in token:
-            username, pw_hash = token.split("|", 1)
-            
-            # Verify with DB
-            if _check_supabase():
-               user = supabase_db.get_user_by_username(username)
-               if user and user['password_hash'] == pw_hash:
-                   st.session_state["logged_in"] = True
-                   st.session_state["user_info"] = user
-                   st.session_state["user_db_path"] = None
-                   st.session_state["auto_login_checked"] = True
-                   # Không cần update last_login ở đây để giảm DB write
-                   return True
-            else:
-                # Local SQLite verification
-                init_users_db()
-                conn = sqlite3.connect(get_users_db_path())
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM users WHERE username = ? AND password_hash = ?", (username, pw_hash))
-                row = cursor.fetchone()
-                conn.close()
-                
-                if row:
-                    st.session_state["logged_in"] = True
-                    st.session_state["user_info"] = dict(row)
-                    st.session_state["user_db_path"] = get_user_db_path(username)
-                    st.session_state["auto_login_checked"] = True
-                    # Không cần update last login để tăng tốc
-                    return True
+        # Cookie kiểu cũ (username|password_hash) không còn hợp lệ: cần đăng nhập lại
+        user = validate_session_token(token) if token and "|" not in token else None
+        if user:
+            st.session_state["logged_in"] = True
+            st.session_state["user_info"] = user
+            st.session_state["user_db_path"] = None if _check_supabase() else get_user_db_path(user['username'])
+            st.session_state["session_token"] = token
+            st.session_state["auto_login_checked"] = True
+            # Không cần update last_login ở đây để giảm DB write
+            return True
     except Exception as e:
         print(f"Auto login error: {e}")
     
@@ -312,13 +624,14 @@ def logout():
     st.session_state["logged_in"] = False
     st.session_state["user_info"] = None
     st.session_state["user_db_path"] = None
+    revoke_session_token(st.session_state.pop("session_token", None))
     
     # Xóa Cookie
     if _COOKIE_MANAGER_OK:
         try:
             cookie_manager = get_cookie_manager()
             if cookie_manager:
-                cookie_manager.delete("work_tracker_token")
+                cookie_manager.delete(COOKIE_NAME)
         except:
             pass
 
@@ -450,7 +763,7 @@ def show_login_page():
                         st.session_state["_login_success"] = True  # Flag to rerun
                         
                         if remember_me:
-                            set_remember_me_cookie(username, user_info['password_hash'])
+                            set_remember_me_cookie(user_info)
                         
                         st.success(f"✅ {message} Đang chuyển hướng...")
                         # Note: rerun will happen on next render cycle via flag check above